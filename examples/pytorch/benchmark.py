@@ -0,0 +1,443 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""End-to-end latency benchmark of the FasterTransformer PyTorch ops, with regression checks.
+
+Performance used to be measured by scraping the logs of benchmarks/*/*.sh or by the ``--time``
+flags of the examples, which print one average. This harness runs a sweep of
+(batch size, input length, output length, beam width, precision) points on one model type:
+
+    python examples/pytorch/benchmark.py --model gpt --ckpt_path /models/opt-1.3b/1-gpu \\
+        --sweep "batch=1,8;input=128,512;output=32;beam=1,4;precision=fp16" \\
+        --output results.json --baseline baseline.json --tolerance 0.05
+
+Each point gets `--warmup` untimed iterations and `--iterations` timed ones. The latency
+distribution of each point (mean, stdev, min, p50, p90, p99, max) and its throughput go into a JSON
+file, along with a fingerprint of the environment (GPU, driver stack, op library, git commit). With
+``--baseline``, the p50 latency of every point is compared with the stored results, and the exit
+status is 1 if one of them is slower by more than `--tolerance`. ``--model stub`` replaces the op
+with a CPU stand-in whose latency is a function of the point, to exercise the harness itself.
+"""
+import argparse
+import dataclasses
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import typing
+
+LOGGER = logging.getLogger(__name__)
+
+RESULTS_VERSION = 1
+DEFAULT_SWEEP = "batch=1;input=128;output=32;beam=1;precision=fp16"
+DEFAULT_TOLERANCE = 0.05
+# statistic compared with the baseline
+COMPARED_STAT = "p50_ms"
+_SWEEP_ALIASES = {"batch": "batch_size", "input": "input_len", "output": "output_len", "beam": "beam_width"}
+_ENV_VARS = ("CUDA_VISIBLE_DEVICES", "NVIDIA_TF32_OVERRIDE", "FT_LIB_DIR")
+
+
+@dataclasses.dataclass(frozen=True)
+class SweepPoint:
+    batch_size: int = 1
+    input_len: int = 128
+    output_len: int = 32
+    beam_width: int = 1
+    precision: str = "fp16"
+
+    def key(self) -> str:
+        return f"bs{self.batch_size}_in{self.input_len}_out{self.output_len}_beam{self.beam_width}_{self.precision}"
+
+
+def parse_sweep(spec: str) -> typing.List[SweepPoint]:
+    """Expands a sweep spec into the cross product of its values.
+
+    `spec` is either "name=v1,v2;name=v3" (names are the `SweepPoint` fields or batch, input, output
+    and beam) or the path of a JSON file with such a mapping of names to lists, or a list of points.
+    """
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            spec_json = json.load(f)
+        if isinstance(spec_json, list):
+            return [SweepPoint(**{_SWEEP_ALIASES.get(name, name): value for name, value in point.items()})
+                    for point in spec_json]
+        values = {name: value if isinstance(value, list) else [value] for name, value in spec_json.items()}
+    else:
+        values = {}
+        for item in spec.split(";"):
+            if item.strip():
+                name, _, value = item.partition("=")
+                values[name.strip()] = [v.strip() for v in value.split(",") if v.strip()]
+
+    types = {field.name: field.type for field in dataclasses.fields(SweepPoint)}
+    axes = {}
+    for name, axis_values in values.items():
+        field = _SWEEP_ALIASES.get(name, name)
+        if field not in types:
+            raise ValueError(f"Unknown sweep parameter {name!r}, expected one of {sorted(types)}")
+        cast = int if types[field] in (int, "int") else str
+        axes[field] = [cast(value) for value in axis_values]
+    return [SweepPoint(**dict(zip(axes, combination))) for combination in itertools.product(*axes.values())]
+
+
+class Runner:
+    """Prepares the iterations of sweep points on one model.
+
+    `prepare(point)` builds the inputs of a point and returns a callable that runs one iteration and
+    returns once its results are ready (e.g. after synchronizing the GPU).
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+
+    def prepare(self, point: SweepPoint) -> typing.Callable[[], None]:
+        raise NotImplementedError
+
+    def library(self) -> typing.Optional[str]:
+        return None
+
+
+class StubRunner(Runner):
+    """CPU stand-in for an op: sleeps base + per-token time for the tokens of the point."""
+
+    _PRECISION_FACTOR = {"fp32": 2.0, "fp16": 1.0, "bf16": 1.0, "int8": 0.75}
+
+    def prepare(self, point: SweepPoint) -> typing.Callable[[], None]:
+        tokens = point.batch_size * point.beam_width * (point.input_len + point.output_len)
+        seconds = (self.args.stub_base_ms + self.args.stub_ms_per_token * tokens) / 1000
+        seconds *= self._PRECISION_FACTOR.get(point.precision, 1.0)
+        return lambda: time.sleep(seconds)
+
+
+class DecoderRunner(Runner):
+    """GPT, GPT-J and GPT-NeoX checkpoints, built by `model_factory.build_model` once per precision."""
+
+    def __init__(self, args: argparse.Namespace):
+        super().__init__(args)
+        from examples.pytorch.model_factory import read_config
+        self.config = read_config(args.ckpt_path)
+        self._models = {}
+
+    def _model(self, precision: str):
+        if precision not in self._models:
+            from examples.pytorch.model_factory import build_model
+            # one model at a time on the GPU
+            self._models.clear()
+            self._models[precision] = build_model(self.args.ckpt_path, self.args.tensor_para_size,
+                                                  self.args.pipeline_para_size, lib_dir=self.args.lib_dir,
+                                                  infer_data_type=precision)
+        return self._models[precision]
+
+    def prepare(self, point: SweepPoint) -> typing.Callable[[], None]:
+        import torch
+
+        from examples.pytorch import synthetic_inputs
+        model = self._model(point.precision)
+        batch_size = point.batch_size
+        inputs = synthetic_inputs.generate(batch_size, point.input_len, self.config.vocab_size,
+                                           exclude=(self.config.start_id, self.config.end_id), seed=self.args.seed)
+        start_ids = torch.from_numpy(inputs.input_ids)
+        start_lengths = torch.from_numpy(inputs.lengths)
+        sampling = dict(top_k=torch.ones([batch_size], dtype=torch.int32),
+                        top_p=torch.zeros([batch_size], dtype=torch.float32),
+                        beam_search_diversity_rate=torch.zeros([batch_size], dtype=torch.float32),
+                        temperature=torch.ones([batch_size], dtype=torch.float32),
+                        len_penalty=torch.zeros([batch_size], dtype=torch.float32),
+                        repetition_penalty=torch.ones([batch_size], dtype=torch.float32),
+                        random_seed=torch.zeros([batch_size], dtype=torch.int64))
+
+        def step():
+            with torch.no_grad():
+                model(start_ids, start_lengths, point.output_len, point.beam_width, **sampling)
+            torch.cuda.synchronize()
+        return step
+
+    def library(self) -> typing.Optional[str]:
+        from examples.pytorch.model_factory import lib_path
+        return lib_path(self.config.model_type, self.args.lib_dir)
+
+
+class T5Runner(DecoderRunner):
+    """T5 checkpoints: encoder and decoding of random input ids."""
+
+    def prepare(self, point: SweepPoint) -> typing.Callable[[], None]:
+        import types
+
+        import torch
+
+        from examples.pytorch import synthetic_inputs
+        model = self._model(point.precision)
+        inputs = synthetic_inputs.generate(point.batch_size, point.input_len, self.config.decoder.vocab_size,
+                                           exclude=(self.config.start_id, self.config.end_id),
+                                           seed=self.args.seed, last_token=self.config.end_id)
+        input_token = types.SimpleNamespace(input_ids=torch.from_numpy(inputs.input_ids),
+                                            seq_len=torch.from_numpy(inputs.lengths))
+
+        def step():
+            with torch.no_grad():
+                model(input_token, None, point.beam_width, point.output_len, 1, 0.0, 0.0)
+            torch.cuda.synchronize()
+        return step
+
+
+class BertRunner(Runner):
+    """BERT encoder with random weights of the shape given by --bert_* (no checkpoint); output_len is unused."""
+
+    def __init__(self, args: argparse.Namespace):
+        super().__init__(args)
+        self._encoders = {}
+
+    def _encoder(self, precision: str):
+        if precision not in self._encoders:
+            import torch
+            from examples.pytorch.bert.utils.encoder import CustomEncoder, EncoderWeights
+            hidden_dim = self.args.bert_head_num * self.args.bert_head_size
+            weights = EncoderWeights(self.args.bert_layer_num, hidden_dim)
+            if precision == "fp16":
+                weights.to_half()
+            elif precision == "bf16":
+                weights.to_bfloat16()
+            weights.to_cuda()
+            encoder = CustomEncoder(self.args.bert_layer_num, self.args.bert_head_num, self.args.bert_head_size,
+                                    weights, remove_padding=True, path=self.library())
+            self._encoders.clear()
+            self._encoders[precision] = (torch.jit.script(encoder), hidden_dim)
+        return self._encoders[precision]
+
+    def prepare(self, point: SweepPoint) -> typing.Callable[[], None]:
+        import torch
+        encoder, hidden_dim = self._encoder(point.precision)
+        dtype = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}[point.precision]
+        generator = torch.Generator().manual_seed(self.args.seed)
+        hidden_states = (torch.randn([point.batch_size, point.input_len, hidden_dim], generator=generator)
+                         * 0.02).to("cuda", dtype)
+        sequence_lengths = torch.full([point.batch_size], point.input_len, dtype=torch.int32, device="cuda")
+
+        def step():
+            with torch.no_grad():
+                # the FT encoder takes the sequence lengths instead of the attention mask
+                encoder(hidden_states, hidden_states, sequence_lengths)
+            torch.cuda.synchronize()
+        return step
+
+    def library(self) -> typing.Optional[str]:
+        from examples.pytorch.model_factory import lib_path
+        return lib_path("bert", self.args.lib_dir)
+
+
+RUNNERS: typing.Dict[str, typing.Type[Runner]] = {
+    "stub": StubRunner,
+    "gpt": DecoderRunner,
+    "gptj": DecoderRunner,
+    "gptneox": DecoderRunner,
+    "t5": T5Runner,
+    "bert": BertRunner,
+}
+
+
+def percentile(sorted_values: typing.Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(latencies: typing.Sequence[float]) -> typing.Dict[str, float]:
+    """Latency statistics in milliseconds of per-iteration `latencies` in seconds."""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        "mean_ms": statistics.fmean(values),
+        "stdev_ms": statistics.stdev(values) if len(values) > 1 else 0.0,
+        "min_ms": values[0],
+        "p50_ms": percentile(values, 50),
+        "p90_ms": percentile(values, 90),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1],
+    }
+
+
+def measure(step: typing.Callable[[], None], warmup: int, iterations: int) -> typing.List[float]:
+    for _ in range(warmup):
+        step()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_sweep(runner: Runner, points: typing.Sequence[SweepPoint], warmup: int,
+              iterations: int) -> typing.List[typing.Dict[str, typing.Any]]:
+    results = []
+    for point in points:
+        step = runner.prepare(point)
+        latencies = measure(step, warmup, iterations)
+        stats = summarize(latencies)
+        generated = point.batch_size * point.output_len
+        result = {
+            "key": point.key(),
+            "point": dataclasses.asdict(point),
+            "iterations": iterations,
+            "warmup": warmup,
+            "latency": stats,
+            "latencies_ms": [latency * 1000 for latency in latencies],
+            "sequences_per_s": point.batch_size * 1000 / stats["mean_ms"],
+            "generated_tokens_per_s": generated * 1000 / stats["mean_ms"],
+        }
+        LOGGER.info("%s: p50 %.3f ms, p99 %.3f ms, %.1f generated tokens/s", point.key(), stats["p50_ms"],
+                    stats["p99_ms"], result["generated_tokens_per_s"])
+        results.append(result)
+    return results
+
+
+def _git_revision() -> typing.Optional[str]:
+    repo_dir = os.path.dirname(os.path.realpath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def _file_fingerprint(path: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    if not path or not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"path": os.path.abspath(path), "sha256": digest.hexdigest(), "size": os.path.getsize(path)}
+
+
+def environment(library: typing.Optional[str] = None) -> typing.Dict[str, typing.Any]:
+    """Fingerprint of what the latencies depend on besides the sweep point."""
+    fingerprint = {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "git_revision": _git_revision(),
+        "library": _file_fingerprint(library),
+        "env": {name: os.environ[name] for name in _ENV_VARS if name in os.environ},
+    }
+    # only if a runner imported it, the stub runs without torch
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        fingerprint["torch"] = torch.__version__
+        fingerprint["cuda"] = torch.version.cuda
+        if torch.cuda.is_available():
+            fingerprint["cudnn"] = torch.backends.cudnn.version()
+            fingerprint["gpus"] = [torch.cuda.get_device_name(i) for i in range(torch.cuda.device_count())]
+    return fingerprint
+
+
+def compare(results: typing.Sequence[typing.Dict[str, typing.Any]], baseline: typing.Dict[str, typing.Any],
+            tolerance: float, stat: str = COMPARED_STAT) -> typing.List[str]:
+    """Returns a message for every point whose `stat` is more than `tolerance` above the baseline's."""
+    baseline_results = {result["key"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result["key"])
+        if previous is None:
+            LOGGER.info("%s: not in the baseline", result["key"])
+            continue
+        current_value, baseline_value = result["latency"][stat], previous["latency"][stat]
+        change = current_value / baseline_value - 1 if baseline_value > 0 else 0.0
+        message = f"{result['key']}: {stat} {current_value:.3f} vs {baseline_value:.3f} ({change:+.1%})"
+        if change > tolerance:
+            regressions.append(message)
+            LOGGER.warning("Regression %s", message)
+        else:
+            LOGGER.info("%s", message)
+    return regressions
+
+
+def _environment_changes(current: typing.Dict[str, typing.Any],
+                         baseline: typing.Dict[str, typing.Any]) -> typing.List[str]:
+    keys = ("hostname", "gpus", "torch", "cuda", "library", "env")
+    return [key for key in keys if current.get(key) != baseline.get(key)]
+
+
+def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", choices=sorted(RUNNERS), default="stub")
+    parser.add_argument("--ckpt_path", type=str, help="FasterTransformer checkpoint dir (with config.ini)")
+    parser.add_argument("--lib_dir", type=str, default=None, help="Directory of the libth_*.so ops")
+    parser.add_argument("--tensor_para_size", type=int, default=1)
+    parser.add_argument("--pipeline_para_size", type=int, default=1)
+    parser.add_argument("--sweep", type=str, default=DEFAULT_SWEEP,
+                        help='"name=v1,v2;..." over batch, input, output, beam and precision, or a JSON file')
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, help="JSON file to write the results to")
+    parser.add_argument("--baseline", type=str, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Allowed relative increase of {COMPARED_STAT} over the baseline")
+    parser.add_argument("--bert_layer_num", type=int, default=12)
+    parser.add_argument("--bert_head_num", type=int, default=12)
+    parser.add_argument("--bert_head_size", type=int, default=64)
+    parser.add_argument("--stub_base_ms", type=float, default=1.0)
+    parser.add_argument("--stub_ms_per_token", type=float, default=0.001)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.model in ("gpt", "gptj", "gptneox", "t5") and not args.ckpt_path:
+        parser.error(f"--ckpt_path is required for --model {args.model}")
+    points = parse_sweep(args.sweep)
+    runner = RUNNERS[args.model](args)
+    results = run_sweep(runner, points, args.warmup, args.iterations)
+    report = {
+        "version": RESULTS_VERSION,
+        "model": args.model,
+        "ckpt_path": args.ckpt_path,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(runner.library()),
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        LOGGER.info("Wrote %d results to %s", len(results), args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changed = _environment_changes(report["environment"], baseline.get("environment", {}))
+        if changed:
+            LOGGER.warning("The environment differs from the baseline's in: %s", ", ".join(changed))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} of {len(results)} points regressed by more than {args.tolerance:.0%}:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print(f"No regressions over {args.tolerance:.0%} in {len(results)} points")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+    sys.exit(main())
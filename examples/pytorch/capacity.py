@@ -0,0 +1,117 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Capacity and load a serving worker advertises to the coordinator in its `Join`.
+
+Workers used to join with gpu_num=0, gpu_memory=0 and no tags, so the coordinator could not tell a
+busy worker from an idle one. `update_instance` fills the `Instance` of a join with the worker's
+host and GPU, and its tags with:
+
+- free_gpu_memory: bytes free on the worker's GPU, measured after its models are loaded;
+- max_batch_size;
+- tokens_per_second: decoding throughput of one request, measured by the warmup;
+- queue_depth: requests the worker has accepted and not answered yet;
+
+plus any extra tags of the worker (all tag values are strings). `reannounce` joins again
+periodically, so that the coordinator sees the current values; `start_reannounce` runs it once per
+worker, however many of the worker's classes ask for it.
+"""
+import asyncio
+import logging
+import os
+import platform
+import typing
+
+import torch
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_ANNOUNCE_INTERVAL = 30.0
+
+
+def gpu_memory(device=None) -> typing.Tuple[int, int]:
+    """(free, total) bytes of `device`, (0, 0) without a GPU."""
+    if not torch.cuda.is_available():
+        return 0, 0
+    return torch.cuda.mem_get_info(device)
+
+
+def host_memory() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError):
+        return 0
+
+
+def tokens_per_second(warmup_result: typing.Optional[typing.Dict[str, typing.Any]]) -> float:
+    """Generated tokens per second over the steady latencies of a `warmup.run_warmup` result."""
+    if not warmup_result:
+        return 0.0
+    tokens, seconds = 0, 0.0
+    for shape, timings in warmup_result["shapes"].items():
+        tokens += int(shape.split(":")[1])
+        seconds += timings["steady_ms"] / 1000
+    return tokens / seconds if seconds > 0 else 0.0
+
+
+def update_instance(instance, device=None, gpu_num: int = 1, max_batch_size: int = 1,
+                    tokens_per_second: float = 0.0, queue_depth: int = 0, **extra_tags):
+    """Sets the host, GPU and load fields of a together_web3 `Instance` in place."""
+    free, total = gpu_memory(device)
+    instance.arch = platform.machine()
+    instance.os = platform.system()
+    instance.cpu_num = os.cpu_count()
+    instance.memory = host_memory()
+    if total:
+        instance.gpu_num = gpu_num
+        instance.gpu_type = torch.cuda.get_device_name(device)
+        instance.gpu_memory = total
+    tags = dict(instance.tags or {})
+    tags.update({
+        "free_gpu_memory": str(free),
+        "max_batch_size": str(max_batch_size),
+        "tokens_per_second": f"{tokens_per_second:.1f}",
+        "queue_depth": str(queue_depth),
+    })
+    tags.update({key: str(value) for key, value in extra_tags.items()})
+    instance.tags = tags
+    return instance
+
+
+async def reannounce(join: typing.Callable[[], typing.Awaitable[None]], interval: float,
+                     stopped: typing.Callable[[], bool]):
+    """Calls `join()` every `interval` seconds until `stopped()`; interval <= 0 disables it."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if stopped():
+            return
+        try:
+            await join()
+        except Exception:
+            LOGGER.exception("Re-announcing capacity failed")
+
+
+def start_reannounce(worker, loop: typing.Optional[asyncio.AbstractEventLoop] = None) -> "asyncio.Future[None]":
+    """Starts `reannounce` of `worker._join_local_coordinator` unless it already runs for `worker`.
+
+    `worker` provides `announce_interval` and `shutdown`; the task is kept on the worker, which also
+    keeps it from being garbage collected.
+    """
+    task = getattr(worker, "_reannounce_task", None)
+    if task is None or task.done():
+        task = asyncio.ensure_future(reannounce(worker._join_local_coordinator, worker.announce_interval,
+                                                lambda: worker.shutdown), loop=loop)
+        worker._reannounce_task = task
+    return task
@@ -0,0 +1,184 @@
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import dataclasses
+import functools
+import json
+import logging
+import pathlib
+import typing
+
+import torch
+
+
+LOGGER = logging.getLogger(__name__)
+
+# How many checkpoint shards a conversion worker keeps open at once. Workers map shards on the CPU, so an
+# open shard only costs its pickled metadata; pages of tensor data are faulted in when a task touches them.
+_WORKER_SHARD_CACHE_SIZE = 16
+
+
+def _load_checkpoint(checkpoint_path, map_location=None, mmap_location="cpu") -> typing.Tuple[typing.Any, bool]:
+    """load_checkpoint() that also tells whether the checkpoint is memory-mapped.
+
+    A mapped checkpoint is loaded with ``mmap_location``, others with ``map_location``.
+    """
+    if not isinstance(checkpoint_path, (str, pathlib.Path)):
+        with checkpoint_path.open() as checkpoint_file:
+            return torch.load(checkpoint_file, map_location=map_location), False
+    try:
+        return torch.load(checkpoint_path, map_location=mmap_location, mmap=True), True
+    except (TypeError, RuntimeError, ValueError):
+        # TypeError: torch<2.1 has no mmap argument; RuntimeError/ValueError: legacy (non-zip) checkpoint format.
+        return torch.load(checkpoint_path, map_location=map_location), False
+
+
+def load_checkpoint(checkpoint_path, map_location=None):
+    """Loads a torch checkpoint memory-mapped when possible, falling back to a regular (full) load.
+
+    Besides file paths, accepts objects with an ``open()`` method returning a seekable binary file,
+    such as ``examples.pytorch.nemo.NemoArchiveMember``.
+    """
+    return _load_checkpoint(checkpoint_path, map_location=map_location, mmap_location=map_location)[0]
+
+
+def get_state(checkpoint, state_path: typing.Sequence[str]):
+    state = checkpoint
+    for name in state_path:
+        state = state[name]
+    return state
+
+
+@dataclasses.dataclass(frozen=True)
+class ConversionTask:
+    """Conversion of a single weight: which shards and key it reads and the function writing its outputs.
+
+    ``convert_fn`` is called as ``convert_fn(transformer_model_list=...)`` with one ``{key: tensor}`` dict
+    per shard in ``shard_paths``, so the existing ``*_and_convert_process`` functions can be used through
+    ``functools.partial``.
+    """
+
+    name: str
+    shard_paths: typing.Tuple[typing.Any, ...]  # anything accepted by load_checkpoint()
+    state_path: typing.Tuple[str, ...]
+    state_key: str
+    key: str
+    convert_fn: typing.Callable
+
+
+@dataclasses.dataclass(frozen=True)
+class ConversionStage:
+    """Shards converted together, e.g. the training TP shards of one inference rank and pipeline stage.
+
+    ``plan_fn`` is called in the main process with the loaded checkpoints of ``shard_paths`` and returns
+    the stage's tasks; it can also collect stage-wide values (vocabulary size, embeddings) from them, so
+    that every shard is loaded once.
+    """
+
+    shard_paths: typing.Tuple[typing.Any, ...]  # anything accepted by load_checkpoint()
+    plan_fn: typing.Callable[[typing.List[typing.Any]], typing.List[ConversionTask]]
+
+
+class ConversionManifest:
+    """Append-only record of finished conversion tasks, used to resume an interrupted conversion."""
+
+    FILENAME = "conversion_manifest.jsonl"
+
+    def __init__(self, saved_dir: typing.Union[str, pathlib.Path], resume: bool = False):
+        self._path = pathlib.Path(saved_dir) / self.FILENAME
+        self._done = set()
+        if resume and self._path.exists():
+            with self._path.open("r") as manifest_file:
+                for line in manifest_file:
+                    line = line.strip()
+                    if line:
+                        self._done.add(json.loads(line)["task"])
+            LOGGER.info("Resuming conversion, %d tasks already done according to %s", len(self._done), self._path)
+        else:
+            self._path.write_text("")
+
+    def __contains__(self, task_name: str) -> bool:
+        return task_name in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def record(self, task_name: str):
+        with self._path.open("a") as manifest_file:
+            manifest_file.write(json.dumps({"task": task_name}) + "\n")
+        self._done.add(task_name)
+
+
+@functools.lru_cache(maxsize=_WORKER_SHARD_CACHE_SIZE)
+def _load_shard(shard_path: str):
+    # only mapped shards are loaded by the workers, on the CPU: a cached shard does not hold its tensors
+    return load_checkpoint(shard_path, map_location="cpu")
+
+
+def _map_tensor(tensor: torch.Tensor, map_location) -> torch.Tensor:
+    """Moves a tensor mapped on the CPU where ``map_location`` would have loaded it from a shard."""
+    if map_location is None or map_location == "cpu":
+        return tensor
+    if callable(map_location):
+        # the storage location saved in the shard is lost once mapped, so map it as saved by rank 0 ("cuda:0")
+        storage = map_location(tensor.untyped_storage(), "cuda:0")
+        return torch.empty(0, dtype=tensor.dtype, device=storage.device).set_(
+            storage, tensor.storage_offset(), tensor.size(), tensor.stride()
+        )
+    return tensor.to(map_location)
+
+
+def _execute_task(task: ConversionTask, tensors: typing.Optional[typing.List[torch.Tensor]] = None,
+                  map_location=None) -> str:
+    if tensors is None:
+        tensors = [
+            _map_tensor(get_state(_load_shard(shard_path), task.state_path)[task.state_key], map_location)
+            for shard_path in task.shard_paths
+        ]
+    task.convert_fn(transformer_model_list=[{task.key: tensor} for tensor in tensors])
+    return task.name
+
+
+def _execute_task_star(task_and_tensors):
+    return _execute_task(*task_and_tensors)
+
+
+def run_conversion_plan(pool, stages: typing.Sequence[ConversionStage], manifest: ConversionManifest,
+                        map_location=None):
+    """Plans each stage from a single load of its shards and runs its tasks not yet in the manifest on the pool.
+
+    Each task is recorded in the manifest as it finishes. Shards that can be memory-mapped are mapped on
+    the CPU, and the workers map them again to read exactly the tensors of their task, which they move
+    where ``map_location`` would have loaded them. Others (legacy formats, .nemo archive members) are
+    loaded once with ``map_location`` and the workers receive only the tensors of their task instead of
+    the whole state dicts.
+    """
+    num_tasks = num_done = 0
+    for stage in stages:
+        loaded = [_load_checkpoint(shard_path, map_location=map_location) for shard_path in stage.shard_paths]
+        checkpoints = [checkpoint for checkpoint, _ in loaded]
+        tasks = stage.plan_fn(checkpoints)
+        pending = [task for task in tasks if task.name not in manifest]
+        num_tasks += len(tasks)
+        num_done += len(tasks) - len(pending)
+        if all(mmapped for _, mmapped in loaded):
+            work_items = [(task, None, map_location) for task in pending]
+        else:
+            work_items = [
+                (task, [get_state(checkpoint, task.state_path)[task.state_key] for checkpoint in checkpoints])
+                for task in pending
+            ]
+        for task_name in pool.imap_unordered(_execute_task_star, work_items):
+            manifest.record(task_name)
+        del loaded, checkpoints, work_items
+    LOGGER.info("Conversion plan: %d tasks, %d were already done", num_tasks, num_done)
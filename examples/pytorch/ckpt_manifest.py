@@ -0,0 +1,280 @@
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Integrity manifest of a converted FasterTransformer checkpoint directory.
+
+Converters write their weights with ``save_weight()`` and call ``write_manifest()`` once all files are
+written. The manifest (``manifest.json`` next to ``config.ini``) lists name, shape, dtype, byte size
+and a blake2b hash of every ``*.bin`` file. ``verify_manifest()`` checks a directory against it on a
+thread pool; hashing releases the GIL, so reading and hashing files in parallel runs close to disk
+bandwidth. ``mode="size"`` only compares file sizes, which catches truncated files in milliseconds.
+
+    python examples/pytorch/ckpt_manifest.py create <model_dir>
+    python examples/pytorch/ckpt_manifest.py verify <model_dir> [--size-only]
+"""
+import argparse
+import concurrent.futures
+import configparser
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import sys
+import time
+import typing
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_ALGORITHM = "blake2b-128"
+VERIFY_MODES = ("none", "size", "full")
+
+# Entries recorded by save_weight(), possibly from several converter processes at once; merged into the
+# manifest and removed by write_manifest().
+_ENTRIES_FILENAME = ".manifest_entries.jsonl"
+_READ_CHUNK_SIZE = 16 << 20
+_RANK_SUFFIX_PATTERN = re.compile(r"\.(\d+)\.bin$")
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def _default_num_threads() -> int:
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def hash_file(path: typing.Union[str, pathlib.Path]) -> str:
+    file_hash = _new_hash()
+    with open(path, "rb", buffering=0) as weight_file:
+        buffer = bytearray(_READ_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n_read = weight_file.readinto(buffer)
+            if not n_read:
+                break
+            file_hash.update(view[:n_read])
+    return file_hash.hexdigest()
+
+
+def save_weight(array, path: typing.Union[str, pathlib.Path]):
+    """Drop-in replacement of ``array.tofile(path)`` which also records the file's manifest entry.
+
+    The hash is computed from the array in memory, so the file does not have to be read back.
+    """
+    array = np.ascontiguousarray(array)
+    array.tofile(path)
+    path = pathlib.Path(path)
+    file_hash = _new_hash()
+    file_hash.update(memoryview(array).cast("B"))
+    entry = {
+        "name": path.name,
+        "shape": list(array.shape),
+        "dtype": array.dtype.name,
+        "size": array.nbytes,
+        "hash": file_hash.hexdigest(),
+        # identifies this version of the file, see write_manifest()
+        "mtime_ns": path.stat().st_mtime_ns,
+    }
+    # a single O_APPEND write of one short line is not interleaved with other processes' lines
+    fd = os.open(path.parent / _ENTRIES_FILENAME, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def _config_weight_dtype(model_dir: pathlib.Path) -> typing.Optional[str]:
+    config_path = model_dir / "config.ini"
+    if not config_path.exists():
+        return None
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    for section in config.sections():
+        data_type = config[section].get("weight_data_type")
+        if data_type:
+            return {"fp32": "float32", "fp16": "float16"}.get(data_type, data_type)
+    return None
+
+
+def write_manifest(model_dir: typing.Union[str, pathlib.Path], num_threads: typing.Optional[int] = None) -> dict:
+    """Writes ``manifest.json`` for all ``*.bin`` files of ``model_dir``.
+
+    Files saved with ``save_weight()`` reuse the recorded entry as long as their size and modification
+    time are the recorded ones; any other file, e.g. one rewritten since by a converter that does not
+    use ``save_weight()``, is hashed from disk and gets ``shape=None`` and the dtype declared in
+    ``config.ini``.
+    """
+    model_dir = pathlib.Path(model_dir)
+    entries_path = model_dir / _ENTRIES_FILENAME
+    recorded = {}
+    if entries_path.exists():
+        with entries_path.open("r") as entries_file:
+            for line in entries_file:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    recorded[entry["name"]] = entry  # last write wins, e.g. for resumed conversions
+
+    files = {}
+    unrecorded = []
+    for path in sorted(model_dir.glob("*.bin")):
+        entry = recorded.get(path.name)
+        stat = path.stat()
+        # entries left by an interrupted conversion may describe an older version of the file
+        if entry is not None and (entry["size"], entry.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns):
+            files[path.name] = {key: value for key, value in entry.items() if key not in ("name", "mtime_ns")}
+        else:
+            unrecorded.append(path)
+
+    if unrecorded:
+        LOGGER.info("Hashing %d files without recorded manifest entries", len(unrecorded))
+        dtype = _config_weight_dtype(model_dir)
+        with concurrent.futures.ThreadPoolExecutor(num_threads or _default_num_threads()) as executor:
+            for path, file_hash in zip(unrecorded, executor.map(hash_file, unrecorded)):
+                files[path.name] = {"shape": None, "dtype": dtype, "size": path.stat().st_size, "hash": file_hash}
+
+    manifest = {"version": MANIFEST_VERSION, "hash_algorithm": HASH_ALGORITHM, "files": dict(sorted(files.items()))}
+    tmp_path = model_dir / (MANIFEST_FILENAME + ".tmp")
+    with tmp_path.open("w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(tmp_path, model_dir / MANIFEST_FILENAME)
+    if entries_path.exists():
+        entries_path.unlink()
+    LOGGER.info("Wrote manifest of %d files to %s", len(files), model_dir / MANIFEST_FILENAME)
+    return manifest
+
+
+def load_manifest(model_dir: typing.Union[str, pathlib.Path]) -> typing.Optional[dict]:
+    manifest_path = pathlib.Path(model_dir) / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return None
+    with manifest_path.open("r") as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("hash_algorithm") != HASH_ALGORITHM:
+        raise ValueError(f"Unsupported manifest hash algorithm {manifest.get('hash_algorithm')} in {manifest_path}")
+    return manifest
+
+
+def _belongs_to_rank(name: str, tensor_para_rank: typing.Optional[int]) -> bool:
+    if tensor_para_rank is None:
+        return True
+    match = _RANK_SUFFIX_PATTERN.search(name)
+    return match is None or int(match.group(1)) == tensor_para_rank
+
+
+def verify_manifest(
+    model_dir: typing.Union[str, pathlib.Path],
+    mode: str = "full",
+    num_threads: typing.Optional[int] = None,
+    tensor_para_rank: typing.Optional[int] = None,
+) -> typing.List[str]:
+    """Checks ``model_dir`` against its manifest and returns the list of problems found (empty if none).
+
+    ``mode`` is ``"size"`` to compare byte sizes only or ``"full"`` to also compare hashes. When
+    ``tensor_para_rank`` is given, tensor-parallel files of other ranks (``*.<rank>.bin``) are skipped.
+    """
+    if mode not in ("size", "full"):
+        raise ValueError(f"Unknown verification mode {mode}, expected 'size' or 'full'")
+    model_dir = pathlib.Path(model_dir)
+    manifest = load_manifest(model_dir)
+    if manifest is None:
+        return [f"{model_dir / MANIFEST_FILENAME} does not exist"]
+
+    problems = []
+    to_hash = []
+    for name, entry in manifest["files"].items():
+        if not _belongs_to_rank(name, tensor_para_rank):
+            continue
+        path = model_dir / name
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            problems.append(f"{name}: missing")
+            continue
+        if size != entry["size"]:
+            problems.append(f"{name}: size {size} bytes, expected {entry['size']}")
+        elif mode == "full":
+            to_hash.append((name, path, entry["hash"]))
+
+    if to_hash:
+        # largest files first so that the pool is not left waiting on one big file at the end
+        to_hash.sort(key=lambda item: -manifest["files"][item[0]]["size"])
+        with concurrent.futures.ThreadPoolExecutor(num_threads or _default_num_threads()) as executor:
+            hashes = executor.map(hash_file, [path for _, path, _ in to_hash])
+            for (name, _, expected_hash), file_hash in zip(to_hash, hashes):
+                if file_hash != expected_hash:
+                    problems.append(f"{name}: hash {file_hash}, expected {expected_hash}")
+    return sorted(problems)
+
+
+def verify_checkpoint_dir(
+    model_dir: typing.Union[str, pathlib.Path],
+    mode: str,
+    num_threads: typing.Optional[int] = None,
+    tensor_para_rank: typing.Optional[int] = None,
+):
+    """Worker startup check: verifies ``model_dir`` unless ``mode`` is ``"none"``.
+
+    Raises ``RuntimeError`` listing the problems found. A missing manifest only logs a warning so that
+    checkpoints converted before manifests existed can still be served.
+    """
+    if mode == "none":
+        return
+    if not (pathlib.Path(model_dir) / MANIFEST_FILENAME).exists():
+        LOGGER.warning("No %s in %s, skipping checkpoint verification", MANIFEST_FILENAME, model_dir)
+        return
+    start_time = time.perf_counter()
+    problems = verify_manifest(model_dir, mode=mode, num_threads=num_threads, tensor_para_rank=tensor_para_rank)
+    if problems:
+        raise RuntimeError(f"Checkpoint {model_dir} failed {mode} verification:\n  " + "\n  ".join(problems))
+    LOGGER.info("Checkpoint %s passed %s verification in %.2f s", model_dir, mode, time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("command", choices=["create", "verify"])
+    parser.add_argument("model_dir", help="directory with the converted model.*.bin files and config.ini")
+    parser.add_argument("--size-only", "--size_only", action="store_true", help="verify: compare file sizes only")
+    parser.add_argument("--threads", type=int, default=None, help="number of hashing threads")
+    parser.add_argument(
+        "--tensor-para-rank", "--tensor_para_rank", type=int, default=None,
+        help="verify: skip tensor parallel files of other ranks",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+
+    if args.command == "create":
+        write_manifest(args.model_dir, num_threads=args.threads)
+        return 0
+
+    start_time = time.perf_counter()
+    problems = verify_manifest(
+        args.model_dir,
+        mode="size" if args.size_only else "full",
+        num_threads=args.threads,
+        tensor_para_rank=args.tensor_para_rank,
+    )
+    for problem in problems:
+        LOGGER.error(problem)
+    LOGGER.info("Verification %s in %.2f s", "failed" if problems else "passed", time.perf_counter() - start_time)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
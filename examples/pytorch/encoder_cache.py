@@ -0,0 +1,138 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of encoder outputs of an encoder-decoder model (T5), keyed by the input token ids.
+
+Requests often repeat a source text with other decoding settings (beam width, max_tokens) or
+retry it. `EncoderOutputCache.encode` looks up every row of a batch by its token ids, runs the
+encoder only on the rows it does not hold and assembles the padded [batch, seq_len, hidden]
+encoder output the decoding takes. Rows are kept on the GPU within `gpu_budget_bytes`; the least
+recently used ones are moved to pinned host memory within `host_budget_bytes`, and dropped after.
+
+The cached outputs are only valid for the weights they were computed with, so a worker must
+`clear()` the cache when it loads other weights. Tensor-parallel ranks stay consistent as long
+as they all see the same batches with the same budgets.
+"""
+import collections
+import typing
+
+import torch
+
+# row key -> encoder output [seq_len, hidden]
+_Rows = "collections.OrderedDict[typing.Tuple[int, ...], torch.Tensor]"
+
+
+def _nbytes(tensor: torch.Tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+class EncoderOutputCache:
+
+    def __init__(self, gpu_budget_bytes: int, host_budget_bytes: int = 0, device=None):
+        self.gpu_budget_bytes = gpu_budget_bytes
+        self.host_budget_bytes = host_budget_bytes
+        self.device = torch.device("cuda", torch.cuda.current_device()) if device is None else torch.device(device)
+        # least recently used first
+        self._on_device: _Rows = collections.OrderedDict()
+        self._on_host: _Rows = collections.OrderedDict()
+        self.device_bytes = 0
+        self.host_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, token_ids: typing.Sequence[typing.Sequence[int]],
+               encode_fn: typing.Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
+               ) -> typing.Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the encoder output [batch, max len, hidden] and the lengths [batch] of `token_ids`.
+
+        `encode_fn(input_ids, seq_len)` runs the encoder on int32 device tensors [batch, max len]
+        and [batch]; it is only called for the rows not in the cache.
+        """
+        lengths = [len(ids) for ids in token_ids]
+        rows: typing.List[typing.Optional[torch.Tensor]] = [self._get(tuple(ids)) for ids in token_ids]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        seq_len = torch.tensor(lengths, dtype=torch.int32).to(self.device, non_blocking=True)
+
+        if missing:
+            missing_len = max(lengths[i] for i in missing)
+            input_ids = torch.zeros([len(missing), missing_len], dtype=torch.int32)
+            for j, i in enumerate(missing):
+                input_ids[j, :lengths[i]] = torch.as_tensor(token_ids[i], dtype=torch.int32)
+            missing_seq_len = seq_len if len(missing) == len(rows) else seq_len[missing]
+            outputs = encode_fn(input_ids.to(self.device), missing_seq_len)
+            for j, i in enumerate(missing):
+                rows[i] = outputs[j, :lengths[i]]
+                # a copy, so that the cached row does not keep the whole batch output alive
+                self._put(tuple(token_ids[i]), rows[i].clone())
+            if len(missing) == len(rows):
+                return outputs, seq_len
+
+        first = rows[0]
+        batch = torch.zeros([len(rows), max(lengths), first.shape[-1]], dtype=first.dtype, device=self.device)
+        for i, row in enumerate(rows):
+            batch[i, :lengths[i]] = row
+        return batch, seq_len
+
+    def _get(self, key: typing.Tuple[int, ...]) -> typing.Optional[torch.Tensor]:
+        row = self._on_device.get(key)
+        if row is not None:
+            self._on_device.move_to_end(key)
+            return row
+        row = self._on_host.pop(key, None)
+        if row is None:
+            return None
+        self.host_bytes -= _nbytes(row)
+        row = row.to(self.device, non_blocking=True)
+        self._put(key, row)
+        return row
+
+    def _put(self, key: typing.Tuple[int, ...], row: torch.Tensor):
+        size = _nbytes(row)
+        if size > self.gpu_budget_bytes or key in self._on_device:
+            return
+        self._on_device[key] = row
+        self.device_bytes += size
+        while self.device_bytes > self.gpu_budget_bytes:
+            old_key, old_row = self._on_device.popitem(last=False)
+            self.device_bytes -= _nbytes(old_row)
+            self._to_host(old_key, old_row)
+
+    def _to_host(self, key: typing.Tuple[int, ...], row: torch.Tensor):
+        size = _nbytes(row)
+        if size > self.host_budget_bytes:
+            return
+        host_row = torch.empty(row.shape, dtype=row.dtype, pin_memory=True)
+        host_row.copy_(row, non_blocking=True)
+        self._on_host[key] = host_row
+        self.host_bytes += size
+        while self.host_bytes > self.host_budget_bytes:
+            _, old_row = self._on_host.popitem(last=False)
+            self.host_bytes -= _nbytes(old_row)
+
+    def clear(self):
+        self._on_device.clear()
+        self._on_host.clear()
+        self.device_bytes = 0
+        self.host_bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "device_rows": len(self._on_device),
+            "device_bytes": self.device_bytes,
+            "host_rows": len(self._on_host),
+            "host_bytes": self.host_bytes,
+        }
@@ -1,4 +1,8 @@
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch import startup
+startup.begin()
 from typing import Dict
 import argparse
 import timeit
@@ -10,12 +14,14 @@ import logging
 from together_worker.fast_inference import FastInferenceInterface
 from together_web3.computer import RequestTypeLanguageModelInference
 from together_web3.together import TogetherWeb3, TogetherClientOptions
+from examples.pytorch.ckpt_manifest import VERIFY_MODES, verify_checkpoint_dir
+from examples.pytorch.gpt.utils.scoring import DEFAULT_MAX_TOKENS, completion_pair, completion_top, openai_logprobs, requested_top_n
+from examples.pytorch.model_factory import DEFAULT_LIB_DIR, LIB_DIR_ENV, build_model, lib_path, load_tokenizer, read_config
+from examples.pytorch.warmup import DEFAULT_SHAPES, install_gemm_config, parse_shapes, run_warmup, warmup_enabled
 import torch
 import torch.distributed as dist
 from torch.nn.utils.rnn import pad_sequence
-from utils.gpt import ParallelGPT
 from utils.para_utils import *
-from transformers import AutoTokenizer, AutoConfig
 import logging
 
 logger = logging.getLogger(__name__)
@@ -56,45 +62,51 @@ class FastOPTInference(FastInferenceInterface):
             "repetition_penalty": 1.0,
             "return_cum_log_probs": 0,
             "return_output_length":0,
+            "logprobs": None,
+            "echo": False,
         }
+        self.score_max_tokens = args.get('score_max_tokens', DEFAULT_MAX_TOKENS)
+        self.model_name = model_name
+        self.warmup_shapes = parse_shapes(args.get('warmup_shapes', DEFAULT_SHAPES))
         
-        if args['hf_model_name'] == 'facebook/opt-175b':
-            hf_config = vars(AutoConfig.from_pretrained('facebook/opt-66b'))
-            head_num = 96
-            layer_num = 96
-            max_seq_len = 2048
-            size_per_head = 128
-            self.tokenizer = AutoTokenizer.from_pretrained('facebook/opt-66b', use_fast=False)
-        else:
-            hf_config = vars(AutoConfig.from_pretrained(args['hf_model_name']))
-            head_num = hf_config['num_attention_heads']
-            layer_num = hf_config['num_hidden_layers']
-            max_seq_len = hf_config['max_position_embeddings']
-            size_per_head = hf_config['hidden_size'] // head_num
-            self.tokenizer = AutoTokenizer.from_pretrained(args['hf_model_name'], use_fast=False)
-        start_id = hf_config['bos_token_id']
-        self.end_id = hf_config['eos_token_id']
-        vocab_size = 50272
-        layernorm_eps = 1e-5
-        layernorm_type = 'pre_layernorm' if hf_config['do_layer_norm_before'] else 'post_layernorm'
-        activation_type = 'Relu' if hf_config['activation_function'] == 'relu' else 'Gelu'
-        has_post_decoder_layernorm = layernorm_type == 'pre_layernorm'
-        lib_path = '/workspace/Port_FasterTransformer/build/lib/libth_parallel_gpt.so'
         ckpt_path = args['ckpt_path']
-        self.tokenizer.pad_token = self.tokenizer.eos_token
+        verify_checkpoint_dir(ckpt_path, args.get('verify_ckpt', 'none'), tensor_para_rank=dist.get_rank())
+        config = read_config(ckpt_path)
+        self.end_id = config.end_id
+        # OPT-175B is not on the hub, it shares the tokenizer of OPT-66B
+        hf_model_name = 'facebook/opt-66b' if args['hf_model_name'] == 'facebook/opt-175b' else args['hf_model_name']
+        tokenizer = startup.in_background("load tokenizer", load_tokenizer, ckpt_path, hf_model_name)
         torch.manual_seed(0)
         with torch.no_grad():
             # Prepare model.
-            self.opt_model = ParallelGPT(head_num, size_per_head, vocab_size, start_id, self.end_id, layer_num,
-                                         max_seq_len, self.tensor_para_size, self.pipeline_para_size, lib_path,
-                                         layernorm_eps, layernorm_type, activation_type, has_post_decoder_layernorm,
-                                         int8_mode=0, weights_data_type='fp16')
-            if not self.opt_model.load_w_type(ckpt_path=ckpt_path, infer_data_type='fp16'):
-                logging.debug("[WARNING] Checkpoint file not found. Model loading is skipped.")
-               
+            if warmup_enabled():
+                # every rank merges the config before building its op; the first one generates it
+                install_gemm_config(lib_path("parallel_gpt", args.get('lib_dir')), self.max_batch_size, 1,
+                                    max(shape[0] for shape in self.warmup_shapes), config.head_num,
+                                    config.size_per_head, config.inter_size, config.vocab_size,
+                                    tensor_para_size=self.tensor_para_size)
+            self.opt_model = build_model(ckpt_path, self.tensor_para_size, self.pipeline_para_size,
+                                         lib_dir=args.get('lib_dir'), parallel=True)
+        self.tokenizer = tokenizer.result()
                 
         logging.debug(f"<FastOPTInference.__init__> rank {dist.get_rank()} initialization done")
 
+    def warmup(self):
+        if warmup_enabled():
+            run_warmup(self._warmup_request, self.model_name, self.warmup_shapes)
+
+    def _warmup_request(self, input_len, output_len):
+        self.dispatch_request([{"prompt": " the" * input_len, "max_tokens": output_len}], None)
+
+    def start(self):
+        # rank 0 sends the warmup requests before it joins the coordinator; the other ranks run them
+        # from their worker() loop, in step with rank 0 as for real requests
+        if dist.get_rank() == 0:
+            with startup.phase("warmup"):
+                self.warmup()
+        startup.report()
+        super().start()
+
     def _sync_task_info(self):
         logging.debug(f"<FastOPTInference._sync_task_info> enter rank-<{dist.get_rank()}>")
         dist.barrier()
@@ -125,8 +137,10 @@ class FastOPTInference(FastInferenceInterface):
         self.task_info["stream_tokens"] = args.get("stream_tokens", False)
         self.task_info["return_cum_log_probs"] = args.get("return_cum_log_probs", 0)
         self.task_info["return_output_length"] = args.get("return_output_length", 0)
+        self.task_info["logprobs"] = args.get("logprobs")
+        self.task_info["echo"] = bool(args.get("echo", False))
         
-        if len(self.task_info["prompt_seqs"][0]) == 0 or self.task_info["output_len"] == 0:
+        if len(self.task_info["prompt_seqs"][0]) == 0 or (self.task_info["output_len"] == 0 and not self.task_info["echo"]):
             inferenece_result = []
             item = {'choices': [], }
             for beam_id in range(self.task_info["beam_width"]):
@@ -164,38 +178,39 @@ class FastOPTInference(FastInferenceInterface):
             logging.debug(f"start_ids: length ({start_ids.shape[0]}) ids: {start_ids}")
             
             time = timeit.default_timer()
-            max_batch_size = self.max_batch_size
-            tokens_batch = self.opt_model(start_ids,
-                                    start_lengths,
-                                    self.task_info["output_len"],
-                                    self.task_info["beam_width"],
-                                    self.task_info["top_k"] * torch.ones(size=[max_batch_size], dtype=torch.int32),
-                                    self.task_info["top_p"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["beam_search_diversity_rate"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["temperature"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["len_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["repetition_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.random_seed_tensor,
-                                    self.task_info["return_output_length"],
-                                    self.task_info["return_cum_log_probs"])
+            top = None
+            if self.task_info["output_len"] == 0:
+                # echo only: the prompt is returned (and scored)
+                tokens_batch = start_ids[:, None, :]
+                self.task_info["return_cum_log_probs"] = 0
+                self.task_info["beam_width"] = 1
+            else:
+                tokens_batch, top = self._generate(start_ids, start_lengths)
             # only a thread (rank 0) gets the output, while the others are supposed to return None.
             time_elapsed = timeit.default_timer() - time
         logging.debug("[INFO] OPT time costs: {:.2f} ms. <rank-{}>".format(time_elapsed * 1000, dist.get_rank()))
-        
+
+        if self.task_info["return_cum_log_probs"] > 0 and tokens_batch is not None:
+            tokens_batch, _, cum_log_probs = tokens_batch
+            logging.debug('[INFO] Log probs of sentences:', cum_log_probs)
+
+        outputs = None
         if dist.get_rank() == 0:
             assert tokens_batch is not None
-        
-            if self.task_info["return_cum_log_probs"] > 0:
-                tokens_batch, _, cum_log_probs = tokens_batch
-                logging.debug('[INFO] Log probs of sentences:', cum_log_probs)
+            # the contexts are known, only the outputs after the shortest one are copied to the host
+            min_length = int(start_lengths.min())
+            tokens_batch = tokens_batch[:, :, min_length:].cpu().numpy()
+            # exclude context input from the output
+            outputs = [[tokens[beam_id][start_lengths[i] - min_length:] for beam_id in range(self.task_info["beam_width"])]
+                       for i, tokens in enumerate(tokens_batch)]
+        scores = self._score(start_ids, start_lengths, outputs, top)
 
+        if dist.get_rank() == 0:
             inferenece_result = []
-            tokens_batch = tokens_batch.cpu().numpy()
             
-            for i, (context, tokens) in enumerate(zip(self.task_info["prompt_seqs"], tokens_batch)):
+            for i, (context, beams) in enumerate(zip(self.task_info["prompt_seqs"], outputs)):
                 item = {'choices': [], }
-                for beam_id in range(self.task_info["beam_width"]):
-                    token = tokens[beam_id][start_lengths[i]:]  # exclude context input from the output
+                for beam_id, token in enumerate(beams):
                     output = self.tokenizer.decode(token)
                     logging.debug(f"[INFO] batch {i}, beam {beam_id}: \n[Context]\n{context}\n\n[Output]\n{output}\n")
                     choice = {
@@ -203,6 +218,12 @@ class FastOPTInference(FastInferenceInterface):
                         "index": beam_id,
                         "finish_reason": "length"
                     }
+                    if self.task_info["echo"]:
+                        choice["text"] = context + choice["text"]
+                    if scores is not None:
+                        result, unscored, choice_top = scores[i][beam_id]
+                        choice["logprobs"] = openai_logprobs(self.tokenizer, result, unscored,
+                                                             0 if self.task_info["echo"] else len(context), choice_top)
                 item['choices'].append(choice)
                 inferenece_result.append(item)
             #  So far coordinator does not support batch. 
@@ -213,7 +234,65 @@ class FastOPTInference(FastInferenceInterface):
             }
         else:
             return None
-        
+
+    def _generate(self, start_ids, start_lengths):
+        """The model's outputs and, if the request wants `logprobs` alternatives, the generation's top log probs
+        on the device: ids [batch, output_len, N] and log probs [batch, output_len, N]."""
+        top_n = requested_top_n(self.task_info["logprobs"], self.task_info["beam_width"])
+        with torch.no_grad():
+            max_batch_size = self.max_batch_size
+            tokens_batch = self.opt_model(start_ids,
+                                    start_lengths,
+                                    self.task_info["output_len"],
+                                    self.task_info["beam_width"],
+                                    self.task_info["top_k"] * torch.ones(size=[max_batch_size], dtype=torch.int32),
+                                    self.task_info["top_p"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
+                                    self.task_info["beam_search_diversity_rate"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
+                                    self.task_info["temperature"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
+                                    self.task_info["len_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
+                                    self.task_info["repetition_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
+                                    self.random_seed_tensor,
+                                    self.task_info["return_output_length"],
+                                    self.task_info["return_cum_log_probs"],
+                                    top_n)
+        if not top_n:
+            return tokens_batch, None
+        *outputs, top_log_probs, top_ids = tokens_batch
+        return (outputs[0] if len(outputs) == 1 else tuple(outputs)), (top_ids[:, 0], top_log_probs[:, 0])
+
+    def _score(self, start_ids, start_lengths, outputs, top):
+        """[batch][beam] (Score, unscored prompt ids, alternatives) of the `outputs` if `logprobs` is set.
+
+        Rank 0 builds the pairs to score from its outputs and broadcasts them, so that all ranks run
+        the same batches. The alternatives of the generated tokens are the generation's `top`, of which
+        only [batch, output_len, N] is copied to rank 0's host.
+        """
+        if self.task_info["logprobs"] is None:
+            return None
+        echo = self.task_info["echo"]
+        pairs = [None]
+        if dist.get_rank() == 0:
+            pairs[0] = [[completion_pair(start_ids[i, :start_lengths[i]].tolist(), output, echo, self.tokenizer.all_special_ids)
+                         for output in beams]
+                        for i, beams in enumerate(outputs)]
+        dist.broadcast_object_list(pairs, src=0)
+        flat = [pair for beams in pairs[0] for pair, _ in beams]
+        top_n = requested_top_n(self.task_info["logprobs"])
+        results = iter(self.opt_model.score(flat, self.end_id, max_tokens=self.score_max_tokens,
+                                            top_n=top_n if echo or top is None else 0))
+        if dist.get_rank() != 0:
+            return None
+        if top is not None:
+            top = (top[0].cpu().numpy(), top[1].cpu().numpy())
+        scores = []
+        for i, beams in enumerate(pairs[0]):
+            scores.append([])
+            for beam_id, (_, unscored) in enumerate(beams):
+                result = next(results)
+                generated = None if top is None else (top[0][i], top[1][i])
+                scores[-1].append((result, unscored, completion_top(result, len(outputs[i][beam_id]), echo, generated)))
+        return scores
+
     def worker(self):
         while True:
             self._sync_task_info()
@@ -227,15 +306,25 @@ if __name__ == "__main__":
     parser.add_argument('--together_model_name', type=str, default=os.environ.get('SERVICE', 'Together-opt-175b'),
                         help='worker name for together coordinator.')
     parser.add_argument('--hf_model_name', type=str, default='facebook/opt-175b',
-                        help='hugging face model name (used to load config).')
+                        help='hugging face model name (used to load the tokenizer when the checkpoint has none).')
     parser.add_argument('--ckpt_path', type=str, default='/workspace/Port_FasterTransformer/build/model/opt-175b-tp6/6-gpu',
                         help='path to the checkpoint file.')
+    parser.add_argument('--lib_dir', type=str, default=os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR),
+                        help='directory with the FasterTransformer op libraries.')
+    parser.add_argument('--verify_ckpt', type=str, default=os.environ.get('VERIFY_CKPT', 'none'), choices=VERIFY_MODES,
+                        help='check the checkpoint against its manifest.json before loading: none, size or full.')
     parser.add_argument('--tensor_para_size', type=int, default=1,
                         help='tensor parallel size')
+    parser.add_argument('--score_max_tokens', type=int, default=int(os.environ.get('SCORE_MAX_TOKENS', DEFAULT_MAX_TOKENS)),
+                        help='padded tokens per batch when scoring the tokens of requests with logprobs.')
+    parser.add_argument('--warmup_shapes', type=str, default=os.environ.get('WARMUP_SHAPES', DEFAULT_SHAPES),
+                        help='input_len:output_len pairs run before joining the coordinator (WARMUP=0 skips warmup).')
     parser.add_argument('--worker_name', type=str, default=os.environ.get('WORKER','worker1'),
                         help='worker name for together coordinator.')
     parser.add_argument('--group_name', type=str, default=os.environ.get('GROUP', 'group1'),
                         help='group name for together coordinator.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print an import and initialization timeline once the worker is ready.')
     
     args = parser.parse_args()
     
@@ -254,7 +343,11 @@ if __name__ == "__main__":
         "worker_name": args.worker_name,
         "group_name": args.group_name,
         "ckpt_path": args.ckpt_path,
+        "lib_dir": args.lib_dir,
+        "verify_ckpt": args.verify_ckpt,
         "tensor_para_size":args.tensor_para_size,
+        "score_max_tokens": args.score_max_tokens,
+        "warmup_shapes": args.warmup_shapes,
         "stream_tokens_pipe": False,
         "max_batch_size":1
     })
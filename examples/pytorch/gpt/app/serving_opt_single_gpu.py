@@ -1,4 +1,10 @@
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch import startup
+startup.begin()
+import functools
+import threading
 from typing import Dict
 import argparse
 import timeit
@@ -10,12 +16,17 @@ import logging
 from together_worker.fast_inference import FastInferenceInterface
 from together_web3.computer import RequestTypeLanguageModelInference
 from together_web3.together import TogetherWeb3, TogetherClientOptions
+from examples.pytorch.capacity import DEFAULT_ANNOUNCE_INTERVAL, start_reannounce, tokens_per_second, update_instance
+from examples.pytorch.ckpt_manifest import VERIFY_MODES, verify_checkpoint_dir
+from examples.pytorch.gpt.utils.scoring import DEFAULT_MAX_TOKENS, completion_pair, completion_top, openai_logprobs, requested_top_n
+from examples.pytorch.lifecycle import DEFAULT_DRAIN_TIMEOUT, Drainer
+from examples.pytorch.model_factory import DEFAULT_LIB_DIR, LIB_DIR_ENV, build_model, lib_path, load_tokenizer, read_config
+from examples.pytorch.model_registry import ModelRegistry, checkpoint_bytes, default_gpu_budget, parse_models
+from examples.pytorch.request_buffers import RequestBuffers
+from examples.pytorch.warmup import DEFAULT_SHAPES, install_gemm_config, parse_shapes, run_warmup, warmup_enabled
 import torch
 import torch.distributed as dist
-from torch.nn.utils.rnn import pad_sequence
-from utils.gpt import GPT
 from utils.para_utils import *
-from transformers import AutoTokenizer, AutoConfig
 import logging
 
 logger = logging.getLogger(__name__)
@@ -34,6 +45,8 @@ class FastOPTInference(FastInferenceInterface):
         self.pipeline_para_size = 1
         self.max_batch_size = args['max_batch_size']
         self.random_seed_tensor = torch.zeros([self.max_batch_size], dtype=torch.int64)
+        # inputs and sampling parameters are written into these once-allocated buffers for every request
+        self.buffers = RequestBuffers(self.max_batch_size, 2048)
         self.task_info={
             "prompt_seqs": None,
             "output_len":16,
@@ -46,40 +59,134 @@ class FastOPTInference(FastInferenceInterface):
             "repetition_penalty": 1.0,
             "return_cum_log_probs": 0,
             "return_output_length":0,
+            "logprobs": None,
+            "echo": False,
         }
+        self.score_max_tokens = args.get('score_max_tokens', DEFAULT_MAX_TOKENS)
         
-        hf_config = vars(AutoConfig.from_pretrained(args['hf_model_name']))
-        head_num = hf_config['num_attention_heads']
-        layer_num = hf_config['num_hidden_layers']
-        start_id = hf_config['bos_token_id']
-        self.end_id = hf_config['eos_token_id']
-        size_per_head = hf_config['hidden_size'] // head_num
-        vocab_size = 50272
-        max_seq_len = 2048
-        layernorm_eps = 1e-5
-        layernorm_type = 'pre_layernorm' if hf_config['do_layer_norm_before'] else 'post_layernorm'
-        activation_type = 'Relu' if hf_config['activation_function'] == 'relu' else 'Gelu'
-        has_post_decoder_layernorm = layernorm_type == 'pre_layernorm'
-        lib_path = '/workspace/Port_FasterTransformer/build/lib/libth_gpt.so'
-        ckpt_path = args['ckpt_path']
-        assert(ckpt_path.endswith("-tp1"))
-        self.tokenizer = AutoTokenizer.from_pretrained(args['hf_model_name'], use_fast=False)
-        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.verify_ckpt = args.get('verify_ckpt', 'none')
+        self.lib_dir = args.get('lib_dir')
+        self.warmup_shapes = parse_shapes(args.get('warmup_shapes', DEFAULT_SHAPES))
         torch.manual_seed(0)
+
+        # The worker's own model plus the ones in --models, loaded on first request within the GPU budget.
+        self.default_model = model_name
+        models = {model_name: {"hf_model_name": args['hf_model_name'], "ckpt_path": args['ckpt_path']}}
+        models.update(parse_models(args.get('models')))
+        self.model_args = models
+        self.registry = ModelRegistry(
+            gpu_budget_bytes=int(args.get('gpu_memory_budget', 0) * 2**30) or default_gpu_budget(),
+            host_budget_bytes=int(args.get('host_memory_budget', 0) * 2**30),
+            stats_path=args.get('registry_stats'))
+        for name, model_args in models.items():
+            self.registry.register(name, functools.partial(self._load_model, **model_args),
+                                   estimate_bytes=checkpoint_bytes(model_args['ckpt_path']))
+        self._select_model(self.default_model)
+        self.drainer = Drainer(self, args.get('drain_timeout', DEFAULT_DRAIN_TIMEOUT))
+        self.swap_file = args.get('swap_file')
+        self.announce_interval = args.get('announce_interval', DEFAULT_ANNOUNCE_INTERVAL)
+        self.tokens_per_second = 0.0
+        logging.debug(f"<FastOPTInference.__init__> initialization done")
+
+    def warmup(self):
+        if warmup_enabled():
+            result = run_warmup(self._warmup_request, self.default_model, self.warmup_shapes)
+            self.tokens_per_second = tokens_per_second(result)
+
+    def _warmup_request(self, input_len, output_len):
+        self.dispatch_request([{"prompt": " the" * input_len, "max_tokens": output_len}], None)
+
+    def start(self):
+        # the worker joins the coordinator in start(), so it only becomes ready once it is warm
+        with startup.phase("warmup"):
+            self.warmup()
+        startup.report()
+        self.drainer.install_signal_handlers(reload=self.swap_models)
+        start_reannounce(self, loop=self.loop)
+        super().start()
+
+    async def _join_local_coordinator(self):
+        # every join, including the periodic re-announcements, advertises the current capacity and load
+        update_instance(self.coordinator_join_request.instance, self.registry.device,
+                        max_batch_size=self.max_batch_size, tokens_per_second=self.tokens_per_second,
+                        queue_depth=self.drainer.inflight, draining=int(self.drainer.draining),
+                        models=",".join(self.registry.names()))
+        await super()._join_local_coordinator()
+
+    def dispatch_shutdown(self):
+        # finish the queued and running requests before the server loop closes the connection
+        self.drainer.begin("shutdown request")
+
+    async def together_request(self, match_event, raw_event):
+        if self.drainer.draining:
+            await self.drainer.reject(match_event)
+            return
+        with self.drainer.track():
+            await super().together_request(match_event, raw_event)
+
+    async def http_request(self, web_request):
+        if self.drainer.draining:
+            return self.drainer.http_rejection()
+        with self.drainer.track():
+            return await super().http_request(web_request)
+
+    def swap_models(self):
+        """Reloads the models of --swap_file, e.g. {"name": {"ckpt_path": ...}}, from their new checkpoints.
+
+        Each model keeps serving from its current checkpoint until the new one is loaded.
+        """
+        if not self.swap_file:
+            logging.warning("SIGHUP without --swap_file, nothing to swap")
+            return
+        for name, model_args in parse_models(self.swap_file).items():
+            if name not in self.registry:
+                logging.warning(f"Cannot swap unknown model {name}")
+                continue
+            threading.Thread(target=self._swap_model, args=(name, model_args), daemon=True).start()
+
+    def _swap_model(self, name, model_args):
+        model_args = dict(self.model_args[name], **model_args)
+        try:
+            # eviction and switch run on the request executor, so no request uses the models they free
+            self.registry.swap(name, functools.partial(self._load_model, **model_args),
+                               estimate_bytes=checkpoint_bytes(model_args['ckpt_path']),
+                               switch=lambda fn: self.executor.submit(fn).result())
+        except Exception:
+            logging.exception(f"Swapping {name} to {model_args['ckpt_path']} failed, still serving the old model")
+            return
+        self.model_args[name] = model_args
+
+    def _load_model(self, hf_model_name, ckpt_path):
+        verify_checkpoint_dir(ckpt_path, self.verify_ckpt)
+        assert(ckpt_path.endswith("-tp1"))
+        config = read_config(ckpt_path)
+        # the tokenizer (and transformers) loads while the weights do
+        tokenizer = startup.in_background("load tokenizer", load_tokenizer, ckpt_path, hf_model_name)
         with torch.no_grad():
             # Prepare model.
-            self.opt_model = GPT(head_num, size_per_head, vocab_size, start_id, self.end_id, layer_num,
-                                         max_seq_len, self.tensor_para_size, self.pipeline_para_size, lib_path,
-                                         layernorm_eps, layernorm_type, activation_type, has_post_decoder_layernorm,
-                                         int8_mode=0, weights_data_type='fp16')
-            if not self.opt_model.load_w_type(ckpt_path=ckpt_path, infer_data_type='fp16'):
-                logging.debug("[WARNING] Checkpoint file not found. Model loading is skipped.")      
-        logging.debug(f"<FastOPTInference.__init__> initialization done")
+            if warmup_enabled():
+                install_gemm_config(lib_path("gpt", self.lib_dir), self.max_batch_size, 1,
+                                    max(shape[0] for shape in self.warmup_shapes),
+                                    config.head_num, config.size_per_head, config.inter_size, config.vocab_size)
+            opt_model = build_model(ckpt_path, self.tensor_para_size, self.pipeline_para_size, lib_dir=self.lib_dir)
+        # travels with the model (as its end_id does), so a swap installs both with it at once
+        opt_model.tokenizer = tokenizer.result()
+        return opt_model
+
+    def _select_model(self, name):
+        self.opt_model = self.registry.get(name)
+        self.tokenizer = self.opt_model.tokenizer
+        self.end_id = self.opt_model.end_id
     
     def dispatch_request(self, args, env) -> Dict:
         logging.debug(f"dispatch_request get {args}")
         args = args[0]
         args = {k: v for k, v in args.items() if v is not None}
+        model = args.get('model', self.default_model)
+        if model not in self.registry:
+            logging.debug(f"Unknown model {model}, serving {self.default_model}")
+            model = self.default_model
+        self._select_model(model)
         # Inputs
         self.task_info["prompt_seqs"] = [args['prompt']]
         self.task_info["output_len"] = get_int(args.get("max_tokens", 16), default=16)
@@ -94,6 +201,8 @@ class FastOPTInference(FastInferenceInterface):
         self.task_info["stream_tokens"] = args.get("stream_tokens", False)
         self.task_info["return_cum_log_probs"] = args.get("return_cum_log_probs", 0)
         self.task_info["return_output_length"] = args.get("return_output_length", 0)
+        self.task_info["logprobs"] = args.get("logprobs")
+        self.task_info["echo"] = bool(args.get("echo", False))
           
         result = self._run_inference()
         logging.debug(f"<FastOPTInference.dispatch_request> return: {result}")
@@ -104,28 +213,21 @@ class FastOPTInference(FastInferenceInterface):
         
         with torch.no_grad():
             contexts = self.task_info["prompt_seqs"]
-            start_ids = [torch.IntTensor(self.tokenizer.encode(c)) for c in contexts]
-            start_lengths = [len(ids) for ids in start_ids]
-            
-            start_ids = pad_sequence(start_ids, batch_first=True, padding_value=self.end_id)
-            start_lengths = torch.IntTensor(start_lengths)
-            logging.debug(f"start_ids: length ({start_ids.shape[0]}) ids: {start_ids}")
+            token_ids = [self.tokenizer.encode(c) for c in contexts]
+            # kept on the host to strip the contexts from the outputs
+            start_lengths = [len(ids) for ids in token_ids]
+            start_ids, device_lengths = self.buffers.inputs(token_ids, self.end_id)
+            logging.debug(f"start_ids: length ({len(token_ids)}) ids: {token_ids}")
             
             time = timeit.default_timer()
-            max_batch_size = self.max_batch_size
-            tokens_batch = self.opt_model(start_ids,
-                                    start_lengths,
-                                    self.task_info["output_len"],
-                                    self.task_info["beam_width"],
-                                    self.task_info["top_k"] * torch.ones(size=[max_batch_size], dtype=torch.int32),
-                                    self.task_info["top_p"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["beam_search_diversity_rate"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["temperature"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["len_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["repetition_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.random_seed_tensor,
-                                    self.task_info["return_output_length"],
-                                    self.task_info["return_cum_log_probs"])
+            top = None
+            if self.task_info["output_len"] == 0 and self.task_info["echo"]:
+                # only the prompt is returned (and scored)
+                tokens_batch = torch.IntTensor(token_ids)[:, None, :]
+                self.task_info["return_cum_log_probs"] = 0
+                self.task_info["beam_width"] = 1
+            else:
+                tokens_batch, top = self._generate(start_ids, device_lengths)
             # only a thread (rank 0) gets the output, while the others are supposed to return None.
             time_elapsed = timeit.default_timer() - time
         logging.debug("[INFO] OPT time costs: {:.2f} ms. <rank-{}>".format(time_elapsed * 1000, dist.get_rank()))
@@ -137,12 +239,14 @@ class FastOPTInference(FastInferenceInterface):
             logging.debug('[INFO] Log probs of sentences:', cum_log_probs)
 
         inferenece_result = []
-        tokens_batch = tokens_batch.cpu().numpy()
+        # the contexts are known, only the outputs after the shortest one are copied to the host
+        min_length = min(start_lengths)
+        tokens_batch = tokens_batch[:, :, min_length:].cpu().numpy()
         
         for i, (context, tokens) in enumerate(zip(self.task_info["prompt_seqs"], tokens_batch)):
             item = {'choices': [], }
             for beam_id in range(self.task_info["beam_width"]):
-                token = tokens[beam_id][start_lengths[i]:]  # exclude context input from the output
+                token = tokens[beam_id][start_lengths[i] - min_length:]  # exclude context input from the output
                 output = self.tokenizer.decode(token)
                 logging.debug(f"[INFO] batch {i}, beam {beam_id}: \n[Context]\n{context}\n\n[Output]\n{output}\n")
                 choice = {
@@ -150,6 +254,9 @@ class FastOPTInference(FastInferenceInterface):
                     "index": beam_id,
                     "finish_reason": "length"
                 }
+                if self.task_info["echo"] or self.task_info["logprobs"] is not None:
+                    choice.update(self._echo_and_score(context, token_ids[i], token, choice["text"],
+                                                       None if top is None else (top[0][i], top[1][i])))
             item['choices'].append(choice)
             inferenece_result.append(item)
         #  So far coordinator does not support batch. 
@@ -158,6 +265,57 @@ class FastOPTInference(FastInferenceInterface):
             "choices": inferenece_result[0]['choices'],
             "raw_compute_time": time_elapsed
         }
+
+    def _generate(self, start_ids, device_lengths):
+        """The model's outputs and, if the request wants `logprobs` alternatives, the generation's top log probs:
+        ids [batch, output_len, N] and log probs [batch, output_len, N], selected on the device."""
+        top_n = requested_top_n(self.task_info["logprobs"], self.task_info["beam_width"])
+        with torch.no_grad():
+            sampling = self.buffers.sampling_params(
+                top_k=self.task_info["top_k"],
+                top_p=self.task_info["top_p"],
+                beam_search_diversity_rate=self.task_info["beam_search_diversity_rate"],
+                temperature=self.task_info["temperature"],
+                len_penalty=self.task_info["len_penalty"],
+                repetition_penalty=self.task_info["repetition_penalty"],
+            )
+            tokens_batch = self.opt_model(start_ids,
+                                    device_lengths,
+                                    self.task_info["output_len"],
+                                    self.task_info["beam_width"],
+                                    sampling["top_k"],
+                                    sampling["top_p"],
+                                    sampling["beam_search_diversity_rate"],
+                                    sampling["temperature"],
+                                    sampling["len_penalty"],
+                                    sampling["repetition_penalty"],
+                                    self.random_seed_tensor,
+                                    self.task_info["return_output_length"],
+                                    self.task_info["return_cum_log_probs"],
+                                    top_n)
+        if not top_n:
+            return tokens_batch, None
+        *outputs, top_log_probs, top_ids = tokens_batch
+        tokens_batch = outputs[0] if len(outputs) == 1 else tuple(outputs)
+        # only [batch, output_len, N] crosses to the host
+        return tokens_batch, (top_ids[:, 0].cpu().numpy(), top_log_probs[:, 0].cpu().numpy())
+
+    def _echo_and_score(self, prompt, prompt_ids, output_ids, text, top=None):
+        """The choice's text with the prompt if `echo`, and the log probabilities of its tokens if `logprobs` is set.
+
+        `top` are the alternatives of the generated tokens; those of an echoed prompt come from scoring it.
+        """
+        echo = self.task_info["echo"]
+        choice = {"text": prompt + text if echo else text}
+        if self.task_info["logprobs"] is not None:
+            pair, unscored = completion_pair(prompt_ids, output_ids, echo, self.tokenizer.all_special_ids)
+            # the generation's alternatives leave only an echoed prompt's to the scoring pass
+            top_n = requested_top_n(self.task_info["logprobs"])
+            result = self.opt_model.score([pair], self.end_id, max_tokens=self.score_max_tokens,
+                                          top_n=top_n if echo or top is None else 0)[0]
+            choice["logprobs"] = openai_logprobs(self.tokenizer, result, unscored, 0 if echo else len(prompt),
+                                                 completion_top(result, len(output_ids), echo, top))
+        return choice
         
 
 if __name__ == "__main__":
@@ -170,10 +328,37 @@ if __name__ == "__main__":
                         help='hugging face model name (used to load config).')
     parser.add_argument('--ckpt_path', type=str, default='/workspace/Port_FasterTransformer/build/model/opt-1.3b-tp1',
                         help='path to the checkpoint file.')
+    parser.add_argument('--lib_dir', type=str, default=os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR),
+                        help='directory with the FasterTransformer op libraries.')
+    parser.add_argument('--verify_ckpt', type=str, default=os.environ.get('VERIFY_CKPT', 'none'), choices=VERIFY_MODES,
+                        help='check the checkpoint against its manifest.json before loading: none, size or full.')
+    parser.add_argument('--models', type=str, default=os.environ.get('MODELS'),
+                        help='JSON (or a JSON file) of additional models served on request, '
+                             'e.g. {"name": {"hf_model_name": ..., "ckpt_path": ...}}.')
+    parser.add_argument('--gpu_memory_budget', type=float, default=float(os.environ.get('GPU_MEMORY_BUDGET', 0)),
+                        help='GiB of GPU memory for model weights; 0 uses 80%% of the device.')
+    parser.add_argument('--host_memory_budget', type=float, default=float(os.environ.get('HOST_MEMORY_BUDGET', 0)),
+                        help='GiB of host memory for models evicted from the GPU; 0 drops them.')
+    parser.add_argument('--registry_stats', type=str, default=os.environ.get('REGISTRY_STATS'),
+                        help='JSON file updated with the residency and load/evict latency of the models.')
+    parser.add_argument('--warmup_shapes', type=str, default=os.environ.get('WARMUP_SHAPES', DEFAULT_SHAPES),
+                        help='input_len:output_len pairs run before joining the coordinator (WARMUP=0 skips warmup).')
+    parser.add_argument('--drain_timeout', type=float, default=float(os.environ.get('DRAIN_TIMEOUT', DEFAULT_DRAIN_TIMEOUT)),
+                        help='seconds to finish accepted requests on SIGTERM or a shutdown request before exiting.')
+    parser.add_argument('--swap_file', type=str, default=os.environ.get('SWAP_FILE'),
+                        help='JSON (or a JSON file) of new checkpoints, e.g. {"name": {"ckpt_path": ...}}, '
+                             'loaded next to the serving models on SIGHUP and switched to once ready.')
+    parser.add_argument('--announce_interval', type=float,
+                        default=float(os.environ.get('ANNOUNCE_INTERVAL', DEFAULT_ANNOUNCE_INTERVAL)),
+                        help='seconds between re-joins advertising free memory, throughput and queue depth; 0 disables.')
+    parser.add_argument('--score_max_tokens', type=int, default=int(os.environ.get('SCORE_MAX_TOKENS', DEFAULT_MAX_TOKENS)),
+                        help='padded tokens per batch when scoring the tokens of requests with logprobs.')
     parser.add_argument('--worker_name', type=str, default=os.environ.get('WORKER', 'worker1'),
                         help='worker name for together coordinator.')
     parser.add_argument('--group_name', type=str, default=os.environ.get('GROUP', 'group1'),
                         help='group name for together coordinator.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print an import and initialization timeline once the worker is ready.')
     
     args = parser.parse_args()
     
@@ -192,6 +377,17 @@ if __name__ == "__main__":
         "worker_name": args.worker_name,
         "group_name": args.group_name,
         "ckpt_path": args.ckpt_path,
+        "lib_dir": args.lib_dir,
+        "verify_ckpt": args.verify_ckpt,
+        "models": args.models,
+        "gpu_memory_budget": args.gpu_memory_budget,
+        "host_memory_budget": args.host_memory_budget,
+        "registry_stats": args.registry_stats,
+        "warmup_shapes": args.warmup_shapes,
+        "drain_timeout": args.drain_timeout,
+        "swap_file": args.swap_file,
+        "announce_interval": args.announce_interval,
+        "score_max_tokens": args.score_max_tokens,
         "stream_tokens_pipe": False,
         "max_batch_size":1
     })
@@ -0,0 +1,83 @@
+import argparse
+import sys
+import timeit
+from dataclasses import asdict
+from dacite import from_dict
+sys.path.append("./")
+
+from together_web3.codec import compile_decoder, compile_encoder
+from together_web3.computer import EventEnvelope, MatchEvent, Result, ResultEnvelope
+
+# Shaped like the coordinator's match event for a language model request.
+MATCH_EVENT = {
+    "event_type": "match",
+    "signature": None,
+    "match_id": "0x5b3b0e6f7c2d4b1a9e8f",
+    "match": {
+        "match_type": "service",
+        "ask_address": "0x0000000000000000000000000000000000000001",
+        "bid_address": "0x0000000000000000000000000000000000000002",
+        "ask_offer_id": "0x9d2c1f8e",
+        "bid_offer_id": "0x4a7b3e6d",
+        "ask_signature": None,
+        "bid_signature": None,
+        "service_bid": {
+            "offer_type": "service-bid",
+            "job": {
+                "request_type": "language-model-inference",
+                "model": "opt-1.3b",
+                "prompt": "Where is Zurich?",
+                "max_tokens": 64,
+                "temperature": 0.8,
+                "top_p": 1.0,
+                "stop": ["\n"],
+            },
+        },
+    },
+}
+EVENT_ENVELOPE = {"signature": None, "events": [MATCH_EVENT]}
+RESULT = {
+    "ask_address": "0x0000000000000000000000000000000000000001",
+    "bid_address": "0x0000000000000000000000000000000000000002",
+    "ask_offer_id": "0x9d2c1f8e",
+    "bid_offer_id": "0x4a7b3e6d",
+    "match_id": "0x5b3b0e6f7c2d4b1a9e8f",
+    "data": {
+        "result_type": "language-model-inference",
+        "choices": [{"text": " Zurich is the largest city in Switzerland.", "index": 0, "finish_reason": "length"}],
+        "raw_compute_time": 0.123,
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000, help="iterations per measurement")
+    args = parser.parse_args()
+
+    decode_envelope = compile_decoder(EventEnvelope)
+    decode_match = compile_decoder(MatchEvent)
+    decode_result = compile_decoder(Result)
+    encode_result_envelope = compile_encoder(ResultEnvelope)
+    result_envelope = ResultEnvelope(result=from_dict(data_class=Result, data=RESULT), signature=None)
+
+    cases = [
+        ("decode EventEnvelope",
+         lambda: from_dict(data_class=EventEnvelope, data=EVENT_ENVELOPE), lambda: decode_envelope(EVENT_ENVELOPE)),
+        ("decode MatchEvent",
+         lambda: from_dict(data_class=MatchEvent, data=MATCH_EVENT), lambda: decode_match(MATCH_EVENT)),
+        ("decode Result",
+         lambda: from_dict(data_class=Result, data=RESULT), lambda: decode_result(RESULT)),
+        ("encode ResultEnvelope",
+         lambda: asdict(result_envelope), lambda: encode_result_envelope(result_envelope)),
+    ]
+    print(f"{'case':<24}{'dacite/asdict us':>18}{'codec us':>12}{'speedup':>10}")
+    for name, reference, fast in cases:
+        assert reference() == fast(), f"{name}: codec result differs from the reference"
+        reference_time = timeit.timeit(reference, number=args.n) / args.n * 1e6
+        fast_time = timeit.timeit(fast, number=args.n) / args.n * 1e6
+        print(f"{name:<24}{reference_time:>18.2f}{fast_time:>12.2f}{reference_time / fast_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
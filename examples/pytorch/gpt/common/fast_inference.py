@@ -1,10 +1,11 @@
 import asyncio
 import os
+import platform
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from dacite import from_dict 
 from dataclasses import asdict
-from typing import Dict
+from typing import Dict, Set
 from loguru import logger
 from typing import Any
 import torch.distributed as dist
@@ -24,8 +25,14 @@ from .together_web3.computer import (
     RequestTypeShutdown,
     ResultEnvelope,
 )
+from .together_web3.codec import compile_decoder
 from .together_web3.coordinator import Join, JoinEnvelope
 from .together_web3.together import TogetherClientOptions, TogetherWeb3
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch.capacity import DEFAULT_ANNOUNCE_INTERVAL, start_reannounce, update_instance
+
+_decode_result = compile_decoder(Result)
+
 
 class ServiceDomain(Enum):
     http = "http"
@@ -41,6 +48,17 @@ class FastInferenceInterface:
         self.coordinator: TogetherWeb3 = args.get(
             "coordinator") if self.service_domain == ServiceDomain.together else None
         self.shutdown = False
+        # Single thread running the model, fed by the coordinator's event queue.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.group_name = args.get("group_name", "group1")
+        self.worker_name = args.get("worker_name")
+        self.max_batch_size = args.get("max_batch_size", 1)
+        self.tokens_per_second = 0.0
+        self.announce_interval = args.get("announce_interval", DEFAULT_ANNOUNCE_INTERVAL)
+        # the request being run, on top of the events queued in the coordinator client
+        self.running = 0
+        # result uploads in flight: the loop only keeps weak references to tasks
+        self._result_tasks: Set["asyncio.Task[None]"] = set()
 
     def start(self):
         loop = asyncio.get_event_loop()
@@ -57,6 +75,7 @@ class FastInferenceInterface:
             self.coordinator._on_disconnect.append(self._join_local_coordinator)
             self.coordinator._on_match_event.append(self.together_request)
             await self._join_local_coordinator()
+            start_reannounce(self)
             logger.info("Start _run_together_server")
             try:
                 while not self.shutdown:
@@ -71,30 +90,27 @@ class FastInferenceInterface:
     async def _join_local_coordinator(self):
         try:
             logger.info("_join_local_coordinator")
+            instance = Instance(resource_type=ResourceTypeInstance, tags={})
+            # every join, including the periodic re-announcements, advertises the current capacity and load
+            update_instance(instance, gpu_num=dist.get_world_size(), max_batch_size=self.max_batch_size,
+                            tokens_per_second=self.tokens_per_second,
+                            queue_depth=self.coordinator.event_queue_depth() + self.running)
             join = Join(
-                group_name="group1",
-                worker_name="worker"+str(dist.get_rank()),
-                host_name="",
+                group_name=self.group_name,
+                worker_name=self.worker_name or "worker"+str(dist.get_rank()),
+                host_name=platform.node(),
                 host_ip="",
                 interface_ip=[],
-                instance=Instance(
-                    arch="",
-                    os="",
-                    cpu_num=0,
-                    gpu_num=0,
-                    gpu_type="",
-                    gpu_memory=0,
-                    resource_type=ResourceTypeInstance,
-                    tags={}
-                ),
+                instance=instance,
                 config={
-                    "model": "opt66b",
+                    "model": self.model_name,
                     "request_type": RequestTypeLanguageModelInference,
                 },
             )
             self.subscription_id = await self.coordinator.get_subscription_id("coordinator")
-            args = self.coordinator.coordinator.join(
-                asdict(JoinEnvelope(join=join, signature=None)), self.subscription_id)
+            # through the non-blocking client, as the join repeats while this loop serves requests
+            args = await self.coordinator.rpc.call(
+                "coordinator_join", [asdict(JoinEnvelope(join=join, signature=None)), self.subscription_id])
 
         except Exception as e:
             logger.exception(f'_join_local_coordinator failed: {e}')
@@ -102,9 +118,20 @@ class FastInferenceInterface:
 
     async def together_request(self, match_event: MatchEvent, raw_event: Dict[str, Any]) -> None:
         logger.info(f"together_request {raw_event}")
+        stats = self.coordinator.event_stats
+        logger.info(f"together_request waited {stats.last_wait * 1000:.1f} ms "
+                    f"(mean {stats.mean_wait * 1000:.1f} ms), {self.coordinator.event_queue_depth()} events queued")
         request_json = [raw_event["match"]["service_bid"]["job"]]
-        response_json = self.dispatch_request(request_json, match_event)
-        await self.send_result_back(match_event, response_json)
+        self.running += 1
+        try:
+            response_json = await asyncio.get_event_loop().run_in_executor(
+                self.executor, self.dispatch_request, request_json, match_event)
+        finally:
+            self.running -= 1
+        # the upload is ordered per match by the coordinator client; don't hold up the next event for it
+        task = asyncio.ensure_future(self.send_result_back(match_event, response_json))
+        self._result_tasks.add(task)
+        task.add_done_callback(self._result_tasks.discard)
 
     async def send_result_back(self, match_event: MatchEvent, result_data: Dict[str, Any], partial: bool = False) -> None:
         try:
@@ -120,14 +147,11 @@ class FastInferenceInterface:
             if partial:
                 result["partial"] = True
             await self.coordinator.update_result(ResultEnvelope(
-                result=from_dict(
-                    data_class=Result,
-                    data=result,
-                ),
+                result=_decode_result(result),
                 signature=None,
             ))
         except Exception as e:
-            logger.error(f"send_result_back error: {e}")
+            logger.exception(f"send_result_back error: {e}")
 
     def _shutdown(self) -> None:
         logger.info("Shutting down")
@@ -0,0 +1,145 @@
+"""Precompiled converters between JSON dicts and the dataclasses of `computer.py`.
+
+`dacite.from_dict` resolves type hints and validates every value on every call, and
+`dataclasses.asdict` deep-copies field by field through reflection. For the messages handled per
+request (events, matches and results) that overhead lands on the event-loop thread. The
+converters here are generated once per dataclass as plain Python functions and give the same
+objects as `from_dict` (same defaults, `None` for missing Optional fields, `MissingValueError`
+for missing required fields, extra keys ignored) and the same dicts as `asdict`. Unlike
+`from_dict` they do not type-check values; use them only for payloads that come from the
+coordinator or from this package.
+"""
+from typing import Any, Callable, Dict, Union, get_type_hints
+
+import copy
+import dataclasses
+import typing
+
+from dacite.exceptions import MissingValueError
+
+_NoneType = type(None)
+_SCALAR_TYPES = (str, int, float, bool, _NoneType)
+
+_decoders: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
+_encoders: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+
+
+def _is_optional(type_: Any) -> bool:
+    return typing.get_origin(type_) is Union and _NoneType in typing.get_args(type_)
+
+
+def _value_builder(type_: Any, namespace: Dict[str, Any]) -> Callable[[str], str]:
+    """Returns a function formatting the expression that converts the JSON value `expr` to `type_`."""
+    if _is_optional(type_):
+        args = [arg for arg in typing.get_args(type_) if arg is not _NoneType]
+        inner = _value_builder(args[0] if len(args) == 1 else Union[tuple(args)], namespace)
+        if inner("v") == "v":
+            return inner
+        return lambda expr: f"(None if {expr} is None else {inner(expr)})"
+    if dataclasses.is_dataclass(type_):
+        name = f"_decode_{type_.__name__}"
+        namespace[name] = compile_decoder(type_)
+        return lambda expr: f"{name}({expr})"
+    origin = typing.get_origin(type_)
+    if origin in (list, typing.List):
+        (item_type,) = typing.get_args(type_) or (Any,)
+        item = _value_builder(item_type, namespace)
+        if item("v") == "v":
+            return lambda expr: f"list({expr})"
+        return lambda expr: f"[{item('v')} for v in {expr}]"
+    if origin in (dict, typing.Dict):
+        return lambda expr: f"dict({expr})"
+    # str, int, float, bool, Any and the Union of plain types used for prompts are taken as they are
+    return lambda expr: expr
+
+
+def compile_decoder(data_class: type) -> Callable[[Dict[str, Any]], Any]:
+    """Returns a function equivalent to `lambda data: from_dict(data_class, data)` for valid data."""
+    decoder = _decoders.get(data_class)
+    if decoder is not None:
+        return decoder
+
+    namespace: Dict[str, Any] = {
+        "_cls": data_class,
+        "MissingValueError": MissingValueError,
+        "_MISSING": dataclasses.MISSING,
+    }
+    hints = get_type_hints(data_class)
+    lines = ["def _decode(data):"]
+    args = []
+    for i, data_field in enumerate(dataclasses.fields(data_class)):
+        if not data_field.init:
+            continue
+        name = data_field.name
+        convert = _value_builder(hints[name], namespace)
+        if data_field.default is not dataclasses.MISSING:
+            namespace[f"_default_{i}"] = data_field.default
+            missing = f"_default_{i}"
+        elif data_field.default_factory is not dataclasses.MISSING:
+            namespace[f"_factory_{i}"] = data_field.default_factory
+            missing = f"_factory_{i}()"
+        elif _is_optional(hints[name]):
+            missing = "None"
+        else:
+            missing = None
+        if missing is None:
+            lines.append(f"    if {name!r} not in data: raise MissingValueError({name!r})")
+            lines.append(f"    f{i} = {convert(f'data[{name!r}]')}")
+        else:
+            lines.append(f"    v = data.get({name!r}, _MISSING)")
+            lines.append(f"    f{i} = {missing} if v is _MISSING else {convert('v')}")
+        args.append(f"{name}=f{i}")
+    lines.append(f"    return _cls({', '.join(args)})")
+    exec("\n".join(lines), namespace)
+    decoder = namespace["_decode"]
+    _decoders[data_class] = decoder
+    return decoder
+
+
+def _encode_value(value: Any) -> Any:
+    if type(value) in _SCALAR_TYPES:
+        return value
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return compile_encoder(type(value))(value)
+    if isinstance(value, dict):
+        return type(value)((_encode_value(k), _encode_value(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return type(value)(_encode_value(v) for v in value)
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return type(value)(_encode_value(v) for v in value)
+    # namedtuples and arbitrary objects are rare in messages; asdict deep-copies them too
+    return copy.deepcopy(value)
+
+
+def compile_encoder(data_class: type) -> Callable[[Any], Dict[str, Any]]:
+    """Returns a function equivalent to `dataclasses.asdict` for instances of exactly `data_class`."""
+    encoder = _encoders.get(data_class)
+    if encoder is not None:
+        return encoder
+
+    hints = get_type_hints(data_class)
+    items = []
+    for data_field in dataclasses.fields(data_class):
+        name = data_field.name
+        type_ = hints[name]
+        if type_ in (str, int, float, bool) or (
+                _is_optional(type_) and all(arg in _SCALAR_TYPES for arg in typing.get_args(type_))):
+            # immutable scalars, which asdict's deepcopy returns unchanged
+            items.append(f"{name!r}: obj.{name}")
+        else:
+            items.append(f"{name!r}: _encode_value(obj.{name})")
+    namespace: Dict[str, Any] = {"_encode_value": _encode_value}
+    exec(f"def _encode(obj):\n    return {{{', '.join(items)}}}", namespace)
+    encoder = namespace["_encode"]
+    _encoders[data_class] = encoder
+    return encoder
+
+
+def encode(obj: Any) -> Dict[str, Any]:
+    """Fast `dataclasses.asdict(obj)`."""
+    return compile_encoder(type(obj))(obj)
+
+
+def decode(data_class: type, data: Dict[str, Any]) -> Any:
+    """Fast `dacite.from_dict(data_class, data)` for well-formed data."""
+    return compile_decoder(data_class)(data)
@@ -182,6 +182,10 @@ class InstanceBid(Offer):
 
 @dataclass
 class Match:
+    # Decoded from every match event; slots make construction and attribute access cheaper.
+    __slots__ = ("match_type", "ask_address", "bid_address", "ask_offer_id", "bid_offer_id",
+                 "ask_signature", "bid_signature")
+
     match_type: str
     ask_address: str
     bid_address: str
@@ -276,6 +280,8 @@ class ImageModelInferenceRequest(Job):
 
 @dataclass
 class Result:
+    __slots__ = ("ask_address", "bid_address", "ask_offer_id", "bid_offer_id", "match_id", "partial", "data")
+
     ask_address: str
     bid_address: str
     ask_offer_id: str
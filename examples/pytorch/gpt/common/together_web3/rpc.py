@@ -0,0 +1,128 @@
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+import asyncio
+import collections
+import itertools
+import json
+import logging
+from asyncio import Future, Task
+from dataclasses import dataclass
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class JsonRpcError(Exception):
+    """Error object returned by the JSON-RPC server."""
+
+    def __init__(self, error: Dict[str, Any]):
+        super().__init__(f"{error.get('code')}: {error.get('message')}")
+        self.code = error.get("code")
+        self.data = error.get("data")
+
+
+@dataclass
+class _Call:
+    method: str
+    params: List[Any]
+    future: "Future[Any]"
+    id: int
+
+
+class AsyncJsonRpcClient:
+    """JSON-RPC 2.0 over HTTP on a pooled keep-alive aiohttp session.
+
+    `call()` enqueues the request without waiting and returns a Future for its result, so the event
+    loop is never blocked by a round trip. At most `max_in_flight` HTTP requests are outstanding.
+    Calls sharing an `order_key` (e.g. the partial and final results of one match) are sent in call
+    order, one request after the other; calls queued behind a request in flight are sent together
+    as a JSON-RPC batch of up to `max_batch_size` calls. Calls without a key are sent concurrently.
+    """
+
+    def __init__(self, http_url: str, max_in_flight: int = 8, max_batch_size: int = 16, timeout: float = 30.0):
+        self.http_url = http_url
+        self.max_in_flight = max_in_flight
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._lanes: Dict[Hashable, Deque[_Call]] = {}
+        self._tasks: "set[Task[None]]" = set()
+
+    def _ensure_session(self) -> None:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                json_serialize=json.dumps,
+            )
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def call(self, method: str, params: List[Any], order_key: Optional[Hashable] = None) -> "Future[Any]":
+        """Queues `method(*params)` and returns a Future resolved with its result."""
+        self._ensure_session()
+        rpc_call = _Call(method, params, asyncio.get_event_loop().create_future(), next(self._ids))
+        if order_key is None:
+            self._spawn(self._send([rpc_call]))
+        elif order_key in self._lanes:
+            self._lanes[order_key].append(rpc_call)
+        else:
+            self._lanes[order_key] = collections.deque([rpc_call])
+            self._spawn(self._drain_lane(order_key))
+        return rpc_call.future
+
+    def pending(self) -> int:
+        """Number of queued calls not yet handed to the HTTP session."""
+        return sum(len(lane) for lane in self._lanes.values())
+
+    async def _drain_lane(self, order_key: Hashable) -> None:
+        lane = self._lanes[order_key]
+        try:
+            while lane:
+                batch = [lane.popleft() for _ in range(min(self.max_batch_size, len(lane)))]
+                await self._send(batch)
+        finally:
+            del self._lanes[order_key]
+
+    async def _send(self, batch: List[_Call]) -> None:
+        payload: Any = [{"jsonrpc": "2.0", "id": c.id, "method": c.method, "params": c.params} for c in batch]
+        if len(payload) == 1:
+            payload = payload[0]
+        try:
+            async with self._in_flight:
+                async with self._session.post(self.http_url, json=payload) as response:
+                    response.raise_for_status()
+                    replies = await response.json(content_type=None)
+        except Exception as e:
+            for rpc_call in batch:
+                if not rpc_call.future.done():
+                    rpc_call.future.set_exception(e)
+            return
+
+        replies = replies if isinstance(replies, list) else [replies]
+        replies_by_id = {reply.get("id"): reply for reply in replies}
+        for rpc_call in batch:
+            if rpc_call.future.done():
+                continue
+            reply = replies_by_id.get(rpc_call.id)
+            if reply is None:
+                rpc_call.future.set_exception(JsonRpcError({"message": f"no response to {rpc_call.method}"}))
+            elif reply.get("error") is not None:
+                rpc_call.future.set_exception(JsonRpcError(reply["error"]))
+            else:
+                rpc_call.future.set_result(reply.get("result"))
+
+    async def close(self) -> None:
+        """Waits for queued calls to be sent, then closes the HTTP session."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,10 +1,11 @@
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Union, cast
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union, cast
 
 import asyncio
 import dataclasses
 import json
 import logging
 import random
+import time
 from asyncio import Future, Task
 from dataclasses import asdict, dataclass, fields
 from enum import Enum
@@ -32,6 +33,7 @@ from .computer import (
     OfferTypeServiceBid,
     RequestTypeImageModelInference,
     RequestTypeLanguageModelInference,
+    RequestTypeShutdown,
     ResourceTypeService,
     ResultEnvelope,
     ResultEvent,
@@ -41,10 +43,18 @@ from .computer import (
     TogetherComputer,
     TogetherComputerProtocol,
 )
+from .codec import compile_decoder, encode
 from .coordinator import TogetherCoordinator, TogetherCoordinatorProtocol
+from .rpc import AsyncJsonRpcClient
 
 logger = logging.getLogger(__name__)
 
+# Every websocket message goes through these, see codec.py.
+_decode_event_envelope = compile_decoder(EventEnvelope)
+_decode_new_block_event = compile_decoder(NewBlockEvent)
+_decode_match_event = compile_decoder(MatchEvent)
+_decode_result_event = compile_decoder(ResultEvent)
+
 
 @dataclass
 class ResolveOptions:
@@ -57,6 +67,26 @@ class TogetherClientOptions:
     maintainConnection: Optional[bool] = None
 
 
+@dataclass
+class EventIntakeStats:
+    """Websocket intake counters: how many events wait and how long they wait before handling.
+
+    Waits, handled and queue depth cover the queued inference matches; control events are handled
+    on receipt and only counted in received.
+    """
+    received: int = 0
+    handled: int = 0
+    max_queue_depth: int = 0
+    #: Seconds between receiving an event and starting its handler.
+    last_wait: float = 0.0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.handled if self.handled else 0.0
+
+
 def asdict_filter_none(x):
     return asdict(x, dict_factory=lambda x: {k: v for (k, v) in x if v is not None})
 
@@ -92,18 +122,26 @@ class TogetherWeb3:
     _on_match_for_bid: "Dict[str, List[Callable[[Dict[str, Any]], None]]]" = {}
     _on_result_for_bid: "Dict[str, List[Future[Dict[str, Any]]]]" = {}
     _handle_disconnect_delay = 2
+    _event_queue: "Optional[asyncio.Queue[Any]]" = None
+    _event_consumer: "Optional[Task[None]]" = None
+    _control_tasks: "Optional[Set[Task[None]]]" = None
 
     def __init__(
         self,
         options: TogetherClientOptions = TogetherClientOptions(),
         http_url: str = "https://computer.together.xyz",
         websocket_url: Optional[str] = None,
+        event_queue_size: int = 1024,
+        rpc_max_in_flight: int = 8,
+        rpc_max_batch_size: int = 16,
         **kwargs: Any
     ):
         self.http_url = http_url
         self.websocket_url = websocket_url if websocket_url else websocket_url_from_http_url(
             http_url)
         self.options = options
+        self.event_queue_size = event_queue_size
+        self.event_stats = EventIntakeStats()
         self.web3 = Web3(
             provider=HTTPProvider(self.http_url),
             modules={
@@ -115,6 +153,10 @@ class TogetherWeb3:
         self.accounts = cast(Any, self.web3).accounts
         self.coordinator = cast(Any, self.web3).coordinator
         self.together = cast(Any, self.web3).together
+        # Results and offers go through this non-blocking client; the synchronous web3 modules above
+        # stay available for one-off calls such as coordinator_join.
+        self.rpc = AsyncJsonRpcClient(
+            self.http_url, max_in_flight=rpc_max_in_flight, max_batch_size=rpc_max_batch_size)
 
     def subscribe_events(self, rpc_namespace: str = "together") -> None:
         """Opens WebSocket connection to the Together Computer."""
@@ -133,13 +175,25 @@ class TogetherWeb3:
         for future_subscription_id in resolve_subscription_id:
             future_subscription_id.set_result(
                 self._subscription_id if self._subscription_id else "")
+        if self._event_queue is None:
+            self._event_queue = asyncio.Queue(maxsize=self.event_queue_size)
+        if self._event_consumer is None or self._event_consumer.done():
+            self._event_consumer = asyncio.create_task(self._consume_events(handler))
         try:
+            # The reader only enqueues inference matches, so that it keeps receiving while a handler
+            # (e.g. an inference) runs. A full queue blocks it, pushing back on the sender. Control
+            # events never wait behind an inference, see _dispatch_control_event().
             while True:
                 message = await asyncio.wait_for(ws.recv(), 1073741824)
                 response = json.loads(message)
                 result = response["params"]["result"]
                 # logger.info("_handle_events: %s", result)
-                await handler(result)
+                if self._is_control_event(result):
+                    await self._dispatch_control_event(handler, result)
+                    continue
+                await self._event_queue.put((time.monotonic(), result))
+                self.event_stats.received += 1
+                self.event_stats.max_queue_depth = max(self.event_stats.max_queue_depth, self._event_queue.qsize())
         except asyncio.CancelledError:
             return
         except BaseException:
@@ -151,24 +205,74 @@ class TogetherWeb3:
             await asyncio.sleep(self._handle_disconnect_delay)
         await self._handle_disconnect()
 
+    async def _consume_events(self, handler: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        while True:
+            received_time, result = await self._event_queue.get()
+            wait = time.monotonic() - received_time
+            stats = self.event_stats
+            stats.handled += 1
+            stats.last_wait = wait
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            try:
+                await handler(result)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                logging.exception("consume_events")
+            finally:
+                self._event_queue.task_done()
+
+    @staticmethod
+    def _is_control_event(result: Dict[str, Any]) -> bool:
+        """Everything but an inference match: new blocks, results and shutdown requests."""
+        event = result["events"][0]
+        if event.get("event_type") != EventTypeMatch:
+            return True
+        job = event.get("match", {}).get("service_bid", {}).get("job") or {}
+        return job.get("request_type") == RequestTypeShutdown
+
+    async def _dispatch_control_event(self, handler: Callable[[Dict[str, Any]], Awaitable[None]],
+                                      result: Dict[str, Any]) -> None:
+        self.event_stats.received += 1
+        if result["events"][0].get("event_type") != EventTypeMatch:
+            # resolves futures only, handled inline
+            await self._run_control_handler(handler, result)
+            return
+        # a shutdown match goes through the match callbacks, which may wait for the running
+        # inference; run them beside the reader and keep a reference until they finish
+        if self._control_tasks is None:
+            self._control_tasks = set()
+        task = asyncio.ensure_future(self._run_control_handler(handler, result))
+        self._control_tasks.add(task)
+        task.add_done_callback(self._control_tasks.discard)
+
+    @staticmethod
+    async def _run_control_handler(handler: Callable[[Dict[str, Any]], Awaitable[None]],
+                                   result: Dict[str, Any]) -> None:
+        try:
+            await handler(result)
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            logging.exception("handle_control_event")
+
+    def event_queue_depth(self) -> int:
+        """Number of received events waiting for their handler."""
+        return self._event_queue.qsize() if self._event_queue else 0
+
     async def _handle_event(self, result: Dict[str, Any]) -> None:
-        update = from_dict(data_class=EventEnvelope, data=result)
+        update = _decode_event_envelope(result)
         if update.events[0].event_type == EventTypeNewBlock:
             await self._handle_new_block_event(
-                from_dict(
-                    data_class=NewBlockEvent,
-                    data=result["events"][0]))
+                _decode_new_block_event(result["events"][0]))
         elif update.events[0].event_type == EventTypeMatch:
             await self._handle_match_event(
-                from_dict(
-                    data_class=MatchEvent,
-                    data=result["events"][0]),
+                _decode_match_event(result["events"][0]),
                 result["events"][0])
         elif update.events[0].event_type == EventTypeResult:
             await self._handle_result_event(
-                from_dict(
-                    data_class=ResultEvent,
-                    data=result["events"][0]),
+                _decode_result_event(result["events"][0]),
                 result["events"][0])
         else:
             logger.error(f"unknown event_type: {update.events[0].event_type}")
@@ -217,6 +321,14 @@ class TogetherWeb3:
             self._subscription.cancel()
             await self._subscription
             self._subscription = None
+        if self._event_consumer:
+            self._event_consumer.cancel()
+            try:
+                await self._event_consumer
+            except asyncio.CancelledError:
+                pass
+            self._event_consumer = None
+        await self.rpc.close()
 
     async def get_subscription_id(self, rpc_namespace: str = "together") -> str:
         """Returns subscription ID where asynchronous results can be sent."""
@@ -241,11 +353,16 @@ class TogetherWeb3:
     async def update_offer(self, update: OfferEnvelope) -> str:
         """Publishes an Offer to the network."""
         # logger.info("update_offer: %s", asdict(update))
-        offer_id = self.together.updateOffer(asdict(update), self._subscription_id)
+        offer_id = await self.rpc.call("together_updateOffer", [encode(update), self._subscription_id])
         return offer_id
 
     async def update_result(self, result: ResultEnvelope) -> str:
-        result_id = self.coordinator.updateResult(asdict(result), self._subscription_id)
+        # Results of one match (streamed partial tokens, then the final result) must arrive in order,
+        # results of different matches are uploaded concurrently.
+        result_id = await self.rpc.call(
+            "coordinator_updateResult",
+            [encode(result), self._subscription_id],
+            order_key=result.result.match_id)
         return result_id
 
     async def resolve_offer(
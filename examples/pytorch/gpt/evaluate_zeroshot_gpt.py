@@ -18,6 +18,7 @@
 
 import math
 
+import numpy as np
 import torch
 
 import os
@@ -49,6 +50,7 @@ from megatron.model import DistributedDataParallel as LocalDDP
 from megatron.model import Float16Module
 
 from examples.pytorch.gpt.utils.gpt import GPT
+from examples.pytorch.gpt.utils.token_cache import DEFAULT_CACHE_DIR, file_digest, lambada_cache, pad_rows
 
 def get_tasks_args(parser):
     """Provide extra arguments required for tasks."""
@@ -73,6 +75,9 @@ def get_tasks_args(parser):
                        help='Sliding window for overlapping evaluation.')
     group.add_argument('--strict-lambada', action='store_true',
                        help='Use more difficult formulation of lambada.')
+    group.add_argument('--token-cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                       help='Directory of the tokenized LAMBADA data, reused '
+                       'by later runs with the same data and tokenizer.')
     # Retriever args
     group.add_argument('--qa-data-dev', type=str, default=None,
                        help='Path to the QA dataset dev file.')
@@ -304,6 +309,36 @@ def evaluate_and_print_results(task, data_loader, model, eval_metric, args):
         print('-' * length)
 
 
+def build_lambada_data_loader(args, tokenizer):
+    """LAMBADA batches of similar length from the token cache, padded to their longest example.
+
+    Yields the same {'text', 'pad_mask'} batches as Megatron's LAMBADA dataset, without padding
+    every example to seq_length.
+    """
+    assert len(args.valid_data) == 1
+    vocab_files = [path for path in (args.vocab_file, args.merge_file) if path]
+    dataset = lambada_cache(args.valid_data[0],
+                            tokenize=lambda texts: [tokenizer.tokenize(text) for text in texts],
+                            tokenizer_id='{}:{}'.format(args.tokenizer_type, file_digest(*vocab_files)),
+                            strict=args.strict_lambada,
+                            cache_dir=args.token_cache_dir)
+
+    def collate(examples):
+        rows = [np.concatenate([example['inputs'], example['labels']]) for example in examples]
+        pad_mask = np.zeros([len(examples), max(len(row) for row in rows)], dtype=np.int64)
+        for i, example in enumerate(examples):
+            num_inputs = len(example['inputs'])
+            pad_mask[i, num_inputs:num_inputs + len(example['labels'])] = 1
+        return {'text': torch.from_numpy(pad_rows(rows, tokenizer.eod).astype(np.int64)),
+                'pad_mask': torch.from_numpy(pad_mask[:, 1:])}
+
+    # every data parallel rank runs its share of the batches, the results are all-reduced
+    batches = dataset.length_sorted_batches(args.micro_batch_size)
+    batches = batches[mpu.get_data_parallel_rank()::mpu.get_data_parallel_world_size()]
+    return torch.utils.data.DataLoader(dataset, batch_sampler=batches, num_workers=args.num_workers,
+                                       collate_fn=collate, pin_memory=True)
+
+
 def main():
     """Main program."""
     args = get_args()
@@ -336,9 +371,12 @@ def main():
         assert not args.fp16
         model.bfloat16()
     # Data stuff.
-    dataset = build_dataset(args.task)
-    dataloader = build_data_loader(dataset, args.micro_batch_size,
-                                   args.num_workers, drop_last=False)
+    if args.task == 'LAMBADA':
+        dataloader = build_lambada_data_loader(args, tokenzier)
+    else:
+        dataset = build_dataset(args.task)
+        dataloader = build_data_loader(dataset, args.micro_batch_size,
+                                       args.num_workers, drop_last=False)
 
     # Run evaluation.
     evaluate_and_print_results(args.task, dataloader, model, eval_metric, args)
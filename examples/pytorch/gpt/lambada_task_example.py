@@ -25,6 +25,8 @@ import transformers
 
 from utils.gpt import GptInitModelParameters, GptRuntimeModelParameters
 from utils.parallel_gpt import ParallelGPT
+from utils.eval_driver import run_batched
+from utils.token_cache import DEFAULT_CACHE_DIR, lambada_cache, pad_rows, tokenizer_fingerprint
 
 class TensorEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -32,37 +34,6 @@ class TensorEncoder(json.JSONEncoder):
             return obj.tolist()
         return super().default(obj)
 
-class LambadaDataset(torch.utils.data.Dataset):
-    def __init__(self, path, tokenizer, seq_len):
-        self.seq_len = seq_len
-        self.tokenizer = tokenizer
-
-        with open(path, "r") as f:
-            texts = [json.loads(line)["text"] for line in f.readlines()]
-
-            # this whitespace preprocessing (additional space and stripping) is required
-            labels = [" " + text.split()[-1] for text in texts]
-            inputs = [text[: text.rfind(label)].strip() for text, label in zip(texts, labels)]
-            self.encodings = self.tokenizer(
-                inputs,
-                labels,
-                padding="max_length",
-                max_length=self.seq_len,
-                return_token_type_ids=True,
-                return_tensors="pt",
-            )
-
-    def __len__(self):
-        return self.encodings["input_ids"].shape[0]
-
-    def __getitem__(self, idx):
-        return {
-            "input_ids": self.encodings["input_ids"][idx],
-            "attention_mask": self.encodings["attention_mask"][idx],
-            "token_type_ids": self.encodings["token_type_ids"][idx],
-        }
-
-
 @dataclasses.dataclass
 class Metric:
     acc: float
@@ -134,7 +105,19 @@ def main():
     )
     parser.add_argument("--lambada-path", type=str, required=True, help="LAMBADA task data path")
     parser.add_argument("--output-path", type=str, help="Path to sample output file.")
-    parser.add_argument("--batch-size", type=int, default=1, help="Batch size")
+    parser.add_argument("--batch-size", type=int, default=1, help="Maximum batch size")
+    parser.add_argument(
+        "--max-batch-tokens",
+        type=int,
+        default=16384,
+        help="Maximum padded tokens (batch size x (longest input + output length)) per batch",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="Directory of the tokenized datasets, reused by later runs with the same data and tokenizer",
+    )
 
     GptInitModelParameters.update_argparser(parser)
     GptRuntimeModelParameters.update_argparser(parser)
@@ -154,12 +137,16 @@ def main():
 
     vocab_path = checkpoint_path / "vocab.json"
     merges_path = checkpoint_path / "merges.txt"
-    max_seq_len = config_reader.getint("ft_instance_hyperparameter", "max_seq_len")
 
     tokenizer = transformers.GPT2TokenizerFast(vocab_path.as_posix(), merges_path.as_posix())
     tokenizer.add_special_tokens({"pad_token": tokenizer.eos_token})
-    dataset = LambadaDataset(args.lambada_path, tokenizer=tokenizer, seq_len=max_seq_len)
-    data_loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size)
+    dataset = lambada_cache(
+        args.lambada_path,
+        tokenize=lambda texts: tokenizer(texts)["input_ids"],
+        tokenizer_id=tokenizer_fingerprint(tokenizer),
+        cache_dir=args.cache_dir,
+    )
+    print(f"[INFO] Tokenized LAMBADA: {dataset.directory}")
 
     runtime_parameters = GptRuntimeModelParameters.from_args(args, config_reader)
     inference_parameters_dict = dataclasses.asdict(runtime_parameters)
@@ -170,85 +157,72 @@ def main():
 
     beam_idx = 0  # use only 1st beam result
 
-    requested_num = 0
-    correct_num = 0
-    results = {"output": {"lambada": []}, "results": {"lambada": {}}}
-    with torch.no_grad():
+    def run_batch(batch_idxes):
+        inputs_tokens_batch = [dataset.row("inputs", idx) for idx in batch_idxes]
+        labels_tokens_batch = [torch.from_numpy(dataset.row("labels", idx).astype(np.int64)) for idx in batch_idxes]
+
+        input_tokens_lengths = [len(input_tokens) for input_tokens in inputs_tokens_batch]
+        # max is required due to scalar is used for output_seq_len input
+        expected_tokens_lengths = max([label_tokens.shape[0] for label_tokens in labels_tokens_batch])
+
+        # shape=(batch_size, max input length in the batch)
+        start_ids = torch.from_numpy(pad_rows(inputs_tokens_batch, tokenizer.pad_token_id))
+        runtime_parameters = GptRuntimeModelParameters.from_args(args, config_reader, start_ids.shape[0])
+        inference_parameters_dict = dataclasses.asdict(runtime_parameters)
 
-        for entries in data_loader:
-            inputs_tokens_batch = [
-                input_ids[(attention_mask == 1) & (token_type_ids == 0)]
-                for input_ids, attention_mask, token_type_ids in zip(
-                    entries["input_ids"], entries["attention_mask"], entries["token_type_ids"]
-                )
-            ]
-            labels_tokens_batch = [
-                input_ids[(attention_mask == 1) & (token_type_ids == 1)]
-                for input_ids, attention_mask, token_type_ids in zip(
-                    entries["input_ids"], entries["attention_mask"], entries["token_type_ids"]
-                )
-            ]
-
-            inputs_tokens_batch_padded = [
-                torch.nn.functional.pad(
-                    input_tokens,
-                    pad=[0, (max_seq_len - input_tokens.shape[0])],
-                    mode="constant",
-                    value=tokenizer.pad_token_id,
-                )
-                for input_tokens in inputs_tokens_batch
-            ]
-
-            input_tokens_lengths = [input_tokens.shape[0] for input_tokens in inputs_tokens_batch]
-            # max is required due to scalar is used for output_seq_len input
-            expected_tokens_lengths = max([label_tokens.shape[0] for label_tokens in labels_tokens_batch])
-
-            start_ids = torch.stack(inputs_tokens_batch_padded)  # shape=(batch_size, max_seq_len)
-            runtime_parameters = GptRuntimeModelParameters.from_args(args, config_reader, start_ids.shape[0])
-            inference_parameters_dict = dataclasses.asdict(runtime_parameters)
-
-            start_ids = start_ids.to(torch.int32)
-            result_all_tokens_batch = gpt(
-                start_ids,
-                torch.IntTensor(input_tokens_lengths),
-                expected_tokens_lengths,
-                **inference_parameters_dict,
+        result_all_tokens_batch = gpt(
+            start_ids,
+            torch.IntTensor(input_tokens_lengths),
+            expected_tokens_lengths,
+            **inference_parameters_dict,
+        )
+
+        # the answer follows each input's own tokens
+        results_tokens_batch = [
+            result_tokens_ids[beam_idx][input_len:input_len + label_tokens.shape[0]].cpu().to(torch.int64)
+            for result_tokens_ids, input_len, label_tokens in zip(
+                result_all_tokens_batch, input_tokens_lengths, labels_tokens_batch
             )
+        ]
+
+        result_text_batch = tokenizer.batch_decode(results_tokens_batch)
+        input_text_batch = tokenizer.batch_decode(inputs_tokens_batch)
+        label_text_batch = tokenizer.batch_decode(labels_tokens_batch)
+
+        batch_results = []
+        for idx in range(len(batch_idxes)):
+            is_correct_answer = torch.all(labels_tokens_batch[idx] == results_tokens_batch[idx])
+            batch_results.append(RequestAndResult(
+                prompt=input_text_batch[idx],
+                model_answer=result_text_batch[idx],
+                target=label_text_batch[idx],
+                input_ids=list(map(int, inputs_tokens_batch[idx])),
+                input_len=int(input_tokens_lengths[idx]),
+                output_len=expected_tokens_lengths,
+                init_model_parameters=GptInitModelParameters.from_args(args, config_reader),
+                runtime_model_parameters=runtime_parameters.slice_args(idx),
+                output_ids=list(map(int, result_all_tokens_batch[idx][beam_idx])),
+                metrics=Metric(acc=float(is_correct_answer)),
+            ))
+        return batch_results
 
-            results_idxes = [
-                torch.nonzero(token_type_ids, as_tuple=True)[0] for token_type_ids in entries["token_type_ids"]
-            ]
-            results_tokens_batch = [
-                result_tokens_ids[beam_idx][result_idxes].cpu()
-                for result_tokens_ids, result_idxes in zip(result_all_tokens_batch, results_idxes)
-            ]
-
-            labels_tokens_batch = [tokens.cpu() for tokens in labels_tokens_batch]
-            results_tokens_batch = [tokens.cpu() for tokens in results_tokens_batch]
-
-            result_text_batch = tokenizer.batch_decode(results_tokens_batch)
-            input_text_batch = tokenizer.batch_decode(inputs_tokens_batch)
-            label_text_batch = tokenizer.batch_decode(labels_tokens_batch)
-
-            for idx in range(len(inputs_tokens_batch)):
-                is_correct_answer = torch.all(labels_tokens_batch[idx] == results_tokens_batch[idx])
-                correct_num += int(is_correct_answer)
-                result = RequestAndResult(
-                    prompt=input_text_batch[idx],
-                    model_answer=result_text_batch[idx],
-                    target=label_text_batch[idx],
-                    input_ids=list(map(int, inputs_tokens_batch[idx])),
-                    input_len=int(input_tokens_lengths[idx]),
-                    output_len=expected_tokens_lengths,
-                    init_model_parameters=GptInitModelParameters.from_args(args, config_reader),
-                    runtime_model_parameters=runtime_parameters.slice_args(idx),
-                    output_ids=list(map(int, result_all_tokens_batch[idx][beam_idx])),
-                    metrics=Metric(acc=float(is_correct_answer)),
-                )
-                results["output"]["lambada"].append(dataclasses.asdict(result))
-
-            requested_num += len(inputs_tokens_batch)
+    results = {"output": {"lambada": []}, "results": {"lambada": {}}}
+    with torch.no_grad():
+        # batches of similar input length, only padded to their longest input instead of max_seq_len
+        outputs, throughput = run_batched(
+            range(len(dataset)),
+            dataset.lengths("inputs"),
+            run_batch,
+            max_tokens=args.max_batch_tokens,
+            output_len=int(dataset.lengths("labels").max()),
+            max_batch_size=args.batch_size,
+            output_lengths=lambda result: result.output_len,
+        )
+    print(throughput.report("lambada"))
 
+    requested_num = len(outputs)
+    correct_num = sum(int(result.metrics.acc) for result in outputs)
+    results["output"]["lambada"] = [dataclasses.asdict(result) for result in outputs]
     accuracy = correct_num * 100 / requested_num
     print(f"[INFO] accuracy: {accuracy:0.4f}% (total : {requested_num})")
 
@@ -26,6 +26,7 @@ import gc
 import torch.distributed as dist
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dir_path + "/../../..")
+from examples.pytorch import synthetic_inputs
 from examples.pytorch.gpt.utils.parallel_gpt import ParallelGPT
 import examples.pytorch.gpt.utils.gpt_token_encoder as encoder
 
@@ -98,6 +99,11 @@ def main():
                         help='path to sample input file. If not set, it runs with no context inputs.')
     parser.add_argument('--sample_output_file', type=str, default=None,
                         help='path to sample output file.')
+    parser.add_argument('--synthetic_input_len', type=str, default=None,
+                        help='run max_batch_size random inputs of this length instead of a sample input file: '
+                        'N, uniform:MIN:MAX or requests:<requests.jsonl>.')
+    parser.add_argument('--synthetic_input_seed', type=int, default=0,
+                        help='seed of the random inputs.')
     parser.add_argument('--enable_random_seed', action='store_true',
                         help='is use the random seed for sentences in a batch.')
     parser.add_argument('--int8_mode', type=int, default=0,
@@ -162,6 +168,13 @@ def main():
             batch_size = min(len(contexts), max_batch_size)
         contexts = contexts[:batch_size]
         start_ids = [torch.IntTensor(enc.encode(c)) for c in contexts]
+    elif args.synthetic_input_len:  # random contexts
+        batch_size = max_batch_size
+        synthetic = synthetic_inputs.generate(batch_size, args.synthetic_input_len, vocab_size,
+                                              exclude=(start_id, end_id), seed=args.synthetic_input_seed,
+                                              pad_id=end_id, max_len=args.max_seq_len)
+        start_ids = [torch.from_numpy(ids[:length]) for ids, length in zip(synthetic.input_ids, synthetic.lengths)]
+        contexts = [f'<{length} random tokens>' for length in synthetic.lengths]
     else:  # unconditional case
         batch_size = max_batch_size
         contexts = ['<|endoftext|>'] * batch_size
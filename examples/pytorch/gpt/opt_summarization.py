@@ -26,6 +26,7 @@ from tqdm import tqdm
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dir_path + "/../../..")
+from examples.pytorch.gpt.utils.eval_driver import add_batching_args, run_batched
 from examples.pytorch.gpt.utils.parallel_gpt import ParallelGPT
 
 def main():
@@ -54,6 +55,7 @@ def main():
     )
     parser.add_argument('--rougeLsum_threshold', type=float,
                         help='Threshold of FT rougeLsum score')
+    add_batching_args(parser, dashes=False)
 
 
 
@@ -99,7 +101,7 @@ def main():
     top_p = 0.0
     temperature = 1
     max_seq_len = hf_config['max_position_embeddings']
-    max_batch_size = 1
+    max_batch_size = args.max_batch_size
     repetition_penalty = 1
     vocab_size = hf_config['vocab_size']
     tensor_para_size = args.tensor_para_size
@@ -143,7 +145,7 @@ def main():
     elif args.data_type == 'bf16':
         gpt.bfloat16()
 
-    def summarize_ft(datapoint):
+    def encode(datapoint):
         if summarize:
             line = datapoint['article'] + ' TL;DR: '
         else:
@@ -151,31 +153,36 @@ def main():
         line = line.strip()
         line = line.replace(" n't", "n't")
 
-        line_encoded = tokenizer.encode(line, return_tensors='pt')
+        line_encoded = tokenizer.encode(line)
         if summarize:
-            line_encoded = line_encoded[:, -923:]
-        else:
-            line_encoded = line_encoded[:, -768:]
-        line_encoded = line_encoded.type(torch.int32)
+            return line_encoded[-923:]
+        return line_encoded[-768:]
+
+    def summarize_ft(lines_encoded):
+        batch_size = len(lines_encoded)
+        input_lengths = [len(line_encoded) for line_encoded in lines_encoded]
+        # padded to the longest input of the batch, the outputs follow each input's own tokens
+        start_ids = torch.full([batch_size, max(input_lengths)], tokenizer.pad_token_id, dtype=torch.int32)
+        for i, line_encoded in enumerate(lines_encoded):
+            start_ids[i, :input_lengths[i]] = torch.tensor(line_encoded, dtype=torch.int32)
 
         with torch.no_grad():
-            output, ft_output_len = gpt(line_encoded, torch.IntTensor([len(line_encoded[0])]),
+            output, ft_output_len = gpt(start_ids, torch.IntTensor(input_lengths),
                                         output_len,
                                         1,
-                                        top_k * torch.ones(size=[max_batch_size], dtype=torch.int32),
-                                        top_p * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                        0.0 * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                        temperature * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                        1.0 * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                        repetition_penalty * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                        random_seed_tensor,
+                                        top_k * torch.ones(size=[batch_size], dtype=torch.int32),
+                                        top_p * torch.ones(size=[batch_size], dtype=torch.float32),
+                                        0.0 * torch.ones(size=[batch_size], dtype=torch.float32),
+                                        temperature * torch.ones(size=[batch_size], dtype=torch.float32),
+                                        1.0 * torch.ones(size=[batch_size], dtype=torch.float32),
+                                        repetition_penalty * torch.ones(size=[batch_size], dtype=torch.float32),
+                                        random_seed_tensor[:batch_size],
                                         True)
 
-        tokens = output[0][0][len(line_encoded[0]):ft_output_len[0]].cpu().numpy()
-
-        output_lines = tokenizer.decode(output[0][0][len(line_encoded[0]):ft_output_len[0]])
-        output_lines = ".".join(output_lines.split('.')[:4]) + "."
-        return output_lines, tokens
+        tokens_batch = [output[i][0][input_lengths[i]:ft_output_len[i]].cpu().numpy() for i in range(batch_size)]
+        output_lines_batch = tokenizer.batch_decode(tokens_batch)
+        output_lines_batch = [".".join(output_lines.split('.')[:4]) + "." for output_lines in output_lines_batch]
+        return list(zip(output_lines_batch, tokens_batch))
 
     def summarize_hf(datapoint):
         if summarize:
@@ -208,7 +215,7 @@ def main():
 
     if summarize:
         datapoint = dataset_cnn['test'][0]
-        summary, _ = summarize_ft(datapoint)
+        summary, _ = summarize_ft([encode(datapoint)])[0]
         print('---------------------------------------------------------')
         print('FT Generated : ')
         print(' Article : ', datapoint['article'])
@@ -231,16 +238,33 @@ def main():
     else:
         tokens = []
 
-    ft_time = 0.0
-    hf_time = 0.0
-    for data_point_idx in tqdm(range(1, 11490, int(11490 / args.max_ite))):
+    data_point_idxes = list(range(1, 11490, int(11490 / args.max_ite)))
+    datapoints = [dataset_cnn['test'][data_point_idx] for data_point_idx in data_point_idxes]
+    lines_encoded = [encode(datapoint) for datapoint in datapoints]
+
+    def summarize_ft_batch(batch_idxes):
         try:
-            datapoint = dataset_cnn['test'][data_point_idx]
+            return summarize_ft([lines_encoded[idx] for idx in batch_idxes])
+        except:
+            print('Error with datapoints : ', [data_point_idxes[idx] for idx in batch_idxes])
+            return [(None, None)] * len(batch_idxes)
+
+    # FT runs length-sorted batches under a token budget, the results come back in dataset order
+    ft_results, ft_throughput = run_batched(list(range(len(datapoints))),
+                                            [len(line_encoded) for line_encoded in lines_encoded],
+                                            summarize_ft_batch,
+                                            max_tokens=args.max_batch_tokens,
+                                            output_len=output_len,
+                                            max_batch_size=max_batch_size,
+                                            output_lengths=lambda result: 0 if result[1] is None else len(result[1]))
+    ft_time = ft_throughput.seconds
 
-            start_time = datetime.now()
-            summary_ft, tokens_ft = summarize_ft(datapoint)
-            stop_time = datetime.now()
-            ft_time += (stop_time - start_time).total_seconds()
+    hf_time = 0.0
+    for data_point_idx, datapoint, (summary_ft, tokens_ft) in tqdm(zip(data_point_idxes, datapoints, ft_results),
+                                                                  total=len(datapoints)):
+        if tokens_ft is None:
+            continue
+        try:
             if (test_hf and summarize) or not summarize:
                 start_time = datetime.now()
                 summary_hf, tokens_hf = summarize_hf(datapoint)
@@ -288,6 +312,7 @@ def main():
                     print(f'{key} : {computed_metrics_hf[key].mid[2]*100}')
 
             print(f'Faster Transformers (total latency: {ft_time} sec)')
+            print(ft_throughput.report("Faster Transformers"))
             for key in computed_metrics_ft.keys():
                 print(f'{key} : {computed_metrics_ft[key].mid[2]*100}')
             if args.rougeLsum_threshold != None:
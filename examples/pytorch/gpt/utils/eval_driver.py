@@ -0,0 +1,106 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Length-sorted, token-budgeted batching for the offline evaluators.
+
+The LAMBADA and summarization evaluators used to run fixed-size batches in file order, each one
+padded to a global maximum length. `run_batched` sorts the examples by length, longest first, and
+fills each batch while its padded size, batch size * (longest input + output length), stays within
+`max_tokens`, so short examples are batched wide and long ones narrow. The results come back in the
+original order, along with the examples/s and tokens/s of the run.
+"""
+import argparse
+import dataclasses
+import time
+import typing
+
+import numpy as np
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+
+def add_batching_args(parser: argparse.ArgumentParser, max_tokens: int = 16384, max_batch_size: int = 64,
+                      dashes: bool = True):
+    """Adds --max-batch-tokens and --max-batch-size (or their underscore spellings)."""
+    sep = "-" if dashes else "_"
+    parser.add_argument(f"--max{sep}batch{sep}tokens", type=int, default=max_tokens,
+                        help="Maximum padded tokens (batch size x (longest input + output length)) per batch")
+    parser.add_argument(f"--max{sep}batch{sep}size", type=int, default=max_batch_size,
+                        help="Maximum number of examples per batch")
+
+
+def token_budget_batches(input_lengths: typing.Sequence[int], max_tokens: int, output_len: int = 0,
+                         max_batch_size: typing.Optional[int] = None) -> typing.List[typing.List[int]]:
+    """Example indices grouped longest first into batches of at most `max_tokens` padded tokens.
+
+    An example that alone exceeds the budget runs in a batch of its own.
+    """
+    input_lengths = np.asarray(input_lengths, dtype=np.int64)
+    order = np.argsort(-input_lengths, kind="stable")
+    batches: typing.List[typing.List[int]] = []
+    batch_len = 0
+    for idx in order.tolist():
+        # sorted longest first, so the first example of a batch sets its padded length
+        if batches and len(batches[-1]) < (max_batch_size or max_tokens) and \
+                (len(batches[-1]) + 1) * batch_len <= max_tokens:
+            batches[-1].append(idx)
+        else:
+            batches.append([idx])
+            batch_len = int(input_lengths[idx]) + output_len
+    return batches
+
+
+@dataclasses.dataclass
+class Throughput:
+    examples: int = 0
+    batches: int = 0
+    # input and generated tokens of the examples, without padding
+    tokens: int = 0
+    padded_tokens: int = 0
+    seconds: float = 0.0
+
+    def report(self, name: str = "eval") -> str:
+        seconds = max(self.seconds, 1e-9)
+        padding = 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+        return (f"[INFO] {name}: {self.examples} examples in {self.batches} batches, {self.seconds:.2f} s, "
+                f"{self.examples / seconds:.2f} examples/s, {self.tokens / seconds:.1f} tokens/s, "
+                f"{padding * 100:.1f}% padding")
+
+
+def run_batched(examples: typing.Sequence[T], input_lengths: typing.Sequence[int],
+                run_batch: typing.Callable[[typing.List[T]], typing.Sequence[R]],
+                max_tokens: int, output_len: int = 0, max_batch_size: typing.Optional[int] = None,
+                output_lengths: typing.Optional[typing.Callable[[R], int]] = None,
+                ) -> typing.Tuple[typing.List[R], Throughput]:
+    """Runs `run_batch` over token-budgeted batches of `examples` and returns its results in the original order.
+
+    `run_batch` gets a list of examples and returns one result per example. `output_lengths(result)`
+    gives the number of tokens generated for an example, `output_len` if not given; it only feeds the
+    tokens/s figure.
+    """
+    results: typing.List[typing.Optional[R]] = [None] * len(examples)
+    stats = Throughput()
+    for batch in token_budget_batches(input_lengths, max_tokens, output_len, max_batch_size):
+        start = time.perf_counter()
+        batch_results = run_batch([examples[idx] for idx in batch])
+        stats.seconds += time.perf_counter() - start
+        assert len(batch_results) == len(batch), "run_batch must return one result per example"
+        for idx, result in zip(batch, batch_results):
+            results[idx] = result
+            generated = output_lengths(result) if output_lengths is not None else output_len
+            stats.tokens += int(input_lengths[idx]) + generated
+        stats.padded_tokens += len(batch) * (max(int(input_lengths[idx]) for idx in batch) + output_len)
+        stats.examples += len(batch)
+        stats.batches += 1
+    return results, stats
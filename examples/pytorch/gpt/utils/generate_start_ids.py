@@ -14,6 +14,14 @@
 
 import argparse
 import configparser
+import os
+import sys
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../../../..")
+from examples.pytorch import synthetic_inputs
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -21,6 +29,14 @@ if __name__ == "__main__":
                         help='batch size')
     parser.add_argument('-max_input_length', '--max_input_length', type=int, required=True, metavar='NUMBER',
                         help='max input length')
+    parser.add_argument('--vocab_size', type=int, default=0,
+                        help='draw random ids below vocab_size instead of repeating token 198')
+    parser.add_argument('--input_length_spec', type=str, default=None,
+                        help='lengths of the random rows: N, uniform:MIN:MAX or requests:<requests.jsonl> '
+                        '(default: max_input_length)')
+    parser.add_argument('--exclude_ids', type=int, nargs='*', default=[50256],
+                        help='special token ids the random rows do not contain')
+    parser.add_argument('--seed', type=int, default=0)
     args = parser.parse_args()
     args_dict = vars(args)
 
@@ -28,13 +44,10 @@ if __name__ == "__main__":
     max_input_length = args_dict["max_input_length"]
     path = f"../examples/cpp/multi_gpu_gpt/start_ids.csv"
 
-    with open(path, 'w') as f:
-        ids = ""
-        for i in range(batch_size):
-            for j in range(max_input_length):
-                if j == 0:
-                    ids = f"{ids}198"
-                else:
-                    ids = f"{ids}, 198"
-            ids = f"{ids}\n"
-        f.write(ids)
+    if args.vocab_size > 0:
+        batch = synthetic_inputs.generate(batch_size, args.input_length_spec or max_input_length, args.vocab_size,
+                                          exclude=args.exclude_ids, seed=args.seed, max_len=max_input_length)
+    else:
+        batch = synthetic_inputs.SyntheticBatch(np.full([batch_size, max_input_length], 198, dtype=np.int32),
+                                                np.full([batch_size], max_input_length, dtype=np.int32))
+    synthetic_inputs.write_csv(path, batch)
@@ -15,6 +15,7 @@
 from __future__ import print_function
 
 import argparse
+import configparser
 import dataclasses
 import json
 import os
@@ -145,12 +146,19 @@ class GPTWeights(object):
         return len(self.w)
 
     def _map(self, func):
+        # Tied weights (e.g. embedding_table and embedding_kernel) are the same tensor object,
+        # so map each object once to keep them sharing storage after dtype/device conversion.
+        mapped = {}
+        def map_once(w):
+            if id(w) not in mapped:
+                mapped[id(w)] = (w, func(w))
+            return mapped[id(w)][1]
         for i in range(len(self.w)):
             if isinstance(self.w[i], list):
                 for j in range(len(self.w[i])):
-                    self.w[i][j] = func(self.w[i][j])
+                    self.w[i][j] = map_once(self.w[i][j])
             else:
-                self.w[i] = func(self.w[i])
+                self.w[i] = map_once(self.w[i])
 
     def _map_int8(self, func):
         for i in range(len(self.int8_w)):
@@ -168,10 +176,22 @@ class GPTWeights(object):
             else:
                 self.scale[i] = func(self.scale[i])
 
+    @staticmethod
+    def has_tied_embedding(ckpt_path):
+        """Whether the LM head reuses model.wte.bin instead of a separate model.lm_head.weight.bin."""
+        config_path = os.path.join(ckpt_path, "config.ini")
+        if os.path.isfile(config_path):
+            config = configparser.ConfigParser()
+            config.read(config_path)
+            if config.has_option("gpt", "tie_word_embeddings"):
+                return config.getboolean("gpt", "tie_word_embeddings")
+        return not os.path.isfile(ckpt_path + "/model.lm_head.weight.bin")
+
     def load(self, ckpt_path, tensor_para_rank, pipeline_para_rank):
         if not os.path.exists(ckpt_path):
             return False
         w = []
+        tied_embedding = self.has_tied_embedding(ckpt_path)
 
         type_map = {np.float32: torch.float32, np.float16: torch.float16}
         # Load
@@ -213,11 +233,12 @@ class GPTWeights(object):
             f"the value of maximum sequence length during training ({wpe.size(0)})."
         )
         w.append(wpe)
-        w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.wte.bin", dtype=self.weights_data_type)))
-        if os.path.isfile(ckpt_path + "/model.lm_head.weight.bin"):
-            w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.lm_head.weight.bin", dtype=self.weights_data_type)))
+        wte = torch.from_numpy(np.fromfile(ckpt_path + "/model.wte.bin", dtype=self.weights_data_type))
+        w.append(wte)
+        if tied_embedding:
+            w.append(wte)
         else:
-            w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.wte.bin", dtype=self.weights_data_type)))
+            w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.lm_head.weight.bin", dtype=self.weights_data_type)))
 
 
         if self.has_adapters:
@@ -238,11 +259,18 @@ class GPTWeights(object):
             w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.after_ffn_adapter.dense_4h_to_h.bias.bin".format(i),
                                                 dtype=self.weights_data_type)) if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type]) for i in range(self.layer_num)])
 
+        final_layernorm_w_offset = 2 if self.has_post_decoder_layernorm else 0
+        embedding_table_idx = 12 * self.layer_num + final_layernorm_w_offset + 1
+        embedding_kernel_idx = embedding_table_idx + 1
+
         # Reshape
         try:
             total_size = 0
             for i in range(len(w)):
-                if w[i].nelement() > 0:
+                if tied_embedding and i == embedding_kernel_idx:
+                    # Point both slots at the same tensor so that _map() converts and uploads it only once.
+                    self.w[i] = self.w[embedding_table_idx]
+                elif w[i].nelement() > 0:
                     # print(f"Expected shape: {self.w[i].shape} loaded shape: {w[i].shape})")
                     self.w[i] = w[i].reshape(self.w[i].shape)
                     total_size += (w[i].nelement() * w[i].element_size())
@@ -258,7 +286,6 @@ class GPTWeights(object):
 
         #transpose calibrate quantize the kernel
         layer_num = self.layer_num
-        final_layernorm_w_offset = 2 if self.has_post_decoder_layernorm else 0
         if self.int8_mode != 0:
             for i in range(layer_num):
                 self.int8_w[i + 0*layer_num], self.scale[i + 0*layer_num] = self.weight_transpose_calibrate_quantize(self.w[2*layer_num + i])
@@ -419,7 +446,17 @@ class GPT(nn.Module):
                 repetition_penalty=None,
                 random_seed=None,
                 return_output_length=False,
-                return_cum_log_probs=0):
+                return_cum_log_probs=0,
+                return_top_log_probs=0,
+                return_context_log_probs=0):
+        """With `return_top_log_probs` N > 0, the outputs end with the N most likely tokens of the model at
+        each generated step and their log probabilities, top_log_probs and top_ids [batch, beam, output_len, N],
+        selected on the device.
+
+        With `return_context_log_probs` M > 0 (and return_cum_log_probs=2), they then end with the log
+        probability of each input token after the first, context_log_probs [batch, beam, input_len - 1], and
+        the M most likely tokens after each input token, context_top_log_probs and context_top_ids
+        [batch, beam, input_len, M]; all from the one context pass."""
         if not self.build_model:
             self.cuda()
         input_len = start_ids.size(1)
@@ -428,7 +465,9 @@ class GPT(nn.Module):
         # Inputs to device
         start_ids = start_ids.cuda(self.device)
         start_lengths = start_lengths.cuda(self.device)
-        # outputs: output_ids, output_lengths, output_cum_log_probs (optional)
+        # outputs: output_ids, output_lengths, output_cum_log_probs (optional),
+        #          output_top_log_probs and output_top_ids (optional),
+        #          context_log_probs, context_top_log_probs and context_top_ids (optional)
         outputs = self.model.forward(start_ids,
                                      start_lengths,
                                      output_len,
@@ -440,19 +479,33 @@ class GPT(nn.Module):
                                      len_penalty, # optional, can be None
                                      repetition_penalty, # optional, can be None
                                      random_seed, # optional, can be None
-                                     return_cum_log_probs) # optional, can be None
+                                     return_cum_log_probs, # optional, can be None
+                                     return_top_log_probs, # optional, can be None
+                                     return_context_log_probs) # optional, can be None
+        top_outputs = ()
+        if return_context_log_probs > 0:
+            outputs, top_outputs = outputs[:-3], tuple(outputs[-3:])
+        if return_top_log_probs > 0:
+            outputs, top_outputs = outputs[:-2], tuple(outputs[-2:]) + top_outputs
         if return_cum_log_probs == 0:
             output_ids, output_lengths = outputs
         else:
             output_ids, output_lengths, output_cum_log_probs = outputs
         if return_output_length:
             if return_cum_log_probs > 0:
-                return output_ids, output_lengths, output_cum_log_probs
+                return (output_ids, output_lengths, output_cum_log_probs) + top_outputs
             else:
-                return output_ids, output_lengths
+                return (output_ids, output_lengths) + top_outputs
+        elif top_outputs:
+            return (output_ids,) + top_outputs
         else:
             return output_ids
 
+    def score(self, pairs, pad_id=None, **kwargs):
+        """Log probabilities of the continuations of (context ids, continuation ids) pairs, see scoring.score."""
+        from .scoring import score
+        return score(self, pairs, self.end_id if pad_id is None else pad_id, **kwargs)
+
     def set_input_tensor(self, input_tensor):
         """Set input tensor to be used instead of forward()'s input.
 
@@ -30,6 +30,7 @@ from transformers import OPTForCausalLM, AutoModelForCausalLM # transformers-4.2
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dir_path + "/../../../..")
 sys.path.append(dir_path)
+from examples.pytorch.ckpt_manifest import save_weight, write_manifest
 
 def get_weight_data_type(data_type):
     if data_type == "fp32":
@@ -49,20 +50,20 @@ def split_and_convert_process(i, saved_dir,factor,key,args, val):
         # shared weights, only need to convert the weights of rank 0
         if i == 0:
             saved_path = saved_dir + "/model." + key + ".bin"
-            val.tofile(saved_path)
+            save_weight(val, saved_path)
 
     elif key.find("attention.dense.weight") != -1 or key.find("mlp.dense_4h_to_h.weight") != -1:
         split_vals = np.split(val, factor, axis=0)
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     elif key.find("mlp.dense_h_to_4h.weight") != -1 or key.find("mlp.dense_h_to_4h.bias") != -1:
 
         split_vals = np.split(val, factor, axis=-1)
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     elif key.find("attention.query_key_value.bias") != -1:
         local_dim = (int)(val.shape[-1] / 3)
@@ -72,7 +73,7 @@ def split_and_convert_process(i, saved_dir,factor,key,args, val):
 
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     elif key.find("attention.query_key_value.weight") != -1:
         hidden_dim = val.shape[0]
@@ -83,7 +84,7 @@ def split_and_convert_process(i, saved_dir,factor,key,args, val):
 
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     else:
         print("[ERROR] cannot find key '{}'".format(key))
@@ -118,6 +119,8 @@ def split_and_convert(args):
     config = configparser.ConfigParser()
     config["gpt"] = {}
     has_post_decoder_layernorm = "model.decoder.final_layer_norm.bias" in layer_names
+    # Without project_in/project_out the LM head is the embedding table itself, so only model.wte.bin is saved.
+    tie_word_embeddings = "model.decoder.project_in.weight" not in layer_names
     try:
         config["gpt"]["model_name"] = "opt" if hf_config["_name_or_path"] == '' else hf_config["_name_or_path"]
         config["gpt"]["head_num"] = str(hf_config["num_attention_heads"])
@@ -130,6 +133,7 @@ def split_and_convert(args):
         config["gpt"]["layernorm_type"] = "pre_layernorm" if hf_config["do_layer_norm_before"] else "post_layernorm"
         config["gpt"]["activation_type"] = "Relu"
         config["gpt"]["has_post_decoder_layernorm"] = "1" if has_post_decoder_layernorm else "0"
+        config["gpt"]["tie_word_embeddings"] = "1" if tie_word_embeddings else "0"
         config["gpt"]["vocab_size"] = str(hf_config["vocab_size"])
         config["gpt"]["start_id"] = str(hf_config["bos_token_id"])
         config["gpt"]["end_id"] = str(hf_config["eos_token_id"])
@@ -201,20 +205,19 @@ def split_and_convert(args):
     padding_offset = 2
     for name, param in model_named_parameters.items():
         if name == 'model.decoder.embed_positions.weight':
-            param[padding_offset:,...].detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.wpe.bin")
+            save_weight(param[padding_offset:,...].detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.wpe.bin")
         elif name == 'model.decoder.embed_tokens.weight':
             if 'model.decoder.project_in.weight' in model_named_parameters.keys():
                 project_in = model_named_parameters['model.decoder.project_in.weight']
                 project_out = model_named_parameters['model.decoder.project_out.weight']
-                torch.matmul(param, project_in).detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.wte.bin")
-                torch.matmul(param, project_out).detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.lm_head.weight.bin")
+                save_weight(torch.matmul(param, project_in).detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.wte.bin")
+                save_weight(torch.matmul(param, project_out).detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.lm_head.weight.bin")
             else:
-                param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.wte.bin")
-                param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.lm_head.weight.bin")
+                save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.wte.bin")
         elif name == 'model.decoder.final_layer_norm.weight':
-            param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.final_layernorm.weight.bin")
+            save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.final_layernorm.weight.bin")
         elif name == 'model.decoder.final_layer_norm.bias':
-            param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.final_layernorm.bias.bin")
+            save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.final_layernorm.bias.bin")
         elif name.find("project_in") != -1 or name.find("project_out") != -1:
             continue
         else:
@@ -227,6 +230,7 @@ def split_and_convert(args):
 
     pool.close()
     pool.join()
+    write_manifest(saved_dir)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
@@ -15,6 +15,7 @@
 import argparse
 import configparser
 import datetime
+import functools
 import json
 import multiprocessing
 import pathlib
@@ -33,6 +34,9 @@ if __root_package_path__ not in sys.path:
         f"'export PYTHONPATH={__root_package_path__}:${{PYTHONPATH}}'"
     )
 
+from examples.pytorch.ckpt_conversion import (
+    ConversionManifest, ConversionStage, ConversionTask, load_checkpoint, run_conversion_plan
+)
 from examples.pytorch.gpt.utils.gpt import DEFAULT_START_TAG, DEFAULT_END_TAG, OPENAI_GPT2_START_ID, OPENAI_GPT2_END_ID
 from examples.pytorch.utils import torch2np, safe_transpose, cpu_map_location, gpu_map_location, WEIGHT2DTYPE
 
@@ -326,10 +330,11 @@ def _get_checkpoint_name(checkpoint_dir):
 
 def convert_checkpoint(args):
     saved_dir = pathlib.Path(args.saved_dir) / f"{args.infer_gpu_num:d}-gpu"
-    if saved_dir.exists():
-        print(f"[ERROR] Remove {saved_dir} target directory before running conversion")
+    if saved_dir.exists() and not args.resume:
+        print(f"[ERROR] Remove {saved_dir} target directory before running conversion or pass --resume")
         sys.exit(1)
-    saved_dir.mkdir(parents=True)
+    saved_dir.mkdir(parents=True, exist_ok=True)
+    manifest = ConversionManifest(saved_dir, resume=args.resume)
 
     if args.vocab_path:
         shutil.copy(args.vocab_path, (saved_dir / "vocab.json").as_posix())
@@ -347,7 +352,7 @@ def convert_checkpoint(args):
     if not checkpoints_paths:
         print(f"[ERROR] Cannot find checkpoint in {checkpoints_dir}.")
         exit(1)
-    model_00 = torch.load(checkpoints_paths[0].as_posix(), map_location=map_location_fn)
+    model_00 = load_checkpoint(checkpoints_paths[0].as_posix(), map_location=map_location_fn)
 
     if "hyper_parameters" in list(model_00.keys()):
         print("Use nemo_ckpt_converter.py script for conversion of this checkpoint")
@@ -404,60 +409,56 @@ def convert_checkpoint(args):
     main_loop = min(training_tensor_para_size, inference_tensor_para_size)
     vocab_size_list = [0 for i in range(main_loop)]
     
-    torch.multiprocessing.set_start_method("spawn")
-    torch.multiprocessing.set_sharing_strategy("file_system")
-    pool = multiprocessing.Pool(args.processes)
-    has_adapters = False
+    # Plan one task per (tp rank, pp rank, weight) while each stage's shards are loaded; workers load only the
+    # tensors of their own task.
+    convert_fn = merge_and_convert_process if is_merge_ckpt else split_and_convert_process
+    adapters = []
+
+    def plan_stage(i, j, shard_paths, checkpoints):
+        for m in checkpoints:
+            adapters.append(any("adaptor" in key for key in m['model']['language_model'][megatron_gpt_key].keys()))
+            if j == 0:
+                vocab_size_list[i] = m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"].shape[0]
+                w_e_list.append(torch2np(
+                    m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"],
+                    np_weight_data_type
+                ))
+        keys = list(checkpoints[0]["model"]["language_model"][megatron_gpt_key].keys())
+        return [
+            ConversionTask(
+                name=f"tp{i}.pp{j}.{key}",
+                shard_paths=shard_paths,
+                state_path=("model", "language_model", megatron_gpt_key),
+                state_key=key,
+                key=key,
+                convert_fn=functools.partial(
+                    convert_fn, i, j, saved_dir, factor, key, model_training_args,
+                    ckpt_ver=checkpoint_version, np_weight_data_type=np_weight_data_type,
+                ),
+            )
+            for key in keys
+        ]
+
+    stages = []
     for i in range(main_loop):
         for j in range(training_pipeline_para_size):
-            
-            transformer_models = []
             if is_merge_ckpt:
-                for k in range(factor):
-                    m = torch.load(model_weights_paths[i * factor + k][j].as_posix(), map_location=map_location_fn)
-                    if not has_adapters:
-                        has_adapters = any("adaptor" in key for key in m['model']['language_model'][megatron_gpt_key].keys())
-                    transformer_models.append(m["model"]["language_model"][megatron_gpt_key])
-
-                    if j == 0:
-                        vocab_size_list[i] = m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"].shape[0]
-                        w_e_list.append(torch2np(m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"], np_weight_data_type))
+                shard_paths = [model_weights_paths[i * factor + k][j] for k in range(factor)]
             else:
-                m = torch.load(model_weights_paths[i][j].as_posix(), map_location=map_location_fn)
-                if not has_adapters:
-                    has_adapters = any("adaptor" in key for key in m['model']['language_model'][megatron_gpt_key].keys())
-            
-                if j == 0:
-                    vocab_size_list[i] = m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"].shape[0]
-                    w_e_list.append(torch2np(
-                        m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"],
-                        np_weight_data_type
-                    ))
-                transformer_models.append(m["model"]["language_model"][megatron_gpt_key])
-
-            pool.starmap(
-                merge_and_convert_process if is_merge_ckpt else split_and_convert_process,
-                [
-                    (
-                        i,
-                        j,
-                        saved_dir,
-                        factor,
-                        k,
-                        model_training_args,
-                        transformer_models,
-                        checkpoint_version,
-                        np_weight_data_type,
-                    )
-                    for (k, v) in transformer_models[0].items()
-                ],
-            )
+                shard_paths = [model_weights_paths[i][j]]
+            shard_paths = tuple(shard_path.as_posix() for shard_path in shard_paths)
+            stages.append(ConversionStage(shard_paths, functools.partial(plan_stage, i, j, shard_paths)))
 
+    torch.multiprocessing.set_start_method("spawn")
+    torch.multiprocessing.set_sharing_strategy("file_system")
+    pool = multiprocessing.Pool(args.processes)
+    run_conversion_plan(pool, stages, manifest, map_location=map_location_fn)
     pool.close()
     pool.join()
 
     torch.cuda.synchronize()
 
+    has_adapters = any(adapters)
     np.concatenate(w_e_list, axis=0).tofile((saved_dir / "model.wte.bin").as_posix())
 
     # save vocab_size
@@ -542,6 +543,11 @@ def main():
         default=1,
         help="Whether to load model weights to CPU",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted conversion in an existing output directory, skipping finished weights",
+    )
     parser.add_argument(
         "--vocab-path",
         type=str,
@@ -16,6 +16,7 @@ import argparse
 import configparser
 import dataclasses
 import datetime
+import functools
 import logging
 import multiprocessing
 import os
@@ -37,9 +38,16 @@ if __root_package_path__ not in sys.path:
         f"'export PYTHONPATH={__root_package_path__}:${{PYTHONPATH}}'"
     )
 
+from examples.pytorch.ckpt_conversion import (
+    ConversionManifest,
+    ConversionStage,
+    ConversionTask,
+    run_conversion_plan,
+)
 from examples.pytorch.gpt.utils.gpt import GptModelConfig
 from examples.pytorch.nemo import (
     UnpackedNemoCheckpointDir,
+    open_nemo_ckpt,
     unpack_nemo_ckpt,
     extract_layers_with_prefix,
 )
@@ -271,18 +279,11 @@ def convert_checkpoint(unpacked_checkpoints_dir: UnpackedNemoCheckpointDir, args
 
     # if checkpoints files could be found - start preparing output dir
     saved_dir = _prepare_saved_dir(args)
+    manifest = ConversionManifest(saved_dir, resume=args.resume)
 
     map_location_fn = cpu_map_location if bool(args.load_checkpoints_to_cpu) else gpu_map_location
     np_weight_data_type = WEIGHT2DTYPE[args.weight_data_type]
 
-    # load position_embedding from rank 0
-    model_00 = torch.load(checkpoints_paths[0][0], map_location=map_location_fn)
-    val = model_00.get("state_dict", model_00)["model.language_model.embedding.position_embeddings.weight"]
-    # not weight, do not need to transpose
-    val = torch2np(val, np_weight_data_type)
-    val.tofile(saved_dir / "model.wpe.bin")
-    del model_00
-
     w_e_list = []
 
     training_tensor_para_size = nemo_model_config.get("tensor_model_parallel_size", 1)
@@ -300,52 +301,61 @@ def convert_checkpoint(unpacked_checkpoints_dir: UnpackedNemoCheckpointDir, args
 
     main_loop = min(training_tensor_para_size, inference_tensor_para_size)
 
-    torch.multiprocessing.set_start_method("spawn")
-    torch.multiprocessing.set_sharing_strategy("file_system")
-    pool = multiprocessing.Pool(args.processes)
+    # Plan one task per (tp rank, pp rank, weight) while each stage's shards are loaded; workers load only the
+    # tensors of their own task.
+    encoder_prefix = "model.language_model.encoder."
+    convert_fn = merge_and_convert_process if is_merge_ckpt else split_and_convert_process
+
+    def plan_stage(i, j, shard_paths, checkpoints):
+        if i == 0 and j == 0:
+            # position_embedding from rank 0, read from the stage's load: archive members cannot be mapped
+            model_00 = checkpoints[0]
+            val = model_00.get("state_dict", model_00)["model.language_model.embedding.position_embeddings.weight"]
+            # not weight, do not need to transpose
+            val = torch2np(val, np_weight_data_type)
+            val.tofile(saved_dir / "model.wpe.bin")
+        if j == 0:
+            for model in checkpoints:
+                val = model.get("state_dict", model)["model.language_model.embedding.word_embeddings.weight"]
+                w_e_list.append(torch2np(val, np_weight_data_type))
+        model = checkpoints[0]
+        state_path = ("state_dict",) if "state_dict" in model else ()
+        return [
+            ConversionTask(
+                name=f"tp{i}.pp{j}.{key}",
+                shard_paths=shard_paths,
+                state_path=state_path,
+                state_key=encoder_prefix + key,
+                key=key,
+                convert_fn=functools.partial(
+                    convert_fn,
+                    i,  # tp_rank
+                    j,  # pp_rank
+                    saved_dir,
+                    factor,
+                    key,
+                    nemo_model_config,
+                    np_weight_data_type=np_weight_data_type,
+                    args=args,
+                ),
+            )
+            for key in extract_layers_with_prefix(model, encoder_prefix)
+        ]
+
+    stages = []
     for i in range(main_loop):
         for j in range(training_pipeline_para_size):
-
-            transformer_models = []
             if is_merge_ckpt:
-                for k in range(factor):
-                    rank_weights = checkpoints_paths[i * factor + k][j]
-                    model = torch.load(rank_weights, map_location=map_location_fn)
-                    if j == 0:
-                        val = model.get("state_dict", model)["model.language_model.embedding.word_embeddings.weight"]
-                        val = torch2np(val, np_weight_data_type)
-                        w_e_list.append(val)
-                    layers = extract_layers_with_prefix(model, "model.language_model.encoder.")
-                    transformer_models.append(layers)
+                shard_paths = [checkpoints_paths[i * factor + k][j] for k in range(factor)]
             else:
-                rank_weights = checkpoints_paths[i][j]
-                model = torch.load(rank_weights, map_location=map_location_fn)
-
-                if j == 0:
-                    val = model.get("state_dict", model)["model.language_model.embedding.word_embeddings.weight"]
-                    val = torch2np(val, np_weight_data_type)
-                    w_e_list.append(val)
-                layers = extract_layers_with_prefix(model, "model.language_model.encoder.")
-                transformer_models.append(layers)
-
-            pool.starmap(
-                merge_and_convert_process if is_merge_ckpt else split_and_convert_process,
-                [
-                    (
-                        i,  # tp_rank
-                        j,  # pp_rank
-                        saved_dir,
-                        factor,
-                        key,
-                        nemo_model_config,
-                        transformer_models,
-                        np_weight_data_type,
-                        args,
-                    )
-                    for key in transformer_models[0]
-                ],
-            )
+                shard_paths = [checkpoints_paths[i][j]]
+            shard_paths = tuple(shard_paths)
+            stages.append(ConversionStage(shard_paths, functools.partial(plan_stage, i, j, shard_paths)))
 
+    torch.multiprocessing.set_start_method("spawn")
+    torch.multiprocessing.set_sharing_strategy("file_system")
+    pool = multiprocessing.Pool(args.processes)
+    run_conversion_plan(pool, stages, manifest, map_location=map_location_fn)
     pool.close()
     pool.join()
 
@@ -397,10 +407,10 @@ def _prepare_saved_dir(args):
         saved_dir = saved_dir / f"{args.infer_gpu_num:d}-gpu/"
     else:
         saved_dir = saved_dir / f"unfusedQKV-{args.infer_gpu_num:d}-gpu"
-    if saved_dir.exists():
-        LOGGER.error(f"Remove %s target directory before running conversion", saved_dir)
+    if saved_dir.exists() and not args.resume:
+        LOGGER.error(f"Remove %s target directory before running conversion or pass --resume", saved_dir)
         sys.exit(1)
-    saved_dir.mkdir(parents=True)
+    saved_dir.mkdir(parents=True, exist_ok=True)
     return saved_dir
 
 
@@ -580,6 +590,11 @@ def main():
         default=1,
         help="Whether to load model weights to CPU",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted conversion in an existing output directory, skipping finished weights",
+    )
     parser.add_argument(
         "--vocab-path",
         help="Path to vocabulary file to embed in FasterTransformer checkpoint",
@@ -618,11 +633,10 @@ def main():
         if input_path.is_file():
             checkpoint_dir_path = temp_dir / "unpacked"
             start_time = datetime.datetime.now()
-            unpacked_checkpoint_dir = UnpackedNemoCheckpointDir(
-                unpack_nemo_ckpt(args.in_file, checkpoint_dir_path),
-                load_checkpoints_to_cpu=bool(args.load_checkpoints_to_cpu),
+            unpacked_checkpoint_dir = open_nemo_ckpt(
+                args.in_file, checkpoint_dir_path, load_checkpoints_to_cpu=bool(args.load_checkpoints_to_cpu)
             )
-            LOGGER.info("Spent %s (h:m:s) to unpack NeMo archive", datetime.datetime.now() - start_time)
+            LOGGER.info("Spent %s (h:m:s) to open NeMo archive", datetime.datetime.now() - start_time)
         else:
             unpacked_checkpoint_dir = UnpackedNemoCheckpointDir(
                 input_path, load_checkpoints_to_cpu=bool(args.load_checkpoints_to_cpu)
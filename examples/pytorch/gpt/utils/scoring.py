@@ -0,0 +1,223 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Log probabilities of given continuations, without generating them.
+
+Clients used to rank continuations with `max_tokens=1` generation calls. `score` computes the log
+probability of each continuation token given its context and the tokens before it, with the GPT op:
+
+- each pair is a single row, context + continuation, run through the op once with
+  `return_cum_log_probs=2` and `return_context_log_probs`. Its context pass already computes the log
+  probability of every input token given the ones before it (for the cumulative log probability), and
+  returns them per position; the continuation's are the last len(continuation) of them;
+- the same pass selects the most likely tokens after each input token on the device: the first is the
+  greedy one, i.e. whether each continuation token is the greedy choice, and with `top_n` they are the
+  alternatives to each continuation token;
+- rows are deduplicated (pairs with the same tokens share a row) and batched longest first within a
+  token budget (see eval_driver.token_budget_batches). Per batch, [batch, length] log probabilities and
+  [batch, length, max(top_n, 1)] most likely tokens are copied back.
+
+A continuation of n tokens costs one row of len(context) + n tokens, with or without `per_token`.
+"""
+import dataclasses
+import typing
+
+import numpy as np
+import torch
+
+from .eval_driver import token_budget_batches
+from .token_cache import pad_rows
+
+DEFAULT_MAX_TOKENS = 16384
+# the most alternatives per token a request gets, as in the OpenAI completions API
+MAX_TOP_LOGPROBS = 5
+
+TokenIds = typing.Sequence[int]
+# the ids [steps, N] and log probabilities [steps, N] of the most likely tokens at each step
+TopLogProbs = typing.Tuple[np.ndarray, np.ndarray]
+
+
+@dataclasses.dataclass
+class Score:
+    token_ids: typing.List[int]
+    # the log probability of each continuation token, None when scored with per_token=False
+    token_logprobs: typing.Optional[typing.List[float]]
+    # whether each continuation token is the model's greedy choice, None when scored with per_token=False
+    greedy: typing.Optional[typing.List[bool]]
+    logprob: float
+    # the top_n most likely tokens instead of each continuation token, with score(..., top_n=N)
+    top: typing.Optional[TopLogProbs] = None
+
+    @property
+    def is_greedy(self) -> typing.Optional[bool]:
+        return None if self.greedy is None else all(self.greedy)
+
+
+def _greedy_params(batch_size: int) -> typing.Dict[str, torch.Tensor]:
+    return {
+        "top_k": torch.ones([batch_size], dtype=torch.int32),
+        "top_p": torch.zeros([batch_size], dtype=torch.float32),
+        "beam_search_diversity_rate": torch.zeros([batch_size], dtype=torch.float32),
+        "temperature": torch.ones([batch_size], dtype=torch.float32),
+        "len_penalty": torch.zeros([batch_size], dtype=torch.float32),
+        "repetition_penalty": torch.ones([batch_size], dtype=torch.float32),
+        "random_seed": torch.zeros([batch_size], dtype=torch.int64),
+    }
+
+
+def score_rows(model, rows: typing.Sequence[TokenIds], pad_id: int, max_tokens: int = DEFAULT_MAX_TOKENS,
+               max_batch_size: typing.Optional[int] = None, top_n: int = 0
+               ) -> typing.List[typing.Tuple[np.ndarray, TopLogProbs]]:
+    """Scores every token of every row but the first, with one forward pass per batch of rows.
+
+    For each row, the log probability of each of its tokens after the first, float32 [len(row) - 1], and the
+    model's most likely tokens instead of each of them, ([len(row) - 1, max(top_n, 1)], same), highest first:
+    the first is the greedy token.
+    """
+    results = [None] * len(rows)
+    lengths = [len(row) for row in rows]
+    for batch in token_budget_batches(lengths, max_tokens, output_len=1, max_batch_size=max_batch_size):
+        start_ids = torch.from_numpy(pad_rows([rows[idx] for idx in batch], pad_id))
+        start_lengths = torch.IntTensor([lengths[idx] for idx in batch])
+        with torch.no_grad():
+            # the op generates at least one token; it is not used
+            *_, log_probs, top_log_probs, top_ids = model(start_ids, start_lengths, 1, 1,
+                                                          **_greedy_params(len(batch)),
+                                                          return_output_length=True, return_cum_log_probs=2,
+                                                          return_context_log_probs=max(top_n, 1))
+        log_probs = log_probs[:, 0].cpu().numpy()
+        top_ids = top_ids[:, 0].cpu().numpy()
+        top_log_probs = top_log_probs[:, 0].cpu().numpy()
+        for i, idx in enumerate(batch):
+            # position t of both scores token t + 1, given the tokens up to t
+            num_scored = lengths[idx] - 1
+            results[idx] = (log_probs[i, :num_scored], (top_ids[i, :num_scored], top_log_probs[i, :num_scored]))
+    return results
+
+
+def _empty_top(top_n: int) -> typing.Optional[TopLogProbs]:
+    if not top_n:
+        return None
+    return np.zeros([0, top_n], dtype=np.int32), np.zeros([0, top_n], dtype=np.float32)
+
+
+def score(model, pairs: typing.Sequence[typing.Tuple[TokenIds, TokenIds]], pad_id: int,
+          max_tokens: int = DEFAULT_MAX_TOKENS, max_batch_size: typing.Optional[int] = None,
+          per_token: bool = True, top_n: int = 0) -> typing.List[Score]:
+    """Scores the continuation of each (context ids, continuation ids) pair, see the module docstring.
+
+    `model` is a GPT or ParallelGPT; on several ranks, every rank must score the same pairs. Contexts
+    must not be empty, start them with the start id to score a text from its first token. `top_n`
+    requires `per_token`.
+    """
+    assert per_token or not top_n, "the alternatives of each token need per_token scoring"
+    row_index: typing.Dict[typing.Tuple[int, ...], int] = {}
+    pair_rows = []
+    for context, continuation in pairs:
+        if len(context) == 0:
+            raise ValueError("Cannot score a continuation without context, start it with the start id")
+        tokens = tuple(int(token) for token in list(context) + list(continuation))
+        pair_rows.append(row_index.setdefault(tokens, len(row_index)) if len(continuation) else None)
+
+    rows = [list(tokens) for tokens in row_index]
+    row_scores = score_rows(model, rows, pad_id, max_tokens, max_batch_size, top_n) if rows else []
+
+    scores = []
+    for (context, continuation), index in zip(pairs, pair_rows):
+        continuation = [int(token) for token in continuation]
+        if index is None:
+            scores.append(Score(continuation, [] if per_token else None, [] if per_token else None, 0.0,
+                                _empty_top(top_n)))
+            continue
+        log_probs, (top_ids, top_log_probs) = row_scores[index]
+        # the continuation starts after the last context token
+        begin = len(context) - 1
+        token_logprobs = log_probs[begin:].astype(np.float64)
+        if per_token:
+            greedy = (top_ids[begin:, 0] == continuation).tolist()
+            pair_top = (top_ids[begin:, :top_n], top_log_probs[begin:, :top_n]) if top_n else None
+            scores.append(Score(continuation, token_logprobs.tolist(), greedy, float(token_logprobs.sum()), pair_top))
+        else:
+            scores.append(Score(continuation, None, None, float(token_logprobs.sum())))
+    return scores
+
+
+def requested_top_n(logprobs: typing.Optional[int], beam_width: int = 1) -> int:
+    """The alternatives per token for a request's `logprobs`, capped at MAX_TOP_LOGPROBS; none with beam search."""
+    if not logprobs or beam_width != 1:
+        return 0
+    return max(0, min(int(logprobs), MAX_TOP_LOGPROBS))
+
+
+def completion_pair(prompt_ids: TokenIds, output_ids: TokenIds, echo: bool = False,
+                    special_ids: typing.Collection[int] = ()
+                    ) -> typing.Tuple[typing.Tuple[typing.List[int], typing.List[int]], typing.List[int]]:
+    """The (context, continuation) pair that scores a completion, and the returned prompt tokens it leaves unscored.
+
+    Without `echo`, the prompt is the context of the output. With it, the prompt tokens are scored
+    too, all but the first: it is returned without log probability, or dropped if it is a special
+    token (e.g. the </s> the OPT tokenizer starts with).
+    """
+    prompt_ids = [int(token) for token in prompt_ids]
+    output_ids = [int(token) for token in output_ids]
+    if not echo:
+        return (prompt_ids, output_ids), []
+    unscored = [] if prompt_ids[0] in special_ids else prompt_ids[:1]
+    return (prompt_ids[:1], prompt_ids[1:] + output_ids), unscored
+
+
+def completion_top(result: Score, num_output: int, echo: bool = False,
+                   generated: typing.Optional[TopLogProbs] = None) -> typing.Optional[TopLogProbs]:
+    """The alternatives of a completion's returned tokens, scored as `result`.
+
+    With the `generated` alternatives of its `num_output` generated tokens, the scoring rows only need
+    to provide those of an echoed prompt (score's `top_n` is only needed with `echo`); without, they
+    provide all.
+    """
+    if generated is None:
+        return result.top
+    generated = (generated[0][:num_output], generated[1][:num_output])
+    if not echo:
+        return generated
+    num_prompt = len(result.token_ids) - num_output
+    return (np.concatenate([result.top[0][:num_prompt], generated[0]]),
+            np.concatenate([result.top[1][:num_prompt], generated[1]]))
+
+
+def openai_logprobs(tokenizer, result: Score, unscored_ids: TokenIds = (), text_offset: int = 0,
+                    top: typing.Optional[TopLogProbs] = None) -> typing.Dict[str, typing.Any]:
+    """The "logprobs" of an OpenAI completion choice: tokens, token_logprobs, top_logprobs and text_offset.
+
+    `unscored_ids` come first, with a None log probability. `top` gives the alternatives of the last
+    len(top[0]) returned tokens, by default those of `result` (see score's `top_n`); the tokens before
+    have None. All tokens, returned and alternatives, are decoded with a single batch_decode call;
+    `text_offset` is where the first one starts in the returned text.
+    """
+    token_ids = [int(token) for token in unscored_ids] + result.token_ids
+    top = result.top if top is None else top
+    alternative_ids = [] if top is None else np.asarray(top[0]).reshape(-1).tolist()
+    strings = tokenizer.batch_decode([[token] for token in token_ids + alternative_ids]) if token_ids else []
+    tokens = strings[:len(token_ids)]
+    offsets = np.cumsum([text_offset] + [len(token) for token in tokens[:-1]]).tolist() if tokens else []
+    top_logprobs = None
+    if top is not None:
+        steps = len(top[0])
+        alternatives = iter(strings[len(token_ids):])
+        top_logprobs = [None] * (len(token_ids) - steps) + [
+            {next(alternatives): float(logprob) for logprob in logprobs} for logprobs in np.asarray(top[1]).tolist()]
+    return {
+        "tokens": tokens,
+        "token_logprobs": [None] * len(unscored_ids) + list(result.token_logprobs),
+        "top_logprobs": top_logprobs,
+        "text_offset": offsets,
+    }
@@ -0,0 +1,183 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pre-tokenized, memory-mapped evaluation datasets.
+
+The evaluators used to read and tokenize their dataset, padded to the maximum sequence length, on
+every run. `TokenCache` stores the token ids of one or more fields per example (e.g. the LAMBADA
+context and its last word) once, as flat ``<field>.tokens.npy`` arrays with ``<field>.offsets.npy``
+row boundaries, under a directory named after a hash of the dataset file, the tokenizer and the
+preprocessing. Later runs memory-map the arrays and only read the rows they use.
+
+`TokenCache.length_sorted_batches` groups examples of similar length, so that each batch is only
+padded to its own longest row (see `pad_rows`).
+"""
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import typing
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TOKEN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fastertransformer", "tokens"))
+# bumped when the cache layout changes
+CACHE_VERSION = 1
+_META_FILENAME = "meta.json"
+
+Tokenize = typing.Callable[[typing.List[str]], typing.List[typing.List[int]]]
+
+
+def file_digest(*paths: typing.Union[str, pathlib.Path]) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of a Hugging Face tokenizer's vocabulary and rules.
+
+    For other tokenizers (e.g. Megatron's), hash their vocabulary files with `file_digest` instead.
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        state = backend.to_str()
+    else:
+        state = json.dumps(sorted(tokenizer.get_vocab().items()))
+    return hashlib.sha256(f"{type(tokenizer).__name__}\n{state}".encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+
+    def __init__(self, directory: typing.Union[str, pathlib.Path]):
+        self.directory = pathlib.Path(directory)
+        with (self.directory / _META_FILENAME).open("r") as meta_file:
+            self.meta = json.load(meta_file)
+        self.fields: typing.List[str] = self.meta["fields"]
+        self._tokens = {field: np.load(self.directory / f"{field}.tokens.npy", mmap_mode="r") for field in self.fields}
+        self._offsets = {field: np.load(self.directory / f"{field}.offsets.npy") for field in self.fields}
+
+    def __len__(self) -> int:
+        return self.meta["num_examples"]
+
+    def __getitem__(self, idx: int) -> typing.Dict[str, np.ndarray]:
+        return {field: self.row(field, idx) for field in self.fields}
+
+    def row(self, field: str, idx: int) -> np.ndarray:
+        offsets = self._offsets[field]
+        return self._tokens[field][offsets[idx]:offsets[idx + 1]]
+
+    def lengths(self, field: str) -> np.ndarray:
+        return np.diff(self._offsets[field])
+
+    def length_sorted_batches(self, batch_size: int, fields: typing.Optional[typing.Sequence[str]] = None,
+                              descending: bool = True) -> typing.List[typing.List[int]]:
+        """Example indices in batches of similar total length of `fields` (default: all fields).
+
+        The longest batches come first, so that running out of memory shows up right away.
+        """
+        lengths = sum(self.lengths(field) for field in (fields or self.fields))
+        order = np.argsort(-lengths if descending else lengths, kind="stable")
+        return [order[start:start + batch_size].tolist() for start in range(0, len(order), batch_size)]
+
+    @classmethod
+    def write(cls, directory: typing.Union[str, pathlib.Path],
+              fields: typing.Dict[str, typing.Sequence[typing.Sequence[int]]],
+              meta: typing.Optional[typing.Dict[str, typing.Any]] = None) -> "TokenCache":
+        """Writes the token ids of every field into `directory`, atomically, and opens it."""
+        directory = pathlib.Path(directory)
+        num_examples = {len(rows) for rows in fields.values()}
+        assert len(num_examples) == 1, "all fields need one row per example"
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix=f".{directory.name}.", dir=directory.parent))
+        try:
+            for field, rows in fields.items():
+                offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+                np.cumsum([len(row) for row in rows], out=offsets[1:])
+                tokens = np.fromiter((token for row in rows for token in row), dtype=np.int32, count=offsets[-1])
+                np.save(tmp_dir / f"{field}.tokens.npy", tokens)
+                np.save(tmp_dir / f"{field}.offsets.npy", offsets)
+            with (tmp_dir / _META_FILENAME).open("w") as meta_file:
+                json.dump(dict(meta or {}, version=CACHE_VERSION, fields=list(fields),
+                               num_examples=num_examples.pop()), meta_file, indent=2)
+            try:
+                tmp_dir.rename(directory)
+            except OSError:
+                # another process wrote the same cache first
+                if not (directory / _META_FILENAME).exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return cls(directory)
+
+
+def cache_key(*parts: typing.Any) -> str:
+    return hashlib.sha256(json.dumps([CACHE_VERSION, *parts]).encode("utf-8")).hexdigest()[:16]
+
+
+def open_or_build(name: str, key: str,
+                  build: typing.Callable[[], typing.Dict[str, typing.Sequence[typing.Sequence[int]]]],
+                  cache_dir: typing.Union[str, pathlib.Path] = DEFAULT_CACHE_DIR,
+                  meta: typing.Optional[typing.Dict[str, typing.Any]] = None) -> TokenCache:
+    """Opens ``<cache_dir>/<name>-<key>``, calling `build()` for its fields first if it does not exist."""
+    directory = pathlib.Path(cache_dir) / f"{name}-{key}"
+    if (directory / _META_FILENAME).exists():
+        return TokenCache(directory)
+    return TokenCache.write(directory, build(), meta)
+
+
+def _read_lambada(path: typing.Union[str, pathlib.Path]) -> typing.List[str]:
+    with open(path, "r") as f:
+        return [json.loads(line)["text"] for line in f]
+
+
+def _split_lambada(texts: typing.List[str]) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    # this whitespace preprocessing (additional space and stripping) is required
+    labels = [" " + text.split()[-1] for text in texts]
+    inputs = [text[: text.rfind(label)].strip() for text, label in zip(texts, labels)]
+    return inputs, labels
+
+
+def lambada_cache(path: typing.Union[str, pathlib.Path], tokenize: Tokenize, tokenizer_id: str, strict: bool = True,
+                  cache_dir: typing.Union[str, pathlib.Path] = DEFAULT_CACHE_DIR) -> TokenCache:
+    """LAMBADA tokenized into the fields "inputs" and "labels".
+
+    With `strict`, the label is the tokenized last word; otherwise the whole text is tokenized and
+    the label is its last token, as in Megatron's non-strict formulation. `tokenizer_id` identifies the
+    tokenizer in the cache key, see `tokenizer_fingerprint`.
+    """
+    def build():
+        texts = _read_lambada(path)
+        if strict:
+            inputs, labels = _split_lambada(texts)
+            return {"inputs": tokenize(inputs), "labels": tokenize(labels)}
+        tokens = tokenize(texts)
+        return {"inputs": [row[:-1] for row in tokens], "labels": [row[-1:] for row in tokens]}
+
+    key = cache_key("lambada", file_digest(path), tokenizer_id, strict)
+    return open_or_build("lambada", key, build, cache_dir, meta={"dataset": str(path), "strict": strict})
+
+
+def pad_rows(rows: typing.Sequence[np.ndarray], pad_id: int, width: typing.Optional[int] = None) -> np.ndarray:
+    """Stacks `rows` into an int32 [len(rows), width] array padded with `pad_id`; width defaults to the longest row."""
+    width = max(len(row) for row in rows) if width is None else width
+    batch = np.full([len(rows), width], pad_id, dtype=np.int32)
+    for i, row in enumerate(rows):
+        batch[i, :len(row)] = row
+    return batch
@@ -1,14 +1,23 @@
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch import startup
+startup.begin()
+import functools
+import threading
 import torch
 import timeit
 from typing import Dict
 from together_worker.fast_inference import FastInferenceInterface
 from together_web3.computer import RequestTypeLanguageModelInference
 from together_web3.together import TogetherWeb3, TogetherClientOptions
-from transformers import AutoTokenizer, AutoConfig
-from torch.nn.utils.rnn import pad_sequence
-from utils.gptj import GPTJ
+from examples.pytorch.capacity import DEFAULT_ANNOUNCE_INTERVAL, start_reannounce, tokens_per_second, update_instance
+from examples.pytorch.ckpt_manifest import VERIFY_MODES, verify_checkpoint_dir
+from examples.pytorch.lifecycle import DEFAULT_DRAIN_TIMEOUT, Drainer
+from examples.pytorch.model_factory import DEFAULT_LIB_DIR, LIB_DIR_ENV, build_model, lib_path, load_tokenizer, read_config
+from examples.pytorch.model_registry import ModelRegistry, checkpoint_bytes, default_gpu_budget, parse_models
+from examples.pytorch.request_buffers import RequestBuffers
+from examples.pytorch.warmup import DEFAULT_SHAPES, install_gemm_config, parse_shapes, run_warmup, warmup_enabled
 import argparse
 import logging
 
@@ -74,6 +83,8 @@ class FastGPTJTInference(FastInferenceInterface):
         self.pipeline_para_size = 1
         self.max_batch_size = args['max_batch_size']
         self.random_seed_tensor = torch.zeros([self.max_batch_size], dtype=torch.int64)
+        # inputs and sampling parameters are written into these once-allocated buffers for every request
+        self.buffers = RequestBuffers(self.max_batch_size, 2048, device=os.environ.get('DEVICE'))
         self.task_info={
             "prompt_seqs": None,
             "output_len":16,
@@ -88,35 +99,130 @@ class FastGPTJTInference(FastInferenceInterface):
             "return_output_length":0,
         }
         
-        hf_config = vars(AutoConfig.from_pretrained(args['hf_model_name']))
-        head_num = hf_config['n_head']   
-        layer_num = hf_config['n_layer']
-        start_id = hf_config['bos_token_id']
-        self.end_id = hf_config['eos_token_id']
-        size_per_head = hf_config['n_embd'] // head_num
-        vocab_size = hf_config['vocab_size']
-        rotary_embedding_dim = hf_config['rotary_dim']
-        max_seq_len = hf_config['n_positions']
-        lib_path = '/workspace/Port_FasterTransformer/build/lib/libth_gptj.so'
-        ckpt_path = args['ckpt_path']
-        self.tokenizer = AutoTokenizer.from_pretrained(args['hf_model_name'])
-        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.verify_ckpt = args.get('verify_ckpt', 'none')
+        self.lib_dir = args.get('lib_dir')
+        self.warmup_shapes = parse_shapes(args.get('warmup_shapes', DEFAULT_SHAPES))
         torch.manual_seed(0)
+
+        # The worker's own model plus the ones in --models, loaded on first request within the GPU budget.
+        self.default_model = model_name
+        models = {model_name: {"hf_model_name": args['hf_model_name'], "ckpt_path": args['ckpt_path']}}
+        models.update(parse_models(args.get('models')))
+        self.model_args = models
+        device = os.environ.get('DEVICE')
+        self.registry = ModelRegistry(
+            gpu_budget_bytes=int(args.get('gpu_memory_budget', 0) * 2**30) or default_gpu_budget(device),
+            host_budget_bytes=int(args.get('host_memory_budget', 0) * 2**30),
+            device=device, stats_path=args.get('registry_stats'))
+        for name, model_args in models.items():
+            self.registry.register(name, functools.partial(self._load_model, **model_args),
+                                   estimate_bytes=checkpoint_bytes(model_args['ckpt_path']))
+        self._select_model(self.default_model)
+        self.drainer = Drainer(self, args.get('drain_timeout', DEFAULT_DRAIN_TIMEOUT))
+        self.swap_file = args.get('swap_file')
+        self.announce_interval = args.get('announce_interval', DEFAULT_ANNOUNCE_INTERVAL)
+        self.tokens_per_second = 0.0
+        logging.debug(f"<FastGPTJInference.__init__> initialization done")
+
+    def warmup(self):
+        if warmup_enabled():
+            result = run_warmup(self._warmup_request, self.default_model, self.warmup_shapes)
+            self.tokens_per_second = tokens_per_second(result)
+
+    def _warmup_request(self, input_len, output_len):
+        self.dispatch_request([{"prompt": " the" * input_len, "max_tokens": output_len}], None)
+
+    def start(self):
+        # the worker joins the coordinator in start(), so it only becomes ready once it is warm
+        with startup.phase("warmup"):
+            self.warmup()
+        startup.report()
+        self.drainer.install_signal_handlers(reload=self.swap_models)
+        start_reannounce(self, loop=self.loop)
+        super().start()
+
+    async def _join_local_coordinator(self):
+        # every join, including the periodic re-announcements, advertises the current capacity and load
+        update_instance(self.coordinator_join_request.instance, self.registry.device,
+                        max_batch_size=self.max_batch_size, tokens_per_second=self.tokens_per_second,
+                        queue_depth=self.drainer.inflight, draining=int(self.drainer.draining),
+                        models=",".join(self.registry.names()))
+        await super()._join_local_coordinator()
+
+    def dispatch_shutdown(self):
+        # finish the queued and running requests before the server loop closes the connection
+        self.drainer.begin("shutdown request")
+
+    async def together_request(self, match_event, raw_event):
+        if self.drainer.draining:
+            await self.drainer.reject(match_event)
+            return
+        with self.drainer.track():
+            await super().together_request(match_event, raw_event)
+
+    async def http_request(self, web_request):
+        if self.drainer.draining:
+            return self.drainer.http_rejection()
+        with self.drainer.track():
+            return await super().http_request(web_request)
+
+    def swap_models(self):
+        """Reloads the models of --swap_file, e.g. {"name": {"ckpt_path": ...}}, from their new checkpoints.
+
+        Each model keeps serving from its current checkpoint until the new one is loaded.
+        """
+        if not self.swap_file:
+            logging.warning("SIGHUP without --swap_file, nothing to swap")
+            return
+        for name, model_args in parse_models(self.swap_file).items():
+            if name not in self.registry:
+                logging.warning(f"Cannot swap unknown model {name}")
+                continue
+            threading.Thread(target=self._swap_model, args=(name, model_args), daemon=True).start()
+
+    def _swap_model(self, name, model_args):
+        model_args = dict(self.model_args[name], **model_args)
+        try:
+            # eviction and switch run on the request executor, so no request uses the models they free
+            self.registry.swap(name, functools.partial(self._load_model, **model_args),
+                               estimate_bytes=checkpoint_bytes(model_args['ckpt_path']),
+                               switch=lambda fn: self.executor.submit(fn).result())
+        except Exception:
+            logging.exception(f"Swapping {name} to {model_args['ckpt_path']} failed, still serving the old model")
+            return
+        self.model_args[name] = model_args
+
+    def _load_model(self, hf_model_name, ckpt_path):
+        verify_checkpoint_dir(ckpt_path, self.verify_ckpt)
+        config = read_config(ckpt_path)
+        # the tokenizer (and transformers) loads while the weights do
+        tokenizer = startup.in_background("load tokenizer", load_tokenizer, ckpt_path, hf_model_name)
         
         # Prepare model.
-        self.gptj_model = GPTJ(head_num, size_per_head, layer_num, vocab_size, rotary_embedding_dim, 
-                start_id, self.end_id, max_seq_len, 1, 1,
-                lib_path=lib_path, weights_data_type='fp32', device_index=os.environ.get('DEVICE'))
-   
-        if not self.gptj_model.load(ckpt_path=ckpt_path, infer_data_type='fp16'):
-            logging.debug("[WARNING] Checkpoint file not found. Model loading is skipped.")
+        if warmup_enabled():
+            install_gemm_config(lib_path("gptj", self.lib_dir), self.max_batch_size, 1,
+                                max(shape[0] for shape in self.warmup_shapes),
+                                config.head_num, config.size_per_head, config.inter_size, config.vocab_size)
+        gptj_model = build_model(ckpt_path, lib_dir=self.lib_dir, device_index=os.environ.get('DEVICE'))
+        # travels with the model (as its end_id does), so a swap installs both with it at once
+        gptj_model.tokenizer = tokenizer.result()
         torch.cuda.empty_cache()
-        logging.debug(f"<FastGPTJInference.__init__> initialization done")
+        return gptj_model
+
+    def _select_model(self, name):
+        self.gptj_model = self.registry.get(name)
+        self.tokenizer = self.gptj_model.tokenizer
+        self.end_id = self.gptj_model.end_id
 
     def dispatch_request(self, args, env) -> Dict:
         logging.debug(f"<FastGPTJInference.dispatch_request> starts")
         args = args[0]
         args = {k: v for k, v in args.items() if v is not None}
+        model = args.get('model', self.default_model)
+        if model not in self.registry:
+            logging.debug(f"Unknown model {model}, serving {self.default_model}")
+            model = self.default_model
+        self._select_model(model)
         # Inputs
         self.task_info["prompt_seqs"] = [str(args['prompt'])]
         self.task_info["output_len"] = get_int(args.get("max_tokens", 16), default=16)
@@ -151,7 +257,6 @@ class FastGPTJTInference(FastInferenceInterface):
             return result
         else:
             result = self._run_inference()
-            torch.cuda.empty_cache()
             logging.debug(f"<FastGPTJInference.dispatch_request> return: {result}")
             return result
 
@@ -160,26 +265,32 @@ class FastGPTJTInference(FastInferenceInterface):
         
         with torch.no_grad():
             contexts = self.task_info["prompt_seqs"]
-            start_ids = [torch.IntTensor(self.tokenizer.encode(c)) for c in contexts]
-            start_lengths = [len(ids) for ids in start_ids]
-            
-            start_ids = pad_sequence(start_ids, batch_first=True, padding_value=self.end_id)
-            start_lengths = torch.IntTensor(start_lengths)
-            logging.debug(f"start_ids: length ({start_ids.shape[0]}) ids: {start_ids}")
+            token_ids = [self.tokenizer.encode(c) for c in contexts]
+            # kept on the host to strip the contexts from the outputs
+            start_lengths = [len(ids) for ids in token_ids]
+            start_ids, device_lengths = self.buffers.inputs(token_ids, self.end_id)
+            logging.debug(f"start_ids: length ({len(token_ids)}) ids: {token_ids}")
             
             time = timeit.default_timer()
-            max_batch_size = self.max_batch_size
             logging.debug(self.task_info)
+            sampling = self.buffers.sampling_params(
+                top_k=self.task_info["top_k"],
+                top_p=self.task_info["top_p"],
+                beam_search_diversity_rate=self.task_info["beam_search_diversity_rate"],
+                temperature=self.task_info["temperature"],
+                len_penalty=self.task_info["len_penalty"],
+                repetition_penalty=self.task_info["repetition_penalty"],
+            )
             tokens_batch = self.gptj_model(start_ids,
-                                    start_lengths,
+                                    device_lengths,
                                     self.task_info["output_len"],
                                     self.task_info["beam_width"],
-                                    self.task_info["top_k"] * torch.ones(size=[max_batch_size], dtype=torch.int32),
-                                    self.task_info["top_p"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["beam_search_diversity_rate"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["temperature"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["len_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                    self.task_info["repetition_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
+                                    sampling["top_k"],
+                                    sampling["top_p"],
+                                    sampling["beam_search_diversity_rate"],
+                                    sampling["temperature"],
+                                    sampling["len_penalty"],
+                                    sampling["repetition_penalty"],
                                     self.random_seed_tensor)
             # only a thread (rank 0) gets the output, while the others are supposed to return None.
             time_elapsed = timeit.default_timer() - time
@@ -222,14 +333,39 @@ if __name__ == "__main__":
     parser.add_argument('--together_model_name', type=str, default=os.environ.get('SERVICE', 'Together-gpt-JT-6B-v1'),
                         help='worker name for together coordinator.')
     parser.add_argument('--hf_model_name', type=str, default='togethercomputer/GPT-JT-6B-v1',
-                        help='hugging face model name (used to load config).')
+                        help='hugging face model name (used to load the tokenizer when the checkpoint has none).')
     parser.add_argument('--ckpt_path', type=str, default='/workspace/Port_FasterTransformer/build/model/GPT-JT-6B-v1-tp1',
                         help='path to the checkpoint file.')
+    parser.add_argument('--lib_dir', type=str, default=os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR),
+                        help='directory with the FasterTransformer op libraries.')
+    parser.add_argument('--verify_ckpt', type=str, default=os.environ.get('VERIFY_CKPT', 'none'), choices=VERIFY_MODES,
+                        help='check the checkpoint against its manifest.json before loading: none, size or full.')
+    parser.add_argument('--models', type=str, default=os.environ.get('MODELS'),
+                        help='JSON (or a JSON file) of additional models served on request, '
+                             'e.g. {"name": {"hf_model_name": ..., "ckpt_path": ...}}.')
+    parser.add_argument('--gpu_memory_budget', type=float, default=float(os.environ.get('GPU_MEMORY_BUDGET', 0)),
+                        help='GiB of GPU memory for model weights; 0 uses 80%% of the device.')
+    parser.add_argument('--host_memory_budget', type=float, default=float(os.environ.get('HOST_MEMORY_BUDGET', 0)),
+                        help='GiB of host memory for models evicted from the GPU; 0 drops them.')
+    parser.add_argument('--registry_stats', type=str, default=os.environ.get('REGISTRY_STATS'),
+                        help='JSON file updated with the residency and load/evict latency of the models.')
+    parser.add_argument('--warmup_shapes', type=str, default=os.environ.get('WARMUP_SHAPES', DEFAULT_SHAPES),
+                        help='input_len:output_len pairs run before joining the coordinator (WARMUP=0 skips warmup).')
+    parser.add_argument('--drain_timeout', type=float, default=float(os.environ.get('DRAIN_TIMEOUT', DEFAULT_DRAIN_TIMEOUT)),
+                        help='seconds to finish accepted requests on SIGTERM or a shutdown request before exiting.')
+    parser.add_argument('--swap_file', type=str, default=os.environ.get('SWAP_FILE'),
+                        help='JSON (or a JSON file) of new checkpoints, e.g. {"name": {"ckpt_path": ...}}, '
+                             'loaded next to the serving models on SIGHUP and switched to once ready.')
+    parser.add_argument('--announce_interval', type=float,
+                        default=float(os.environ.get('ANNOUNCE_INTERVAL', DEFAULT_ANNOUNCE_INTERVAL)),
+                        help='seconds between re-joins advertising free memory, throughput and queue depth; 0 disables.')
     parser.add_argument('--worker_name', type=str, default=os.environ.get('WORKER','worker1'),
                         help='worker name for together coordinator.')
     parser.add_argument('--group_name', type=str, default=os.environ.get('GROUP', 'group1'),
                         help='group name for together coordinator.')
     
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print an import and initialization timeline once the worker is ready.')
     
     args = parser.parse_args()
     
@@ -247,6 +383,16 @@ if __name__ == "__main__":
         "coordinator": coordinator,
         "hf_model_name": args.hf_model_name,
         "ckpt_path":args.ckpt_path,
+        "lib_dir": args.lib_dir,
+        "verify_ckpt": args.verify_ckpt,
+        "models": args.models,
+        "gpu_memory_budget": args.gpu_memory_budget,
+        "host_memory_budget": args.host_memory_budget,
+        "registry_stats": args.registry_stats,
+        "warmup_shapes": args.warmup_shapes,
+        "drain_timeout": args.drain_timeout,
+        "swap_file": args.swap_file,
+        "announce_interval": args.announce_interval,
         "worker_name": args.worker_name,
         "group_name": args.group_name,
         "tensor_para_size":1,
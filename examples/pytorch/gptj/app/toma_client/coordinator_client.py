@@ -1,12 +1,10 @@
 import os
 import json
 import requests
-import boto3
-import os
 from uuid import uuid4
-from botocore.exceptions import ClientError
 from loguru import logger
-import netifaces as ni
+# boto3 and netifaces are imported by the methods that use them, so that a worker does not
+# pay for them at startup
 
 
 class LocalCoordinatorClient:
@@ -39,6 +37,7 @@ class LocalCoordinatorClient:
         os.remove(input_path)
 
     def notify_inference_join(self, job_id, netname='access'):
+        import netifaces as ni
         ip = ni.ifaddresses(netname)[ni.AF_INET][0]['addr']
         return requests.post(self.coordinator_url+f"/rank/"+str(job_id), json={"ip": ip}).json()
 
@@ -51,6 +50,8 @@ class LocalCoordinatorClient:
     def upload_file(self, filename, object_name=None):
         if object_name is None:
             object_name = str(uuid4())+".png"
+        import boto3
+        from botocore.exceptions import ClientError
         s3_client = boto3.client('s3')
         try:
             response = s3_client.upload_file(filename, 'toma-all', object_name)
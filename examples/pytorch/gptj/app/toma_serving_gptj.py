@@ -1,15 +1,18 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch import startup
+startup.begin()
 import argparse
 import time
 from toma_client.coordinator_client import LocalCoordinatorClient
 import traceback
 from loguru import logger
-from transformers import AutoTokenizer, AutoConfig
 import math
 import numpy as np
 import random
 import torch
-import os
-from utils.gptj import GPTJ
+from examples.pytorch.model_factory import DEFAULT_LIB_DIR, LIB_DIR_ENV, build_model, load_tokenizer, read_config
 from torch.nn.utils.rnn import pad_sequence
 import timeit
 
@@ -47,9 +50,13 @@ def main():
     parser.add_argument('--together_model_name', type=str, default='Together-gpt-JT-6B-v1',
                         help='worker name for together coordinator.')
     parser.add_argument('--hf_model_name', type=str, default='togethercomputer/GPT-JT-6B-v1',
-                        help='hugging face model name (used to load config).')
+                        help='hugging face model name (used to load the tokenizer when the checkpoint has none).')
     parser.add_argument('--ckpt_path', type=str, default='/workspace/Port_FasterTransformer/build/model/GPT-JT-6B-v1-tp1/1-gpu',
                         help='path to the checkpoint file.')
+    parser.add_argument('--lib_dir', type=str, default=os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR),
+                        help='directory with the FasterTransformer op libraries.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print an import and initialization timeline once the worker is ready.')
     args = parser.parse_args()
     print("\n=============== Arguments ===============")
     print(args)
@@ -76,29 +83,17 @@ def main():
             "return_output_length":0,
         }
         
-        hf_config = vars(AutoConfig.from_pretrained(args.hf_model_name))
-        head_num = hf_config['n_head']   
-        layer_num = hf_config['n_layer']
-        start_id = hf_config['bos_token_id']
-        end_id = hf_config['eos_token_id']
-        size_per_head = hf_config['n_embd'] // head_num
-        vocab_size = hf_config['vocab_size']
-        rotary_embedding_dim = hf_config['rotary_dim']
-        max_seq_len = hf_config['n_positions']
-        lib_path = '/workspace/Port_FasterTransformer/build/lib/libth_gptj.so'
         ckpt_path = args.ckpt_path
-        tokenizer = AutoTokenizer.from_pretrained(args.hf_model_name)
-        tokenizer.pad_token = tokenizer.eos_token
+        end_id = read_config(ckpt_path).end_id
+        tokenizer = startup.in_background("load tokenizer", load_tokenizer, ckpt_path, args.hf_model_name)
         torch.manual_seed(0)
         
         # Prepare model.
-        gptj_model = GPTJ(head_num, size_per_head, layer_num, vocab_size, rotary_embedding_dim, 
-                          start_id, end_id, max_seq_len, 1, 1, lib_path=lib_path, weights_data_type='fp32')
-   
-        if not gptj_model.load(ckpt_path=ckpt_path, infer_data_type='fp16'):
-            print("[WARNING] Checkpoint file not found. Model loading is skipped.")
+        gptj_model = build_model(ckpt_path, lib_dir=args.lib_dir)
+        tokenizer = tokenizer.result()
         torch.cuda.empty_cache()
         print(f"<FastGPTJInference.__init__> initialization done")
+        startup.report()
         
     except Exception as e:
         print('Exception in model initialization inference:', e)
@@ -6,6 +6,10 @@ import torch.nn as nn
 import numpy as np
 import torch.distributed as dist
 import time
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../../.."))
+from examples.pytorch.shared_weights import load_weight, release as release_shared_weights
 
 def _profiling_torch_tensor_memory():
     total_size = 0
@@ -123,50 +127,50 @@ class GPTJWeights(object):
         def is_load(i):
             return self.layers_per_device * pipeline_para_rank <= i < self.layers_per_device * (pipeline_para_rank + 1)
 
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.input_layernorm.weight.bin".format(i),
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.input_layernorm.weight.bin".format(i),
                                                dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.input_layernorm.bias.bin".format(i),
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.input_layernorm.bias.bin".format(i),
                                                dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.attention.query_key_value.weight.{}.bin"
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.attention.query_key_value.weight.{}.bin"
                                                .format(i, tensor_para_rank), dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
         # GPT-J has no bias for query key and value. 
         w.extend([torch.zeros(self.local_hidden_units * 3).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.attention.dense.weight.{}.bin"
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.attention.dense.weight.{}.bin"
                                                .format(i, tensor_para_rank), dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.mlp.dense_h_to_4h.weight.{}.bin"
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.mlp.dense_h_to_4h.weight.{}.bin"
                                                .format(i, tensor_para_rank), dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.mlp.dense_h_to_4h.bias.{}.bin"
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.mlp.dense_h_to_4h.bias.{}.bin"
                                                .format(i, tensor_para_rank), dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.mlp.dense_4h_to_h.weight.{}.bin"
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.mlp.dense_4h_to_h.weight.{}.bin"
                                                .format(i, tensor_para_rank), dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
-        w.extend([torch.from_numpy(np.fromfile(ckpt_path + "/model.layers.{}.mlp.dense_4h_to_h.bias.bin"
+        w.extend([torch.from_numpy(load_weight(ckpt_path + "/model.layers.{}.mlp.dense_4h_to_h.bias.bin"
                                                .format(i), dtype=self.weights_data_type))
                   if is_load(i) else torch.empty(0).to(type_map[self.weights_data_type])
                   for i in range(self.layer_num)])
 
-        w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.wte.bin",
+        w.append(torch.from_numpy(load_weight(ckpt_path + "/model.wte.bin",
                                               dtype=self.weights_data_type)))
-        w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.final_layernorm.weight.bin",
+        w.append(torch.from_numpy(load_weight(ckpt_path + "/model.final_layernorm.weight.bin",
                                               dtype=self.weights_data_type)))
-        w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.final_layernorm.bias.bin",
+        w.append(torch.from_numpy(load_weight(ckpt_path + "/model.final_layernorm.bias.bin",
                                               dtype=self.weights_data_type)))
-        w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.lm_head.weight.bin", dtype=self.weights_data_type)))
-        w.append(torch.from_numpy(np.fromfile(ckpt_path + "/model.lm_head.bias.bin", dtype=self.weights_data_type)))
+        w.append(torch.from_numpy(load_weight(ckpt_path + "/model.lm_head.weight.bin", dtype=self.weights_data_type)))
+        w.append(torch.from_numpy(load_weight(ckpt_path + "/model.lm_head.bias.bin", dtype=self.weights_data_type)))
 
         # Reshape
         try:
@@ -279,6 +283,8 @@ class GPTJ(nn.Module):
         
         print("<GPTJ>:load: call self.cuda()")
         self.cuda()
+        # the weights are on the device; drop this worker's reference to the staged host copy
+        release_shared_weights(ckpt_path)
         end_time = time.time()
         print(f"<GPTJ>:load: load weight ends. Loading takes {end_time - start_time} seconds.")
         _profiling_torch_tensor_memory()
@@ -1,5 +1,7 @@
 from argparse import ArgumentParser
 from os import makedirs
+import os
+import sys
 import numpy as np
 from pathlib import Path
 
@@ -7,6 +9,10 @@ import torch
 import configparser
 from transformers import PretrainedConfig
 
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../../../..")
+from examples.pytorch.ckpt_manifest import save_weight, write_manifest
+
 torch.set_printoptions(linewidth=130, sci_mode=False)
 np.set_printoptions(linewidth=130, suppress=True)
 
@@ -16,7 +22,7 @@ np.set_printoptions(linewidth=130, suppress=True)
 def savebin(param, save_path):
     if isinstance(param, torch.Tensor):
         param = param.cpu().float().numpy()
-    np.squeeze(param).astype(np.float32).tofile(save_path + ".bin")
+    save_weight(np.squeeze(param).astype(np.float32), save_path + ".bin")
 
 def param2file(pt_param, layer_id, save_dir, dest_key):
     base_n = save_dir + "/model.layers." + str(layer_id) + "."
@@ -150,5 +156,6 @@ if __name__ == "__main__":
     savebin(checkpoint['transformer.ln_f.bias'], output_dir + "/model.final_layernorm.bias")
     savebin(checkpoint['lm_head.weight'], output_dir + "/model.lm_head.weight")
     savebin(checkpoint['lm_head.bias'], output_dir + "/model.lm_head.bias")
+    write_manifest(output_dir)
 
     print("done")
@@ -1,14 +1,18 @@
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch import startup
+startup.begin()
 import torch
 import timeit
 from typing import Dict
 from utils.fast_inference import FastInferenceInterface 
 from together_web3.computer import RequestTypeLanguageModelInference
 from together_web3.together import TogetherWeb3, TogetherClientOptions
-from transformers import AutoTokenizer, AutoConfig
+from examples.pytorch.ckpt_manifest import VERIFY_MODES, verify_checkpoint_dir
+from examples.pytorch.model_factory import DEFAULT_LIB_DIR, LIB_DIR_ENV, build_model, lib_path, load_tokenizer, read_config
+from examples.pytorch.warmup import DEFAULT_SHAPES, install_gemm_config, parse_shapes, run_warmup, warmup_enabled
 from torch.nn.utils.rnn import pad_sequence
-from utils.gptneox import GPTNeox
 import argparse
 import torch.distributed as dist
 from utils.text_utils import *
@@ -54,35 +58,48 @@ class FastGPTNeoxTPInference(FastInferenceInterface):
             "return_cum_log_probs": 0,
             "return_output_length":0,
         }
+        self.model_name = model_name
+        self.warmup_shapes = parse_shapes(args.get('warmup_shapes', DEFAULT_SHAPES))
         
-        hf_config = vars(AutoConfig.from_pretrained(args['hf_model_name']))
-        head_num = hf_config['num_attention_heads']
-        layer_num = hf_config['num_hidden_layers']
-        start_id = hf_config['bos_token_id']
-        self.end_id = hf_config['eos_token_id']
-        size_per_head = hf_config['hidden_size'] // head_num
-        vocab_size = hf_config['vocab_size']
-        rotary_embedding_dim = 24
-        max_seq_len = hf_config['max_position_embeddings']
-        lib_path ='/workspace/Port_FasterTransformer/build/lib/libth_gptneox.so'
         ckpt_path = args['ckpt_path']
-        self.tokenizer = AutoTokenizer.from_pretrained(args['hf_model_name'])
-        self.tokenizer.pad_token = self.tokenizer.eos_token
-        use_gptj_residual = args['use_gptj_residual']
-        weights_data_type = args['weights_data_type']
+        verify_checkpoint_dir(ckpt_path, args.get('verify_ckpt', 'none'), tensor_para_rank=dist.get_rank())
+        config = read_config(ckpt_path)
+        self.end_id = config.end_id
+        tokenizer = startup.in_background("load tokenizer", load_tokenizer, ckpt_path, args['hf_model_name'])
         infer_data_type = args['infer_data_type']
         torch.manual_seed(0)
         
         # Prepare model.
-        self.gptneox_model = GPTNeox(head_num, size_per_head, layer_num, vocab_size, rotary_embedding_dim, 
-            start_id, self.end_id, max_seq_len, self.tensor_para_size, self.pipeline_para_size, use_gptj_residual,
-            lib_path=lib_path, weights_data_type=weights_data_type, inference_data_type=infer_data_type)
-        
-        if not self.gptneox_model.load(ckpt_path=ckpt_path, infer_data_type=infer_data_type):
-            print("[WARNING] Checkpoint file not found. Model loading is skipped.")
+        if warmup_enabled():
+            # every rank merges the config before building its op; the first one generates it
+            install_gemm_config(lib_path("gptneox", args.get('lib_dir')), self.max_batch_size, 1,
+                                max(shape[0] for shape in self.warmup_shapes), config.head_num,
+                                config.size_per_head, config.inter_size, config.vocab_size,
+                                data_type=infer_data_type, tensor_para_size=self.tensor_para_size)
+        self.gptneox_model = build_model(ckpt_path, self.tensor_para_size, self.pipeline_para_size,
+                                         lib_dir=args.get('lib_dir'), infer_data_type=infer_data_type,
+                                         use_gptj_residual=args['use_gptj_residual'],
+                                         weight_data_type=args['weights_data_type'])
+        self.tokenizer = tokenizer.result()
         torch.cuda.empty_cache()
         print(f"<FastGPTNeoxTPInference.__init__> rank {dist.get_rank()} initialization done")
 
+    def warmup(self):
+        if warmup_enabled():
+            run_warmup(self._warmup_request, self.model_name, self.warmup_shapes)
+
+    def _warmup_request(self, input_len, output_len):
+        self.dispatch_request([{"prompt": " the" * input_len, "max_tokens": output_len}], None)
+
+    def start(self):
+        # rank 0 sends the warmup requests before it joins the coordinator; the other ranks run them
+        # from their worker() loop, in step with rank 0 as for real requests
+        if dist.get_rank() == 0:
+            with startup.phase("warmup"):
+                self.warmup()
+        startup.report()
+        super().start()
+
     def _sync_task_info(self):
         print(f"<FastGPTNeoxTPInference._sync_task_info> enter rank-<{dist.get_rank()}>")
         dist.barrier()
@@ -209,9 +226,13 @@ if __name__ == "__main__":
     parser.add_argument('--together_model_name', type=str, default='Together-gpt-neox-20b-tp2',
                         help='worker name for together coordinator.')
     parser.add_argument('--hf_model_name', type=str, default='EleutherAI/gpt-neox-20b',
-                        help='hugging face model name (used to load config).')
+                        help='hugging face model name (used to load the tokenizer when the checkpoint has none).')
     parser.add_argument('--ckpt_path', type=str, default='/workspace/Port_FasterTransformer/build/model/gpt-neox-20b-tp2/2-gpu',
                         help='path to the checkpoint file.')
+    parser.add_argument('--lib_dir', type=str, default=os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR),
+                        help='directory with the FasterTransformer op libraries.')
+    parser.add_argument('--verify_ckpt', type=str, default=os.environ.get('VERIFY_CKPT', 'none'), choices=VERIFY_MODES,
+                        help='check the checkpoint against its manifest.json before loading: none, size or full.')
     parser.add_argument('--worker_name', type=str, default='worker1',
                         help='worker name for together coordinator.')
     parser.add_argument('--group_name', type=str, default='group1',
@@ -226,6 +247,10 @@ if __name__ == "__main__":
                         help='infer_data_type. [fp16, fp32]')
     parser.add_argument('--use_gptj_residual', action='store_true', 
                         help='whether or not to use_gptj_residual.')
+    parser.add_argument('--warmup_shapes', type=str, default=os.environ.get('WARMUP_SHAPES', DEFAULT_SHAPES),
+                        help='input_len:output_len pairs run before joining the coordinator (WARMUP=0 skips warmup).')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print an import and initialization timeline once the worker is ready.')
     args = parser.parse_args()
     coord_url = os.environ.get("COORD_URL", "127.0.0.1")
     
@@ -238,12 +263,15 @@ if __name__ == "__main__":
         "coordinator": coordinator,
         "hf_model_name": args.hf_model_name,
         "ckpt_path":args.ckpt_path,
+        "lib_dir": args.lib_dir,
+        "verify_ckpt": args.verify_ckpt,
         "worker_name": args.worker_name,
         "group_name": args.group_name,
         "tensor_para_size":args.tensor_para_size,
         "max_batch_size":1,
         "use_gptj_residual": True, # args.use_gptj_residual
         "weights_data_type": args.weights_data_type,
-        "infer_data_type": args.infer_data_type
+        "infer_data_type": args.infer_data_type,
+        "warmup_shapes": args.warmup_shapes
     })
     fip.start()
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
 import asyncio
 import fcntl
@@ -9,14 +9,12 @@ import multiprocessing
 import os
 import platform
 import socket
+import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
 from enum import Enum
 
-import netifaces
-from aiohttp import web
-from dacite import from_dict
 from together_web3.computer import (
     Instance,
     MatchEvent,
@@ -28,6 +26,14 @@ from together_web3.computer import (
 )
 from together_web3.coordinator import Join, JoinEnvelope
 from together_web3.together import TogetherWeb3
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../../.."))
+from examples.pytorch.capacity import DEFAULT_ANNOUNCE_INTERVAL, start_reannounce, update_instance
+from examples.pytorch.gpt.common.together_web3.rpc import AsyncJsonRpcClient
+
+# netifaces, aiohttp and dacite are only needed once the worker serves, so they are imported on
+# first use and not by every app that imports this module
+if TYPE_CHECKING:
+    from aiohttp import web
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +47,7 @@ def get_host_ip():
 
 
 def get_non_loopback_ipv4_addresses():
+    import netifaces
     addresses = []
     for interface in netifaces.interfaces():
         if netifaces.AF_INET in netifaces.ifaddresses(interface):
@@ -128,6 +135,10 @@ class FastInferenceInterface:
     def worker(self):
         pass
 
+    def capacity_tags(self) -> Dict[str, Any]:
+        """Extra tags advertised in every join; override to add the worker's own state."""
+        return {}
+
     def __init__(self, model_name: str, args: Dict[str, Any] = {}):
         args['model_name'] = model_name
         self.service_domain = args.get("service_domain", ServiceDomain.together)
@@ -149,6 +160,12 @@ class FastInferenceInterface:
         self.stream_token_pipe_w: int = -1
         self.stream_token_pipe_task: Optional[asyncio.Task[None]] = None
         self.served = 0
+        # requests accepted and not answered yet, advertised as the queue depth
+        self.pending = 0
+        self.max_batch_size = args.get("max_batch_size", 1)
+        self.tokens_per_second = 0.0
+        self.announce_interval = args.get("announce_interval", DEFAULT_ANNOUNCE_INTERVAL)
+        self.coordinator_rpc: Optional[AsyncJsonRpcClient] = None
 
     def start(self):
         if self.rank == 0:
@@ -170,6 +187,7 @@ class FastInferenceInterface:
             self.worker()
 
     async def _run_http_server(self) -> None:
+        from aiohttp import web
         logger.info("Start _run_http_server %s:%d", self.http_host, self.http_port)
         app = web.Application()
         app.add_routes([web.post('/', self.http_request)])
@@ -188,6 +206,8 @@ class FastInferenceInterface:
         self.coordinator._on_connect.append(self._join_local_coordinator)
         self.coordinator._on_match_event.append(self.together_request)
         self.coordinator.subscribe_events("coordinator")
+        # a no-op if the app started it already
+        start_reannounce(self)
         logger.info("Start _run_together_server")
         try:
             while not self.shutdown:
@@ -198,26 +218,35 @@ class FastInferenceInterface:
 
     async def _join_local_coordinator(self):
         try:
-            args = self.coordinator.coordinator.join(
-                asdict(
-                    JoinEnvelope(
-                        join=self.coordinator_join_request,
-                        signature=None)),
-                await self.coordinator.get_subscription_id()
-            )
+            # every join, including the periodic re-announcements, advertises the current capacity and load
+            update_instance(self.coordinator_join_request.instance, gpu_num=self.workers,
+                            max_batch_size=self.max_batch_size, tokens_per_second=self.tokens_per_second,
+                            queue_depth=self.pending, **self.capacity_tags())
+            if self.coordinator_rpc is None:
+                # not the synchronous web3 module: the join repeats while this loop serves requests
+                self.coordinator_rpc = AsyncJsonRpcClient(self.coordinator.http_url)
+            args = await self.coordinator_rpc.call("coordinator_join", [
+                asdict(JoinEnvelope(join=self.coordinator_join_request, signature=None)),
+                await self.coordinator.get_subscription_id(),
+            ])
             logger.info('_join_local_coordinator: %s', args)
 
         except Exception as e:
             logger.exception(f'_join_local_coordinator failed: {e}')
 
-    async def http_request(self, web_request: web.Request) -> web.Response:
+    async def http_request(self, web_request: "web.Request") -> "web.Response":
+        from aiohttp import web
         wrapped_request = False
         request_json = await web_request.json()
         if not isinstance(request_json, list):
             request_json = [request_json]
             wrapped_request = True
         self.request_json = request_json
-        response_json = await self.loop.run_in_executor(self.executor, self.dispatch_request, request_json, None)
+        self.pending += 1
+        try:
+            response_json = await self.loop.run_in_executor(self.executor, self.dispatch_request, request_json, None)
+        finally:
+            self.pending -= 1
         response_json = response_json if isinstance(response_json, list) else [response_json]
         self.request_json = []
         self.served += 1
@@ -240,7 +269,12 @@ class FastInferenceInterface:
         self.request_json = [event["match"]["service_bid"]["job"] for event in raw_event]
         if self.request_json[0].get("request_type") == RequestTypeShutdown:
             self.dispatch_shutdown()
-        response_json = await self.loop.run_in_executor(self.executor, self.dispatch_request, self.request_json, match_event)
+        self.pending += 1
+        try:
+            response_json = await self.loop.run_in_executor(
+                self.executor, self.dispatch_request, self.request_json, match_event)
+        finally:
+            self.pending -= 1
         response_json = response_json if isinstance(response_json, list) else [response_json]
         self.request_json = []
         self.match_event = []
@@ -248,6 +282,7 @@ class FastInferenceInterface:
         await asyncio.gather(*[self.send_result_back(match_event[i], response_json[i]) for i in range(len(response_json))])
 
     async def send_result_back(self, match_event: MatchEvent, result_data: Dict[str, Any], partial: bool = False) -> None:
+        from dacite import from_dict
         try:
             # logger.info(f"send_result_back {result_data}")
             result = {
@@ -326,6 +361,9 @@ class FastInferenceInterface:
         logger.info("Shutting down")
         if self.coordinator:
             await self.coordinator.close()
+        if self.coordinator_rpc is not None:
+            await self.coordinator_rpc.close()
+            self.coordinator_rpc = None
         if self.stream_token_pipe_task:
             self.stream_token_pipe_task.cancel()
             await self.stream_token_pipe_task
@@ -22,6 +22,9 @@ import torch
 import os
 import sys
 from transformers import GPTNeoXForCausalLM # 4.21.1
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../../../../..")
+from examples.pytorch.ckpt_manifest import save_weight, write_manifest
 
 def get_weight_data_type(data_type):
     if data_type == "fp32":
@@ -57,7 +60,7 @@ def prefix_prompt_convert(args, config, weight_data_type):
         weights_split = torch.split(weights, local_head_num, dim=2)
         for i in range(args.infer_gpu_num):
             output_file_path = saved_dir + "/model.prefix_prompt." + task_name + ".weight." + str(i) + ".bin"
-            weights_split[i].detach().cpu().numpy().astype(weight_data_type).tofile(output_file_path)
+            save_weight(weights_split[i].detach().cpu().numpy().astype(weight_data_type), output_file_path)
         
     return task_list
 
@@ -73,14 +76,14 @@ def split_and_convert_process(i, saved_dir,factor,key,args,config,val):
         # shared weights, only need to convert the weights of rank 0
         if i == 0:
             saved_path = saved_dir + "/model." + key + ".bin"
-            val.tofile(saved_path)
+            save_weight(val, saved_path)
 
     elif key.find("attention.dense.weight") != -1 or key.find("mlp.dense_4h_to_h.weight") != -1:
         split_vals = np.split(val, factor, axis=0)
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
             try:
-                split_vals[j].tofile(saved_path)
+                save_weight(split_vals[j], saved_path)
             except:
                 print(f"Fail to save: {saved_dir + '/model.' + key + '.%d.bin' % (i * factor + j)}")
 
@@ -89,7 +92,7 @@ def split_and_convert_process(i, saved_dir,factor,key,args,config,val):
         split_vals = np.split(val, factor, axis=-1)
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     elif key.find("attention.query_key_value.bias") != -1:
         local_dim = (int)(val.shape[-1] / 3)
@@ -101,7 +104,7 @@ def split_and_convert_process(i, saved_dir,factor,key,args,config,val):
 
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     elif key.find("attention.query_key_value.weight") != -1:
         hidden_dim = val.shape[0]
@@ -117,7 +120,7 @@ def split_and_convert_process(i, saved_dir,factor,key,args,config,val):
 
         for j in range(factor):
             saved_path = saved_dir + "/model." + key + ".%d.bin" % (i * factor + j)
-            split_vals[j].tofile(saved_path)
+            save_weight(split_vals[j], saved_path)
 
     else:
         print("[ERROR] cannot find key '{}'".format(key))
@@ -227,18 +230,18 @@ def split_and_convert(args):
         if name == 'gpt_neox.embed_in.weight':
             try:
                 print(f"Save: {name}")
-                param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.wte.bin")
+                save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.wte.bin")
             except:
                 print(f"Fail to save {saved_dir + 'model.wte.bin'}.")
         elif name == 'gpt_neox.final_layer_norm.bias':
             print(f"Save: {name}")
-            param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.final_layernorm.bias.bin")
+            save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.final_layernorm.bias.bin")
         elif name == 'gpt_neox.final_layer_norm.weight':
             print(f"Save: {name}")
-            param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.final_layernorm.weight.bin")
+            save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.final_layernorm.weight.bin")
         elif name == 'embed_out.weight':
             print(f"Save: {name}")
-            param.detach().cpu().numpy().astype(np_weight_data_type).tofile(saved_dir + "model.lm_head.weight.bin")
+            save_weight(param.detach().cpu().numpy().astype(np_weight_data_type), saved_dir + "model.lm_head.weight.bin")
         else:
             # for i in range(len(huggingface_model_name_pattern)):
             #    if name.find(huggingface_model_name_pattern[i]) != -1:
@@ -259,8 +262,9 @@ def split_and_convert(args):
             attn_bias = np.fromfile(saved_dir + f"/model.layers.{layer_idx}.attention.dense.bias.bin", dtype=np_weight_data_type)
             mlp_bias =  np.fromfile(saved_dir + f"/model.layers.{layer_idx}.mlp.dense_4h_to_h.bias.bin", dtype=np_weight_data_type)
 
-            (attn_bias + mlp_bias).tofile(saved_dir + f"/model.layers.{layer_idx}.mlp.attention.bias.sum.bin")
-            
+            save_weight(attn_bias + mlp_bias, saved_dir + f"/model.layers.{layer_idx}.mlp.attention.bias.sum.bin")
+
+    write_manifest(saved_dir)
 
 """
 def compute_gpt_j_residual(saved_dir):
@@ -268,7 +272,7 @@ def compute_gpt_j_residual(saved_dir):
         attn_bias = np.fromfile(saved_dir + f"/model.layers.{layer_idx}.attention.dense.bias.bin", dtype=np.float16)
         mlp_bias =  np.fromfile(saved_dir + f"/model.layers.{layer_idx}.mlp.dense_4h_to_h.bias.bin", dtype=np.float16)
 
-        (attn_bias + mlp_bias).tofile(saved_dir + f"/model.layers.{layer_idx}.mlp.attention.bias.sum.bin")
+        save_weight(attn_bias + mlp_bias, saved_dir + f"/model.layers.{layer_idx}.mlp.attention.bias.sum.bin")
 """
 
 
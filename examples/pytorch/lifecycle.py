@@ -0,0 +1,114 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Graceful drain of a serving worker (a FastInferenceInterface) before it exits.
+
+`dispatch_shutdown` used to set `shutdown`, after which the server loop closed the coordinator
+connection and dropped whatever requests were queued or running. A `Drainer` instead:
+
+- counts the requests the worker has accepted and not answered yet (`track()`);
+- on `begin()` (SIGTERM/SIGINT or a shutdown request) answers every new match with a 503
+  result instead of queueing it, waits for the accepted requests to finish, up to a timeout,
+  and only then sets `shutdown` and stops the event loop. A second signal stops it immediately.
+
+SIGHUP is left to the worker, which uses it to swap models to new checkpoints in the background.
+"""
+import asyncio
+import contextlib
+import logging
+import signal
+import threading
+import time
+import typing
+
+from together_web3.computer import RequestTypeLanguageModelInference
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DRAIN_TIMEOUT = 300.0
+# the server loops check `shutdown` every second before closing the coordinator connection
+_SHUTDOWN_POLL_SECONDS = 2.0
+
+
+class Drainer:
+
+    def __init__(self, service, timeout: float = DEFAULT_DRAIN_TIMEOUT):
+        self.service = service
+        self.timeout = timeout
+        self.draining = False
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self):
+        """Counts a request as in flight until it is answered."""
+        with self._lock:
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def begin(self, reason: str = ""):
+        """Starts draining; may be called from any thread."""
+        if self.draining:
+            return
+        self.draining = True
+        LOGGER.info("Draining%s: %d requests in flight, timeout %.0f s",
+                    f" ({reason})" if reason else "", self.inflight, self.timeout)
+        loop = self.service.loop
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._drain(), loop=loop))
+
+    def on_signal(self, name: str):
+        if self.draining:
+            LOGGER.warning("%s while draining, stopping with %d requests in flight", name, self.inflight)
+            self.service.shutdown = True
+            self.service.loop.stop()
+            return
+        self.begin(name)
+
+    def install_signal_handlers(self, reload: typing.Optional[typing.Callable[[], None]] = None):
+        """Drains on SIGTERM/SIGINT and calls `reload` on SIGHUP."""
+        loop = self.service.loop
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.on_signal, sig.name)
+        if reload is not None:
+            loop.add_signal_handler(signal.SIGHUP, reload)
+
+    async def _drain(self):
+        start = time.monotonic()
+        while self.inflight and time.monotonic() - start < self.timeout:
+            await asyncio.sleep(0.1)
+        if self.inflight:
+            LOGGER.warning("Drain timed out after %.0f s with %d requests in flight", self.timeout, self.inflight)
+        else:
+            LOGGER.info("Drained in %.1f s", time.monotonic() - start)
+        self.service.shutdown = True
+        await asyncio.sleep(_SHUTDOWN_POLL_SECONDS)
+        self.service.loop.stop()
+
+    async def reject(self, match_event):
+        """Answers matches that arrive while draining, so that their clients can retry elsewhere."""
+        match_event = match_event if isinstance(match_event, list) else [match_event]
+        result = {
+            "result_type": RequestTypeLanguageModelInference,
+            "status": 503,
+            "error": "worker is draining",
+            "choices": [],
+        }
+        await asyncio.gather(*[self.service.send_result_back(event, result) for event in match_event])
+
+    def http_rejection(self):
+        from aiohttp import web
+        return web.json_response({"error": "worker is draining"}, status=503)
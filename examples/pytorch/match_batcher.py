@@ -0,0 +1,102 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batching of coordinator match events for workers that run several prompts per model call.
+
+The coordinator delivers one match event at a time, so `together_request` used to run the
+model on a single prompt. `MatchBatcher` queues the events instead and passes them in batches
+of up to `max_batch_size` to the worker's handler, typically `FastInferenceInterface.together_request`,
+which takes lists of events and sends the i-th result of `dispatch_request` back to the i-th match.
+A batch is closed `window` seconds after its first event or when it is full. Batches run one after
+the other, so events arriving while one runs are collected into the next.
+
+Jobs of the `alone_request_types` (e.g. shutdown) run in a batch of their own: the handler only
+looks at the request type of the first event of a batch.
+"""
+import asyncio
+import logging
+import typing
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BATCH_WINDOW = 0.005
+
+
+class MatchBatcher:
+
+    def __init__(self,
+                 handler: typing.Callable[[typing.List[typing.Any], typing.List[typing.Any]], typing.Awaitable[None]],
+                 max_batch_size: int, window: float = DEFAULT_BATCH_WINDOW,
+                 alone_request_types: typing.Collection[str] = ()):
+        self.handler = handler
+        self.max_batch_size = max(max_batch_size, 1)
+        self.window = window
+        self.alone_request_types = frozenset(alone_request_types)
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._consumer: typing.Optional[asyncio.Future] = None
+        # an event that runs alone, taken from the queue while collecting the batch before it
+        self._held: typing.Optional[typing.Tuple[typing.Any, typing.Any]] = None
+
+    async def submit(self, match_event, raw_event):
+        """Queues one event (or a list of them) and returns without waiting for its result."""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._consumer = asyncio.ensure_future(self._consume())
+        match_events = match_event if isinstance(match_event, list) else [match_event]
+        raw_events = raw_event if isinstance(raw_event, list) else [raw_event]
+        for event in zip(match_events, raw_events):
+            self._queue.put_nowait(event)
+
+    def queue_depth(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + (self._held is not None)
+
+    def _runs_alone(self, event) -> bool:
+        _, raw_event = event
+        return raw_event["match"]["service_bid"]["job"].get("request_type") in self.alone_request_types
+
+    async def _next_batch(self) -> typing.List[typing.Tuple[typing.Any, typing.Any]]:
+        loop = asyncio.get_event_loop()
+        if self._held is not None:
+            batch, self._held = [self._held], None
+            return batch
+        batch = [await self._queue.get()]
+        if self._runs_alone(batch[0]):
+            return batch
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                event = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if self._runs_alone(event):
+                # closes this batch, and runs right after it
+                self._held = event
+                break
+            batch.append(event)
+        return batch
+
+    async def _consume(self):
+        while True:
+            batch = await self._next_batch()
+            LOGGER.debug("Running a batch of %d matches, %d queued", len(batch), self._queue.qsize())
+            try:
+                await self.handler([match for match, _ in batch], [raw for _, raw in batch])
+            except Exception:
+                LOGGER.exception("Handling a batch of %d matches failed", len(batch))
@@ -0,0 +1,323 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Builds the FasterTransformer models of the serving apps from a converted checkpoint directory.
+
+The apps used to rebuild the hyper-parameters of their model by hand, from `AutoConfig` (which
+needs the Hugging Face hub or cache) or from hardcoded values, and to load the op libraries from
+a fixed build path. Everything needed is in the `config.ini` the converters write next to the
+weights, one section per model type:
+
+- ``[gpt]`` (GPT, OPT): built as `GPT`, or `ParallelGPT` for tensor/pipeline parallel workers;
+- ``[gptj]``: `GPTJ`;
+- ``[gptneox]``: `GPTNeox`;
+- ``[encoder]``, ``[decoder]`` and ``[structure]`` (T5): `FTT5`.
+
+`read_config` parses it once per file version, `build_model` constructs and loads the model, and
+`lib_path` finds the op library in ``--lib_dir``/``$FT_LIB_DIR``. The model classes are only
+imported when a model is built, and `transformers` only by `load_tokenizer`, which prefers the
+tokenizer files stored with the checkpoint over the hub and the fast (Rust) tokenizers. The
+apps run it with `startup.in_background`, so that it overlaps the weight loading.
+"""
+import configparser
+import dataclasses
+import functools
+import logging
+import math
+import os
+import time
+import typing
+
+from examples.pytorch import startup
+
+LOGGER = logging.getLogger(__name__)
+
+LIB_DIR_ENV = "FT_LIB_DIR"
+DEFAULT_LIB_DIR = "/workspace/Port_FasterTransformer/build/lib"
+CONFIG_FILENAME = "config.ini"
+# used when config.ini has no max_pos_seq_len, as the GPT-J and GPT-NeoX converters do
+DEFAULT_MAX_SEQ_LEN = 2048
+# tokenizer files that may be saved next to the weights, see `load_tokenizer`
+TOKENIZER_FILES = ("tokenizer.json", "tokenizer_config.json", "special_tokens_map.json", "vocab.json",
+                   "merges.txt", "spiece.model")
+
+_LIBRARIES = {
+    "gpt": "libth_gpt.so",
+    "parallel_gpt": "libth_parallel_gpt.so",
+    "gptj": "libth_gptj.so",
+    "gptneox": "libth_gptneox.so",
+    "t5": "libth_t5.so",
+    "bert": "libth_bert.so",
+}
+# T5 decoding uses a fixed bucket distance for the relative attention
+_T5_MAX_DISTANCE = 128
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelConfig:
+    """Hyper-parameters of a decoder-only model (``[gpt]``, ``[gptj]`` or ``[gptneox]``)."""
+    model_type: str
+    model_name: str
+    head_num: int
+    size_per_head: int
+    inter_size: int
+    layer_num: int
+    vocab_size: int
+    start_id: int
+    end_id: int
+    max_seq_len: int
+    weight_data_type: str
+    rotary_embedding_dim: int = 0
+    use_gptj_residual: bool = False
+    layernorm_eps: float = 1e-6
+    layernorm_type: str = "pre_layernorm"
+    activation_type: str = "Gelu"
+    has_post_decoder_layernorm: bool = True
+
+    @classmethod
+    def from_section(cls, model_type: str, section: configparser.SectionProxy):
+        return cls(
+            model_type=model_type,
+            model_name=section.get("model_name", model_type),
+            head_num=section.getint("head_num"),
+            size_per_head=section.getint("size_per_head"),
+            inter_size=section.getint("inter_size"),
+            layer_num=section.getint("num_layer"),
+            vocab_size=section.getint("vocab_size"),
+            start_id=section.getint("start_id"),
+            end_id=section.getint("end_id"),
+            max_seq_len=section.getint("max_pos_seq_len", fallback=DEFAULT_MAX_SEQ_LEN),
+            weight_data_type=section.get("weight_data_type", "fp32"),
+            rotary_embedding_dim=section.getint("rotary_embedding", fallback=0),
+            use_gptj_residual=section.getboolean("use_gptj_residual", fallback=False),
+            layernorm_eps=section.getfloat("layernorm_eps", fallback=1e-6),
+            layernorm_type=section.get("layernorm_type", "pre_layernorm"),
+            activation_type=section.get("activation_type", "Gelu"),
+            has_post_decoder_layernorm=section.getboolean("has_post_decoder_layernorm", fallback=True),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class T5StackConfig:
+    """The ``[encoder]`` or ``[decoder]`` section of a T5 checkpoint, with the `T5Config` attribute names
+    the FTT5 weight classes read."""
+    vocab_size: int
+    d_model: int
+    d_kv: int
+    d_ff: int
+    num_layers: int
+    num_heads: int
+    relative_attention_num_buckets: int
+    feed_forward_proj: str
+    pad_token_id: int
+    eos_token_id: int
+    is_gated_act: bool
+    decoder_start_token_id: int = 0
+    tie_word_embeddings: bool = True
+
+    @classmethod
+    def from_section(cls, section: configparser.SectionProxy):
+        return cls(
+            vocab_size=section.getint("vocab_size"),
+            d_model=section.getint("d_model"),
+            d_kv=section.getint("d_kv"),
+            d_ff=section.getint("d_ff"),
+            num_layers=section.getint("num_layers"),
+            num_heads=section.getint("num_heads"),
+            relative_attention_num_buckets=section.getint("relative_attention_num_buckets_or_max_pos_seq_len"),
+            feed_forward_proj=section.get("feed_forward_proj"),
+            pad_token_id=section.getint("pad_token_id"),
+            eos_token_id=section.getint("eos_token_id"),
+            is_gated_act=section.getboolean("is_gated_act", fallback=False),
+            decoder_start_token_id=section.getint("decoder_start_token_id", fallback=0),
+            tie_word_embeddings=section.getboolean("tie_word_embeddings", fallback=True),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class T5ModelConfig:
+    model_type: str
+    encoder: T5StackConfig
+    decoder: T5StackConfig
+    t5_with_bias: bool
+    position_embedding_type: int
+    weight_data_type: str
+
+    @property
+    def start_id(self) -> int:
+        return self.decoder.decoder_start_token_id
+
+    @property
+    def end_id(self) -> int:
+        return self.decoder.eos_token_id
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser):
+        encoder = T5StackConfig.from_section(config["encoder"])
+        decoder = T5StackConfig.from_section(config["decoder"])
+        assert encoder.feed_forward_proj == decoder.feed_forward_proj, \
+            "encoder and decoder must use the same feed_forward_proj"
+        return cls(
+            model_type="t5",
+            encoder=encoder,
+            decoder=decoder,
+            t5_with_bias=config.getboolean("structure", "t5_with_bias", fallback=False),
+            position_embedding_type=0 if config.get("structure", "position_embedding_type",
+                                                    fallback="relative") == "relative" else 1,
+            # checkpoints written before weight_data_type was recorded are fp16
+            weight_data_type=config.get("encoder", "weight_data_type", fallback="fp16"),
+        )
+
+
+AnyModelConfig = typing.Union[ModelConfig, T5ModelConfig]
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_config(config_path: str, mtime_ns: int) -> AnyModelConfig:
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    if config.has_section("encoder") and config.has_section("decoder"):
+        return T5ModelConfig.from_config(config)
+    for model_type in ("gpt", "gptj", "gptneox"):
+        if config.has_section(model_type):
+            return ModelConfig.from_section(model_type, config[model_type])
+    raise ValueError(f"{config_path} has none of the [gpt], [gptj], [gptneox] or [encoder]/[decoder] sections")
+
+
+def read_config(ckpt_path: str) -> AnyModelConfig:
+    """Parses ``<ckpt_path>/config.ini``; the result is cached until the file changes."""
+    config_path = os.path.join(ckpt_path, CONFIG_FILENAME)
+    if not os.path.isfile(config_path):
+        raise FileNotFoundError(f"{config_path} not found, only converted FasterTransformer checkpoints are supported")
+    return _parse_config(os.path.realpath(config_path), os.stat(config_path).st_mtime_ns)
+
+
+def lib_path(library: str, lib_dir: typing.Optional[str] = None) -> str:
+    """Path of the op library of a model type (or "parallel_gpt") in `lib_dir`, $FT_LIB_DIR or the default build."""
+    lib_dir = lib_dir or os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR)
+    return os.path.join(lib_dir, _LIBRARIES[library])
+
+
+def _model_library(config: AnyModelConfig, parallel: bool) -> str:
+    return "parallel_gpt" if config.model_type == "gpt" and parallel else config.model_type
+
+
+def build_model(ckpt_path: str, tensor_para_size: int = 1, pipeline_para_size: int = 1,
+                lib_dir: typing.Optional[str] = None, infer_data_type: str = "fp16",
+                parallel: bool = False, device_index=None, **overrides):
+    """Constructs the model of `ckpt_path` from its config.ini and loads its weights.
+
+    `overrides` replace config values, e.g. ``build_model(path, use_gptj_residual=True)``.
+    GPT checkpoints are built as `ParallelGPT` when `parallel` is set, e.g. for MPI workers.
+    """
+    config = read_config(ckpt_path)
+    if overrides:
+        config = dataclasses.replace(config, **overrides)
+    library = lib_path(_model_library(config, parallel), lib_dir)
+    start_time = time.perf_counter()
+    with startup.phase(f"build {config.model_type} model from {ckpt_path}"):
+        if config.model_type == "t5":
+            model = _build_t5(config, ckpt_path, tensor_para_size, pipeline_para_size, library, infer_data_type)
+        else:
+            model = _build_decoder(config, ckpt_path, tensor_para_size, pipeline_para_size, library,
+                                   infer_data_type, parallel, device_index)
+    LOGGER.info("Built %s from %s in %.1f s", type(model).__name__, ckpt_path, time.perf_counter() - start_time)
+    return model
+
+
+def _build_decoder(config: ModelConfig, ckpt_path, tensor_para_size, pipeline_para_size, library,
+                   infer_data_type, parallel, device_index):
+    if config.model_type == "gpt":
+        from examples.pytorch.gpt.app.utils.gpt import GPT, ParallelGPT
+        model_class = ParallelGPT if parallel else GPT
+        model = model_class(config.head_num, config.size_per_head, config.vocab_size, config.start_id, config.end_id,
+                            config.layer_num, config.max_seq_len, tensor_para_size, pipeline_para_size, library,
+                            config.layernorm_eps, config.layernorm_type, config.activation_type,
+                            config.has_post_decoder_layernorm, int8_mode=0,
+                            weights_data_type=config.weight_data_type)
+        loaded = model.load_w_type(ckpt_path=ckpt_path, infer_data_type=infer_data_type)
+    elif config.model_type == "gptj":
+        from examples.pytorch.gptj.app.utils.gptj import GPTJ
+        model = GPTJ(config.head_num, config.size_per_head, config.layer_num, config.vocab_size,
+                     config.rotary_embedding_dim, config.start_id, config.end_id, config.max_seq_len,
+                     tensor_para_size, pipeline_para_size, lib_path=library,
+                     weights_data_type=config.weight_data_type, device_index=device_index)
+        loaded = model.load(ckpt_path=ckpt_path, infer_data_type=infer_data_type)
+    else:
+        from examples.pytorch.gptneox.app.utils.gptneox import GPTNeox
+        model = GPTNeox(config.head_num, config.size_per_head, config.layer_num, config.vocab_size,
+                        config.rotary_embedding_dim, config.start_id, config.end_id, config.max_seq_len,
+                        tensor_para_size, pipeline_para_size, config.use_gptj_residual, lib_path=library,
+                        weights_data_type=config.weight_data_type, inference_data_type=infer_data_type)
+        loaded = model.load(ckpt_path=ckpt_path, infer_data_type=infer_data_type)
+    if not loaded:
+        LOGGER.warning("Checkpoint files not found in %s, model loading is skipped", ckpt_path)
+    return model
+
+
+def _build_t5(config: T5ModelConfig, ckpt_path, tensor_para_size, pipeline_para_size, library, infer_data_type):
+    import numpy as np
+    import torch
+    from examples.pytorch.t5.app.utils.ft_decoding import FTT5, FTT5Decoding, FTT5DecodingWeight
+    from examples.pytorch.t5.app.utils.ft_encoder import FTT5Encoder, FTT5EncoderWeight
+
+    encoder, decoder = config.encoder, config.decoder
+    weight_data_type = {"fp32": np.float32, "fp16": np.float16}[config.weight_data_type]
+    weight_kwargs = dict(t5_with_bias=config.t5_with_bias, use_gated_activation=encoder.is_gated_act,
+                         position_embedding_type=config.position_embedding_type, weight_data_type=weight_data_type)
+    encoder_weight = FTT5EncoderWeight(encoder, tensor_para_size, pipeline_para_size, **weight_kwargs)
+    decoding_weight = FTT5DecodingWeight(decoder, tensor_para_size, pipeline_para_size, **weight_kwargs)
+    encoder_weight.load_from_bin(ckpt_path)
+    decoding_weight.load_from_bin(ckpt_path)
+    if infer_data_type == "fp16":
+        encoder_weight.to_half()
+        decoding_weight.to_half()
+    encoder_weight.to_cuda()
+    decoding_weight.to_cuda()
+
+    q_scaling = 1.0 / math.sqrt(encoder.d_kv)
+    activation_type = encoder.feed_forward_proj
+    with torch.no_grad():
+        ft_encoder = FTT5Encoder(encoder_weight.w, library, encoder.num_heads, encoder.d_kv, encoder.d_ff,
+                                 encoder.d_model, True, encoder.num_layers, encoder.relative_attention_num_buckets,
+                                 _T5_MAX_DISTANCE, False, q_scaling, tensor_para_size, pipeline_para_size,
+                                 config.t5_with_bias, config.position_embedding_type, activation_type=activation_type)
+        ft_decoding = FTT5Decoding(decoding_weight.w, library, decoder.num_heads, decoder.d_kv, decoder.d_ff,
+                                   encoder.d_model, decoder.d_model, decoder.num_layers,
+                                   decoder.decoder_start_token_id, decoder.eos_token_id, decoder.vocab_size,
+                                   q_scaling, decoder.relative_attention_num_buckets, max_distance=_T5_MAX_DISTANCE,
+                                   tensor_para_size=tensor_para_size, pipeline_para_size=pipeline_para_size,
+                                   t5_with_bias=config.t5_with_bias,
+                                   position_embedding_type=config.position_embedding_type,
+                                   activation_type=activation_type, tie_word_embeddings=decoder.tie_word_embeddings)
+        return FTT5(ft_encoder, ft_decoding)
+
+
+def has_tokenizer_files(ckpt_path: str) -> bool:
+    return any(os.path.isfile(os.path.join(ckpt_path, name)) for name in TOKENIZER_FILES)
+
+
+def load_tokenizer(ckpt_path: str, hf_model_name: typing.Optional[str] = None, use_fast: bool = True, **kwargs):
+    """Loads the tokenizer saved with the checkpoint, or else the one of `hf_model_name`.
+
+    `AutoTokenizer` falls back to the Python tokenizer when a model has no fast one. The pad token
+    is set to the end-of-sequence token, as the serving apps expect.
+    """
+    from transformers import AutoTokenizer
+    source = ckpt_path if has_tokenizer_files(ckpt_path) else hf_model_name
+    if source is None:
+        raise ValueError(f"{ckpt_path} has no tokenizer files and no hf_model_name was given")
+    tokenizer = AutoTokenizer.from_pretrained(source, use_fast=use_fast, **kwargs)
+    LOGGER.info("Loaded %s from %s", type(tokenizer).__name__, source)
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
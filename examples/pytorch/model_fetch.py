@@ -0,0 +1,300 @@
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fetches a converted checkpoint from an HTTP(S) object store into a local model directory.
+
+The store is expected to serve ``<model_url>/manifest.json`` (see ``ckpt_manifest.py``) next to the
+model files. Every file is downloaded as concurrent byte-range requests into a content-addressed
+cache (``<cache_dir>/blobs/<hash[:2]>/<hash>``), verified against the manifest hash and then
+hard-linked into the model directory; cache hits are verified the same way. Interrupted downloads
+resume from their finished chunks, and workers on the same node share the cache: a file lock makes
+sure each blob is downloaded once.
+
+    python examples/pytorch/model_fetch.py --model-url https://host/bucket/opt-1.3b-tp1 \\
+        --model-dir /home/user/.together/models/opt-1.3b-tp1
+"""
+import argparse
+import concurrent.futures
+import fcntl
+import http.client
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sys
+import threading
+import time
+import typing
+import urllib.error
+import urllib.request
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+from examples.pytorch.ckpt_manifest import HASH_ALGORITHM, MANIFEST_FILENAME, hash_file
+from examples.pytorch.model_factory import CONFIG_FILENAME, TOKENIZER_FILES
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".together", "cache")
+DEFAULT_CHUNK_SIZE = 64 << 20
+# Small files that are not part of the manifest but are needed to load the model, if the store has them.
+EXTRA_FILES = (CONFIG_FILENAME,) + TOKENIZER_FILES
+
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+def _url_join(base_url: str, name: str) -> str:
+    return base_url.rstrip("/") + "/" + name
+
+
+def _open_url(url: str, timeout: float, byte_range: typing.Optional[typing.Tuple[int, int]] = None):
+    request = urllib.request.Request(url)
+    if byte_range is not None:
+        request.add_header("Range", f"bytes={byte_range[0]}-{byte_range[1] - 1}")
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+class ModelFetcher:
+    """Downloads the files of one model directory through the shared node cache.
+
+    ``num_threads`` bounds the number of concurrent downloads over all files; large files are split
+    into ``chunk_size`` byte ranges so that a single big shard also uses the whole pool.
+    """
+
+    def __init__(
+        self,
+        model_url: str,
+        model_dir: typing.Union[str, pathlib.Path],
+        cache_dir: typing.Union[str, pathlib.Path] = DEFAULT_CACHE_DIR,
+        num_threads: int = 16,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        timeout: float = 60.0,
+    ):
+        self.model_url = model_url
+        self.model_dir = pathlib.Path(model_dir)
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.num_threads = num_threads
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+        self.stats = {"files": 0, "cache_hits": 0, "downloaded_bytes": 0, "resumed_bytes": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _blob_path(self, file_hash: str) -> pathlib.Path:
+        return self.cache_dir / "blobs" / file_hash[:2] / file_hash
+
+    def fetch_manifest(self) -> dict:
+        with _open_url(_url_join(self.model_url, MANIFEST_FILENAME), self.timeout) as response:
+            manifest = json.loads(response.read())
+        if manifest.get("hash_algorithm") != HASH_ALGORITHM:
+            raise ValueError(f"Unsupported manifest hash algorithm {manifest.get('hash_algorithm')}")
+        return manifest
+
+    def _retry(self, fn, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args)
+            # HTTPException: e.g. IncompleteRead, when the connection drops in the middle of a response
+            except (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError) as error:
+                if attempt == self.retries:
+                    raise
+                LOGGER.warning("%s, retrying (%d/%d)", error, attempt + 1, self.retries)
+                time.sleep(min(2 ** attempt, 30))
+
+    def _download_range(self, url: str, fd: int, begin: int, end: int):
+        with _open_url(url, self.timeout, byte_range=(begin, end)) as response:
+            if response.status != 206:
+                raise ConnectionError(f"{url} answered a range request with HTTP {response.status}")
+            offset = begin
+            while offset < end:
+                data = response.read(min(_COPY_BUFFER_SIZE, end - offset))
+                if not data:
+                    raise ConnectionError(f"{url} closed the connection at byte {offset} of range {begin}-{end}")
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+
+    def _download_whole(self, url: str, partial_path: pathlib.Path):
+        with _open_url(url, self.timeout) as response, partial_path.open("wb") as partial_file:
+            shutil.copyfileobj(response, partial_file, _COPY_BUFFER_SIZE)
+
+    def _supports_ranges(self, url: str) -> bool:
+        try:
+            with _open_url(url, self.timeout, byte_range=(0, 1)) as response:
+                return response.status == 206
+        except urllib.error.HTTPError:
+            return False
+
+    def _download_blob(self, executor, name: str, entry: dict, blob_path: pathlib.Path):
+        url = _url_join(self.model_url, name)
+        size = entry["size"]
+        partial_path = blob_path.with_name(blob_path.name + ".partial")
+        # the chunk size, then one line per finished chunk, so that an interrupted download resumes
+        # where it stopped
+        chunks_path = blob_path.with_name(blob_path.name + ".chunks")
+
+        if size <= self.chunk_size or not self._retry(self._supports_ranges, url):
+            executor.submit(self._retry, self._download_whole, url, partial_path).result()
+            self._count("downloaded_bytes", size)
+        else:
+            done = set()
+            if partial_path.exists() and chunks_path.exists():
+                lines = chunks_path.read_text().split()
+                if lines and int(lines[0]) == self.chunk_size:
+                    done = {int(line) for line in lines[1:]}
+            if not done:
+                chunks_path.write_text(f"{self.chunk_size}\n")
+            fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, size)
+                chunk_begins = range(0, size, self.chunk_size)
+                self._count("resumed_bytes", sum(min(self.chunk_size, size - begin) for begin in done))
+                futures = {
+                    executor.submit(
+                        self._retry, self._download_range, url, fd, begin, min(begin + self.chunk_size, size)
+                    ): begin
+                    for begin in chunk_begins
+                    if begin not in done
+                }
+                try:
+                    with chunks_path.open("a") as chunks_file:
+                        for future in concurrent.futures.as_completed(futures):
+                            future.result()
+                            begin = futures[future]
+                            chunks_file.write(f"{begin}\n")
+                            chunks_file.flush()
+                            self._count("downloaded_bytes", min(self.chunk_size, size - begin))
+                except BaseException:
+                    # the other chunks must not write into fd once it is closed (and maybe reused)
+                    for future in futures:
+                        future.cancel()
+                    concurrent.futures.wait(futures)
+                    raise
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        actual_size = partial_path.stat().st_size
+        actual_hash = hash_file(partial_path)
+        if actual_size != size or actual_hash != entry["hash"]:
+            partial_path.unlink()
+            if chunks_path.exists():
+                chunks_path.unlink()
+            raise RuntimeError(
+                f"{url}: downloaded {actual_size} bytes with hash {actual_hash}, "
+                f"expected {size} bytes with hash {entry['hash']}"
+            )
+        os.replace(partial_path, blob_path)
+        if chunks_path.exists():
+            chunks_path.unlink()
+
+    def _is_cached(self, blob_path: pathlib.Path, entry: dict) -> bool:
+        """Whether the cache has a valid blob, removing it if it does not match its size or hash."""
+        if not blob_path.exists():
+            return False
+        # a blob only enters the cache verified, but may be damaged later (disk errors, partial copies)
+        if blob_path.stat().st_size == entry["size"] and hash_file(blob_path) == entry["hash"]:
+            return True
+        LOGGER.warning("Cached %s does not match its manifest entry, downloading it again", blob_path)
+        blob_path.unlink()
+        return False
+
+    def _fetch_file(self, executor, name: str, entry: dict):
+        blob_path = self._blob_path(entry["hash"])
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(blob_path.with_name(blob_path.name + ".lock"), "w") as lock_file:
+            # another worker on this node may be downloading the same blob; wait for it instead of racing
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self._is_cached(blob_path, entry):
+                self._count("cache_hits")
+            else:
+                self._download_blob(executor, name, entry, blob_path)
+
+        target_path = self.model_dir / name
+        if target_path.exists() or target_path.is_symlink():
+            target_path.unlink()
+        try:
+            os.link(blob_path, target_path)
+        except OSError:
+            # cache on another filesystem
+            shutil.copyfile(blob_path, target_path)
+        self._count("files")
+
+    def fetch(self) -> dict:
+        start_time = time.perf_counter()
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self.fetch_manifest()
+        for name in EXTRA_FILES:
+            try:
+                with _open_url(_url_join(self.model_url, name), self.timeout) as response:
+                    (self.model_dir / name).write_bytes(response.read())
+            except urllib.error.HTTPError as error:
+                if error.code != 404:
+                    raise
+
+        # File-level tasks only wait on their chunk futures, so they get their own pool; the shared
+        # chunk pool bounds the number of requests in flight.
+        files = sorted(manifest["files"].items(), key=lambda item: -item[1]["size"])
+        with concurrent.futures.ThreadPoolExecutor(self.num_threads) as chunk_executor, \
+                concurrent.futures.ThreadPoolExecutor(self.num_threads) as file_executor:
+            futures = [file_executor.submit(self._fetch_file, chunk_executor, name, entry) for name, entry in files]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+        # written last: a model directory with a manifest is complete
+        with (self.model_dir / MANIFEST_FILENAME).open("w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        elapsed = time.perf_counter() - start_time
+        LOGGER.info(
+            "Fetched %d files (%d from cache, %.1f MiB downloaded, %.1f MiB resumed) in %.1f s",
+            self.stats["files"], self.stats["cache_hits"], self.stats["downloaded_bytes"] / (1 << 20),
+            self.stats["resumed_bytes"] / (1 << 20), elapsed,
+        )
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        "--model-url", "--model_url", required=True, help="base URL serving manifest.json and model files"
+    )
+    parser.add_argument("--model-dir", "--model_dir", required=True, help="local directory the model is loaded from")
+    parser.add_argument(
+        "--cache-dir", "--cache_dir", default=DEFAULT_CACHE_DIR, help="content-addressed cache shared by the node"
+    )
+    parser.add_argument("--threads", type=int, default=16, help="maximum number of concurrent requests")
+    parser.add_argument(
+        "--chunk-size-mb", "--chunk_size_mb", type=int, default=DEFAULT_CHUNK_SIZE >> 20, help="byte range size"
+    )
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+
+    ModelFetcher(
+        args.model_url,
+        args.model_dir,
+        cache_dir=args.cache_dir,
+        num_threads=args.threads,
+        chunk_size=args.chunk_size_mb << 20,
+        retries=args.retries,
+    ).fetch()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Keeps several FasterTransformer models (GPT, GPTJ, GPTNeox) of one worker within a GPU budget.
+
+Models are registered by name with a function that builds and loads them. `get(name)` returns
+the model on the GPU, loading it on first use. When the models on the GPU would exceed the GPU
+memory budget, the least recently used ones are evicted: their weights are moved to (pinned)
+host memory while the host budget allows, so that the next use only needs a host-to-device copy,
+and are dropped otherwise, so that the next use reloads them from the checkpoint.
+
+The wrappers are moved between devices through their `weights._map()` and `cuda()` methods; the
+op holding device pointers (`model.model`) is deleted on eviction and rebuilt by `cuda()`.
+
+`swap(name, load_fn)` replaces a model blue/green: the new one is loaded next to the old one,
+which keeps serving, and the switch only happens once the new one is ready.
+"""
+import collections
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+import torch
+
+from examples.pytorch.model_factory import read_config
+
+LOGGER = logging.getLogger(__name__)
+
+RESIDENT_DEVICE = "device"
+RESIDENT_HOST = "host"
+NOT_LOADED = "not_loaded"
+
+# bytes per element of the weight_data_type values of config.ini
+WEIGHT_ITEMSIZES = {"fp32": 4, "fp16": 2, "bf16": 2}
+
+
+def parse_models(spec: typing.Optional[str]) -> typing.Dict[str, typing.Dict[str, str]]:
+    """Parses the --models option: JSON, inline or in a file, mapping each name to its arguments.
+
+    e.g. {"gpt-j-6b": {"hf_model_name": "EleutherAI/gpt-j-6B", "ckpt_path": "/models/gpt-j-6b-tp1"}}
+    """
+    if not spec:
+        return {}
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            return json.load(f)
+    return json.loads(spec)
+
+
+def default_gpu_budget(device=None, fraction: float = 0.8) -> int:
+    """`fraction` of the device memory; the rest is left for the activation buffers of the models."""
+    device = torch.device(device) if device is not None else torch.device("cuda", torch.cuda.current_device())
+    return int(torch.cuda.get_device_properties(device).total_memory * fraction)
+
+
+def checkpoint_bytes(ckpt_path: str, weight_data_type: typing.Optional[str] = None, infer_itemsize: int = 2) -> int:
+    """Device footprint estimate of a checkpoint stored as `weight_data_type` and run with `infer_itemsize`.
+
+    `weight_data_type` defaults to the one in the checkpoint's config.ini, which the model loaders also read.
+    """
+    if not os.path.isdir(ckpt_path):
+        return 0
+    if weight_data_type is None:
+        try:
+            weight_data_type = read_config(ckpt_path).weight_data_type
+        except (FileNotFoundError, ValueError):
+            weight_data_type = "fp32"
+    weights_itemsize = WEIGHT_ITEMSIZES[weight_data_type]
+    total = 0
+    for name in os.listdir(ckpt_path):
+        if name.endswith(".bin"):
+            total += os.path.getsize(os.path.join(ckpt_path, name))
+    return total * infer_itemsize // weights_itemsize
+
+
+@dataclasses.dataclass
+class ModelStats:
+    state: str = NOT_LOADED
+    device_bytes: int = 0
+    hits: int = 0
+    loads: int = 0
+    restores: int = 0
+    evictions: int = 0
+    swaps: int = 0
+    last_used: float = 0.0
+    last_load_seconds: float = 0.0
+    last_restore_seconds: float = 0.0
+    last_evict_seconds: float = 0.0
+    last_swap_seconds: float = 0.0
+
+
+def _call(fn: typing.Callable[[], None]):
+    fn()
+
+
+class _Entry:
+    def __init__(self, name: str, load_fn: typing.Callable[[], typing.Any], estimate_bytes: int):
+        self.name = name
+        self.load_fn = load_fn
+        self.estimate_bytes = estimate_bytes
+        self.model = None
+        self.stats = ModelStats()
+
+
+class ModelRegistry:
+    """LRU residency of registered models; see the module docstring.
+
+    `gpu_budget_bytes` bounds the measured device memory of the models on the GPU and
+    `host_budget_bytes` that of the models evicted to host memory (0 drops evicted models).
+    """
+
+    def __init__(self, gpu_budget_bytes: int, host_budget_bytes: int = 0, device=None,
+                 pin_memory: bool = True, stats_path: typing.Optional[str] = None):
+        self.gpu_budget_bytes = gpu_budget_bytes
+        self.host_budget_bytes = host_budget_bytes
+        self.device = torch.device(device) if device is not None else torch.device("cuda", torch.cuda.current_device())
+        self.pin_memory = pin_memory
+        self.stats_path = stats_path
+        self._entries: typing.Dict[str, _Entry] = {}
+        # least recently used first
+        self._on_device: "collections.OrderedDict[str, _Entry]" = collections.OrderedDict()
+        self._on_host: "collections.OrderedDict[str, _Entry]" = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def register(self, name: str, load_fn: typing.Callable[[], typing.Any], estimate_bytes: int = 0):
+        """Adds a model; `load_fn()` must build it and load its weights onto the GPU."""
+        if name in self._entries:
+            raise ValueError(f"Model {name} is already registered")
+        self._entries[name] = _Entry(name, load_fn, estimate_bytes)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def names(self) -> typing.List[str]:
+        return list(self._entries)
+
+    def get(self, name: str):
+        """Returns model `name` on the GPU, loading or restoring it and evicting others as needed."""
+        with self._lock:
+            entry = self._entries[name]
+            entry.stats.last_used = time.time()
+            if entry.stats.state == RESIDENT_DEVICE:
+                entry.stats.hits += 1
+                self._on_device.move_to_end(name)
+                return entry.model
+
+            if entry.stats.state == RESIDENT_HOST:
+                # not a candidate for dropping while others are evicted to host memory to make room for it
+                del self._on_host[name]
+            needed = entry.stats.device_bytes or entry.estimate_bytes
+            self._make_room(needed, keep=name)
+            allocated = torch.cuda.memory_allocated(self.device)
+            start = time.perf_counter()
+            try:
+                if entry.stats.state == RESIDENT_HOST:
+                    entry.model.cuda()
+                    entry.stats.restores += 1
+                    entry.stats.last_restore_seconds = time.perf_counter() - start
+                    LOGGER.info("Restored %s from host memory in %.2f s", name, entry.stats.last_restore_seconds)
+                else:
+                    entry.model = entry.load_fn()
+                    entry.stats.loads += 1
+                    entry.stats.last_load_seconds = time.perf_counter() - start
+                    LOGGER.info("Loaded %s in %.2f s", name, entry.stats.last_load_seconds)
+            except BaseException:
+                entry.model = None
+                entry.stats.state = NOT_LOADED
+                raise
+            entry.stats.device_bytes = max(torch.cuda.memory_allocated(self.device) - allocated, 0) or needed
+            entry.stats.state = RESIDENT_DEVICE
+            self._on_device[name] = entry
+            self._write_stats()
+            return entry.model
+
+    def _device_bytes(self) -> int:
+        return sum(entry.stats.device_bytes for entry in self._on_device.values())
+
+    def _host_bytes(self) -> int:
+        return sum(entry.stats.device_bytes for entry in self._on_host.values())
+
+    def _make_room(self, needed: int, keep: str):
+        while self._on_device and self._device_bytes() + needed > self.gpu_budget_bytes:
+            victim = next(iter(self._on_device))
+            if victim == keep:
+                break
+            self.evict(victim)
+        if self._device_bytes() + needed > self.gpu_budget_bytes:
+            LOGGER.warning("%s (%.2f GiB) does not fit in the GPU budget of %.2f GiB",
+                           keep, needed / 2**30, self.gpu_budget_bytes / 2**30)
+
+    def evict(self, name: str):
+        """Moves model `name` off the GPU: to host memory if the host budget allows, else drops it."""
+        with self._lock:
+            entry = self._entries[name]
+            if entry.stats.state != RESIDENT_DEVICE:
+                return
+            start = time.perf_counter()
+            del self._on_device[name]
+            to_host = entry.stats.device_bytes <= self.host_budget_bytes
+            if to_host:
+                while self._on_host and self._host_bytes() + entry.stats.device_bytes > self.host_budget_bytes:
+                    self._drop(next(iter(self._on_host)))
+            model = entry.model
+            if getattr(model, "build_model", False):
+                del model.model
+                model.build_model = False
+            if to_host:
+                pin = self.pin_memory
+                model.weights._map(lambda w: w.cpu().pin_memory() if pin else w.cpu())
+                if getattr(model, "int8_mode", 0) != 0:
+                    model.weights._map_int8(lambda w: w.cpu().pin_memory() if pin else w.cpu())
+                entry.stats.state = RESIDENT_HOST
+                self._on_host[name] = entry
+            else:
+                # callers may still hold the model object; don't let it keep the device memory alive
+                model.weights = None
+                entry.model = None
+                entry.stats.state = NOT_LOADED
+            del model
+            torch.cuda.empty_cache()
+            entry.stats.evictions += 1
+            entry.stats.last_evict_seconds = time.perf_counter() - start
+            LOGGER.info("Evicted %s to %s in %.2f s", name, "host memory" if to_host else "nothing",
+                        entry.stats.last_evict_seconds)
+            self._write_stats()
+
+    def swap(self, name: str, load_fn: typing.Callable[[], typing.Any], estimate_bytes: int = 0,
+             switch: typing.Optional[typing.Callable[[typing.Callable[[], None]], typing.Any]] = None):
+        """Loads model `name` again with `load_fn` and replaces the current one with it; blocks until done.
+
+        The current model keeps serving while the new one loads, so both must fit on the GPU; other
+        models are evicted to make room. `switch(fn)` must run `fn` where no request uses any model,
+        e.g. on the worker's request executor; by default `fn` is called directly. It runs both the
+        eviction and the switch. `load_fn` becomes the model's loader for later reloads.
+        """
+        if switch is None:
+            switch = _call
+        entry = self._entries[name]
+        needed = estimate_bytes or entry.estimate_bytes or entry.stats.device_bytes
+
+        def _evict_others():
+            with self._lock:
+                if name in self._on_device:
+                    self._on_device.move_to_end(name)
+                self._make_room(needed, keep=name)
+
+        # evicting a model frees its weights, which a running request may be using
+        switch(_evict_others)
+        allocated = torch.cuda.memory_allocated(self.device)
+        start = time.perf_counter()
+        model = load_fn()
+        device_bytes = max(torch.cuda.memory_allocated(self.device) - allocated, 0) or needed
+
+        def _switch():
+            with self._lock:
+                old_model = entry.model
+                self._on_host.pop(name, None)
+                entry.model = model
+                entry.load_fn = load_fn
+                entry.estimate_bytes = estimate_bytes or entry.estimate_bytes
+                entry.stats.device_bytes = device_bytes
+                entry.stats.state = RESIDENT_DEVICE
+                self._on_device[name] = entry
+                self._on_device.move_to_end(name)
+                if old_model is not None:
+                    if getattr(old_model, "build_model", False):
+                        del old_model.model
+                        old_model.build_model = False
+                    old_model.weights = None
+                    del old_model
+                    torch.cuda.empty_cache()
+                entry.stats.swaps += 1
+                entry.stats.last_swap_seconds = time.perf_counter() - start
+                LOGGER.info("Swapped %s in %.2f s", name, entry.stats.last_swap_seconds)
+                self._write_stats()
+
+        switch(_switch)
+
+    def _drop(self, name: str):
+        entry = self._on_host.pop(name)
+        entry.model.weights = None
+        entry.model = None
+        entry.stats.state = NOT_LOADED
+        LOGGER.info("Dropped %s from host memory", name)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            return {
+                "gpu_budget_bytes": self.gpu_budget_bytes,
+                "gpu_used_bytes": self._device_bytes(),
+                "host_budget_bytes": self.host_budget_bytes,
+                "host_used_bytes": self._host_bytes(),
+                "models": {name: dataclasses.asdict(entry.stats) for name, entry in self._entries.items()},
+            }
+
+    def _write_stats(self):
+        if not self.stats_path:
+            return
+        tmp_path = self.stats_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.stats(), f, indent=1)
+        os.replace(tmp_path, self.stats_path)
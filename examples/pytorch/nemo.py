@@ -11,8 +11,12 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import dataclasses
+import fnmatch
 import functools
+import io
 import logging
+import os
 import pathlib
 import tarfile
 import typing
@@ -20,6 +24,7 @@ import typing
 import torch
 import yaml
 
+from .ckpt_conversion import load_checkpoint
 from .utils import cpu_map_location, gpu_map_location
 
 
@@ -45,6 +50,67 @@ def unpack_nemo_ckpt(
     raise RuntimeError(f"Could not unpack {nemo_archive_path}")
 
 
+class _TarMemberFile(io.RawIOBase):
+    """Read-only, seekable view of a single member stored uncompressed in a tar archive."""
+
+    def __init__(self, archive_path: str, offset: int, size: int):
+        super().__init__()
+        self._file = open(archive_path, "rb")
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            new_pos = pos
+        elif whence == io.SEEK_CUR:
+            new_pos = self._pos + pos
+        elif whence == io.SEEK_END:
+            new_pos = self._size + pos
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._pos = max(0, new_pos)
+        return self._pos
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self._size - self._pos)
+        if length <= 0:
+            return 0
+        self._file.seek(self._offset + self._pos)
+        length = self._file.readinto(memoryview(buffer)[:length])
+        self._pos += length
+        return length
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+@dataclasses.dataclass(frozen=True)
+class NemoArchiveMember:
+    """Checkpoint stored inside an uncompressed .nemo archive, loaded in place from its data offset."""
+
+    archive_path: str
+    name: str
+    offset: int
+    size: int
+
+    def open(self):
+        return io.BufferedReader(_TarMemberFile(self.archive_path, self.offset, self.size), buffer_size=1 << 20)
+
+    def __str__(self):
+        return f"{self.archive_path}:{self.name}"
+
+
 def extract_layers_with_prefix(model_, prefix):
     length_to_trim = len(prefix)
     model_state = model_.get("state_dict", model_)
@@ -186,3 +252,103 @@ class UnpackedNemoCheckpointDir:
                 file_path = files_paths[0]
 
         return file_path
+
+
+class NemoArchiveCheckpointDir(UnpackedNemoCheckpointDir):
+    """Uncompressed .nemo archive read without unpacking the model weights.
+
+    Only the small members (model config, tokenizer files) are extracted to ``out_dir_path``; the weight
+    checkpoints are indexed by their offsets and returned by ``get_checkpoints_paths`` as
+    ``NemoArchiveMember`` objects, which ``examples.pytorch.ckpt_conversion.load_checkpoint`` reads directly
+    from the archive.
+    """
+
+    _CHECKPOINT_SUFFIX = ".ckpt"
+
+    def __init__(
+        self,
+        nemo_archive_path: typing.Union[str, pathlib.Path],
+        out_dir_path: typing.Union[str, pathlib.Path],
+        load_checkpoints_to_cpu: bool = False,
+    ):
+        nemo_archive_path = pathlib.Path(nemo_archive_path)
+        out_dir_path = pathlib.Path(out_dir_path)
+        self._members = {}
+        # "r:" only accepts uncompressed archives; a compressed one raises tarfile.ReadError
+        with tarfile.open(nemo_archive_path, mode="r:") as tar_file:
+            for member in tar_file:
+                if not member.isfile():
+                    continue
+                name = os.path.normpath(member.name)
+                if name.endswith(self._CHECKPOINT_SUFFIX):
+                    self._members[name] = NemoArchiveMember(
+                        nemo_archive_path.as_posix(), name, member.offset_data, member.size
+                    )
+                else:
+                    tar_file.extract(member, path=out_dir_path)
+        super().__init__(out_dir_path, load_checkpoints_to_cpu=load_checkpoints_to_cpu)
+
+    @property
+    @functools.lru_cache
+    def model_config(self):
+        if any(self._checkpoints_dir.rglob("model_config.yaml")):
+            return super().model_config
+
+        # the checkpoints are not extracted, so read the config embedded in the parallel ranks 0 one in place
+        model_config = None
+        checkpoints_names = sorted(name for name in self._members if os.path.basename(name) == self.checkpoint_name)
+        if checkpoints_names:
+            checkpoint_member = self._members[checkpoints_names[0]]
+            map_location_fn = cpu_map_location if self._load_checkpoints_to_cpu else gpu_map_location
+            model_00 = load_checkpoint(checkpoint_member, map_location=map_location_fn)
+            if "hyper_parameters" in model_00 and "cfg" in model_00["hyper_parameters"]:
+                model_config = model_00["hyper_parameters"]["cfg"]
+                LOGGER.debug("Loaded model config from checkpoint %s", checkpoint_member)
+            else:
+                LOGGER.debug("Could not find model config in checkpoint %s", checkpoint_member)
+            del model_00
+
+        if model_config is None:
+            LOGGER.warning("Could not find checkpoint with NeMo model config in %s", self._checkpoints_dir)
+
+        LOGGER.debug("Loaded model config %s", model_config)
+
+        return model_config
+
+    @property
+    @functools.lru_cache
+    def checkpoint_name(self):
+        patterns = [
+            "model_weights.ckpt",  # older megatron checkpoints
+            "*last.ckpt",  # newer format of checkpoints
+        ]
+        for pattern in patterns:
+            model_files = sorted(name for name in self._members if fnmatch.fnmatch(os.path.basename(name), pattern))
+            if model_files:
+                return os.path.basename(model_files[0])
+
+        raise ValueError(f"Could not find checkpoint files in {self._checkpoints_dir}")
+
+    def get_checkpoints_paths(self, tensor_model_parallel_size=1, pipeline_model_parallel_size=1):
+        checkpoints_paths = super().get_checkpoints_paths(tensor_model_parallel_size, pipeline_model_parallel_size)
+        return [
+            [self._members[os.path.normpath(path.relative_to(self.checkpoints_dir))] for path in pp_paths]
+            for pp_paths in checkpoints_paths
+        ]
+
+
+def open_nemo_ckpt(
+    nemo_archive_path: typing.Union[str, pathlib.Path],
+    out_dir_path: typing.Union[str, pathlib.Path],
+    load_checkpoints_to_cpu: bool = False,
+) -> UnpackedNemoCheckpointDir:
+    """Opens a .nemo archive, reading weights in place when it is uncompressed and unpacking it otherwise."""
+    try:
+        return NemoArchiveCheckpointDir(
+            nemo_archive_path, out_dir_path, load_checkpoints_to_cpu=load_checkpoints_to_cpu
+        )
+    except tarfile.ReadError:
+        LOGGER.info("%s is not an uncompressed tar archive; unpacking it", nemo_archive_path)
+        return UnpackedNemoCheckpointDir(
+            unpack_nemo_ckpt(nemo_archive_path, out_dir_path), load_checkpoints_to_cpu=load_checkpoints_to_cpu
+        )
@@ -0,0 +1,87 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Preallocated per-worker input buffers for the FasterTransformer decoding ops.
+
+Serving a request used to allocate its `start_ids`/`start_lengths` on the host, copy them to the
+device synchronously and build one `value * torch.ones([max_batch_size])` tensor per sampling
+parameter. `RequestBuffers` allocates these tensors once for max_batch_size x max_seq_len:
+
+- token ids and lengths are written into pinned host buffers and copied into device buffers with
+  non_blocking copies on the current stream, which the ops run on;
+- the sampling parameters, which the ops read on the host, are filled in place.
+
+The returned tensors are views of the buffers and are only valid until the next request.
+"""
+import typing
+
+import torch
+
+# name -> dtype of the per-row sampling parameters taken by the GPT, GPT-J and GPT-NeoX ops
+SAMPLING_PARAMS = {
+    "top_k": torch.int32,
+    "top_p": torch.float32,
+    "beam_search_diversity_rate": torch.float32,
+    "temperature": torch.float32,
+    "len_penalty": torch.float32,
+    "repetition_penalty": torch.float32,
+}
+
+
+class RequestBuffers:
+
+    def __init__(self, max_batch_size: int, max_seq_len: int, device=None):
+        self.max_batch_size = max_batch_size
+        self.device = torch.device("cuda", torch.cuda.current_device()) if device is None else torch.device(device)
+        self.sampling = {name: torch.empty([max_batch_size], dtype=dtype) for name, dtype in SAMPLING_PARAMS.items()}
+        self._host_lengths = torch.empty([max_batch_size], dtype=torch.int32).pin_memory()
+        self._device_lengths = torch.empty([max_batch_size], dtype=torch.int32, device=self.device)
+        self._copied = torch.cuda.Event()
+        self._allocate_ids(max_seq_len)
+
+    def _allocate_ids(self, max_seq_len: int):
+        self.max_seq_len = max_seq_len
+        # flat, so that a [batch, input_len] view of it is contiguous
+        self._host_ids = torch.empty([self.max_batch_size * max_seq_len], dtype=torch.int32).pin_memory()
+        self._device_ids = torch.empty([self.max_batch_size * max_seq_len], dtype=torch.int32, device=self.device)
+
+    def inputs(self, token_ids: typing.Sequence[typing.Sequence[int]], pad_id: int
+               ) -> typing.Tuple[torch.Tensor, torch.Tensor]:
+        """Returns `start_ids` [batch, max input len] padded with `pad_id` and `start_lengths` on the device."""
+        batch_size = len(token_ids)
+        input_len = max(len(ids) for ids in token_ids)
+        assert batch_size <= self.max_batch_size, f"batch of {batch_size} exceeds max_batch_size {self.max_batch_size}"
+        # the previous request's copies must be done before its host buffers are overwritten
+        self._copied.synchronize()
+        if input_len > self.max_seq_len:
+            self._allocate_ids(input_len)
+
+        host_ids = self._host_ids[:batch_size * input_len].view(batch_size, input_len)
+        host_ids.fill_(pad_id)
+        for row, ids in enumerate(token_ids):
+            host_ids[row, :len(ids)] = torch.as_tensor(ids, dtype=torch.int32)
+            self._host_lengths[row] = len(ids)
+
+        device_ids = self._device_ids[:batch_size * input_len].view(batch_size, input_len)
+        device_ids.copy_(host_ids, non_blocking=True)
+        device_lengths = self._device_lengths[:batch_size]
+        device_lengths.copy_(self._host_lengths[:batch_size], non_blocking=True)
+        self._copied.record()
+        return device_ids, device_lengths
+
+    def sampling_params(self, **values) -> typing.Dict[str, torch.Tensor]:
+        """Fills the sampling parameter tensors, one value for all rows, e.g. sampling_params(top_k=50, ...)."""
+        params = {}
+        for name, value in values.items():
+            params[name] = self.sampling[name].fill_(value)
+        return params
@@ -0,0 +1,271 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Node-wide host-memory staging of checkpoint weight files shared by all worker processes.
+
+When several workers on a node serve the same checkpoint, each of them used to read every
+`model.*.bin` file from disk into its own host buffer before uploading it to its GPU. With
+FT_SHARED_WEIGHTS=1, `load_weight` instead stages each file once into POSIX shared memory
+(/dev/shm/ft_weights_<key>/) and returns a copy-on-write mapping of it, so all workers share one
+host copy and only the first one reads the disk.
+
+A staged checkpoint is reference counted by its holder processes: every process holds a shared
+flock on /dev/shm/ft_weights_<key>.lock and a holders/<pid> entry from its first `load_weight`
+until `release()` or exit. The last process to release removes the staged files. The model
+loaders release a checkpoint once its weights are on the GPU, so the staged copy only lives while
+workers are loading it, e.g. during the initial start of a node or a model swap. As flocks are
+dropped by the kernel when a process dies, `python shared_weights.py sweep` removes what crashed
+workers left behind. A staged file is keyed by the size and mtime of its source, so a replaced
+checkpoint file is staged again. If /dev/shm is too small, files are mapped from the checkpoint
+directory itself, which still shares the page cache between processes.
+"""
+import argparse
+import atexit
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import typing
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+SHM_DIR = "/dev/shm"
+_PREFIX = "ft_weights_"
+
+
+def enabled() -> bool:
+    return os.environ.get("FT_SHARED_WEIGHTS", "0") not in ("", "0")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _StagedCheckpoint:
+    """This process's reference to the staged copy of one checkpoint directory."""
+
+    def __init__(self, ckpt_dir: str, shm_dir: str):
+        key = hashlib.blake2b(ckpt_dir.encode(), digest_size=8).hexdigest()
+        self.ckpt_dir = ckpt_dir
+        self.stage_dir = os.path.join(shm_dir, _PREFIX + key)
+        self.lock_path = self.stage_dir + ".lock"
+        self.holder_path = os.path.join(self.stage_dir, "holders", str(os.getpid()))
+        self._lock_fd: typing.Optional[int] = None
+        self._warned_full = False
+
+    def acquire(self):
+        self._lock_fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o666)
+        # blocks while the last holder of a previous generation is removing the staged files
+        fcntl.flock(self._lock_fd, fcntl.LOCK_SH)
+        os.makedirs(os.path.dirname(self.holder_path), exist_ok=True)
+        with open(self.holder_path, "w"):
+            pass
+
+    def release(self):
+        if self._lock_fd is None:
+            return
+        try:
+            os.unlink(self.holder_path)
+        except FileNotFoundError:
+            pass
+        os.close(self._lock_fd)
+        self._lock_fd = None
+        _remove_if_unused(self.stage_dir, self.lock_path)
+
+    def path_for(self, path: str) -> str:
+        """Returns the staged copy of `path`, staging it first if no process has done so yet."""
+        stat = os.stat(path)
+        staged = os.path.join(self.stage_dir, f"{os.path.basename(path)}.{stat.st_size}.{stat.st_mtime_ns}")
+        if os.path.exists(staged):
+            return staged
+
+        tmp_path = staged + ".tmp"
+        fd = os.open(tmp_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            # only one process copies a file; the others wait for it and map the result
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        try:
+            if os.path.exists(staged):
+                # tmp_path was created again after the copying process renamed it
+                _discard_tmp(tmp_path, fd)
+                return staged
+            free = os.statvfs(self.stage_dir)
+            if free.f_bavail * free.f_frsize < stat.st_size:
+                # writing past the end of a full tmpfs only fails when the pages are touched (SIGBUS)
+                raise OSError(errno.ENOSPC, "not enough space in " + SHM_DIR)
+            os.ftruncate(fd, 0)
+            with open(path, "rb") as src, os.fdopen(os.dup(fd), "wb") as dst:
+                shutil.copyfileobj(src, dst, 16 << 20)
+            os.rename(tmp_path, staged)
+            return staged
+        except BaseException as e:
+            _discard_tmp(tmp_path, fd)
+            if not isinstance(e, OSError) or e.errno != errno.ENOSPC:
+                raise
+            if not self._warned_full:
+                LOGGER.warning("%s is full, mapping weights from %s instead", SHM_DIR, self.ckpt_dir)
+                self._warned_full = True
+            return path
+        finally:
+            os.close(fd)
+
+
+def _discard_tmp(tmp_path: str, fd: int):
+    """Removes `tmp_path` if it is still the file open as `fd`, which this process has locked."""
+    try:
+        if os.stat(tmp_path).st_ino == os.fstat(fd).st_ino:
+            os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_if_unused(stage_dir: str, lock_path: str) -> bool:
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    try:
+        shutil.rmtree(stage_dir, ignore_errors=True)
+    finally:
+        os.close(fd)
+    return True
+
+
+class SharedWeightCache:
+    """Per-process entry point to the staged checkpoints; see the module docstring."""
+
+    def __init__(self, shm_dir: str = SHM_DIR):
+        self.shm_dir = shm_dir
+        self._checkpoints: typing.Dict[str, _StagedCheckpoint] = {}
+        self._lock = threading.Lock()
+
+    def _checkpoint(self, ckpt_dir: str) -> _StagedCheckpoint:
+        ckpt_dir = os.path.realpath(ckpt_dir)
+        with self._lock:
+            checkpoint = self._checkpoints.get(ckpt_dir)
+            if checkpoint is None:
+                checkpoint = _StagedCheckpoint(ckpt_dir, self.shm_dir)
+                checkpoint.acquire()
+                self._checkpoints[ckpt_dir] = checkpoint
+            return checkpoint
+
+    def load(self, path: str, dtype) -> np.ndarray:
+        """Same as `np.fromfile(path, dtype)` but backed by the node-wide staged copy of `path`."""
+        staged = self._checkpoint(os.path.dirname(path)).path_for(path)
+        if os.path.getsize(staged) == 0:
+            return np.empty(0, dtype=dtype)
+        # copy-on-write: pages stay shared unless a loader writes to the array
+        return np.memmap(staged, dtype=dtype, mode="c")
+
+    def release(self, ckpt_dir: typing.Optional[str] = None):
+        """Drops this process's reference to `ckpt_dir` (or to all checkpoints).
+
+        Arrays returned by `load` stay valid; the staged files are removed once the last holder
+        has released them.
+        """
+        with self._lock:
+            if ckpt_dir is None:
+                checkpoints = list(self._checkpoints.values())
+                self._checkpoints.clear()
+            else:
+                checkpoint = self._checkpoints.pop(os.path.realpath(ckpt_dir), None)
+                checkpoints = [checkpoint] if checkpoint is not None else []
+        for checkpoint in checkpoints:
+            checkpoint.release()
+
+
+_cache: typing.Optional[SharedWeightCache] = None
+
+
+def _get_cache() -> SharedWeightCache:
+    global _cache
+    if _cache is None:
+        _cache = SharedWeightCache()
+        atexit.register(_cache.release)
+    return _cache
+
+
+def load_weight(path: str, dtype) -> np.ndarray:
+    """Reads a weight file like `np.fromfile`, through the shared cache if FT_SHARED_WEIGHTS is set."""
+    if not enabled():
+        return np.fromfile(path, dtype=dtype)
+    return _get_cache().load(path, dtype)
+
+
+def release(ckpt_dir: typing.Optional[str] = None):
+    if _cache is not None:
+        _cache.release(ckpt_dir)
+
+
+def status(shm_dir: str = SHM_DIR) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Staged checkpoints on this node with their size and live holder pids."""
+    entries = []
+    for name in sorted(os.listdir(shm_dir)):
+        stage_dir = os.path.join(shm_dir, name)
+        if not name.startswith(_PREFIX) or not os.path.isdir(stage_dir):
+            continue
+        holders_dir = os.path.join(stage_dir, "holders")
+        holders = [int(pid) for pid in os.listdir(holders_dir)] if os.path.isdir(holders_dir) else []
+        files = [f for f in os.listdir(stage_dir) if f != "holders"]
+        entries.append({
+            "dir": stage_dir,
+            "files": len(files),
+            "bytes": sum(os.path.getsize(os.path.join(stage_dir, f)) for f in files),
+            "holders": [pid for pid in holders if _pid_alive(pid)],
+        })
+    return entries
+
+
+def sweep(shm_dir: str = SHM_DIR) -> typing.List[str]:
+    """Removes staged checkpoints no live process holds; returns the removed directories."""
+    removed = []
+    for entry in status(shm_dir):
+        if _remove_if_unused(entry["dir"], entry["dir"] + ".lock"):
+            removed.append(entry["dir"])
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clean up the shared weight staging area.")
+    parser.add_argument("command", choices=["status", "sweep"])
+    parser.add_argument("--shm-dir", "--shm_dir", default=SHM_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+
+    if args.command == "status":
+        for entry in status(args.shm_dir):
+            print(f"{entry['dir']}: {entry['files']} files, {entry['bytes'] / 2**30:.2f} GiB, "
+                  f"holders {entry['holders']}")
+    else:
+        for stage_dir in sweep(args.shm_dir):
+            print(f"removed {stage_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Startup timeline of the serving entry points.
+
+A serving app imports this module first and calls `begin()`. With ``--profile-startup`` on the
+command line (or PROFILE_STARTUP=1) it then records:
+
+- every top-level package imported for the first time (e.g. torch, transformers), with the time
+  spent in it, including the packages it imports itself;
+- the phases the app and `model_factory` mark with `phase()`, e.g. building a model or loading a
+  tokenizer;
+
+and `report()` prints them as a timeline relative to `begin()`, once the worker is about to serve.
+Work started with `in_background()` (e.g. the tokenizer, while the weights load) shows up with the
+name of its thread. For a per-module breakdown of the imports use ``python -X importtime``.
+"""
+import builtins
+import concurrent.futures
+import contextlib
+import os
+import sys
+import threading
+import time
+import typing
+
+PROFILE_FLAG = "--profile-startup"
+PROFILE_ENV = "PROFILE_STARTUP"
+
+
+class StartupTimeline:
+
+    def __init__(self):
+        self.enabled = False
+        self.start = time.perf_counter()
+        # (start offset, seconds, thread name, kind, name)
+        self.events: typing.List[typing.Tuple[float, float, str, str, str]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._import = None
+
+    def record(self, kind: str, name: str, start: float, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.events.append((start - self.start, seconds, threading.current_thread().name, kind, name))
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record("phase", name, start, time.perf_counter() - start)
+
+    def profile_imports(self):
+        """Times the first import of each top-level package by wrapping `__import__`."""
+        if self._import is not None:
+            return
+        self._import = builtins.__import__
+        original = self._import
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            root = name.partition(".")[0]
+            depth = getattr(self._local, "depth", 0)
+            if level or depth or root in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+            self._local.depth = 1
+            start = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                self._local.depth = 0
+                self.record("import", root, start, time.perf_counter() - start)
+
+        builtins.__import__ = timed_import
+
+    def stop_profiling_imports(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def report(self, file=None):
+        if not self.enabled:
+            return
+        file = file or sys.stderr
+        with self._lock:
+            events = sorted(self.events)
+        total = time.perf_counter() - self.start
+        print(f"[startup] {'start':>8}  {'took':>8}  {'thread':<16} event", file=file)
+        for offset, seconds, thread, kind, name in events:
+            print(f"[startup] {offset:7.3f}s  {seconds:7.3f}s  {thread:<16} {kind} {name}", file=file)
+        imports = sum(seconds for _, seconds, thread, kind, _ in events
+                      if kind == "import" and thread == "MainThread")
+        print(f"[startup] ready after {total:.3f}s, {imports:.3f}s of it importing on the main thread", file=file)
+        file.flush()
+
+
+TIMELINE = StartupTimeline()
+_BACKGROUND = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+
+
+def enabled() -> bool:
+    return PROFILE_FLAG in sys.argv or os.environ.get(PROFILE_ENV, "0") not in ("", "0")
+
+
+def begin():
+    """Starts the timeline if profiling is on; call it before the heavy imports."""
+    if enabled() and not TIMELINE.enabled:
+        TIMELINE.enabled = True
+        TIMELINE.profile_imports()
+
+
+def phase(name: str):
+    return TIMELINE.phase(name)
+
+
+def in_background(name: str, fn: typing.Callable, *args, **kwargs) -> concurrent.futures.Future:
+    """Runs `fn` in a startup thread, e.g. to load a tokenizer while the weights load."""
+    def run():
+        with TIMELINE.phase(name):
+            return fn(*args, **kwargs)
+    return _BACKGROUND.submit(run)
+
+
+def report(file=None):
+    """Prints the timeline once, if profiling is on, and stops timing imports."""
+    TIMELINE.stop_profiling_imports()
+    TIMELINE.report(file)
+    TIMELINE.enabled = False
@@ -0,0 +1,144 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Random input token ids for benchmarks, generated with NumPy.
+
+The benchmarks used to fill their inputs token by token in Python loops (t5/perf_benchmark.py's
+`InputTokens`, gpt/utils/generate_start_ids.py), which for large batches of long sequences took
+longer than the inference they measured. `generate` draws a whole [batch, max length] batch at once:
+
+- the ids are drawn uniformly from the vocabulary without the `exclude`d (special) tokens, by
+  drawing indices into the array of allowed ids;
+- the lengths follow a spec, see `sample_lengths`: "128" / "fixed:128", "uniform:32:512", or
+  "requests:<file>.jsonl" to resample the prompt lengths of recorded requests;
+- rows are padded with `pad_id` after their length, and `last_token` (e.g. eos) can end each row;
+- everything derives from `seed`, and batches are cached as .npz files under `cache_dir`, keyed by
+  their parameters (and the contents of a requests file).
+"""
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import typing
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SYNTHETIC_INPUTS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fastertransformer", "inputs"))
+
+
+@dataclasses.dataclass
+class SyntheticBatch:
+    # [batch, max length], padded after each row's length
+    input_ids: np.ndarray
+    # [batch]
+    lengths: np.ndarray
+
+    def attention_mask(self) -> np.ndarray:
+        return (np.arange(self.input_ids.shape[1])[None, :] < self.lengths[:, None]).astype(np.int64)
+
+
+@functools.lru_cache(maxsize=8)
+def _request_lengths(path: str, mtime_ns: int) -> np.ndarray:
+    lengths = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if "input_len" in request:
+                lengths.append(int(request["input_len"]))
+                continue
+            prompts = request["prompt"] if isinstance(request["prompt"], list) else [request["prompt"]]
+            # without a tokenizer, whitespace-separated words stand in for tokens
+            lengths.extend(max(len(prompt.split()), 1) for prompt in prompts)
+    if not lengths:
+        raise ValueError(f"No requests in {path}")
+    return np.asarray(lengths, dtype=np.int32)
+
+
+def request_lengths(path: str) -> np.ndarray:
+    """Prompt lengths of a JSONL file of requests: their "input_len", or the words of their "prompt"."""
+    return _request_lengths(path, os.stat(path).st_mtime_ns)
+
+
+def sample_lengths(spec: typing.Union[str, int], batch_size: int, rng: np.random.Generator,
+                   max_len: typing.Optional[int] = None) -> np.ndarray:
+    """[batch_size] int32 lengths following `spec`, clipped to [1, max_len]."""
+    kind, _, params = str(spec).partition(":")
+    if kind.isdigit():
+        kind, params = "fixed", kind
+    if kind == "fixed":
+        lengths = np.full([batch_size], int(params), dtype=np.int32)
+    elif kind == "uniform":
+        low, high = (int(value) for value in params.split(":"))
+        lengths = rng.integers(low, high, size=batch_size, endpoint=True, dtype=np.int32)
+    elif kind == "requests":
+        lengths = rng.choice(request_lengths(params), size=batch_size)
+    else:
+        raise ValueError(f"Unknown length spec {spec!r}, expected N, fixed:N, uniform:MIN:MAX or requests:PATH")
+    return np.clip(lengths, 1, max_len).astype(np.int32)
+
+
+def _cache_key(*parts: typing.Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def generate(batch_size: int, lengths: typing.Union[str, int], vocab_size: int,
+             exclude: typing.Iterable[int] = (), seed: int = 0, pad_id: int = 0,
+             last_token: typing.Optional[int] = None, max_len: typing.Optional[int] = None,
+             cache_dir: typing.Optional[str] = DEFAULT_CACHE_DIR) -> SyntheticBatch:
+    """A batch of random token ids; see the module docstring. `cache_dir=None` turns the cache off."""
+    exclude = sorted({int(token) for token in exclude if 0 <= token < vocab_size})
+    spec = str(lengths)
+    cache_path = None
+    if cache_dir is not None:
+        source = spec
+        if spec.startswith("requests:"):
+            with open(spec.partition(":")[2], "rb") as f:
+                source = hashlib.sha256(f.read()).hexdigest()
+        key = _cache_key(batch_size, source, vocab_size, exclude, seed, pad_id, last_token, max_len)
+        cache_path = os.path.join(cache_dir, f"inputs-{key}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                return SyntheticBatch(cached["input_ids"], cached["lengths"])
+
+    rng = np.random.default_rng(seed)
+    row_lengths = sample_lengths(spec, batch_size, rng, max_len)
+    width = int(row_lengths.max())
+    allowed = np.setdiff1d(np.arange(vocab_size, dtype=np.int32), np.asarray(exclude, dtype=np.int32),
+                           assume_unique=True)
+    input_ids = allowed[rng.integers(0, len(allowed), size=(batch_size, width))]
+    if last_token is not None:
+        input_ids[np.arange(batch_size), row_lengths - 1] = last_token
+    input_ids[np.arange(width)[None, :] >= row_lengths[:, None]] = pad_id
+    batch = SyntheticBatch(input_ids, row_lengths)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, input_ids=batch.input_ids, lengths=batch.lengths)
+        os.replace(tmp_path, cache_path)
+    return batch
+
+
+def write_csv(path: str, batch: SyntheticBatch):
+    """Writes each row up to its length as a line of comma-separated ids, like start_ids.csv."""
+    with open(path, "w") as f:
+        if (batch.lengths == batch.input_ids.shape[1]).all():
+            np.savetxt(f, batch.input_ids, fmt="%d", delimiter=", ")
+            return
+        for row, length in zip(batch.input_ids, batch.lengths):
+            f.write(", ".join(map(str, row[:length].tolist())) + "\n")
@@ -1,22 +1,22 @@
 import os
-from typing import Dict
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../.."))
+from examples.pytorch import startup
+startup.begin()
+from typing import Dict, List
 import argparse
 import timeit
-import datetime
 import logging
-import configparser
-import math
-from utils.ft_decoding import FTT5DecodingWeight, FTT5Decoding, FTT5
-from utils.ft_encoder import FTT5EncoderWeight, FTT5Encoder
 from together_worker.fast_inference import FastInferenceInterface
-from together_web3.computer import RequestTypeLanguageModelInference
+from together_web3.computer import RequestTypeLanguageModelInference, RequestTypeShutdown
 from together_web3.together import TogetherWeb3, TogetherClientOptions
+from examples.pytorch.encoder_cache import EncoderOutputCache
+from examples.pytorch.match_batcher import DEFAULT_BATCH_WINDOW, MatchBatcher
+from examples.pytorch.model_factory import DEFAULT_LIB_DIR, LIB_DIR_ENV, build_model, load_tokenizer, read_config
+from examples.pytorch.warmup import DEFAULT_SHAPES, parse_shapes, run_warmup, warmup_enabled
 import torch
 import torch.distributed as dist
-from torch.nn.utils.rnn import pad_sequence
 from utils.para_utils import *
-from transformers import AutoTokenizer, AutoConfig, T5Config
-import numpy as np
 
 
 class FastT5Inference(FastInferenceInterface):
@@ -32,211 +32,135 @@ class FastT5Inference(FastInferenceInterface):
         self.pipeline_para_size = 1
         self.max_batch_size = args['max_batch_size']
         self.random_seed_tensor = torch.zeros([self.max_batch_size], dtype=torch.int64)
+        # matches arriving within batch_window seconds are run as one batch; a shutdown runs alone, since
+        # the base class only dispatches it when it comes first
+        self.batcher = MatchBatcher(self._together_batch, self.max_batch_size,
+                                    args.get('batch_window', DEFAULT_BATCH_WINDOW),
+                                    alone_request_types=(RequestTypeShutdown,))
+        # encoder outputs of recent inputs, reused by requests that only change the decoding settings
+        self.encoder_cache = EncoderOutputCache(int(args.get('encoder_cache_gpu_mb', 0) * 2**20),
+                                                int(args.get('encoder_cache_host_mb', 0) * 2**20))
+        # one entry per row of the batch, except for beam_width
         self.task_info={
             "prompt_seqs": None,
-            "output_len":16,
+            "output_len": [],
             "beam_width": 1,
-            "top_k": 50,
-            "top_p": 0,
-            "beam_search_diversity_rate": 0,
-            "temperature": 0.1,
-            "len_penalty": 0,
-            "repetition_penalty": 1.0,
-            "return_output_log_probs": 0,
-            "return_cum_log_probs":0,
-            "return_cross_attentions":0
+            "top_k": [],
+            "top_p": [],
+            "beam_search_diversity_rate": [],
+            "temperature": [],
+            "len_penalty": [],
+            "repetition_penalty": [],
+            "stop": [],
         }
-        self.tokenizer = AutoTokenizer.from_pretrained(args['hf_model_name'], use_fast=False)
-        self.tokenizer.pad_token = self.tokenizer.eos_token
-        
+        self.model_name = model_name
+        self.warmup_shapes = parse_shapes(args.get('warmup_shapes', DEFAULT_SHAPES))
         ckpt_path = args['ckpt_path']
-        ckpt_config = configparser.ConfigParser()
-        ckpt_config_path = os.path.join(ckpt_path, 'config.ini')
-        if os.path.isfile(ckpt_config_path):
-            ckpt_config.read(ckpt_config_path)
-        else:
-            assert False, "[ERROR] This example only support loading model with FT format directly."
-        weight_data_type = np.float16
-        relative_attention_max_distance = 128
-        self.end_id = ckpt_config.getint("decoder", "eos_token_id")
-        encoder_config = T5Config(vocab_size=ckpt_config.getint("encoder", "vocab_size"),
-                                  d_model=ckpt_config.getint("encoder", "d_model"),
-                                  d_kv=ckpt_config.getint("encoder", "d_kv"),
-                                  d_ff=ckpt_config.getint("encoder", "d_ff"),
-                                  num_layers=ckpt_config.getint("encoder", "num_layers"),
-                                  num_decoder_layers=ckpt_config.getint("encoder", "num_decoder_layers"),
-                                  num_heads=ckpt_config.getint("encoder", "num_heads"),
-                                  relative_attention_num_buckets=ckpt_config.getint(
-                                      "encoder", "relative_attention_num_buckets_or_max_pos_seq_len"),
-                                  feed_forward_proj=ckpt_config.get("encoder", "feed_forward_proj"),
-                                  pad_token_id=ckpt_config.getint("encoder", "pad_token_id"),
-                                  eos_token_id=ckpt_config.getint("encoder", "eos_token_id"),
-                                  is_gated_act=ckpt_config.getboolean("encoder", "is_gated_act", fallback=0),
-                                  )
-        decoder_config = T5Config(vocab_size=ckpt_config.getint("decoder", "vocab_size"),
-                                  d_model=ckpt_config.getint("decoder", "d_model"),
-                                  d_kv=ckpt_config.getint("decoder", "d_kv"),
-                                  d_ff=ckpt_config.getint("decoder", "d_ff"),
-                                  num_layers=ckpt_config.getint("decoder", "num_layers"),
-                                  num_decoder_layers=ckpt_config.getint("decoder", "num_decoder_layers"),
-                                  num_heads=ckpt_config.getint("decoder", "num_heads"),
-                                  relative_attention_num_buckets=ckpt_config.getint(
-                                      "decoder", "relative_attention_num_buckets_or_max_pos_seq_len"),
-                                  feed_forward_proj=ckpt_config.get("decoder", "feed_forward_proj"),
-                                  pad_token_id=ckpt_config.getint("decoder", "pad_token_id"),
-                                  eos_token_id=ckpt_config.getint("decoder", "eos_token_id"),
-                                  decoder_start_token_id=ckpt_config.getint("decoder", "decoder_start_token_id"),
-                                  is_gated_act=ckpt_config.getboolean("decoder", "is_gated_act", fallback=0),
-                                  )
-        
-        assert decoder_config.feed_forward_proj == encoder_config.feed_forward_proj
-        assert decoder_config.feed_forward_proj == encoder_config.feed_forward_proj
-        
-        t5_with_bias = ckpt_config.getboolean("structure", "t5_with_bias")
-        use_gated_activation = encoder_config.is_gated_act
-        position_embedding_type = 0 if ckpt_config.get('structure', 'position_embedding_type') == 'relative' else 1
-        activation_type = encoder_config.feed_forward_proj
-        lib_path = '/workspace/Port_FasterTransformer/build/lib/libth_t5.so'
+        tokenizer = startup.in_background("load tokenizer", load_tokenizer, ckpt_path, args['hf_model_name'])
+        self.end_id = read_config(ckpt_path).end_id
+        torch.manual_seed(0)
+        self.ft_t5 = build_model(ckpt_path, self.tensor_para_size, self.pipeline_para_size, lib_dir=args.get('lib_dir'))
+        self.tokenizer = tokenizer.result()
+        print(f"<FastT5Inference.__init__> initialization done <{args['hf_model_name']}>")
+    
+    def warmup(self):
+        if warmup_enabled():
+            run_warmup(self._warmup_request, self.model_name, self.warmup_shapes)
 
-        # https://github.com/huggingface/transformers/blob/main/src/transformers/models/t5/modeling_t5.py#L1660
-        # if tie_word_embeddings == True, scale the decoder output by sequence_output = sequence_output * (self.model_dim**-0.5)
-        tie_word_embeddings = ckpt_config.getboolean("decoder", "tie_word_embeddings")
-        ft_encoder_weight = FTT5EncoderWeight(
-            encoder_config,
-            self.tensor_para_size,
-            self.pipeline_para_size,
-            t5_with_bias=t5_with_bias,
-            use_gated_activation=use_gated_activation,
-            position_embedding_type=position_embedding_type,
-            weight_data_type=weight_data_type
-        )
-        ft_decoding_weight = FTT5DecodingWeight(
-            decoder_config,
-            self.tensor_para_size,
-            self.pipeline_para_size,
-            t5_with_bias=t5_with_bias,
-            use_gated_activation=use_gated_activation,
-            position_embedding_type=position_embedding_type,
-            weight_data_type=weight_data_type,
-        )
-        
-        start_time = datetime.datetime.now()
-        ft_encoder_weight.load_from_bin(ckpt_path)
-        stop_time = datetime.datetime.now()
-        print(f"[INFO] load FT encoder model spend {(stop_time - start_time).total_seconds()} sec")
-        start_time = datetime.datetime.now()
-        ft_decoding_weight.load_from_bin(ckpt_path)
-        stop_time = datetime.datetime.now()
-        print(f"[INFO] load FT decoding model spend {(stop_time - start_time).total_seconds()} sec")
-        ft_encoder_weight.to_half()
-        ft_decoding_weight.to_half()
-        
-        ft_encoder_weight.to_cuda()
-        ft_decoding_weight.to_cuda()
+    def _warmup_request(self, input_len, output_len):
+        self.dispatch_request([{"prompt": " the" * input_len, "max_tokens": output_len}], None)
 
-        q_scaling = 1.0 / (math.sqrt(encoder_config.d_kv))
-        remove_padding = True
-        torch.manual_seed(0)
-        with torch.no_grad():
-            ft_encoder = FTT5Encoder(ft_encoder_weight.w, lib_path, encoder_config.num_heads,
-                                    encoder_config.d_kv, encoder_config.d_ff,
-                                    encoder_config.d_model, remove_padding, encoder_config.num_layers,
-                                    encoder_config.relative_attention_num_buckets,
-                                    relative_attention_max_distance, False, q_scaling, self.tensor_para_size,
-                                    self.pipeline_para_size, t5_with_bias,
-                                    position_embedding_type, activation_type=activation_type)
+    def start(self):
+        # the worker joins the coordinator in start(), so it only becomes ready once it is warm
+        with startup.phase("warmup"):
+            self.warmup()
+        startup.report()
+        super().start()
 
-            ft_decoding = FTT5Decoding(ft_decoding_weight.w, lib_path,
-                                    decoder_config.num_heads, decoder_config.d_kv,
-                                    decoder_config.d_ff, encoder_config.d_model,
-                                    decoder_config.d_model, decoder_config.num_layers,
-                                    decoder_config.decoder_start_token_id, decoder_config.eos_token_id,
-                                    decoder_config.vocab_size, q_scaling,
-                                    decoder_config.relative_attention_num_buckets, max_distance=relative_attention_max_distance,
-                                    tensor_para_size=self.tensor_para_size, pipeline_para_size=self.pipeline_para_size,
-                                    t5_with_bias=t5_with_bias, position_embedding_type=position_embedding_type,
-                                    activation_type=activation_type, tie_word_embeddings=tie_word_embeddings)
+    async def together_request(self, match_event, raw_event):
+        await self.batcher.submit(match_event, raw_event)
 
-            self.ft_t5 = FTT5(ft_encoder, ft_decoding)
-        print(f"<FastT5Inference.__init__> initialization done <{args['hf_model_name']}>")
-    
-    def dispatch_request(self, args, env) -> Dict:
+    async def _together_batch(self, match_events, raw_events):
+        await super().together_request(match_events, raw_events)
+
+    def dispatch_request(self, args, env) -> List[Dict]:
         print(f"dispatch_request get {args}")
-        args = args[0]
-        args = {k: v for k, v in args.items() if v is not None}
-        # Inputs
-        self.task_info["prompt_seqs"] = [args['prompt']]
-        self.task_info["output_len"] = get_int(args.get("max_tokens", 16), default=16)
-        self.task_info["beam_width"] = get_int(args.get("beam_width", 1), default=1)
-        self.task_info["top_k"] = get_int(args.get("top_k", 50), default=50)
-        self.task_info["top_p"] = get_float(args.get("top_p", 0.0), default=0.0)
-        self.task_info["beam_search_diversity_rate"] = get_float(args.get("beam_search_diversity_rate", 0.0), default=0.0)
-        self.task_info["temperature"] = get_float(args.get("temperature", 0.8), default=0.1)
-        self.task_info["len_penalty"] = get_float(args.get("len_penalty", 0.0), default=0.0)
-        self.task_info["repetition_penalty"] = get_float(args.get("repetition_penalty", 1.0), default=1.0)
-        self.task_info["stop"] = args.get("stop", [])
-        self.task_info["stream_tokens"] = args.get("stream_tokens", False)
-        self.task_info["return_output_log_probs"] = args.get("return_output_log_probs", 0)
-        self.task_info["return_cum_log_probs"] = args.get("return_cum_log_probs", 0)
-        self.task_info["return_cross_attentions"] = args.get("return_cross_attentions", 0)
-        
-        result = self._run_inference()
-        print(f"<FastT5Inference.dispatch_request> return: {result}")
-        return result
+        requests = [{k: v for k, v in arg.items() if v is not None} for arg in args]
+        results = [None] * len(requests)
+        for i, request in enumerate(requests):
+            if is_empty_request(request):
+                results[i] = self._empty_result(get_int(request.get("beam_width", 1), default=1))
+        for rows, task_info in batch_task_infos(requests, self.max_batch_size):
+            self.task_info = task_info
+            for i, result in zip(rows, self._run_inference()):
+                results[i] = result
+        print(f"<FastT5Inference.dispatch_request> return: {results}")
+        return results
+
+    def _empty_result(self, beam_width):
+        return {
+            "result_type": RequestTypeLanguageModelInference,
+            "choices": [{"text": '', "index": beam_id, "finish_reason": "length"} for beam_id in range(beam_width)],
+            "raw_compute_time": 0.0
+        }
 
     def _run_inference(self):
         print(f"<FastT5Inference._run_inference> enter rank-<{dist.get_rank()}>")
         
         with torch.no_grad():
             contexts = self.task_info["prompt_seqs"]
-            line_tokens = self.tokenizer(contexts, return_tensors='pt')
+            batch_size = len(contexts)
+            beam_width = self.task_info["beam_width"]
+            token_ids = self.tokenizer(contexts).input_ids
             
             time = timeit.default_timer()
-            max_batch_size = self.max_batch_size
-            tokens_batch, ft_output_len = self.ft_t5(
-                                      line_tokens,
-                                      None,
-                                      self.task_info["beam_width"],
-                                      self.task_info["output_len"],
-                                      self.task_info["top_k"] * torch.ones(size=[max_batch_size], dtype=torch.int32),
-                                      self.task_info["top_p"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                      self.task_info["beam_search_diversity_rate"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                      self.task_info["temperature"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                      self.task_info["len_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                      self.task_info["repetition_penalty"] * torch.ones(size=[max_batch_size], dtype=torch.float32),
-                                      self.random_seed_tensor,
+            # the rows not in the cache are encoded together, padded to the longest one; the encoder
+            # drops the padding again using the per-row lengths
+            ft_encoder_outputs, mem_seq_len = self.encoder_cache.encode(token_ids, self.ft_t5.encode)
+            tokens_batch, ft_output_len = self.ft_t5.decode(
+                                      ft_encoder_outputs,
+                                      mem_seq_len,
+                                      beam_width,
+                                      max(self.task_info["output_len"]),
+                                      torch.tensor(self.task_info["top_k"], dtype=torch.int32),
+                                      torch.tensor(self.task_info["top_p"], dtype=torch.float32),
+                                      torch.tensor(self.task_info["beam_search_diversity_rate"], dtype=torch.float32),
+                                      torch.tensor(self.task_info["temperature"], dtype=torch.float32),
+                                      torch.tensor(self.task_info["len_penalty"], dtype=torch.float32),
+                                      torch.tensor(self.task_info["repetition_penalty"], dtype=torch.float32),
+                                      self.random_seed_tensor[:batch_size],
                                       False, #self.task_info["return_output_log_probs"],
                                       False, #self.task_info["return_cum_log_probs"],
                                       False #self.task_info["return_cross_attentions"]
                                       )
             # only a thread (rank 0) gets the output, while the others are supposed to return None.
             time_elapsed = timeit.default_timer() - time
-        print("[INFO] T5 time costs: {:.2f} ms. ft_output_len: <{}>".format(time_elapsed * 1000, ft_output_len))
+        print("[INFO] T5 time costs: {:.2f} ms for {} rows. ft_output_len: <{}>, encoder cache: {}".format(
+            time_elapsed * 1000, batch_size, ft_output_len, self.encoder_cache.stats()))
         
         assert tokens_batch is not None
     
-        inferenece_result = []
-        
-        for i in range(len(contexts)):
-            item = {'choices': [], }
-            for beam_id in range(self.task_info["beam_width"]):
-                token = tokens_batch[i, beam_id][: ft_output_len[i, beam_id]]  # exclude context input from the output
+        results = []
+        for i in range(batch_size):
+            choices = []
+            for beam_id in range(beam_width):
+                # the batch decodes up to the longest max_tokens; cut each row to its own
+                output_len = min(ft_output_len[i, beam_id], self.task_info["output_len"][i])
+                token = tokens_batch[i, beam_id][:output_len]
                 output = self.tokenizer.decode(token)
                 print(f"[INFO] batch {i}, beam {beam_id}: \n[Context]\n{contexts[i]}\n\n[Output]\n{output}\n")
-                choice = {
-                    "text": post_processing_text(output, self.task_info["stop"]),
+                choices.append({
+                    "text": post_processing_text(output, self.task_info["stop"][i]),
                     "index": beam_id,
                     "finish_reason": "length"
-                }
-            item['choices'].append(choice)
-            inferenece_result.append(item)
-        #  So far coordinator does not support batch. 
-        return {
-            "result_type": RequestTypeLanguageModelInference,
-            "choices": inferenece_result[0]['choices'],
-            "raw_compute_time": time_elapsed
-        }
-        
+                })
+            results.append({
+                "result_type": RequestTypeLanguageModelInference,
+                "choices": choices,
+                "raw_compute_time": time_elapsed
+            })
+        return results
+
 
 if __name__ == "__main__":
     
@@ -245,13 +169,27 @@ if __name__ == "__main__":
     parser.add_argument('--together_model_name', type=str, default='Together-t5-11b',
                         help='worker name for together coordinator.')
     parser.add_argument('--hf_model_name', type=str, default='t5-11b',
-                        help='hugging face model name (used to load config).')
+                        help='hugging face model name (used to load the tokenizer when the checkpoint has none).')
     parser.add_argument('--ckpt_path', type=str, default='/workspace/Port_FasterTransformer/build/model/t5-11b-tp1/1-gpu',
                         help='path to the checkpoint file.')
     # parser.add_argument('--worker_name', type=str, default='worker1',
     #                      help='worker name for together coordinator.')
+    parser.add_argument('--lib_dir', type=str, default=os.environ.get(LIB_DIR_ENV, DEFAULT_LIB_DIR),
+                        help='directory with the FasterTransformer op libraries.')
     parser.add_argument('--group_name', type=str, default='group1',
                         help='group name for together coordinator.')
+    parser.add_argument('--max_batch_size', type=int, default=int(os.environ.get('MAX_BATCH_SIZE', 8)),
+                        help='matches run together in one encoder/decoding call.')
+    parser.add_argument('--encoder_cache_gpu_mb', type=float, default=float(os.environ.get('ENCODER_CACHE_GPU_MB', 256)),
+                        help='MiB of GPU memory for cached encoder outputs; 0 disables the cache.')
+    parser.add_argument('--encoder_cache_host_mb', type=float, default=float(os.environ.get('ENCODER_CACHE_HOST_MB', 1024)),
+                        help='MiB of pinned host memory for encoder outputs evicted from the GPU.')
+    parser.add_argument('--batch_window_ms', type=float, default=float(os.environ.get('BATCH_WINDOW_MS', DEFAULT_BATCH_WINDOW * 1000)),
+                        help='milliseconds to wait for more matches before running a batch.')
+    parser.add_argument('--warmup_shapes', type=str, default=os.environ.get('WARMUP_SHAPES', DEFAULT_SHAPES),
+                        help='input_len:output_len pairs run before joining the coordinator (WARMUP=0 skips warmup).')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print an import and initialization timeline once the worker is ready.')
     
     args = parser.parse_args()
     
@@ -266,7 +204,12 @@ if __name__ == "__main__":
         "hf_model_name": args.hf_model_name,
         "group_name": args.group_name,
         "ckpt_path": args.ckpt_path,
+        "lib_dir": args.lib_dir,
         "stream_tokens_pipe": False,
-        "max_batch_size":1
+        "max_batch_size": args.max_batch_size,
+        "batch_window": args.batch_window_ms / 1000,
+        "encoder_cache_gpu_mb": args.encoder_cache_gpu_mb,
+        "encoder_cache_host_mb": args.encoder_cache_host_mb,
+        "warmup_shapes": args.warmup_shapes,
     })
     fip.start()
\ No newline at end of file
@@ -39,6 +39,39 @@ def post_processing_text(output_text, stop_tokens):
     print(f"<post_processing_text> output: {post_processed_text}")
     return post_processed_text
 
+def is_empty_request(request) -> bool:
+    return len(str(request.get("prompt", ""))) == 0 or get_int(request.get("max_tokens", 16), default=16) == 0
+
+
+def batch_task_infos(requests, max_batch_size):
+    """Yields (row indices, task_info) for batches of the non-empty requests that share a beam width.
+
+    Apart from beam_width, which an ft_t5 call takes for the whole batch, each task_info entry
+    is a list with one value per row.
+    """
+    rows_by_beam_width = {}
+    for i, request in enumerate(requests):
+        if not is_empty_request(request):
+            rows_by_beam_width.setdefault(get_int(request.get("beam_width", 1), default=1), []).append(i)
+    for beam_width, rows in rows_by_beam_width.items():
+        for start in range(0, len(rows), max_batch_size):
+            batch = [requests[i] for i in rows[start:start + max_batch_size]]
+            yield rows[start:start + max_batch_size], {
+                "prompt_seqs": [str(request["prompt"]) for request in batch],
+                "output_len": [get_int(request.get("max_tokens", 16), default=16) for request in batch],
+                "beam_width": beam_width,
+                "top_k": [get_int(request.get("top_k", 50), default=50) for request in batch],
+                "top_p": [get_float(request.get("top_p", 0.0), default=0.0) for request in batch],
+                "beam_search_diversity_rate": [get_float(request.get("beam_search_diversity_rate", 0.0), default=0.0)
+                                               for request in batch],
+                "temperature": [get_float(request.get("temperature", 0.8), default=0.1) for request in batch],
+                "len_penalty": [get_float(request.get("len_penalty", 0.0), default=0.0) for request in batch],
+                "repetition_penalty": [get_float(request.get("repetition_penalty", 1.0), default=1.0)
+                                       for request in batch],
+                "stop": [request.get("stop", []) for request in batch],
+            }
+
+
 def recover_bpe(src):
     dst = []
     for line in src:
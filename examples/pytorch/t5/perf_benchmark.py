@@ -40,6 +40,7 @@ from transformers import T5ForConditionalGeneration # transformers-4.10.0-py3
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dir_path + "/../../..")
 
+from examples.pytorch import synthetic_inputs
 from examples.pytorch.t5.utils.ft_encoder import FTT5EncoderWeight, FTT5Encoder
 from examples.pytorch.t5.utils.ft_decoding import FTT5DecodingWeight, FTT5Decoding, FTT5
 
@@ -57,21 +58,12 @@ class TranslationResult(object):
         self.token_num = 0
 
 class InputTokens(object):
-    def __init__(self, batch_size, input_seq_len, bos_token, eos_token, vocab_size):
-        # Set the last token of each sequence to eos and replace the bos/eos tokens in the middle of the sequences to
-        # some other tokens.
-        normal_token_list = list(range(vocab_size))
-        if bos_token in normal_token_list:
-            normal_token_list.remove(bos_token)
-        if eos_token in normal_token_list:
-            normal_token_list.remove(eos_token)
-        self.input_ids = torch.randint(0, len(normal_token_list), (batch_size, input_seq_len))
-        for batch_idx in range(batch_size):
-            for token_idx in range(input_seq_len):
-                if token_idx == input_seq_len - 1:
-                    self.input_ids[batch_idx][token_idx] = eos_token
-                else:
-                    self.input_ids[batch_idx][token_idx] = normal_token_list[self.input_ids[batch_idx][token_idx]]
+    def __init__(self, batch_size, input_seq_len, bos_token, eos_token, vocab_size, seed=0):
+        # Set the last token of each sequence to eos and draw the other tokens from the vocabulary without the
+        # bos/eos tokens.
+        batch = synthetic_inputs.generate(batch_size, input_seq_len, vocab_size, exclude=(bos_token, eos_token),
+                                          seed=seed, last_token=eos_token)
+        self.input_ids = torch.from_numpy(batch.input_ids.astype(np.int64))
         # Set attention masks to all ones.
         self.attention_mask = torch.ones((batch_size, input_seq_len), dtype=torch.int64)
 
@@ -265,7 +257,7 @@ def translate(args_dict):
 
         ft_t5 = FTT5(ft_encoder, ft_decoding)
 
-    input_token = InputTokens(batch_size, input_seq_len, decoder_config.decoder_start_token_id, decoder_config.eos_token_id, decoder_config.vocab_size)
+    input_token = InputTokens(batch_size, input_seq_len, decoder_config.decoder_start_token_id, decoder_config.eos_token_id, decoder_config.vocab_size, seed)
 
     for i in range(len(translation_result_list)):
         sys.stdout.flush()
@@ -351,7 +351,21 @@ class FTT5(nn.Module):
         else:
             mem_seq_len = input_token.seq_len.type(torch.int32).to("cuda")
 
-        ft_encoder_outputs = self.encoder.forward(input_ids, mem_seq_len, inputs_embeds)
+        ft_encoder_outputs = self.encode(input_ids, mem_seq_len, inputs_embeds)
+        return self.decode(ft_encoder_outputs, mem_seq_len, beam_size, max_seq_len,
+                           top_k, top_p, beam_search_diversity_rate,
+                           temperature, len_penalty, repetition_penalty, random_seed,
+                           is_return_output_log_probs, is_return_cum_log_probs, is_return_cross_attentions)
+
+    def encode(self, input_ids, mem_seq_len, inputs_embeds=None):
+        """Runs the encoder alone; input_ids [batch, seq_len] and mem_seq_len [batch] are int32 on the GPU."""
+        return self.encoder.forward(input_ids, mem_seq_len, inputs_embeds)
+
+    def decode(self, ft_encoder_outputs, mem_seq_len, beam_size, max_seq_len,
+               top_k, top_p, beam_search_diversity_rate,
+               temperature=1.0, len_penalty=0.0, repetition_penalty=1.0, random_seed=0,
+               is_return_output_log_probs=False, is_return_cum_log_probs=False, is_return_cross_attentions=False):
+        """Runs the decoding on encoder outputs, e.g. of `encode` or cached ones."""
         results = self.decoding.forward(beam_size,  # optional, can be None
                                         max_seq_len,
                                         top_k,  # optional, can be None
@@ -22,12 +22,15 @@ import sys
 import os
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dir_path + "/../../../../3rdparty/transformers/src/")
+sys.path.append(dir_path + "/../../../..")
 
 from transformers import T5ForConditionalGeneration # transformers-4.10.0-py3
 
 import numpy as np
 import torch  # pytype: disable=import-error
 
+from examples.pytorch.ckpt_manifest import save_weight, write_manifest
+
 LOGGER = logging.getLogger(__name__)
 
 rename_mapping={"relative_attention_num_buckets":"relative_attention_num_buckets_or_max_pos_seq_len"}
@@ -59,7 +62,7 @@ def fuse_decoder_qkv(model, factor, saved_dir, np_weight_data_type):
         split_vals = np.split(qkv, factor, axis=-1)
         for j in range(factor):
             saved_path = saved_dir / f"decoder.block.{i}.layer.0.SelfAttention.qkv.weight.{j}.bin"
-            split_vals[j].tofile(saved_path.as_posix())
+            save_weight(split_vals[j], saved_path.as_posix())
  
 def split_and_convert_process(key, val, factor, saved_dir, np_weight_data_type):
     if val.dim() == 2:
@@ -71,20 +74,20 @@ def split_and_convert_process(key, val, factor, saved_dir, np_weight_data_type):
     if key.find("shared.weight") != -1:
         # shared weights, only need to convert the weights of rank 0
         saved_path = saved_dir / f"{saved_key}.bin"
-        val.tofile(saved_path.as_posix())
+        save_weight(val, saved_path.as_posix())
         
         saved_path = saved_dir / f"{saved_key}_T.bin"
-        val.T.tofile(saved_path.as_posix())
+        save_weight(val.T, saved_path.as_posix())
     elif key.find("lm_head.weight") != -1:
         # lm_head weights, only need to convert the weights of rank 0
         val = val.transpose(1, 0) # For lm_head, we use TN gemm to compute, so we don't need to transpose
         saved_path = saved_dir / f"{saved_key}.bin"
-        val.tofile(saved_path.as_posix())
+        save_weight(val, saved_path.as_posix())
         
     elif key.find("layer_norm.weight") != -1:
         # shared weights, only need to convert the weights of rank 0
         saved_path = saved_dir / f"{saved_key}.bin"
-        val.tofile(saved_path.as_posix())
+        save_weight(val, saved_path.as_posix())
 
     elif (
         key.find("SelfAttention.o.weight") != -1
@@ -94,7 +97,7 @@ def split_and_convert_process(key, val, factor, saved_dir, np_weight_data_type):
         split_vals = np.split(val, factor, axis=0)
         for j in range(factor):
             saved_path = saved_dir / f"{saved_key}.{j:d}.bin"
-            split_vals[j].tofile(saved_path.as_posix())
+            save_weight(split_vals[j], saved_path.as_posix())
 
     elif (
         key.find("DenseReluDense.wi.weight") != -1 
@@ -111,7 +114,7 @@ def split_and_convert_process(key, val, factor, saved_dir, np_weight_data_type):
         split_vals = np.split(val, factor, axis=-1)
         for j in range(factor):
             saved_path = saved_dir / f"{saved_key}.{j:d}.bin"
-            split_vals[j].tofile(saved_path.as_posix())
+            save_weight(split_vals[j], saved_path.as_posix())
     elif (
         key.find("DenseReluDense.wi_0.weight") != -1 
         or key.find("DenseReluDense.wi_1.weight") != -1
@@ -124,12 +127,12 @@ def split_and_convert_process(key, val, factor, saved_dir, np_weight_data_type):
         split_vals = np.split(val, factor, axis=-1)
         for j in range(factor):
             saved_path = saved_dir / f"{saved_key}.{j:d}.bin"
-            split_vals[j].tofile(saved_path.as_posix())
+            save_weight(split_vals[j], saved_path.as_posix())
     elif key.find("relative_attention_bias") != -1:
         split_vals = np.split(val, factor, axis=0)
         for j in range(factor):
             saved_path = saved_dir / f"{saved_key}.{j:d}.bin"
-            split_vals[j].tofile(saved_path.as_posix())
+            save_weight(split_vals[j], saved_path.as_posix())
     elif (
         key.find("decoder") != -1 and 
         (
@@ -179,6 +182,7 @@ def convert_checkpoint(args):
     for name, param in t5_model.state_dict().items():
         split_and_convert_process(name, param, i_gpu_num, saved_dir, np_weight_data_type)
     fuse_decoder_qkv(t5_model, i_gpu_num, saved_dir, np_weight_data_type)
+    write_manifest(saved_dir)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
@@ -15,6 +15,7 @@
 import argparse
 import configparser
 from datetime import datetime
+import functools
 import multiprocessing
 import shutil
 from pathlib import Path
@@ -24,6 +25,12 @@ import torch  # pytype: disable=import-error
 import sys
 
 sys.path.append("/workdir/megatron-lm")
+sys.path.append(str(Path(__file__).parent.parent.parent.parent.parent.absolute()))
+
+from examples.pytorch.ckpt_conversion import (
+    ConversionManifest, ConversionStage, ConversionTask, load_checkpoint, run_conversion_plan
+)
+from examples.pytorch.utils import cpu_map_location, gpu_map_location
 
 shared_mapping = {
     "wte":"shared.weight",
@@ -119,16 +126,6 @@ def convert_megatron_to_HF_naming_style_multiple(saved_key, name_mapping):
     saved_keys = [block_num + val + "." + weight_or_bias for val in mapping_vals_no_num]
     return saved_keys
 
-def _gpu_map_location(storage, loc):
-    if loc.startswith("cuda"):
-        training_gpu_idx = int(loc.split(":")[1])
-        inference_gpu_idx = training_gpu_idx % torch.cuda.device_count()
-        return storage.cuda(inference_gpu_idx)
-    elif loc.startswith("cpu"):
-        return storage.cpu()
-    else:
-        raise NotImplementedError(f"Not handled {loc}")
-
 # This tool is used to support the new megatron model trained by pipeline parallel + tensor parallel
 def merge_and_convert_process(model_type, i, pipeline_para_rank, saved_dir, factor, key, model_args, transformer_model_list, ckpt_ver, np_weight_data_type):
     prefix = model_type
@@ -356,6 +353,7 @@ def split_and_convert_process(model_type, i, pipeline_para_rank, saved_dir, fact
 def convert_checkpoint(args):
     saved_dir = Path(args.saved_dir) / f"{args.infer_gpu_num:d}-gpu"
     saved_dir.mkdir(parents=True, exist_ok=True)
+    manifest = ConversionManifest(saved_dir, resume=args.resume)
 
     if args.vocab_path:
         shutil.copy(args.vocab_path, (saved_dir / "vocab.json").as_posix())
@@ -365,11 +363,13 @@ def convert_checkpoint(args):
     prefix = Path(args.in_file)
     ckpt_name = "model_optim_rng.pt"
 
+    map_location_fn = cpu_map_location if bool(args.load_checkpoints_to_cpu) else gpu_map_location
+
     # load position_embedding from rank 0
     if (prefix / "mp_rank_00").is_dir():
-        model_00 = torch.load((prefix / "mp_rank_00" / ckpt_name).as_posix(), map_location=_gpu_map_location)
+        model_00 = load_checkpoint((prefix / "mp_rank_00" / ckpt_name).as_posix(), map_location=map_location_fn)
     elif (prefix / "mp_rank_00_000").is_dir():
-        model_00 = torch.load((prefix / "mp_rank_00_000" / ckpt_name).as_posix(), map_location=_gpu_map_location)
+        model_00 = load_checkpoint((prefix / "mp_rank_00_000" / ckpt_name).as_posix(), map_location=map_location_fn)
     else:
         print(f"[ERROR] Cannot find checkpoint in {prefix}.")
         exit(1)
@@ -457,9 +457,40 @@ def convert_checkpoint(args):
     del model_00
     w_e_list = []
 
-    torch.multiprocessing.set_start_method("spawn")
-    torch.multiprocessing.set_sharing_strategy("file_system")
-    pool = multiprocessing.Pool(args.processes)
+    # Plan one task per (model type, tp rank, pp rank, weight) while each stage's shards are loaded; workers
+    # load only the tensors of their own task, on the CPU.
+    convert_fn = merge_and_convert_process if is_merge_ckpt == True else split_and_convert_process
+    lm_head_biases = []
+
+    def plan_stage(i, j, shard_paths, checkpoints):
+        for m in checkpoints:
+            if j == 0:
+                w_e_list.append(
+                    m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"]
+                    .float()
+                    .cpu()
+                    .numpy()
+                    .astype(np_weight_data_type)
+                )
+            lm_head_biases.append(m["model"]["lm_head"]["bias"].float().cpu().numpy())
+        checkpoint_version = checkpoints[0]["checkpoint_version"]
+        return [
+            ConversionTask(
+                name=f"{model_type}.tp{i}.pp{j}.{k}",
+                shard_paths=shard_paths,
+                state_path=("model", "language_model", model_type),
+                state_key=k,
+                key=k,
+                convert_fn=functools.partial(
+                    convert_fn, model_type, i, j, saved_dir, factor, k, model_args,
+                    ckpt_ver=checkpoint_version, np_weight_data_type=np_weight_data_type,
+                ),
+            )
+            for model_type in ["encoder", "decoder"]
+            for k in checkpoints[0]["model"]["language_model"][model_type].keys()
+        ]
+
+    stages = []
     for i in range(main_loop):
         for j in range(model_args.pipeline_model_parallel_size):
             if model_args.pipeline_model_parallel_size == 1:
@@ -467,73 +498,22 @@ def convert_checkpoint(args):
             else:
                 layer_rank_num = f"_{j:03d}"
 
-            encoder_models = []
-            decoder_models = []
-
             if is_merge_ckpt == True:
-                for k in range(factor):
-                    m = torch.load((prefix / f"mp_rank_{i * factor + k:02d}{layer_rank_num}" / ckpt_name).as_posix(), map_location=_gpu_map_location)
-                    encoder_models.append(m["model"]["language_model"]["encoder"])
-                    decoder_models.append(m["model"]["language_model"]["decoder"])
-
-                    if j == 0:
-                        w_e_list.append(m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"].float().cpu().numpy().astype(np_weight_data_type))
+                shard_paths = [(prefix / f"mp_rank_{i * factor + k:02d}{layer_rank_num}" / ckpt_name).as_posix() for k in range(factor)]
             else:
-                m = torch.load((prefix / f"mp_rank_{i:02d}{layer_rank_num}" / ckpt_name).as_posix(), map_location=_gpu_map_location)
-
-                if j == 0:
-                    w_e_list.append(
-                        m["model"]["language_model"]["embedding"]["word_embeddings"]["weight"]
-                        .float()
-                        .cpu()
-                        .numpy()
-                        .astype(np_weight_data_type)
-                    )
-                encoder_models.append(m["model"]["language_model"]["encoder"])
-                decoder_models.append(m["model"]["language_model"]["decoder"])
-
-            pool.starmap(
-                merge_and_convert_process if is_merge_ckpt == True else split_and_convert_process,
-                [
-                    (
-                        "encoder",
-                        i,
-                        j,
-                        saved_dir,
-                        factor,
-                        k,
-                        model_args,
-                        encoder_models,
-                        m["checkpoint_version"],
-                        np_weight_data_type
-                    )
-                    for k in encoder_models[0].keys()
-                ],
-            )
-            pool.starmap(
-                merge_and_convert_process if is_merge_ckpt == True else split_and_convert_process,
-                [
-                    (
-                        "decoder",
-                        i,
-                        j,
-                        saved_dir,
-                        factor,
-                        k,
-                        model_args,
-                        decoder_models,
-                        m["checkpoint_version"],
-                        np_weight_data_type
-                    )
-                    for k in decoder_models[0].keys()
-                ],
-            )
+                shard_paths = [(prefix / f"mp_rank_{i:02d}{layer_rank_num}" / ckpt_name).as_posix()]
+            shard_paths = tuple(shard_paths)
+            stages.append(ConversionStage(shard_paths, functools.partial(plan_stage, i, j, shard_paths)))
 
+    torch.multiprocessing.set_start_method("spawn")
+    torch.multiprocessing.set_sharing_strategy("file_system")
+    pool = multiprocessing.Pool(args.processes)
+    run_conversion_plan(pool, stages, manifest, map_location=map_location_fn)
     pool.close()
     pool.join()
 
     np.concatenate(w_e_list, axis=0).tofile((saved_dir / "shared.weight_T.bin").as_posix())
-    m["model"]["lm_head"]["bias"].float().cpu().numpy().tofile((saved_dir / "shared.bias.bin").as_posix())
+    lm_head_biases[-1].tofile((saved_dir / "shared.bias.bin").as_posix())
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
@@ -543,6 +523,20 @@ if __name__ == "__main__":
     parser.add_argument("-processes", "-p", type=int, help="How many processes to spawn for conversion (default: 64)", default=64)
     parser.add_argument("-weight_data_type", type=str, default="fp32", choices=["fp32", "fp16"])
     parser.add_argument("-model_name", "-m", type=str, help="model name", required=True)
+    parser.add_argument(
+        "--load-checkpoints-to-cpu",
+        "-load_checkpoints_to_cpu",
+        "-cpu",
+        type=int,
+        choices=[0, 1],
+        default=0,
+        help="Whether to load model weights to CPU",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted conversion in an existing output directory, skipping finished weights",
+    )
     parser.add_argument(
         "--vocab-path",
         type=str,
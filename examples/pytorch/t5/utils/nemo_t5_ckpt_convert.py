@@ -34,7 +34,8 @@ if __root_package_path__ not in sys.path:
         f"'export PYTHONPATH={__root_package_path__}:${{PYTHONPATH}}'"
     )
 
-from examples.pytorch.nemo import unpack_nemo_ckpt, UnpackedNemoCheckpointDir, extract_layers_with_prefix
+from examples.pytorch.ckpt_conversion import load_checkpoint
+from examples.pytorch.nemo import open_nemo_ckpt, UnpackedNemoCheckpointDir, extract_layers_with_prefix
 from examples.pytorch.utils import gpu_map_location, WEIGHT2DTYPE, torch2np, cpu_map_location, safe_transpose
 
 
@@ -611,7 +612,7 @@ def convert_checkpoint(unpacked_checkpoints_dir: UnpackedNemoCheckpointDir, args
     has_gated_activations = False
 
     for pipeline_rank in range(len(checkpoints_paths[0])):
-        model_from_selected_pipeline = torch.load(checkpoints_paths[0][pipeline_rank], map_location=map_location_fn)
+        model_from_selected_pipeline = load_checkpoint(checkpoints_paths[0][pipeline_rank], map_location=map_location_fn)
         model_from_selected_pipeline = model_from_selected_pipeline.get("state_dict", model_from_selected_pipeline)
 
         LOGGER.debug(f"Existent pipeline_rank={pipeline_rank} keys:")
@@ -712,7 +713,7 @@ def convert_checkpoint(unpacked_checkpoints_dir: UnpackedNemoCheckpointDir, args
                 if is_merge_ckpt:
                     for k in range(factor):
                         rank_weights = checkpoints_paths[tp_idx * factor + k][pp_idx]
-                        model = torch.load(rank_weights, map_location=map_location_fn)
+                        model = load_checkpoint(rank_weights, map_location=map_location_fn)
 
                         if pp_idx == 0:
                             w_e_val = model.get("state_dict", model)[word_embedding_key]
@@ -740,7 +741,7 @@ def convert_checkpoint(unpacked_checkpoints_dir: UnpackedNemoCheckpointDir, args
                             LOGGER.debug("    %s", name)
                 else:
                     rank_weights = checkpoints_paths[tp_idx][pp_idx]
-                    model = torch.load(rank_weights, map_location=map_location_fn)
+                    model = load_checkpoint(rank_weights, map_location=map_location_fn)
 
                     if pp_idx == 0:
                         w_e_val = model.get("state_dict", model)[word_embedding_key]
@@ -1041,11 +1042,10 @@ def main():
         if input_path.is_file():
             checkpoint_dir_path = temp_dir / "unpacked"
             start_time = datetime.datetime.now()
-            unpacked_checkpoint_dir = UnpackedNemoCheckpointDir(
-                unpack_nemo_ckpt(args.in_file, checkpoint_dir_path),
-                load_checkpoints_to_cpu=bool(args.load_checkpoints_to_cpu),
+            unpacked_checkpoint_dir = open_nemo_ckpt(
+                args.in_file, checkpoint_dir_path, load_checkpoints_to_cpu=bool(args.load_checkpoints_to_cpu)
             )
-            LOGGER.info("Spent %s (h:m:s) to unpack NeMo archive", datetime.datetime.now() - start_time)
+            LOGGER.info("Spent %s (h:m:s) to open NeMo archive", datetime.datetime.now() - start_time)
         else:
             unpacked_checkpoint_dir = UnpackedNemoCheckpointDir(
                 input_path, load_checkpoints_to_cpu=bool(args.load_checkpoints_to_cpu)
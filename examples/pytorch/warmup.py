@@ -0,0 +1,174 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Startup warmup of serving workers with GEMM autotuning results cached per GPU type.
+
+The FasterTransformer ops pick their cuBLAS algorithms from ./gemm_config.in, read when an op is
+built. `install_gemm_config` runs bin/gpt_gemm once per GPU type and model shape, caches its output
+under <cache>/<gpu type>/gemm/ and merges the cached entries of every model a worker serves into
+./gemm_config.in before the model is built. `run_warmup` then sends requests of representative
+input/output lengths through the worker before it joins the coordinator, so that the first real
+request does not pay for lazy initialization, and records the cold and steady latencies of each
+shape in <cache>/<gpu type>/<model>/warmup.json, next to those of earlier starts.
+"""
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+import typing
+
+import torch
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_ROOT = os.path.expanduser("~/.together/cache/warmup")
+DEFAULT_SHAPES = "16:16,128:16,512:1"
+GEMM_CONFIG = "gemm_config.in"
+# gpt_gemm data types
+GEMM_DATA_TYPES = {"fp32": 0, "fp16": 1, "bf16": 2}
+_HISTORY_LENGTH = 10
+
+
+def warmup_enabled() -> bool:
+    return os.environ.get("WARMUP", "1") not in ("", "0")
+
+
+def gpu_type(device=None) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", torch.cuda.get_device_name(device))
+
+
+def parse_shapes(spec: str) -> typing.List[typing.Tuple[int, int]]:
+    """Parses "input_len:output_len,..." warmup shapes."""
+    shapes = []
+    for item in spec.split(","):
+        if item.strip():
+            input_len, output_len = item.split(":")
+            shapes.append((int(input_len), int(output_len)))
+    return shapes
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _merge_gemm_configs(paths: typing.Sequence[str], out_path: str):
+    header = None
+    entries: typing.Dict[str, None] = {}
+    for path in paths:
+        with open(path) as f:
+            lines = f.readlines()
+        if not lines:
+            continue
+        header = header or lines[0]
+        for line in lines[1:]:
+            if line.strip():
+                entries[line] = None
+    if header is None:
+        return
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(header)
+        f.writelines(entries)
+    os.replace(tmp_path, out_path)
+
+
+def install_gemm_config(lib_path: str, batch_size: int, beam_width: int, max_input_len: int, head_num: int,
+                        size_per_head: int, inter_size: int, vocab_size: int, data_type: str = "fp16",
+                        tensor_para_size: int = 1, cache_root: str = DEFAULT_CACHE_ROOT) -> bool:
+    """Adds the tuned GEMM algorithms for one model shape to ./gemm_config.in; call before building the op.
+
+    Runs bin/gpt_gemm next to `lib_path` (or $FT_GEMM_BIN) the first time a shape is seen on a GPU
+    type. Returns False if there is no cached config and no binary to generate it.
+    """
+    gemm_args = [batch_size, beam_width, max_input_len, head_num, size_per_head, inter_size, vocab_size,
+                 GEMM_DATA_TYPES[data_type], tensor_para_size]
+    gemm_dir = os.path.join(cache_root, gpu_type(), "gemm")
+    os.makedirs(gemm_dir, exist_ok=True)
+    cached = os.path.join(gemm_dir, "_".join(str(arg) for arg in gemm_args) + ".in")
+
+    with _locked(cached):
+        if not os.path.exists(cached):
+            gemm_bin = os.environ.get("FT_GEMM_BIN",
+                                      os.path.join(os.path.dirname(os.path.abspath(lib_path)), "..", "bin", "gpt_gemm"))
+            if not os.path.isfile(gemm_bin):
+                LOGGER.info("No cached GEMM config for %s and no %s to generate it", cached, gemm_bin)
+                return False
+            LOGGER.info("Generating GEMM config: %s %s", gemm_bin, " ".join(str(arg) for arg in gemm_args))
+            start = time.perf_counter()
+            with tempfile.TemporaryDirectory(dir=gemm_dir) as work_dir:
+                # gpt_gemm writes gemm_config.in into its working directory
+                subprocess.run([gemm_bin] + [str(arg) for arg in gemm_args], cwd=work_dir, check=True,
+                               stdout=subprocess.DEVNULL)
+                os.replace(os.path.join(work_dir, GEMM_CONFIG), cached)
+            LOGGER.info("Generated %s in %.1f s", cached, time.perf_counter() - start)
+
+    # workers of other models may share the working directory; keep their entries
+    with _locked(os.path.abspath(GEMM_CONFIG)):
+        sources = [GEMM_CONFIG, cached] if os.path.exists(GEMM_CONFIG) else [cached]
+        _merge_gemm_configs(sources, GEMM_CONFIG)
+    return True
+
+
+def _load_history(timings_path: str) -> typing.List[typing.Dict[str, typing.Any]]:
+    if not os.path.exists(timings_path):
+        return []
+    with open(timings_path) as f:
+        return json.load(f).get("history", [])
+
+
+def run_warmup(request_fn: typing.Callable[[int, int], typing.Any], model_name: str,
+               shapes: typing.Sequence[typing.Tuple[int, int]], iterations: int = 2,
+               cache_root: str = DEFAULT_CACHE_ROOT) -> typing.Dict[str, typing.Any]:
+    """Calls `request_fn(input_len, output_len)` `iterations` times per shape and records the latencies.
+
+    The first call of a shape is reported as cold, the mean of the others as steady.
+    """
+    model_dir = os.path.join(cache_root, gpu_type(), re.sub(r"[^A-Za-z0-9._-]+", "_", model_name))
+    os.makedirs(model_dir, exist_ok=True)
+    timings_path = os.path.join(model_dir, "warmup.json")
+    previous = _load_history(timings_path)
+    previous = previous[-1]["shapes"] if previous else {}
+
+    start = time.perf_counter()
+    shape_timings = {}
+    for input_len, output_len in shapes:
+        latencies = []
+        for _ in range(max(iterations, 1)):
+            request_start = time.perf_counter()
+            request_fn(input_len, output_len)
+            torch.cuda.synchronize()
+            latencies.append(time.perf_counter() - request_start)
+        key = f"{input_len}:{output_len}"
+        steady = latencies[1:] or latencies
+        shape_timings[key] = {"cold_ms": latencies[0] * 1000, "steady_ms": sum(steady) / len(steady) * 1000}
+        LOGGER.info("Warmup %s: cold %.1f ms, steady %.1f ms%s", key, shape_timings[key]["cold_ms"],
+                    shape_timings[key]["steady_ms"],
+                    f" (last start {previous[key]['steady_ms']:.1f} ms)" if key in previous else "")
+    result = {"time": time.time(), "seconds": time.perf_counter() - start, "shapes": shape_timings}
+
+    with _locked(timings_path):
+        history = (_load_history(timings_path) + [result])[-_HISTORY_LENGTH:]
+        tmp_path = f"{timings_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"gpu_type": gpu_type(), "model": model_name, "history": history}, f, indent=1)
+        os.replace(tmp_path, timings_path)
+    LOGGER.info("Warmup of %s done in %.1f s", model_name, result["seconds"])
+    return result
@@ -0,0 +1,361 @@
+"""Starts and supervises the serving workers of one node.
+
+Replaces the background-job handling of serve.sh (one `&` job per GPU and `wait -n`, so that
+one crashed worker took down the whole node). Each worker is one process group: a single-GPU
+serving script, or `mpirun` with all ranks of a tensor-parallel model. The supervisor
+
+- starts workers staggered by --stagger seconds, so that model loads do not all hit the disk at once;
+- polls them and restarts only a worker that exited, with exponential backoff which is reset
+  once the worker has been up for --stable-after seconds;
+- optionally runs --health-command for every running worker and restarts a worker that failed it
+  --health-failures times in a row (a hung worker does not exit by itself);
+- writes per-worker status (state, pid, restarts, uptime, last exit code) to --status-file;
+- forwards SIGTERM/SIGINT to all workers and waits up to --stop-timeout for them to drain their
+  accepted requests before exiting;
+- forwards SIGHUP to the main process of every worker, which swaps models to the checkpoints of
+  its --swap_file without downtime.
+
+Worker commands are derived from the same environment as serve.sh (MODEL, MODEL_TYPE,
+NUM_WORKERS, CUDA_VISIBLE_DEVICES, GROUP). --worker-command replaces them, e.g. with dummy workers:
+
+    python serve.py --worker-command "python -c 'import time; time.sleep(5)'" --worker-command "false"
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+import typing
+
+LOGGER = logging.getLogger(__name__)
+
+MODELS_DIR = "/home/user/.together/models"
+
+
+@dataclasses.dataclass
+class WorkerSpec:
+    name: str
+    argv: typing.List[str]
+    env: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    # run every health_interval seconds once the worker is up; "{name}" and "{pid}" are substituted
+    health_command: typing.Optional[str] = None
+
+
+@dataclasses.dataclass
+class WorkerStatus:
+    name: str
+    state: str = "pending"  # pending, running, unhealthy, backoff, stopped
+    pid: typing.Optional[int] = None
+    restarts: int = 0
+    last_exit_code: typing.Optional[int] = None
+    health_failures: int = 0
+    started_at: typing.Optional[float] = None
+    next_start_at: typing.Optional[float] = None
+
+
+class _Worker:
+    def __init__(self, spec: WorkerSpec):
+        self.spec = spec
+        self.status = WorkerStatus(spec.name)
+        self.process: typing.Optional[subprocess.Popen] = None
+        self.backoff = 0.0
+        self.next_health_check = 0.0
+
+
+class Supervisor:
+    """Keeps a set of worker processes running; see the module docstring."""
+
+    def __init__(
+        self,
+        specs: typing.Sequence[WorkerSpec],
+        stagger: float = 0.0,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 60.0,
+        stable_after: float = 60.0,
+        poll_interval: float = 0.5,
+        health_interval: float = 30.0,
+        health_grace: float = 600.0,
+        health_failures: int = 3,
+        health_timeout: float = 10.0,
+        status_file: typing.Optional[str] = None,
+        stop_timeout: float = 30.0,
+    ):
+        self.workers = [_Worker(spec) for spec in specs]
+        self.stagger = stagger
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.poll_interval = poll_interval
+        self.health_interval = health_interval
+        self.health_grace = health_grace
+        self.health_failures = health_failures
+        self.health_timeout = health_timeout
+        self.status_file = status_file
+        self.stop_timeout = stop_timeout
+        self._stopping = False
+        now = time.monotonic()
+        for i, worker in enumerate(self.workers):
+            worker.status.next_start_at = now + i * stagger
+
+    def _start(self, worker: _Worker):
+        env = dict(os.environ)
+        env.update(worker.spec.env)
+        # own process group, so that stopping a worker also stops the ranks mpirun started
+        worker.process = subprocess.Popen(worker.spec.argv, env=env, start_new_session=True)
+        worker.status.state = "running"
+        worker.status.pid = worker.process.pid
+        worker.status.started_at = time.monotonic()
+        worker.status.next_start_at = None
+        worker.status.health_failures = 0
+        # model loading can take minutes, so health checks only begin after the grace period
+        worker.next_health_check = worker.status.started_at + self.health_grace
+        LOGGER.info("Started %s (pid %d): %s", worker.spec.name, worker.process.pid, shlex.join(worker.spec.argv))
+
+    def _on_exit(self, worker: _Worker, exit_code: int):
+        now = time.monotonic()
+        uptime = now - worker.status.started_at
+        worker.process = None
+        worker.status.pid = None
+        worker.status.last_exit_code = exit_code
+        if uptime >= self.stable_after:
+            worker.backoff = 0.0
+        worker.backoff = min(self.backoff_max, worker.backoff * 2 if worker.backoff else self.backoff_initial)
+        worker.status.state = "backoff"
+        worker.status.next_start_at = now + worker.backoff
+        worker.status.restarts += 1
+        LOGGER.warning(
+            "%s exited with code %d after %.1f s, restarting in %.1f s",
+            worker.spec.name, exit_code, uptime, worker.backoff,
+        )
+
+    def _check_health(self, worker: _Worker):
+        command = worker.spec.health_command.format(name=worker.spec.name, pid=worker.process.pid)
+        try:
+            healthy = subprocess.run(command, shell=True, timeout=self.health_timeout,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+        except subprocess.TimeoutExpired:
+            healthy = False
+        worker.next_health_check = time.monotonic() + self.health_interval
+        if healthy:
+            if worker.status.health_failures:
+                LOGGER.info("%s is healthy again", worker.spec.name)
+            worker.status.health_failures = 0
+            worker.status.state = "running"
+            return
+        worker.status.health_failures += 1
+        worker.status.state = "unhealthy"
+        LOGGER.warning("%s failed its health check (%d/%d)",
+                       worker.spec.name, worker.status.health_failures, self.health_failures)
+        if worker.status.health_failures >= self.health_failures:
+            LOGGER.warning("Killing unhealthy %s", worker.spec.name)
+            self._kill(worker, signal.SIGKILL)
+
+    @staticmethod
+    def _kill(worker: _Worker, sig: int):
+        try:
+            os.killpg(worker.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def poll(self):
+        """Reaps exited workers and starts the ones that are due; called every poll_interval."""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is not None:
+                exit_code = worker.process.poll()
+                if exit_code is not None:
+                    self._on_exit(worker, exit_code)
+                elif worker.spec.health_command and worker.next_health_check <= now:
+                    self._check_health(worker)
+            elif not self._stopping and worker.status.next_start_at is not None and worker.status.next_start_at <= now:
+                self._start(worker)
+        self._write_status()
+
+    def status(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        now = time.monotonic()
+        statuses = []
+        for worker in self.workers:
+            status = dataclasses.asdict(worker.status)
+            started_at = status.pop("started_at")
+            status["uptime"] = now - started_at if worker.process is not None else None
+            next_start_at = status.pop("next_start_at")
+            status["starts_in"] = max(0.0, next_start_at - now) if next_start_at is not None else None
+            statuses.append(status)
+        return statuses
+
+    def _write_status(self):
+        if not self.status_file:
+            return
+        tmp_path = self.status_file + ".tmp"
+        with open(tmp_path, "w") as status_file:
+            json.dump({"time": time.time(), "workers": self.status()}, status_file, indent=1)
+        os.replace(tmp_path, self.status_file)
+
+    def reload(self, *_):
+        """Sends SIGHUP to the main process (not the group, which may include mpirun) of every worker."""
+        for worker in self.workers:
+            if worker.process is not None:
+                try:
+                    os.kill(worker.process.pid, signal.SIGHUP)
+                except ProcessLookupError:
+                    pass
+
+    def stop(self, *_):
+        """Asks the run loop to terminate all workers and return; usable as a signal handler."""
+        self._stopping = True
+
+    def _terminate_all(self):
+        running = [worker for worker in self.workers if worker.process is not None]
+        for worker in running:
+            self._kill(worker, signal.SIGTERM)
+        deadline = time.monotonic() + self.stop_timeout
+        for worker in running:
+            try:
+                worker.process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                LOGGER.warning("%s did not stop in %.0f s, killing it", worker.spec.name, self.stop_timeout)
+                self._kill(worker, signal.SIGKILL)
+                worker.process.wait()
+            worker.status.last_exit_code = worker.process.returncode
+            worker.process = None
+            worker.status.pid = None
+        for worker in self.workers:
+            worker.status.state = "stopped"
+            worker.status.next_start_at = None
+        self._write_status()
+
+    def run(self, duration: typing.Optional[float] = None):
+        """Supervises the workers until stop() is called (or for `duration` seconds)."""
+        end = time.monotonic() + duration if duration is not None else None
+        try:
+            while not self._stopping and (end is None or time.monotonic() < end):
+                self.poll()
+                time.sleep(self.poll_interval)
+        finally:
+            self._stopping = True
+            self._terminate_all()
+
+
+def _visible_devices(num_workers: str) -> typing.List[str]:
+    devices = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if devices:
+        devices = devices.split(",")
+        count = len(devices) if num_workers == "auto" else int(num_workers)
+    else:
+        if num_workers == "auto":
+            output = subprocess.run(
+                ["nvidia-smi", "--query-gpu=name", "--format=csv,noheader"],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            count = len(output.splitlines())
+            LOGGER.info("NUM_WORKERS=auto resolved to NUM_WORKERS=%d", count)
+        else:
+            count = int(num_workers)
+        devices = [str(i) for i in range(count)]
+    return devices[:count]
+
+
+def model_worker_specs() -> typing.List[WorkerSpec]:
+    """Worker commands for $MODEL, as serve.sh used to start them."""
+    model = os.environ["MODEL"]
+    model_base, _, shards = model.partition("-tp")
+    if not shards.isdigit() or int(shards) < 1:
+        raise ValueError(f"Couldn't parse tensor parallelism from MODEL={model}")
+    model_shards = int(shards)
+    model_type = os.environ.get("MODEL_TYPE", "gptj")
+    ckpt_path = f"{MODELS_DIR}/{model}"
+
+    if model_shards > 1:
+        scripts = {
+            "gpt": ["examples/pytorch/gpt/app/serving_opt_multi_gpu.py", "--hf_model_name", f"facebook/{model_base}",
+                    "--tensor_para_size", str(model_shards)],
+            "gptneox": ["examples/pytorch/gptneox/app/serving_multi_gpu.py", "--tensor_para_size", str(model_shards)],
+        }
+        if model_type not in scripts:
+            raise ValueError(f"Unknown MODEL_TYPE {model_type} for tensor parallel serving")
+        argv = ["mpirun", "-n", str(model_shards), "--allow-run-as-root", sys.executable] + scripts[model_type]
+        return [WorkerSpec("tp0", argv + ["--ckpt_path", ckpt_path], {"GROUP": os.environ.get("GROUP", "group")})]
+
+    scripts = {
+        "gpt": ["examples/pytorch/gpt/app/serving_opt_single_gpu.py", "--hf_model_name", f"facebook/{model_base}"],
+        "gptj": ["examples/pytorch/gptj/app/serving.py"],
+        "gptneox": ["examples/pytorch/gptneox/app/serving_single_gpu.py"],
+    }
+    if model_type not in scripts:
+        raise ValueError(f"Unknown MODEL_TYPE {model_type}")
+    specs = []
+    # as in serve.sh, the number of single-GPU workers is capped by the tensor parallelism
+    for device in _visible_devices(os.environ.get("NUM_WORKERS", "auto"))[:model_shards]:
+        env = {
+            "DEVICE": os.environ.get("DEVICE", f"cuda:{device}"),
+            "GROUP": os.environ.get("GROUP", f"group{device}"),
+        }
+        argv = [sys.executable] + scripts[model_type] + ["--ckpt_path", ckpt_path]
+        specs.append(WorkerSpec(f"gpu{device}", argv, env))
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--worker-command", "--worker_command", action="append", default=None,
+                        help="command of one worker (repeatable); replaces the commands derived from $MODEL")
+    parser.add_argument("--stagger", type=float, default=float(os.environ.get("STAGGER_SECONDS", 0)),
+                        help="seconds between the initial starts of consecutive workers")
+    parser.add_argument("--backoff-initial", "--backoff_initial", type=float, default=2.0)
+    parser.add_argument("--backoff-max", "--backoff_max", type=float, default=120.0)
+    parser.add_argument("--stable-after", "--stable_after", type=float, default=300.0,
+                        help="uptime after which a worker's restart backoff is reset")
+    parser.add_argument("--health-command", "--health_command", default=os.environ.get("WORKER_HEALTH_COMMAND"),
+                        help="shell command checking one worker, e.g. a probe of its endpoint;\n"
+                             "{name} and {pid} are replaced by the worker's name and pid")
+    parser.add_argument("--health-interval", "--health_interval", type=float, default=30.0)
+    parser.add_argument("--health-grace", "--health_grace", type=float, default=600.0,
+                        help="seconds after a start before the first health check")
+    parser.add_argument("--health-failures", "--health_failures", type=int, default=3,
+                        help="consecutive failed health checks after which a worker is restarted")
+    parser.add_argument("--status-file", "--status_file", default=os.environ.get("WORKER_STATUS_FILE"),
+                        help="JSON file updated with the state of every worker")
+    parser.add_argument("--stop-timeout", "--stop_timeout", type=float,
+                        default=float(os.environ.get("DRAIN_TIMEOUT", 300)) + 30,
+                        help="seconds workers get to drain after SIGTERM before they are killed")
+    parser.add_argument("--dry-run", "--dry_run", action="store_true", help="print the worker commands and exit")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+
+    if args.worker_command:
+        specs = [WorkerSpec(f"worker{i}", shlex.split(command)) for i, command in enumerate(args.worker_command)]
+    else:
+        specs = model_worker_specs()
+    for spec in specs:
+        spec.health_command = args.health_command
+    if args.dry_run:
+        for spec in specs:
+            print(spec.name, " ".join(f"{k}={v}" for k, v in spec.env.items()), shlex.join(spec.argv))
+        return 0
+
+    supervisor = Supervisor(
+        specs,
+        stagger=args.stagger,
+        backoff_initial=args.backoff_initial,
+        backoff_max=args.backoff_max,
+        stable_after=args.stable_after,
+        health_interval=args.health_interval,
+        health_grace=args.health_grace,
+        health_failures=args.health_failures,
+        status_file=args.status_file,
+        stop_timeout=args.stop_timeout,
+    )
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    signal.signal(signal.SIGHUP, supervisor.reload)
+    supervisor.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
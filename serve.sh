@@ -14,67 +14,20 @@ if [[ ! "$MODEL_SHARDS" -gt 0 ]]; then
   exit 1
 fi
 
-NUM_WORKERS=${NUM_WORKERS-auto}
-if [[ -z "$CUDA_VISIBLE_DEVICES" ]]; then
-  unset CUDA_VISIBLE_DEVICES
-  if [[ "$NUM_WORKERS" == "auto" ]]; then
-    NUM_WORKERS=`nvidia-smi --query-gpu=name --format=csv,noheader | wc -l`
-    echo NUM_WORKERS=auto resolved to NUM_WORKERS=${NUM_WORKERS}
-  fi
-  DEVICES=
-  for ((i = 0; i < $NUM_WORKERS; i++)); do
-    DEVICES=$DEVICES,$i
-  done
-else
-  DEVICES=$CUDA_VISIBLE_DEVICES
-  if [[ "$NUM_WORKERS" == "auto" ]]; then
-    NUM_WORKERS=`echo $DEVICES | sed 's/[^,]//g' | wc -c`
-    echo NUM_WORKERS=auto resolved to NUM_WORKERS=${NUM_WORKERS}
-  fi
-fi
-if [ "$NUM_WORKERS" -gt "$MODEL_SHARDS" ]; then
-  NUM_WORKERS=$MODEL_SHARDS
-  echo Reduced NUM_WORKERS to ${NUM_WORKERS} to match tensor parallelism
+# Fetch the model through the node-local download cache when the store serves a manifest.json.
+if [[ ! -z "$MODEL_FETCH_URL" ]]; then
+  python examples/pytorch/model_fetch.py --model-url $MODEL_FETCH_URL --model-dir /home/user/.together/models/$MODEL
 fi
 
-if [ "$MODEL_SHARDS" -gt 1 ]; then
-  case ${MODEL_TYPE-gptj} in
-    gpt)
-      env GROUP=${GROUP-group$i} /bin/bash -c 'mpirun -n $MODEL_SHARDS --allow-run-as-root python examples/pytorch/gpt/app/serving_opt_multi_gpu.py --hf_model_name facebook/$MODEL_BASE --tensor_para_size $MODEL_SHARDS --ckpt_path /home/user/.together/models/$MODEL'
-    ;;
-    gptneox)
-      env GROUP=${GROUP-group$i} /bin/bash -c 'mpirun -n $MODEL_SHARDS --allow-run-as-root python examples/pytorch/gptneox/app/serving_multi_gpu.py --hf_model_name --ckpt_path /home/user/.together/models/$MODEL'
-    ;;
-    *)
-      echo Unknown MODEL_TYPE
-      exit 1
-    ;;
-  esac
-  exit 0
-fi
+# Checkpoint check against manifest.json at worker startup: none, size (file sizes only) or full (hashes).
+export VERIFY_CKPT=${VERIFY_CKPT-none}
 
-count=0
-for i in ${DEVICES//,/$IFS}; do
-  case ${MODEL_TYPE-gptj} in
-    gpt)
-      env DEVICE=${DEVICE-cuda:$i} GROUP=${GROUP-group$i} /bin/bash -c 'python examples/pytorch/gpt/app/serving_opt_single_gpu.py --hf_model_name facebook/$MODEL_BASE --ckpt_path /home/user/.together/models/$MODEL' &
-    ;;
-    gptj)
-      env DEVICE=${DEVICE-cuda:$i} GROUP=${GROUP-group$i} /bin/bash -c 'python examples/pytorch/gptj/app/serving.py --ckpt_path /home/user/.together/models/$MODEL' &
-    ;;
-    gptneox)
-      env DEVICE=${DEVICE-cuda:$i} GROUP=${GROUP-group$i} /bin/bash -c 'python examples/pytorch/gptneox/app/serving_single_gpu.py --ckpt_path /home/user/.together/models/$MODEL' &
-    ;;
-    *)
-      echo Unknown MODEL_TYPE
-      exit 1
-    ;;
-  esac
-  count=`expr $count + 1`
-  if [ $count -eq $NUM_WORKERS ]; then
-    break
-  fi
-done
+# Workers of the same $MODEL loading at the same time share one host copy of the weight files staged
+# in /dev/shm (examples/pytorch/shared_weights.py); it is removed once every worker has its weights on
+# the GPU. 0 makes every worker read the files itself.
+export FT_SHARED_WEIGHTS=${FT_SHARED_WEIGHTS-1}
 
-wait -n
-exit $?
+# Workers are started, health-checked and restarted by serve.py (see its --help); it derives the
+# worker commands from MODEL, MODEL_TYPE, NUM_WORKERS, CUDA_VISIBLE_DEVICES, DEVICE and GROUP.
+trap - SIGINT SIGTERM EXIT
+exec python serve.py "$@"
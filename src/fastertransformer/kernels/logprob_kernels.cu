@@ -207,4 +207,100 @@ template void invokeLogProbFromLogits(float*       cum_log_probs,
                                       const size_t workspace_size,
                                       cudaStream_t stream,
                                       const bool   batch_first);
+
+template<int BLOCK_SIZE>
+__global__ void top_log_probs_kernel(float*       top_log_probs,
+                                     int*         top_ids,
+                                     const float* logits,
+                                     const int    vocab_size,
+                                     const int    vocab_size_padded,
+                                     const int    top_n,
+                                     const int    out_stride)
+{
+    // The top_n entries of log(softmax(logits)) of each row, highest first.
+    //
+    // top_log_probs, top_ids: top_n values at [bidx * out_stride, bidx * out_stride + top_n).
+    // logits: [batch_size, vocab_size_padded], one row per block.
+
+    typedef cub::KeyValuePair<int, float>            KeyValuePair;
+    typedef cub::BlockReduce<KeyValuePair, BLOCK_SIZE> BlockReduce;
+    __shared__ typename BlockReduce::TempStorage temp_storage;
+    __shared__ float                              s_max_logit;
+    __shared__ float                              s_log_sum_exp;
+    __shared__ KeyValuePair                       s_prev;
+
+    const int tidx = threadIdx.x;
+    const int bidx = blockIdx.x;
+    logits += (size_t)bidx * vocab_size_padded;
+
+    float local_max = -FLT_MAX;
+    for (int i = tidx; i < vocab_size; i += BLOCK_SIZE) {
+        local_max = fmax(local_max, logits[i]);
+    }
+    float max_val = blockReduceMax<float>(local_max);
+    if (tidx == 0) {
+        s_max_logit = max_val;
+    }
+    __syncthreads();
+
+    float local_sum_exp = 0.0f;
+    for (int i = tidx; i < vocab_size; i += BLOCK_SIZE) {
+        local_sum_exp += __expf(logits[i] - s_max_logit);
+    }
+    float sum_exp = blockReduceSum<float>(local_sum_exp);
+    if (tidx == 0) {
+        s_log_sum_exp = s_max_logit + __logf(sum_exp + 1e-9f);
+    }
+    __syncthreads();
+
+    // Each pass selects the largest entry after the previous one in (value descending, id ascending)
+    // order, the order of cub::ArgMax, so that ties are neither skipped nor repeated.
+    KeyValuePair prev(-1, FLT_MAX);
+    for (int k = 0; k < top_n; ++k) {
+        KeyValuePair best(vocab_size, -FLT_MAX);
+        for (int i = tidx; i < vocab_size; i += BLOCK_SIZE) {
+            const float val = logits[i];
+            if ((val < prev.value || (val == prev.value && i > prev.key))
+                && (val > best.value || (val == best.value && i < best.key))) {
+                best.key   = i;
+                best.value = val;
+            }
+        }
+        best = BlockReduce(temp_storage).Reduce(best, cub::ArgMax());
+        if (tidx == 0) {
+            top_ids[bidx * out_stride + k]       = best.key;
+            top_log_probs[bidx * out_stride + k] = best.value - s_log_sum_exp;
+            s_prev                               = best;
+        }
+        __syncthreads();
+        prev = s_prev;
+        __syncthreads();
+    }
+}
+
+void invokeTopLogProbs(float*       top_log_probs,
+                       int*         top_ids,
+                       const float* logits,
+                       const size_t batch_size,
+                       const size_t vocab_size,
+                       const size_t vocab_size_padded,
+                       const size_t top_n,
+                       const size_t out_stride,
+                       cudaStream_t stream)
+{
+    // The most likely tokens of each row and their log probabilities, selected on the device so that
+    // only [batch_size, top_n] values per step have to be copied to the host.
+    //
+    // top_log_probs, top_ids: row b writes top_n values at b * out_stride, e.g. out_stride = steps * top_n
+    //     for [batch_size, steps, top_n] outputs offset to the current step.
+    // logits: [batch_size, vocab_size_padded]
+
+    FT_LOG_DEBUG(__PRETTY_FUNCTION__);
+    assert(top_n <= vocab_size && top_n <= out_stride);
+    assert(vocab_size <= vocab_size_padded);
+    constexpr int block_size = 256;
+    top_log_probs_kernel<block_size><<<batch_size, block_size, 0, stream>>>(
+        top_log_probs, top_ids, logits, vocab_size, vocab_size_padded, top_n, out_stride);
+}
+
 }  // end of namespace fastertransformer
@@ -31,4 +31,14 @@ void invokeLogProbFromLogits(float*       cum_log_probs,
                              const size_t workspace_size,
                              cudaStream_t stream,
                              const bool   batch_first = false);
+
+void invokeTopLogProbs(float*       top_log_probs,
+                       int*         top_ids,
+                       const float* logits,
+                       const size_t batch_size,
+                       const size_t vocab_size,
+                       const size_t vocab_size_padded,
+                       const size_t top_n,
+                       const size_t out_stride,
+                       cudaStream_t stream);
 }  // namespace fastertransformer
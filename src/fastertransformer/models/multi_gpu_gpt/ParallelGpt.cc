@@ -558,6 +558,18 @@ void ParallelGpt<T>::forward(std::unordered_map<std::string, Tensor>*       outp
     //          optional. It leads to additional computing cost. If we don't need this result, don't put it.
     //      cum_log_probs [batch_size, beam_width], must be float*. optional.
     //          The cumulative log probability of generated sequences. It may lead to additional computing cost.
+    //      output_top_log_probs [batch_size, beam_width, request_output_seq_len, top_n], must be float*. optional.
+    //          The top_n log probabilities of the model at each generated step, before sampling.
+    //          Only written on the last pipeline stage.
+    //      output_top_ids [batch_size, beam_width, request_output_seq_len, top_n], must be int*.
+    //          Required with output_top_log_probs, the tokens of its log probabilities.
+    //      context_log_probs [batch_size, beam_width, max_input_length - 1], must be float*. optional.
+    //          The log probability of each input token after the first, given the tokens before it. Only
+    //          written with is_return_context_cum_log_probs; entries past input_length - 1 are undefined.
+    //      context_top_log_probs [batch_size, beam_width, max_input_length, top_n], must be float*. optional.
+    //          The top_n log probabilities of the model after each input token, with is_return_context_cum_log_probs.
+    //      context_top_ids [batch_size, beam_width, max_input_length, top_n], must be int*.
+    //          Required with context_top_log_probs, the tokens of its log probabilities.
 
     // Step is from max_input_length ~ max_output_seq_len,
     // When step = k,  we put output ids and caches at step k, and the sequence_length would be k - 1 before
@@ -952,6 +964,9 @@ void ParallelGpt<T>::forward(std::unordered_map<std::string, Tensor>*       outp
                                           beam_width,
                                           (size_t)max_input_length,
                                           gpt_weights);
+                if (pipeline_para_.rank_ == pipeline_para_.world_size_ - 1) {
+                    setContextLogProbs(output_tensors, batch_size * beam_width, (size_t)max_input_length);
+                }
             }
             sync_check_cuda_error();
         }
@@ -1155,6 +1170,27 @@ void ParallelGpt<T>::forward(std::unordered_map<std::string, Tensor>*       outp
                                           stream_);
                 }
 
+                if (output_tensors->count("output_top_log_probs") > 0) {
+                    // the most likely tokens of the model, before sampling rescales the logits in place
+                    Tensor    top_log_probs = output_tensors->at("output_top_log_probs");
+                    const int max_steps     = (int)top_log_probs.shape[2];
+                    const int top_n         = (int)top_log_probs.shape[3];
+                    const int gen_step      = step_ - max_context_len;
+                    if (gen_step >= 0 && gen_step < max_steps) {
+                        const size_t offset = (size_t)id_offset * max_steps * top_n + gen_step * top_n;
+                        invokeTopLogProbs(top_log_probs.getPtr<float>() + offset,
+                                          output_tensors->at("output_top_ids").getPtr<int>() + offset,
+                                          logits_buf_ + vocab_size_units_offset,
+                                          local_batch_size * beam_width,
+                                          vocab_size_,
+                                          vocab_size_padded_,
+                                          top_n,
+                                          max_steps * top_n,
+                                          stream_);
+                        sync_check_cuda_error();
+                    }
+                }
+
                 int                                     tmp_local_batch_size       = local_batch_size;
                 bool                                    is_initialize_random_table = step_ == max_context_len;
                 std::unordered_map<std::string, Tensor> dynamic_decode_input_tensors{
@@ -1214,7 +1250,10 @@ void ParallelGpt<T>::forward(std::unordered_map<std::string, Tensor>*       outp
                     {"should_stop", Tensor{MEMORY_CPU, TYPE_BOOL, {1}, &subbatch_should_stop}}};
                 for (auto t = output_tensors->begin(); t != output_tensors->end(); ++t) {
                     // Handle exceptions.
-                    if (t->first == "cum_log_probs" || t->first == "output_log_probs") {
+                    if (t->first == "cum_log_probs" || t->first == "output_log_probs"
+                        || t->first == "output_top_log_probs" || t->first == "output_top_ids"
+                        || t->first == "context_log_probs" || t->first == "context_top_log_probs"
+                        || t->first == "context_top_ids") {
                         continue;
                     }
                     dynamic_decode_output_tensors.insert(*t);
@@ -1316,6 +1355,39 @@ void ParallelGpt<T>::sendTensorsToFirstPipelineNode(std::unordered_map<std::stri
     ftNcclStreamSynchronize(tensor_para_, pipeline_para_, stream_);
 }
 
+template<typename T>
+void ParallelGpt<T>::setContextLogProbs(std::unordered_map<std::string, Tensor>* output_tensors,
+                                        const size_t                             batchxbeam,
+                                        const size_t                             max_input_length)
+{
+    // Copies out the per-position results of computeContextCumLogProbs, so that the log probabilities of
+    // all the tokens of a sequence take a single forward pass.
+    if (output_tensors->count("context_log_probs") > 0) {
+        Tensor context_log_probs = output_tensors->at("context_log_probs");
+        FT_CHECK_WITH_INFO(context_log_probs.size() == batchxbeam * (max_input_length - 1),
+                           "The shape of context_log_probs should be [batch_size, beam_width, max_input_length - 1].");
+        // lp_logprob_buf_ is batch first, [batchxbeam, max_input_length - 1]
+        cudaAutoCpy(context_log_probs.getPtr<float>(), lp_logprob_buf_, context_log_probs.size(), stream_);
+    }
+    if (output_tensors->count("context_top_log_probs") > 0) {
+        Tensor       top_log_probs = output_tensors->at("context_top_log_probs");
+        const size_t top_n         = top_log_probs.shape[3];
+        FT_CHECK_WITH_INFO(top_log_probs.size() == batchxbeam * max_input_length * top_n,
+                           "context_top_log_probs should be [batch_size, beam_width, max_input_length, top_n].");
+        // lp_logits_buf_ holds the logits of every input position, [batchxbeam * max_input_length, vocab_size_padded_]
+        invokeTopLogProbs(top_log_probs.getPtr<float>(),
+                          output_tensors->at("context_top_ids").getPtr<int>(),
+                          lp_logits_buf_,
+                          batchxbeam * max_input_length,
+                          vocab_size_,
+                          vocab_size_padded_,
+                          top_n,
+                          top_n,
+                          stream_);
+    }
+    sync_check_cuda_error();
+}
+
 template<typename T>
 void ParallelGpt<T>::setOutputTensors(std::unordered_map<std::string, Tensor>*       output_tensors,
                                       const std::unordered_map<std::string, Tensor>* input_tensors,
@@ -100,6 +100,9 @@ private:
                                    const size_t                beam_width,
                                    const size_t                max_input_length,
                                    const ParallelGptWeight<T>* gpt_weights);
+    void setContextLogProbs(std::unordered_map<std::string, Tensor>* output_tensors,
+                            const size_t                             batchxbeam,
+                            const size_t                             max_input_length);
 
 protected:
     // For stateful processing (interactive generation)
@@ -108,7 +108,9 @@ std::vector<th::Tensor> GptOp::forward(th::Tensor               input_ids,
                                        th::optional<th::Tensor> len_penalty_opt,
                                        th::optional<th::Tensor> repetition_penalty_opt,
                                        th::optional<th::Tensor> random_seed_opt,
-                                       th::optional<int64_t>    return_cum_log_probs_opt)
+                                       th::optional<int64_t>    return_cum_log_probs_opt,
+                                       th::optional<int64_t>    return_top_log_probs_opt,
+                                       th::optional<int64_t>    return_context_log_probs_opt)
 {
     CHECK_TH_CUDA(input_ids);
     CHECK_CONTIGUOUS(input_ids);
@@ -126,6 +128,15 @@ std::vector<th::Tensor> GptOp::forward(th::Tensor               input_ids,
     }
 
     const int beam_width = beam_width_opt.has_value() ? (int)beam_width_opt.value() : 1;
+    const int64_t top_n  = return_top_log_probs_opt.has_value() ? return_top_log_probs_opt.value() : 0;
+    TORCH_CHECK(top_n >= 0, "return_top_log_probs should be the number of log probs per step, or 0 (none).");
+    TORCH_CHECK(top_n == 0 || beam_width == 1, "return_top_log_probs is only supported without beam search.");
+    const int64_t context_top_n = return_context_log_probs_opt.has_value() ? return_context_log_probs_opt.value() : 0;
+    TORCH_CHECK(context_top_n >= 0,
+                "return_context_log_probs should be the number of most likely tokens per input position, or 0 (none).");
+    TORCH_CHECK(context_top_n == 0 || (beam_width == 1 && return_cum_log_probs == 2),
+                "return_context_log_probs is only supported without beam search, with return_cum_log_probs 2.");
+    TORCH_CHECK(context_top_n == 0 || input_ids.size(1) > 0, "return_context_log_probs needs input ids.");
 
     const int  batch_size               = input_ids.size(0);
     const int  max_input_length         = input_ids.size(1);
@@ -136,6 +147,26 @@ std::vector<th::Tensor> GptOp::forward(th::Tensor               input_ids,
         torch::empty({batch_size, beam_width}, torch::dtype(torch::kInt32).device(torch::kCUDA).requires_grad(false));
     th::Tensor cum_log_probs =
         torch::empty({batch_size, beam_width}, torch::dtype(torch::kFloat32).device(torch::kCUDA).requires_grad(false));
+    th::optional<th::Tensor> top_log_probs;
+    th::optional<th::Tensor> top_ids;
+    if (top_n > 0) {
+        // steps after the end of a sequence are not written
+        top_log_probs = torch::zeros({batch_size, beam_width, output_len, top_n},
+                                     torch::dtype(torch::kFloat32).device(torch::kCUDA).requires_grad(false));
+        top_ids       = torch::zeros({batch_size, beam_width, output_len, top_n},
+                               torch::dtype(torch::kInt32).device(torch::kCUDA).requires_grad(false));
+    }
+    th::optional<th::Tensor> context_log_probs;
+    th::optional<th::Tensor> context_top_log_probs;
+    th::optional<th::Tensor> context_top_ids;
+    if (context_top_n > 0) {
+        context_log_probs     = torch::zeros({batch_size, beam_width, max_input_length - 1},
+                                         torch::dtype(torch::kFloat32).device(torch::kCUDA).requires_grad(false));
+        context_top_log_probs = torch::zeros({batch_size, beam_width, max_input_length, context_top_n},
+                                             torch::dtype(torch::kFloat32).device(torch::kCUDA).requires_grad(false));
+        context_top_ids       = torch::zeros({batch_size, beam_width, max_input_length, context_top_n},
+                                       torch::dtype(torch::kInt32).device(torch::kCUDA).requires_grad(false));
+    }
 
     ftgpt->forward(input_ids,
                    input_lengths,
@@ -151,11 +182,26 @@ std::vector<th::Tensor> GptOp::forward(th::Tensor               input_ids,
                    len_penalty_opt,
                    repetition_penalty_opt,
                    random_seed_opt,
-                   return_cum_log_probs_opt);
+                   return_cum_log_probs_opt,
+                   top_log_probs,
+                   top_ids,
+                   context_log_probs,
+                   context_top_log_probs,
+                   context_top_ids);
+    std::vector<th::Tensor> outputs{output_ids, sequence_lengths};
     if (return_cum_log_probs > 0) {
-        return std::vector<th::Tensor>{output_ids, sequence_lengths, cum_log_probs};
+        outputs.push_back(cum_log_probs);
+    }
+    if (top_n > 0) {
+        outputs.push_back(top_log_probs.value());
+        outputs.push_back(top_ids.value());
+    }
+    if (context_top_n > 0) {
+        outputs.push_back(context_log_probs.value());
+        outputs.push_back(context_top_log_probs.value());
+        outputs.push_back(context_top_ids.value());
     }
-    return std::vector<th::Tensor>{output_ids, sequence_lengths};
+    return outputs;
 }
 
 }  // namespace torch_ext
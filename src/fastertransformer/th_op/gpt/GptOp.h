@@ -42,7 +42,12 @@ public:
                          th::optional<th::Tensor> len_penalty_opt,
                          th::optional<th::Tensor> repetition_penalty_opt,
                          th::optional<th::Tensor> random_seed_opt,
-                         th::optional<int64_t>    return_cum_log_probs_opt) = 0;
+                         th::optional<int64_t>    return_cum_log_probs_opt,
+                         th::optional<th::Tensor> top_log_probs_opt,
+                         th::optional<th::Tensor> top_ids_opt,
+                         th::optional<th::Tensor> context_log_probs_opt,
+                         th::optional<th::Tensor> context_top_log_probs_opt,
+                         th::optional<th::Tensor> context_top_ids_opt) = 0;
 };
 
 template<typename T>
@@ -193,7 +198,12 @@ public:
                  th::optional<th::Tensor> len_penalty_opt,
                  th::optional<th::Tensor> repetition_penalty_opt,
                  th::optional<th::Tensor> random_seed_opt,
-                 th::optional<int64_t>    return_cum_log_probs_opt) override
+                 th::optional<int64_t>    return_cum_log_probs_opt,
+                 th::optional<th::Tensor> top_log_probs_opt,
+                 th::optional<th::Tensor> top_ids_opt,
+                 th::optional<th::Tensor> context_log_probs_opt,
+                 th::optional<th::Tensor> context_top_log_probs_opt,
+                 th::optional<th::Tensor> context_top_ids_opt) override
     {
         int return_cum_log_probs = return_cum_log_probs_opt.has_value() ? (int)return_cum_log_probs_opt.value() : 0;
 
@@ -333,6 +343,41 @@ public:
                                               get_ptr<float>(cum_log_probs)}});
         }
 
+        if (top_log_probs_opt.has_value() && top_ids_opt.has_value()) {
+            const std::vector<size_t> top_shape{
+                request_batch_size, beam_width, request_output_len, (size_t)top_log_probs_opt.value().size(3)};
+            output_tensors.insert({"output_top_log_probs",
+                                   ft::Tensor{ft::MEMORY_GPU,
+                                              ft::TYPE_FP32,
+                                              top_shape,
+                                              get_ptr<float>(top_log_probs_opt.value())}});
+            output_tensors.insert(
+                {"output_top_ids",
+                 ft::Tensor{ft::MEMORY_GPU, ft::TYPE_INT32, top_shape, get_ptr<int>(top_ids_opt.value())}});
+        }
+
+        if (context_log_probs_opt.has_value() && context_top_log_probs_opt.has_value()
+            && context_top_ids_opt.has_value()) {
+            output_tensors.insert(
+                {"context_log_probs",
+                 ft::Tensor{ft::MEMORY_GPU,
+                            ft::TYPE_FP32,
+                            std::vector<size_t>{request_batch_size, beam_width, max_input_length - 1},
+                            get_ptr<float>(context_log_probs_opt.value())}});
+            const std::vector<size_t> context_top_shape{
+                request_batch_size, beam_width, max_input_length, (size_t)context_top_log_probs_opt.value().size(3)};
+            output_tensors.insert({"context_top_log_probs",
+                                   ft::Tensor{ft::MEMORY_GPU,
+                                              ft::TYPE_FP32,
+                                              context_top_shape,
+                                              get_ptr<float>(context_top_log_probs_opt.value())}});
+            output_tensors.insert({"context_top_ids",
+                                   ft::Tensor{ft::MEMORY_GPU,
+                                              ft::TYPE_INT32,
+                                              context_top_shape,
+                                              get_ptr<int>(context_top_ids_opt.value())}});
+        }
+
         try {
             gpt.forward(&output_tensors, &input_tensors, &gpt_weights_);
         }
@@ -401,7 +446,9 @@ public:
                                th::optional<th::Tensor> len_penalty_opt,
                                th::optional<th::Tensor> repetition_penalty_opt,
                                th::optional<th::Tensor> random_seed_opt,
-                               th::optional<int64_t>    return_cum_log_probs_opt);
+                               th::optional<int64_t>    return_cum_log_probs_opt,
+                               th::optional<int64_t>    return_top_log_probs_opt,
+                               th::optional<int64_t>    return_context_log_probs_opt);
 
 private:
     const at::ScalarType    st_;
@@ -0,0 +1,92 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.benchmark import SweepPoint, compare, main, parse_sweep
+
+
+def _result(key, p50_ms):
+    return {"key": key, "latency": {"p50_ms": p50_ms}}
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_sweep_inline(self):
+        points = parse_sweep("batch=1,8; input=128 ;beam=1,4;precision=fp32")
+        self.assertEqual(len(points), 4)
+        self.assertEqual(points[0], SweepPoint(batch_size=1, input_len=128, beam_width=1, precision="fp32"))
+        self.assertEqual(points[-1], SweepPoint(batch_size=8, input_len=128, beam_width=4, precision="fp32"))
+        self.assertEqual(points[-1].key(), "bs8_in128_out32_beam4_fp32")
+        # unset fields keep their defaults
+        self.assertEqual(parse_sweep(""), [SweepPoint()])
+        with self.assertRaises(ValueError):
+            parse_sweep("batch=1;heads=12")
+
+    def test_parse_sweep_json(self):
+        mapping = self.root / "mapping.json"
+        mapping.write_text(json.dumps({"batch": [1, 2], "output_len": 64}))
+        self.assertEqual(parse_sweep(str(mapping)), [SweepPoint(batch_size=1, output_len=64),
+                                                     SweepPoint(batch_size=2, output_len=64)])
+        points = self.root / "points.json"
+        points.write_text(json.dumps([{"batch": 4, "input": 32}, {"beam_width": 2, "precision": "fp32"}]))
+        self.assertEqual(parse_sweep(str(points)), [SweepPoint(batch_size=4, input_len=32),
+                                                    SweepPoint(beam_width=2, precision="fp32")])
+
+    def test_compare(self):
+        baseline = {"results": [_result("a", 10.0), _result("b", 10.0), _result("c", 0.0)]}
+        results = [_result("a", 10.4), _result("b", 11.0), _result("c", 1.0), _result("new", 100.0)]
+        regressions = compare(results, baseline, tolerance=0.05)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("b: p50_ms 11.000 vs 10.000"))
+        self.assertEqual(compare(results, baseline, tolerance=0.2), [])
+
+    def _main(self, *args):
+        return main(["--model", "stub", "--sweep", "batch=1,2;input=16;output=8", "--warmup", "1",
+                     "--iterations", "5", *args])
+
+    def test_stub_run_and_exit_status(self):
+        baseline = self.root / "out" / "baseline.json"
+        self.assertEqual(self._main("--stub_base_ms", "5", "--output", str(baseline)), 0)
+        report = json.loads(baseline.read_text())
+        self.assertEqual([result["key"] for result in report["results"]],
+                         ["bs1_in16_out8_beam1_fp16", "bs2_in16_out8_beam1_fp16"])
+        result = report["results"][0]
+        self.assertEqual(len(result["latencies_ms"]), 5)
+        self.assertGreaterEqual(result["latency"]["min_ms"], 5.0)
+        self.assertLessEqual(result["latency"]["p50_ms"], result["latency"]["max_ms"])
+        self.assertIn("git_revision", report["environment"])
+
+        # as fast as the baseline, then four times slower
+        self.assertEqual(self._main("--stub_base_ms", "5", "--baseline", str(baseline), "--tolerance", "0.5"), 0)
+        self.assertEqual(self._main("--stub_base_ms", "20", "--baseline", str(baseline), "--tolerance", "0.5"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.synthetic_inputs import generate, request_lengths, sample_lengths, write_csv
+
+
+class SampleLengthsTest(unittest.TestCase):
+
+    def test_fixed(self):
+        rng = np.random.default_rng(0)
+        self.assertEqual(sample_lengths(128, 3, rng).tolist(), [128] * 3)
+        self.assertEqual(sample_lengths("fixed:16", 2, rng).tolist(), [16] * 2)
+        self.assertEqual(sample_lengths("128", 2, rng, max_len=64).tolist(), [64] * 2)
+
+    def test_uniform_bounds_are_inclusive(self):
+        lengths = sample_lengths("uniform:3:5", 1000, np.random.default_rng(0))
+        self.assertEqual(lengths.dtype, np.int32)
+        self.assertEqual(sorted(set(lengths.tolist())), [3, 4, 5])
+
+    def test_clipped_to_one_and_max_len(self):
+        lengths = sample_lengths("uniform:0:100", 1000, np.random.default_rng(0), max_len=50)
+        self.assertGreaterEqual(lengths.min(), 1)
+        self.assertLessEqual(lengths.max(), 50)
+        self.assertEqual(lengths.max(), 50)
+
+    def test_unknown_spec(self):
+        with self.assertRaises(ValueError):
+            sample_lengths("normal:10:2", 1, np.random.default_rng(0))
+
+    def test_requests(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "requests.jsonl")
+            with open(path, "w") as f:
+                for request in ({"input_len": 7}, {"prompt": "three word prompt"}, {"prompt": ["one", ""]}):
+                    f.write(json.dumps(request) + "\n")
+                f.write("\n")
+            self.assertEqual(request_lengths(path).tolist(), [7, 3, 1, 1])
+            lengths = sample_lengths(f"requests:{path}", 100, np.random.default_rng(0))
+            self.assertTrue(set(lengths.tolist()) <= {7, 3, 1})
+
+
+class GenerateTest(unittest.TestCase):
+
+    def test_same_seed_same_batch(self):
+        first = generate(4, "uniform:1:32", 100, seed=3, cache_dir=None)
+        second = generate(4, "uniform:1:32", 100, seed=3, cache_dir=None)
+        other = generate(4, "uniform:1:32", 100, seed=4, cache_dir=None)
+        np.testing.assert_array_equal(first.input_ids, second.input_ids)
+        np.testing.assert_array_equal(first.lengths, second.lengths)
+        self.assertFalse(np.array_equal(first.input_ids, other.input_ids)
+                         and np.array_equal(first.lengths, other.lengths))
+
+    def test_rows_are_padded_after_their_length(self):
+        batch = generate(16, "uniform:1:20", 50, exclude=[0, 1, 2, 99], pad_id=0, last_token=1, cache_dir=None)
+        self.assertEqual(batch.input_ids.shape, (16, batch.lengths.max()))
+        mask = batch.attention_mask()
+        np.testing.assert_array_equal(mask.sum(axis=1), batch.lengths)
+        for row, length in zip(batch.input_ids, batch.lengths):
+            self.assertTrue((row[length:] == 0).all())
+            self.assertEqual(row[length - 1], 1)
+            # the excluded ids only appear as the last token
+            self.assertTrue(((row[:length - 1] > 2) & (row[:length - 1] < 50)).all())
+
+    def test_cached_batches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = generate(2, 8, 100, seed=1, cache_dir=tmp_dir)
+            self.assertEqual(len(os.listdir(tmp_dir)), 1)
+            second = generate(2, 8, 100, seed=1, cache_dir=tmp_dir)
+            np.testing.assert_array_equal(first.input_ids, second.input_ids)
+            generate(2, 8, 100, seed=2, cache_dir=tmp_dir)
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+
+    def test_write_csv(self):
+        batch = generate(2, "uniform:1:4", 10, seed=0, cache_dir=None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "start_ids.csv")
+            write_csv(path, batch)
+            with open(path) as f:
+                rows = [[int(token) for token in line.split(",")] for line in f]
+        self.assertEqual(rows, [row[:length].tolist() for row, length in zip(batch.input_ids, batch.lengths)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.ckpt_manifest import (
+    MANIFEST_FILENAME,
+    save_weight,
+    verify_checkpoint_dir,
+    verify_manifest,
+    write_manifest,
+)
+
+
+class TestCheckpointManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.model_dir = pathlib.Path(self.tmp_dir.name)
+        rng = np.random.default_rng(0)
+        save_weight(rng.standard_normal([4, 8]).astype(np.float32), self.model_dir / "model.wte.bin")
+        save_weight(rng.standard_normal([8]).astype(np.float16), self.model_dir / "model.layers.0.bias.0.bin")
+        save_weight(rng.standard_normal([8]).astype(np.float16), self.model_dir / "model.layers.0.bias.1.bin")
+        # written without save_weight(): hashed from disk by write_manifest()
+        rng.standard_normal([16]).astype(np.float32).tofile(self.model_dir / "model.wpe.bin")
+        (self.model_dir / "config.ini").write_text("[gpt]\nweight_data_type = fp32\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _corrupt(self, name):
+        path = self.model_dir / name
+        data = bytearray(path.read_bytes())
+        data[0] ^= 0xFF
+        path.write_bytes(bytes(data))
+
+    def test_round_trip(self):
+        manifest = write_manifest(self.model_dir)
+        self.assertEqual(sorted(manifest["files"]), sorted(path.name for path in self.model_dir.glob("*.bin")))
+        self.assertEqual(manifest["files"]["model.wte.bin"]["shape"], [4, 8])
+        self.assertEqual(manifest["files"]["model.wte.bin"]["dtype"], "float32")
+        self.assertIsNone(manifest["files"]["model.wpe.bin"]["shape"])
+        self.assertEqual(manifest["files"]["model.wpe.bin"]["dtype"], "float32")
+        self.assertFalse((self.model_dir / ".manifest_entries.jsonl").exists())
+        with (self.model_dir / MANIFEST_FILENAME).open() as manifest_file:
+            self.assertEqual(json.load(manifest_file), manifest)
+
+        self.assertEqual(verify_manifest(self.model_dir, mode="size"), [])
+        self.assertEqual(verify_manifest(self.model_dir, mode="full"), [])
+        verify_checkpoint_dir(self.model_dir, "full")
+
+    def test_stale_recorded_entry_is_hashed_again(self):
+        # the file was rewritten with other contents of the same size after save_weight() recorded it,
+        # e.g. by an earlier interrupted conversion
+        path = self.model_dir / "model.wte.bin"
+        np.ones([4, 8], dtype=np.float32).tofile(path)
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        manifest = write_manifest(self.model_dir)
+        self.assertIsNone(manifest["files"]["model.wte.bin"]["shape"])
+        self.assertNotIn("mtime_ns", manifest["files"]["model.layers.0.bias.0.bin"])
+        self.assertEqual(verify_manifest(self.model_dir, mode="full"), [])
+
+    def test_size_mode_detects_truncation(self):
+        write_manifest(self.model_dir)
+        path = self.model_dir / "model.wte.bin"
+        path.write_bytes(path.read_bytes()[:-4])
+        for mode in ("size", "full"):
+            problems = verify_manifest(self.model_dir, mode=mode)
+            self.assertEqual(len(problems), 1)
+            self.assertIn("model.wte.bin: size", problems[0])
+
+    def test_full_mode_detects_corruption(self):
+        write_manifest(self.model_dir)
+        self._corrupt("model.wte.bin")
+        self._corrupt("model.wpe.bin")
+        # same sizes: only the hashes tell
+        self.assertEqual(verify_manifest(self.model_dir, mode="size"), [])
+        problems = verify_manifest(self.model_dir, mode="full", num_threads=2)
+        self.assertEqual([problem.split(":")[0] for problem in problems], ["model.wpe.bin", "model.wte.bin"])
+        with self.assertRaises(RuntimeError):
+            verify_checkpoint_dir(self.model_dir, "full")
+        verify_checkpoint_dir(self.model_dir, "none")
+
+    def test_missing_file_and_other_ranks(self):
+        write_manifest(self.model_dir)
+        (self.model_dir / "model.layers.0.bias.1.bin").unlink()
+        self.assertEqual(verify_manifest(self.model_dir, mode="size"), ["model.layers.0.bias.1.bin: missing"])
+        self.assertEqual(verify_manifest(self.model_dir, mode="full", tensor_para_rank=0), [])
+
+    def test_missing_manifest(self):
+        self.assertEqual(len(verify_manifest(self.model_dir, mode="size")), 1)
+        # checkpoints converted without a manifest can still be served
+        verify_checkpoint_dir(self.model_dir, "full")
+
+
+if __name__ == "__main__":
+    unittest.main()
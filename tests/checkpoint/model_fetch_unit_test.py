@@ -0,0 +1,202 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.server
+import os
+import pathlib
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.ckpt_manifest import hash_file, write_manifest
+from examples.pytorch.model_fetch import ModelFetcher
+
+CHUNK_SIZE = 1024
+
+
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the store directory and honours single byte ranges, like an object store."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        range_header = self.headers.get("Range")
+        with server.lock:
+            server.requests.append((self.path, range_header))
+        path = pathlib.Path(self.translate_path(self.path))
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", range_header or "")
+        if match is None or not path.is_file():
+            return super().do_GET()
+        begin, end = int(match.group(1)), int(match.group(2)) + 1
+        if (self.path, begin) in server.failing_ranges:
+            self.send_error(500)
+            return
+        with server.lock:
+            garbled = (self.path, begin) in server.garbled_ranges
+            server.garbled_ranges.discard((self.path, begin))
+        if garbled:
+            # once; http.client raises an HTTPException (BadStatusLine), which is neither a URLError nor an OSError
+            self.wfile.write(b"HTTP/1.1 2O6 Partial Content\r\n\r\n")
+            self.close_connection = True
+            return
+        data = path.read_bytes()[begin:end]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Content-Range", f"bytes {begin}-{end - 1}/{path.stat().st_size}")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TestModelFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp_dir.name)
+        self.store_dir = root / "store"
+        self.cache_dir = root / "cache"
+        self.model_dir = root / "model"
+        self.store_dir.mkdir()
+        # a multi-chunk file, fetched as byte ranges, and a small one, fetched with a plain GET
+        (self.store_dir / "model.wte.bin").write_bytes(os.urandom(CHUNK_SIZE * 5 + 100))
+        (self.store_dir / "model.wpe.bin").write_bytes(os.urandom(CHUNK_SIZE // 2))
+        (self.store_dir / "config.ini").write_text("[gpt]\nweight_data_type = fp32\n")
+        self.manifest = write_manifest(self.store_dir)
+
+        handler = lambda *args, **kwargs: _RangeRequestHandler(*args, directory=str(self.store_dir), **kwargs)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failing_ranges = set()
+        self.server.garbled_ranges = set()
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def _fetcher(self, retries=0):
+        return ModelFetcher(self.url, self.model_dir, cache_dir=self.cache_dir, num_threads=4,
+                            chunk_size=CHUNK_SIZE, retries=retries, timeout=10)
+
+    def _blob_path(self, name):
+        file_hash = self.manifest["files"][name]["hash"]
+        return self.cache_dir / "blobs" / file_hash[:2] / file_hash
+
+    def _range_requests(self, name):
+        return [byte_range for path, byte_range in self.server.requests
+                if path == f"/{name}" and byte_range != "bytes=0-0"]
+
+    def _assert_fetched(self):
+        for name in ("model.wte.bin", "model.wpe.bin", "config.ini", "manifest.json"):
+            self.assertEqual((self.model_dir / name).read_bytes(), (self.store_dir / name).read_bytes(), name)
+
+    def test_fetch_and_cache_hits(self):
+        stats = self._fetcher().fetch()
+        self._assert_fetched()
+        self.assertEqual(stats["files"], 2)
+        self.assertEqual(stats["cache_hits"], 0)
+        self.assertEqual(len(self._range_requests("model.wte.bin")), 6)
+
+        stats = self._fetcher().fetch()
+        self._assert_fetched()
+        self.assertEqual(stats["cache_hits"], 2)
+        self.assertEqual(stats["downloaded_bytes"], 0)
+
+    def test_resume_from_finished_chunks(self):
+        blob_path = self._blob_path("model.wte.bin")
+        blob_path.parent.mkdir(parents=True)
+        data = (self.store_dir / "model.wte.bin").read_bytes()
+        # an interrupted download that finished chunks 0 and 2
+        partial = bytearray(len(data))
+        for begin in (0, 2 * CHUNK_SIZE):
+            partial[begin:begin + CHUNK_SIZE] = data[begin:begin + CHUNK_SIZE]
+        blob_path.with_name(blob_path.name + ".partial").write_bytes(bytes(partial))
+        blob_path.with_name(blob_path.name + ".chunks").write_text(f"{CHUNK_SIZE}\n0\n{2 * CHUNK_SIZE}\n")
+
+        stats = self._fetcher().fetch()
+        self._assert_fetched()
+        self.assertEqual(stats["resumed_bytes"], 2 * CHUNK_SIZE)
+        requested = self._range_requests("model.wte.bin")
+        self.assertEqual(len(requested), 4)
+        self.assertNotIn(f"bytes=0-{CHUNK_SIZE - 1}", requested)
+        self.assertNotIn(f"bytes={2 * CHUNK_SIZE}-{3 * CHUNK_SIZE - 1}", requested)
+        self.assertFalse(blob_path.with_name(blob_path.name + ".chunks").exists())
+
+    def test_failed_chunk_then_resume(self):
+        self.server.failing_ranges.add(("/model.wte.bin", 3 * CHUNK_SIZE))
+        with self.assertRaises(urllib.error.HTTPError):
+            self._fetcher().fetch()
+        blob_path = self._blob_path("model.wte.bin")
+        self.assertFalse(blob_path.exists())
+        self.assertFalse((self.model_dir / "manifest.json").exists())
+        finished = blob_path.with_name(blob_path.name + ".chunks").read_text().split()[1:]
+        self.assertNotIn(str(3 * CHUNK_SIZE), finished)
+
+        self.server.failing_ranges.clear()
+        self.server.requests.clear()
+        stats = self._fetcher().fetch()
+        self._assert_fetched()
+        size = self.manifest["files"]["model.wte.bin"]["size"]
+        self.assertEqual(stats["resumed_bytes"], sum(min(CHUNK_SIZE, size - int(begin)) for begin in finished))
+        self.assertEqual(len(self._range_requests("model.wte.bin")), 6 - len(finished))
+
+    def test_garbled_response_is_retried(self):
+        self.server.garbled_ranges.add(("/model.wte.bin", 3 * CHUNK_SIZE))
+        stats = self._fetcher(retries=1).fetch()
+        self._assert_fetched()
+        self.assertEqual(self._range_requests("model.wte.bin").count(f"bytes={3 * CHUNK_SIZE}-{4 * CHUNK_SIZE - 1}"), 2)
+        self.assertEqual(stats["files"], 2)
+
+    def test_size_and_hash_mismatch(self):
+        for name in ("model.wte.bin", "model.wpe.bin"):
+            # the other file may be cached by the previous fetch
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            # the store serves other contents than its manifest lists
+            (self.store_dir / name).write_bytes(os.urandom(CHUNK_SIZE * 5 + 100 if name == "model.wte.bin" else 10))
+            with self.assertRaises(RuntimeError):
+                self._fetcher().fetch()
+            blob_path = self._blob_path(name)
+            self.assertFalse(blob_path.exists())
+            self.assertFalse(blob_path.with_name(blob_path.name + ".partial").exists())
+            self.assertFalse((self.model_dir / "manifest.json").exists())
+            self.manifest = write_manifest(self.store_dir)
+        self._fetcher().fetch()
+        self._assert_fetched()
+
+    def test_damaged_cache_blob_is_downloaded_again(self):
+        self._fetcher().fetch()
+        blob_path = self._blob_path("model.wpe.bin")
+        (self.model_dir / "model.wpe.bin").unlink()
+        # same size, other contents
+        blob_path.write_bytes(bytes(blob_path.stat().st_size))
+        stats = self._fetcher().fetch()
+        self._assert_fetched()
+        self.assertEqual(stats["cache_hits"], 1)
+        self.assertEqual(hash_file(blob_path), self.manifest["files"]["model.wpe.bin"]["hash"])
+
+
+if __name__ == "__main__":
+    unittest.main()
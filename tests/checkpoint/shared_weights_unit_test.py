@@ -0,0 +1,75 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.shared_weights import SharedWeightCache, status
+
+
+class TestSharedWeightCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp_dir.name)
+        self.shm_dir = root / "shm"
+        self.ckpt_dir = root / "ckpt"
+        self.shm_dir.mkdir()
+        self.ckpt_dir.mkdir()
+        self.weight = np.arange(64, dtype=np.float32)
+        self.weight.tofile(self.ckpt_dir / "model.wte.bin")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _staged_files(self):
+        return sorted(path.name for path in self.shm_dir.glob("ft_weights_*/*") if path.is_file())
+
+    def test_load_then_release(self):
+        first, second = SharedWeightCache(str(self.shm_dir)), SharedWeightCache(str(self.shm_dir))
+        np.testing.assert_array_equal(first.load(str(self.ckpt_dir / "model.wte.bin"), np.float32), self.weight)
+        loaded = second.load(str(self.ckpt_dir / "model.wte.bin"), np.float32)
+        self.assertEqual(len(self._staged_files()), 1)
+        self.assertEqual(status(str(self.shm_dir))[0]["holders"], [os.getpid()])
+
+        first.release(str(self.ckpt_dir))
+        # still held by the second cache
+        self.assertEqual(len(self._staged_files()), 1)
+        second.release()
+        self.assertEqual(status(str(self.shm_dir)), [])
+        # loaded arrays outlive the staged files
+        np.testing.assert_array_equal(loaded, self.weight)
+
+    def test_failed_copy_leaves_no_tmp_file(self):
+        cache = SharedWeightCache(str(self.shm_dir))
+        # os.stat() works, reading it fails
+        (self.ckpt_dir / "model.wpe.bin").mkdir()
+        with self.assertRaises(OSError):
+            cache.load(str(self.ckpt_dir / "model.wpe.bin"), np.float32)
+        self.assertEqual(self._staged_files(), [])
+        cache.load(str(self.ckpt_dir / "model.wte.bin"), np.float32)
+        self.assertFalse(any(name.endswith(".tmp") for name in self._staged_files()))
+        cache.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.gpt.utils.eval_driver import Throughput, add_batching_args, run_batched, token_budget_batches
+
+
+class TokenBudgetBatchesTest(unittest.TestCase):
+
+    def test_longest_first_within_the_budget(self):
+        lengths = [2, 8, 4, 4, 2, 2]
+        batches = token_budget_batches(lengths, max_tokens=16)
+        self.assertEqual(batches, [[1, 2], [3, 0, 4, 5]])
+        for batch in batches:
+            self.assertLessEqual(len(batch) * max(lengths[idx] for idx in batch), 16)
+
+    def test_output_length_counts_against_the_budget(self):
+        self.assertEqual(token_budget_batches([4, 4, 4], max_tokens=16), [[0, 1, 2]])
+        self.assertEqual(token_budget_batches([4, 4, 4], max_tokens=16, output_len=2), [[0, 1], [2]])
+
+    def test_budget_is_inclusive(self):
+        self.assertEqual(token_budget_batches([5, 5], max_tokens=10), [[0, 1]])
+        self.assertEqual(token_budget_batches([5, 5], max_tokens=9), [[0], [1]])
+
+    def test_max_batch_size(self):
+        self.assertEqual(token_budget_batches([1] * 5, max_tokens=100, max_batch_size=2), [[0, 1], [2, 3], [4]])
+
+    def test_oversize_example_runs_alone(self):
+        self.assertEqual(token_budget_batches([3, 50, 3], max_tokens=10), [[1], [0, 2]])
+        self.assertEqual(token_budget_batches([50], max_tokens=10, output_len=8), [[0]])
+
+    def test_no_examples(self):
+        self.assertEqual(token_budget_batches([], max_tokens=10), [])
+
+
+class RunBatchedTest(unittest.TestCase):
+
+    def test_results_in_original_order(self):
+        examples = ["bb", "dddd", "a", "ccc"]
+        batches = []
+
+        def run_batch(batch):
+            batches.append(batch)
+            return [example.upper() for example in batch]
+
+        results, stats = run_batched(examples, [len(example) for example in examples], run_batch, max_tokens=8,
+                                     output_len=1)
+        self.assertEqual(results, ["BB", "DDDD", "A", "CCC"])
+        self.assertEqual(batches, [["dddd"], ["ccc", "bb"], ["a"]])
+        self.assertEqual((stats.examples, stats.batches), (4, 3))
+        self.assertEqual(stats.tokens, 10 + 4)
+        self.assertEqual(stats.padded_tokens, 5 + 2 * 4 + 2)
+
+    def test_output_lengths_feed_the_token_count(self):
+        _, stats = run_batched([3, 1], [3, 1], lambda batch: batch, max_tokens=100, output_len=4,
+                               output_lengths=lambda result: result)
+        self.assertEqual(stats.tokens, 3 + 3 + 1 + 1)
+        self.assertEqual(stats.padded_tokens, 2 * (3 + 4))
+
+    def test_run_batch_must_return_one_result_per_example(self):
+        with self.assertRaises(AssertionError):
+            run_batched([1, 2], [1, 1], lambda batch: batch[:1], max_tokens=100)
+
+    def test_report(self):
+        report = Throughput(examples=4, batches=2, tokens=75, padded_tokens=100, seconds=2.0).report("lambada")
+        self.assertIn("lambada: 4 examples in 2 batches", report)
+        self.assertIn("25.0% padding", report)
+
+
+class BatchingArgsTest(unittest.TestCase):
+
+    def test_spellings(self):
+        parser = argparse.ArgumentParser()
+        add_batching_args(parser, max_tokens=1024)
+        args = parser.parse_args(["--max-batch-size", "8"])
+        self.assertEqual((args.max_batch_tokens, args.max_batch_size), (1024, 8))
+        parser = argparse.ArgumentParser()
+        add_batching_args(parser, dashes=False)
+        self.assertEqual(parser.parse_args(["--max_batch_tokens", "64"]).max_batch_tokens, 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
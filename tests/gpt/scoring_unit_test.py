@@ -0,0 +1,164 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+import numpy as np
+import torch
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.gpt.utils.scoring import (
+    Score, completion_pair, completion_top, openai_logprobs, score, score_rows
+)
+
+
+def _log_prob(token):
+    return -0.25 * token
+
+
+def _top_ids(token, top_n):
+    # the greedy token is the scored one when it is even
+    greedy = token if token % 2 == 0 else token + 1
+    return [greedy + 10 * k for k in range(top_n)]
+
+
+class _GptStandIn:
+    """Returns the per-position context log probabilities and most likely tokens of the GPT op.
+
+    Position t of a row scores its token t + 1: log probability -token / 4, and most likely tokens
+    given by _top_ids with log probabilities -k for the k-th.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, start_ids, start_lengths, output_len, beam_width, return_context_log_probs=0, **kwargs):
+        rows = [ids[:length].tolist() for ids, length in zip(start_ids, start_lengths.tolist())]
+        self.batches.append(rows)
+        top_n = return_context_log_probs
+        batch_size, max_length = start_ids.shape
+        log_probs = torch.zeros([batch_size, beam_width, max_length - 1])
+        top_ids = torch.full([batch_size, beam_width, max_length, top_n], -1, dtype=torch.int32)
+        top_log_probs = torch.zeros([batch_size, beam_width, max_length, top_n])
+        for i, row in enumerate(rows):
+            for t, token in enumerate(row[1:]):
+                log_probs[i, 0, t] = _log_prob(token)
+                top_ids[i, 0, t] = torch.tensor(_top_ids(token, top_n))
+                top_log_probs[i, 0, t] = -torch.arange(top_n, dtype=torch.float32)
+        return start_ids, start_lengths, log_probs, top_log_probs, top_ids
+
+
+class _TokenizerStandIn:
+
+    def batch_decode(self, sequences):
+        return [f"<{token}>" for token, in sequences]
+
+
+class ScoreRowsTest(unittest.TestCase):
+
+    def test_scores_every_token_after_the_first(self):
+        model = _GptStandIn()
+        rows = [[1, 2, 3, 4], [5, 6]]
+        results = score_rows(model, rows, pad_id=0, top_n=2)
+        self.assertEqual(len(model.batches), 1)
+        for row, (log_probs, (top_ids, top_log_probs)) in zip(rows, results):
+            np.testing.assert_allclose(log_probs, [_log_prob(token) for token in row[1:]])
+            np.testing.assert_array_equal(top_ids, [_top_ids(token, 2) for token in row[1:]])
+            np.testing.assert_allclose(top_log_probs, [[0, -1]] * (len(row) - 1))
+
+    def test_batches_within_the_token_budget(self):
+        model = _GptStandIn()
+        rows = [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+        results = score_rows(model, rows, pad_id=0, max_tokens=10)
+        self.assertGreater(len(model.batches), 1)
+        self.assertEqual(sorted(row for batch in model.batches for row in batch), sorted(rows))
+        np.testing.assert_allclose(results[2][0], [_log_prob(10)])
+        self.assertEqual(results[2][1][0].shape, (1, 1))
+
+
+class ScoreTest(unittest.TestCase):
+
+    def test_continuation_offsets(self):
+        model = _GptStandIn()
+        (result,) = score(model, [([1, 2, 3], [4, 5])], pad_id=0, top_n=2)
+        self.assertEqual(result.token_ids, [4, 5])
+        self.assertEqual(result.token_logprobs, [_log_prob(4), _log_prob(5)])
+        self.assertAlmostEqual(result.logprob, _log_prob(4) + _log_prob(5))
+        self.assertEqual(result.greedy, [True, False])
+        self.assertFalse(result.is_greedy)
+        np.testing.assert_array_equal(result.top[0], [_top_ids(4, 2), _top_ids(5, 2)])
+
+    def test_identical_pairs_share_a_row(self):
+        model = _GptStandIn()
+        results = score(model, [([1, 2], [4]), ([1], [2, 4]), ([1, 2], [4])], pad_id=0)
+        self.assertEqual([row for batch in model.batches for row in batch], [[1, 2, 4]])
+        self.assertEqual([result.token_logprobs for result in results],
+                         [[_log_prob(4)], [_log_prob(2), _log_prob(4)], [_log_prob(4)]])
+
+    def test_empty_continuation_and_total_only(self):
+        model = _GptStandIn()
+        empty, total = score(model, [([1], []), ([1, 2], [6])], pad_id=0, per_token=False)
+        self.assertEqual((empty.token_logprobs, empty.greedy, empty.logprob), (None, None, 0.0))
+        self.assertEqual((total.token_logprobs, total.greedy, total.top), (None, None, None))
+        self.assertAlmostEqual(total.logprob, _log_prob(6))
+
+    def test_empty_context_is_rejected(self):
+        with self.assertRaises(ValueError):
+            score(_GptStandIn(), [([], [1])], pad_id=0)
+
+
+class CompletionTest(unittest.TestCase):
+
+    def test_completion_pair(self):
+        self.assertEqual(completion_pair([1, 2], [3]), (([1, 2], [3]), []))
+        self.assertEqual(completion_pair([1, 2], [3], echo=True), (([1], [2, 3]), [1]))
+        self.assertEqual(completion_pair([1, 2], [3], echo=True, special_ids=[1]), (([1], [2, 3]), []))
+
+    def test_completion_top(self):
+        result = Score([2, 3, 4], [-1.0, -2.0, -3.0], None, -6.0,
+                       (np.array([[20], [30], [40]]), np.array([[-0.5], [-0.6], [-0.7]])))
+        generated = (np.array([[7], [8]]), np.array([[-0.1], [-0.2]]))
+        self.assertIs(completion_top(result, 1), result.top)
+        top_ids, top_log_probs = completion_top(result, 1, generated=generated)
+        np.testing.assert_array_equal(top_ids, [[7]])
+        top_ids, top_log_probs = completion_top(result, 1, echo=True, generated=generated)
+        np.testing.assert_array_equal(top_ids, [[20], [30], [7]])
+        np.testing.assert_allclose(top_log_probs, [[-0.5], [-0.6], [-0.1]])
+
+
+class OpenaiLogprobsTest(unittest.TestCase):
+
+    def test_unscored_tokens_and_offsets(self):
+        result = Score([2, 13], [-1.0, -2.0], None, -3.0,
+                       (np.array([[4, 5], [6, 7]]), np.array([[-0.5, -1.5], [-0.25, -0.75]])))
+        logprobs = openai_logprobs(_TokenizerStandIn(), result, unscored_ids=[1], text_offset=10)
+        self.assertEqual(logprobs["tokens"], ["<1>", "<2>", "<13>"])
+        self.assertEqual(logprobs["token_logprobs"], [None, -1.0, -2.0])
+        self.assertEqual(logprobs["text_offset"], [10, 13, 16])
+        self.assertEqual(logprobs["top_logprobs"], [None, {"<4>": -0.5, "<5>": -1.5}, {"<6>": -0.25, "<7>": -0.75}])
+
+    def test_given_alternatives_cover_the_last_tokens(self):
+        result = Score([2, 3], [-1.0, -2.0], None, -3.0)
+        top = (np.array([[8]]), np.array([[-0.5]]))
+        logprobs = openai_logprobs(_TokenizerStandIn(), result, top=top)
+        self.assertEqual(logprobs["top_logprobs"], [None, {"<8>": -0.5}])
+        self.assertIsNone(openai_logprobs(_TokenizerStandIn(), result)["top_logprobs"])
+
+
+if __name__ == "__main__":
+    unittest.main()
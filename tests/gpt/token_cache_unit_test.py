@@ -0,0 +1,121 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.gpt.utils.token_cache import (
+    TokenCache, lambada_cache, open_or_build, pad_rows, tokenizer_fingerprint
+)
+
+
+def _tokenize(texts):
+    # one token per word, its length
+    return [[len(word) for word in text.split()] for text in texts]
+
+
+class _VocabTokenizer:
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def get_vocab(self):
+        return self.vocab
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache_dir = pathlib.Path(self.tmp_dir.name)
+
+    def test_write_and_read_rows(self):
+        fields = {"inputs": [[1, 2, 3], [], [4]], "labels": [[5], [6], [7, 8]]}
+        cache = TokenCache.write(self.cache_dir / "data", fields, meta={"dataset": "test"})
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.fields, ["inputs", "labels"])
+        self.assertEqual(cache.meta["dataset"], "test")
+        self.assertEqual(cache.row("inputs", 0).tolist(), [1, 2, 3])
+        self.assertEqual({field: row.tolist() for field, row in cache[1].items()}, {"inputs": [], "labels": [6]})
+        self.assertEqual(cache.lengths("labels").tolist(), [1, 1, 2])
+        # the written directory is the only one left
+        self.assertEqual(os.listdir(self.cache_dir), ["data"])
+        reopened = TokenCache(self.cache_dir / "data")
+        self.assertEqual(reopened.row("labels", 2).tolist(), [7, 8])
+
+    def test_fields_need_one_row_per_example(self):
+        with self.assertRaises(AssertionError):
+            TokenCache.write(self.cache_dir / "data", {"inputs": [[1], [2]], "labels": [[3]]})
+
+    def test_length_sorted_batches(self):
+        cache = TokenCache.write(self.cache_dir / "data", {"inputs": [[1], [1, 2, 3], [1, 2], [1, 2, 3, 4]],
+                                                           "labels": [[1, 2, 3, 4], [1], [1], [1]]})
+        self.assertEqual(cache.length_sorted_batches(2, fields=["inputs"]), [[3, 1], [2, 0]])
+        self.assertEqual(cache.length_sorted_batches(3, fields=["inputs"], descending=False), [[0, 2, 1], [3]])
+        # by total length, ties in example order
+        self.assertEqual(cache.length_sorted_batches(4), [[0, 3, 1, 2]])
+
+    def test_open_or_build_builds_once(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return {"inputs": [[1, 2]]}
+
+        first = open_or_build("data", "key", build, self.cache_dir)
+        second = open_or_build("data", "key", build, self.cache_dir)
+        open_or_build("data", "other-key", build, self.cache_dir)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(first.directory, second.directory)
+        self.assertEqual(second.row("inputs", 0).tolist(), [1, 2])
+
+    def test_lambada_cache(self):
+        path = self.cache_dir / "lambada.jsonl"
+        path.write_text("".join(json.dumps({"text": text}) + "\n" for text in ["a bb ccc", "dddd e"]))
+        strict = lambada_cache(path, _tokenize, "words", cache_dir=self.cache_dir)
+        self.assertEqual([strict.row("inputs", i).tolist() for i in range(2)], [[1, 2], [4]])
+        self.assertEqual(strict.row("labels", 0).tolist(), [3])
+        self.assertTrue(strict.meta["strict"])
+        loose = lambada_cache(path, _tokenize, "words", strict=False, cache_dir=self.cache_dir)
+        self.assertNotEqual(loose.directory, strict.directory)
+        self.assertEqual(loose.row("labels", 1).tolist(), [1])
+        # another dataset file is another cache
+        path.write_text(json.dumps({"text": "ff gg"}) + "\n")
+        changed = lambada_cache(path, _tokenize, "words", cache_dir=self.cache_dir)
+        self.assertEqual(len(changed), 1)
+
+    def test_pad_rows(self):
+        batch = pad_rows([np.array([1, 2, 3]), np.array([4])], pad_id=0)
+        self.assertEqual(batch.dtype, np.int32)
+        self.assertEqual(batch.tolist(), [[1, 2, 3], [4, 0, 0]])
+        self.assertEqual(pad_rows([[1]], pad_id=9, width=3).tolist(), [[1, 9, 9]])
+
+    def test_tokenizer_fingerprint(self):
+        fingerprint = tokenizer_fingerprint(_VocabTokenizer({"a": 0, "b": 1}))
+        self.assertEqual(fingerprint, tokenizer_fingerprint(_VocabTokenizer({"b": 1, "a": 0})))
+        self.assertNotEqual(fingerprint, tokenizer_fingerprint(_VocabTokenizer({"a": 1, "b": 0})))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+# together_web3, as the serving apps import it
+sys.path.append(dir_path + "/../../examples/pytorch/gpt/common")
+
+from examples.pytorch import lifecycle
+from examples.pytorch.lifecycle import Drainer
+
+
+class _Service:
+    """The parts of a FastInferenceInterface a Drainer uses."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.shutdown = False
+        self.results = []
+
+    async def send_result_back(self, match_event, result):
+        self.results.append((match_event, result))
+
+
+class DrainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.service = _Service(self.loop)
+        patcher = mock.patch.object(lifecycle, "_SHUTDOWN_POLL_SECONDS", 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        async def cancel_pending():
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        self.loop.run_until_complete(cancel_pending())
+        self.loop.close()
+
+    def _run(self, timeout=5.0):
+        # the drain stops the loop once it is done
+        self.loop.call_later(timeout, self.loop.stop)
+        self.loop.run_forever()
+
+    def test_track_counts_requests_in_flight(self):
+        drainer = Drainer(self.service)
+        with drainer.track():
+            with drainer.track():
+                self.assertEqual(drainer.inflight, 2)
+        with self.assertRaises(RuntimeError):
+            with drainer.track():
+                raise RuntimeError("request failed")
+        self.assertEqual(drainer.inflight, 0)
+
+    def test_waits_for_requests_in_flight(self):
+        drainer = Drainer(self.service, timeout=5.0)
+        finished = []
+
+        async def request():
+            with drainer.track():
+                await asyncio.sleep(0.3)
+                finished.append(self.service.shutdown)
+
+        self.loop.create_task(request())
+        self.loop.call_soon(drainer.begin, "test")
+        self._run()
+        self.assertTrue(drainer.draining)
+        self.assertEqual(finished, [False])
+        self.assertTrue(self.service.shutdown)
+
+    def test_stops_after_the_timeout(self):
+        drainer = Drainer(self.service, timeout=0.2)
+        # a request that never finishes
+        request = drainer.track()
+        request.__enter__()
+        self.loop.call_soon(drainer.begin, "test")
+        self._run()
+        self.assertTrue(self.service.shutdown)
+        self.assertEqual(drainer.inflight, 1)
+
+    def test_second_signal_stops_immediately(self):
+        drainer = Drainer(self.service, timeout=300.0)
+        # a request that never finishes
+        request = drainer.track()
+        request.__enter__()
+        self.loop.call_soon(drainer.on_signal, "SIGTERM")
+        self.loop.call_later(0.2, drainer.on_signal, "SIGINT")
+        self._run(timeout=10.0)
+        self.assertTrue(self.service.shutdown)
+        self.assertEqual(drainer.inflight, 1)
+
+    def test_rejects_matches_while_draining(self):
+        drainer = Drainer(self.service)
+        self.loop.run_until_complete(drainer.reject(["m0", "m1"]))
+        self.loop.run_until_complete(drainer.reject("m2"))
+        self.assertEqual([event for event, _ in self.service.results], ["m0", "m1", "m2"])
+        self.assertTrue(all(result["status"] == 503 for _, result in self.service.results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import os
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.match_batcher import MatchBatcher
+
+
+def _raw_event(match_id, request_type="language-model-inference"):
+    return {"match_id": match_id, "match": {"service_bid": {"job": {"request_type": request_type}}}}
+
+
+class TestMatchBatcher(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        if self.batcher._consumer is not None:
+            self.batcher._consumer.cancel()
+
+    async def _handler(self, match_events, raw_events):
+        self.batches.append([raw["match_id"] for raw in raw_events])
+        await self.release.wait()
+
+    def _batcher(self, max_batch_size, window=0.05):
+        self.batcher = MatchBatcher(self._handler, max_batch_size, window, alone_request_types=("shutdown",))
+        return self.batcher
+
+    async def _submit(self, *raw_events):
+        for raw_event in raw_events:
+            await self.batcher.submit(raw_event["match_id"], raw_event)
+
+    async def _wait_for_batches(self, count):
+        for _ in range(500):
+            if len(self.batches) >= count:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"batches: {self.batches}")
+
+    async def test_batches_up_to_max_batch_size(self):
+        self._batcher(max_batch_size=2)
+        await self._submit(*[_raw_event(f"m{i}") for i in range(5)])
+        await self._wait_for_batches(3)
+        self.assertEqual(self.batches, [["m0", "m1"], ["m2", "m3"], ["m4"]])
+        self.assertEqual(self.batcher.queue_depth(), 0)
+
+    async def test_list_submission(self):
+        self._batcher(max_batch_size=4)
+        raw_events = [_raw_event("m0"), _raw_event("m1")]
+        await self.batcher.submit(["m0", "m1"], raw_events)
+        await self._wait_for_batches(1)
+        self.assertEqual(self.batches, [["m0", "m1"]])
+
+    async def test_events_during_a_batch_go_to_the_next(self):
+        self._batcher(max_batch_size=4, window=0.01)
+        self.release.clear()
+        await self._submit(_raw_event("m0"))
+        await self._wait_for_batches(1)
+        await self._submit(_raw_event("m1"), _raw_event("m2"))
+        self.assertEqual(self.batcher.queue_depth(), 2)
+        self.release.set()
+        await self._wait_for_batches(2)
+        self.assertEqual(self.batches, [["m0"], ["m1", "m2"]])
+
+    async def test_shutdown_behind_a_request_runs_alone(self):
+        self._batcher(max_batch_size=4)
+        await self._submit(_raw_event("m0"), _raw_event("stop", "shutdown"), _raw_event("m1"))
+        await self._wait_for_batches(3)
+        # the shutdown is the first (and only) event of its batch, where the handler looks for it
+        self.assertEqual(self.batches, [["m0"], ["stop"], ["m1"]])
+
+    async def test_shutdown_first(self):
+        self._batcher(max_batch_size=4)
+        await self._submit(_raw_event("stop", "shutdown"), _raw_event("m0"))
+        await self._wait_for_batches(2)
+        self.assertEqual(self.batches, [["stop"], ["m0"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import torch
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.model_registry import (
+    NOT_LOADED, RESIDENT_DEVICE, RESIDENT_HOST, ModelRegistry, checkpoint_bytes, parse_models
+)
+
+MODEL_BYTES = 100
+
+
+class _Gpu:
+    """Device memory accounting of the stand-in models, returned as torch.cuda.memory_allocated()."""
+
+    def __init__(self):
+        self.allocated = 0
+
+
+class _Weights:
+
+    def __init__(self, gpu):
+        self.gpu = gpu
+        self.weight = torch.zeros(1)
+        self.gpu.allocated += MODEL_BYTES
+
+    def _map(self, fn):
+        self.weight = fn(self.weight)
+        self.gpu.allocated -= MODEL_BYTES
+
+
+class _Model:
+    """A model wrapper as the registry moves it: `weights._map()`, `cuda()` and the op in `model`."""
+
+    def __init__(self, gpu, tokenizer=None):
+        self.gpu = gpu
+        self.weights = _Weights(gpu)
+        self.model = object()
+        self.build_model = True
+        self.tokenizer = tokenizer
+
+    def cuda(self):
+        self.gpu.allocated += MODEL_BYTES
+        self.model = object()
+        self.build_model = True
+
+
+class ModelRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpu = _Gpu()
+        for name, kwargs in (("memory_allocated", {"side_effect": lambda device=None: self.gpu.allocated}),
+                             ("empty_cache", {})):
+            patcher = mock.patch.object(torch.cuda, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _registry(self, num_on_device, num_on_host=0, names="abc"):
+        registry = ModelRegistry(num_on_device * MODEL_BYTES, num_on_host * MODEL_BYTES, device="cpu",
+                                 pin_memory=False)
+        for name in names:
+            registry.register(name, lambda name=name: _Model(self.gpu, tokenizer=f"{name}-tokenizer"), MODEL_BYTES)
+        return registry
+
+    def _states(self, registry):
+        return {name: stats["state"] for name, stats in registry.stats()["models"].items()}
+
+    def test_evicts_least_recently_used(self):
+        registry = self._registry(2)
+        model_a = registry.get("a")
+        registry.get("b")
+        self.assertIs(registry.get("a"), model_a)
+        registry.get("c")
+        self.assertEqual(self._states(registry), {"a": RESIDENT_DEVICE, "b": NOT_LOADED, "c": RESIDENT_DEVICE})
+        self.assertEqual(registry.stats()["gpu_used_bytes"], 2 * MODEL_BYTES)
+        self.assertEqual(registry.stats()["models"]["a"]["hits"], 1)
+
+    def test_restores_from_host_memory(self):
+        registry = self._registry(2, num_on_host=1)
+        model_a = registry.get("a")
+        registry.get("b")
+        registry.get("c")
+        self.assertEqual(self._states(registry), {"a": RESIDENT_HOST, "b": RESIDENT_DEVICE, "c": RESIDENT_DEVICE})
+        self.assertFalse(model_a.build_model)
+        self.assertIs(registry.get("a"), model_a)
+        self.assertTrue(model_a.build_model)
+        self.assertEqual(self._states(registry), {"a": RESIDENT_DEVICE, "b": RESIDENT_HOST, "c": RESIDENT_DEVICE})
+        stats = registry.stats()["models"]["a"]
+        self.assertEqual((stats["loads"], stats["restores"], stats["evictions"]), (1, 1, 1))
+
+    def test_drops_least_recently_evicted_when_host_memory_is_full(self):
+        registry = self._registry(1, num_on_host=1)
+        model_a = registry.get("a")
+        registry.get("b")
+        registry.get("c")
+        self.assertEqual(self._states(registry), {"a": NOT_LOADED, "b": RESIDENT_HOST, "c": RESIDENT_DEVICE})
+        self.assertIsNone(model_a.weights)
+        self.assertEqual(registry.stats()["host_used_bytes"], MODEL_BYTES)
+        registry.get("a")
+        self.assertEqual(registry.stats()["models"]["a"]["loads"], 2)
+
+    def test_failed_load_leaves_model_unloaded(self):
+        registry = self._registry(1, names="")
+
+        def fail():
+            raise RuntimeError("no checkpoint")
+
+        registry.register("a", fail)
+        with self.assertRaises(RuntimeError):
+            registry.get("a")
+        self.assertEqual(self._states(registry), {"a": NOT_LOADED})
+
+    def test_swap_installs_the_new_model_with_its_tokenizer_on_switch(self):
+        registry = self._registry(2)
+        old_model = registry.get("a")
+        registry.get("b")
+        switches = []
+
+        def switch(fn):
+            # the old model serves until the switch, the new one after it
+            self.assertIs(registry.get("a"), old_model)
+            switches.append(fn)
+            fn()
+
+        registry.swap("a", lambda: _Model(self.gpu, tokenizer="a-tokenizer-v2"), switch=switch)
+        self.assertEqual(len(switches), 2)
+        new_model = registry.get("a")
+        self.assertIsNot(new_model, old_model)
+        self.assertEqual(new_model.tokenizer, "a-tokenizer-v2")
+        self.assertIsNone(old_model.weights)
+        # both copies of "a" had to fit during the swap
+        self.assertEqual(self._states(registry), {"a": RESIDENT_DEVICE, "b": NOT_LOADED, "c": NOT_LOADED})
+        self.assertEqual(registry.stats()["models"]["a"]["swaps"], 1)
+
+    def test_register_twice(self):
+        registry = self._registry(1, names="a")
+        with self.assertRaises(ValueError):
+            registry.register("a", lambda: None)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def test_parse_models(self):
+        models = {"gpt-j-6b": {"ckpt_path": "/models/gpt-j-6b-tp1"}}
+        self.assertEqual(parse_models(json.dumps(models)), models)
+        self.assertEqual(parse_models(None), {})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "models.json")
+            with open(path, "w") as f:
+                json.dump(models, f)
+            self.assertEqual(parse_models(path), models)
+
+    def test_checkpoint_bytes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name, size in (("model.wte.bin", 400), ("model.lm_head.bin", 400), ("config.ini", 1000)):
+                with open(os.path.join(tmp_dir, name), "wb") as f:
+                    f.write(b"\0" * size)
+            self.assertEqual(checkpoint_bytes(tmp_dir, "fp32"), 400)
+            self.assertEqual(checkpoint_bytes(tmp_dir, "fp16"), 800)
+            self.assertEqual(checkpoint_bytes(os.path.join(tmp_dir, "missing")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
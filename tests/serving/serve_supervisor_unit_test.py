@@ -0,0 +1,124 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import pathlib
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+SERVE_PY = os.path.join(dir_path, "../../serve.py")
+
+SLEEPER = f"{shlex.quote(sys.executable)} -c 'import time; time.sleep(60)'"
+# exits with 3 on SIGTERM, like a worker that drained its requests
+DRAINING = (f"{shlex.quote(sys.executable)} -c 'import signal, sys, time; "
+            f"signal.signal(signal.SIGTERM, lambda *_: sys.exit(3)); time.sleep(60)'")
+STUCK = (f"{shlex.quote(sys.executable)} -c 'import signal, time; "
+         f"signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)'")
+
+
+class TestSupervisor(unittest.TestCase):
+    """Drives serve.py with dummy --worker-command processes and follows its --status-file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.status_file = pathlib.Path(self.tmp_dir.name) / "status.json"
+        self.process = None
+
+    def tearDown(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.tmp_dir.cleanup()
+
+    def _start(self, worker_commands, *args):
+        argv = [sys.executable, SERVE_PY, "--status-file", str(self.status_file), "--backoff-initial", "0.1",
+                "--backoff-max", "0.2", "--stop-timeout", "5"]
+        for command in worker_commands:
+            argv += ["--worker-command", command]
+        self.process = subprocess.Popen(argv + list(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _workers(self):
+        try:
+            return json.loads(self.status_file.read_text())["workers"]
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _wait_for(self, condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            workers = self._workers()
+            if workers is not None and condition(workers):
+                return workers
+            time.sleep(0.1)
+        self.fail(f"condition not met, workers: {self._workers()}")
+
+    def _stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.assertEqual(self.process.wait(20), 0)
+        return self._workers()
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def test_restarts_only_the_exited_worker(self):
+        self._start([SLEEPER, "false"])
+        workers = self._wait_for(lambda workers: workers[1]["restarts"] >= 2)
+        self.assertEqual(workers[0]["state"], "running")
+        self.assertEqual(workers[0]["restarts"], 0)
+        self.assertEqual(workers[1]["last_exit_code"], 1)
+        pid = workers[0]["pid"]
+
+        workers = self._stop()
+        self.assertEqual([worker["state"] for worker in workers], ["stopped", "stopped"])
+        self.assertFalse(self._alive(pid))
+
+    def test_unhealthy_worker_is_restarted(self):
+        # worker0 fails every health check, worker1 passes them
+        self._start([SLEEPER, SLEEPER], "--health-command", "test {name} != worker0", "--health-grace", "0",
+                    "--health-interval", "0.1", "--health-failures", "2")
+        workers = self._wait_for(lambda workers: workers[0]["restarts"] >= 1)
+        self.assertEqual(workers[0]["last_exit_code"], -signal.SIGKILL)
+        self.assertEqual(workers[1]["restarts"], 0)
+        self.assertEqual(workers[1]["health_failures"], 0)
+        self._stop()
+
+    def test_stop_drains_then_kills(self):
+        self._start([DRAINING, STUCK], "--stop-timeout", "1")
+        workers = self._wait_for(lambda workers: all(worker["state"] == "running" for worker in workers))
+        pids = [worker["pid"] for worker in workers]
+        # let the workers install their signal handlers
+        time.sleep(0.5)
+
+        workers = self._stop()
+        self.assertEqual([worker["state"] for worker in workers], ["stopped", "stopped"])
+        self.assertEqual(workers[0]["last_exit_code"], 3)
+        self.assertEqual(workers[1]["last_exit_code"], -signal.SIGKILL)
+        self.assertEqual([worker["restarts"] for worker in workers], [0, 0])
+        self.assertFalse(any(self._alive(pid) for pid in pids))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.t5.app.utils.para_utils import batch_task_infos, is_empty_request
+
+
+class TestBatchTaskInfos(unittest.TestCase):
+
+    def test_empty_requests(self):
+        self.assertTrue(is_empty_request({}))
+        self.assertTrue(is_empty_request({"prompt": ""}))
+        self.assertTrue(is_empty_request({"prompt": "hi", "max_tokens": 0}))
+        self.assertTrue(is_empty_request({"prompt": "hi", "max_tokens": "0"}))
+        self.assertFalse(is_empty_request({"prompt": "hi"}))
+        # an invalid max_tokens falls back to the default
+        self.assertFalse(is_empty_request({"prompt": "hi", "max_tokens": "many"}))
+
+    def test_mixed_batch(self):
+        requests = [
+            {"prompt": "a", "max_tokens": 4, "top_k": 2},
+            {"prompt": "b", "beam_width": 2, "temperature": 0.5},
+            {"prompt": "", "max_tokens": 4},
+            {"prompt": "c", "max_tokens": 8, "stop": ["\n"]},
+            {"prompt": "d", "max_tokens": 0},
+            {"prompt": "e", "beam_width": "2"},
+        ]
+        batches = list(batch_task_infos(requests, max_batch_size=8))
+        self.assertEqual([rows for rows, _ in batches], [[0, 3], [1, 5]])
+        rows, task_info = batches[0]
+        self.assertEqual(task_info["beam_width"], 1)
+        self.assertEqual(task_info["prompt_seqs"], ["a", "c"])
+        self.assertEqual(task_info["output_len"], [4, 8])
+        self.assertEqual(task_info["top_k"], [2, 50])
+        self.assertEqual(task_info["stop"], [[], ["\n"]])
+        rows, task_info = batches[1]
+        self.assertEqual(task_info["beam_width"], 2)
+        self.assertEqual(task_info["prompt_seqs"], ["b", "e"])
+        self.assertEqual(task_info["temperature"], [0.5, 0.8])
+
+    def test_max_batch_size(self):
+        requests = [{"prompt": str(i)} for i in range(5)]
+        batches = list(batch_task_infos(requests, max_batch_size=2))
+        self.assertEqual([rows for rows, _ in batches], [[0, 1], [2, 3], [4]])
+        self.assertEqual(batches[2][1]["prompt_seqs"], ["4"])
+
+    def test_shutdown_row_is_not_run(self):
+        # a shutdown job batched behind a request: answered as empty, not passed to the model
+        requests = [{"prompt": "a"}, {"request_type": "shutdown"}]
+        self.assertTrue(is_empty_request(requests[1]))
+        self.assertEqual([rows for rows, _ in batch_task_infos(requests, max_batch_size=8)], [[0]])
+        self.assertEqual(list(batch_task_infos([{"request_type": "shutdown"}], max_batch_size=8)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
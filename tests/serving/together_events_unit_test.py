@@ -0,0 +1,122 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+from websockets.asyncio.server import serve
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.gpt.common.together_web3.together import TogetherWeb3
+
+
+def _match_event(match_id, request_type):
+    return {
+        "event_type": "match",
+        "signature": None,
+        "match_id": match_id,
+        "match": {
+            "match_type": "service",
+            "ask_address": "0xask",
+            "bid_address": "0xbid",
+            "ask_offer_id": f"ask-{match_id}",
+            "bid_offer_id": f"bid-{match_id}",
+            "ask_signature": None,
+            "bid_signature": None,
+            "service_bid": {"job": {"request_type": request_type}},
+        },
+    }
+
+
+def _new_block_event(height):
+    return {
+        "event_type": "new-block",
+        "block_previous": "",
+        "block_height": height,
+        "block_nonce": 0,
+        "market_address": "0xmarket",
+    }
+
+
+class TestEventIntake(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.to_send = asyncio.Queue()
+        self.server = await serve(self._serve, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.web3 = TogetherWeb3(http_url=f"http://127.0.0.1:{port}", websocket_url=f"ws://127.0.0.1:{port}")
+        self.web3._handle_disconnect_delay = 0
+        self.release_inference = asyncio.Event()
+        self.handled = []
+        self.web3._on_match_event = [self._on_match]
+
+    async def asyncTearDown(self):
+        self.release_inference.set()
+        await self.web3.close()
+        self.to_send.put_nowait(None)
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, ws):
+        await ws.recv()
+        await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "result": "subscription"}))
+        while True:
+            event = await self.to_send.get()
+            if event is None:
+                return
+            await ws.send(json.dumps({"params": {"result": {"signature": None, "events": [event]}}}))
+
+    async def _on_match(self, match_event, raw_event):
+        self.handled.append(match_event.match_id)
+        if raw_event["match"]["service_bid"]["job"]["request_type"] != "shutdown":
+            # a running inference
+            await self.release_inference.wait()
+
+    async def _wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("condition not met")
+
+    async def test_control_events_do_not_wait_for_inference(self):
+        await self.web3.get_subscription_id()
+        for event in (_match_event("m1", "language-model-inference"),
+                      _match_event("m2", "language-model-inference"),
+                      _new_block_event(7),
+                      _match_event("stop", "shutdown")):
+            self.to_send.put_nowait(event)
+
+        await self._wait_for(lambda: "stop" in self.handled)
+        tip_block = await asyncio.wait_for(self.web3.get_tip_block(), 5)
+        self.assertEqual(tip_block.block_height, 7)
+        # m2 waits in the queue behind the running m1
+        self.assertEqual(self.handled, ["m1", "stop"])
+        self.assertEqual(self.web3.event_queue_depth(), 1)
+        self.assertEqual(self.web3.event_stats.received, 4)
+
+        self.release_inference.set()
+        await self._wait_for(lambda: "m2" in self.handled)
+        self.assertEqual(self.handled, ["m1", "stop", "m2"])
+        self.assertEqual(self.web3.event_stats.handled, 2)
+        self.assertEqual(self.web3.event_queue_depth(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import sys
+import unittest
+
+from aiohttp import web
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dir_path + "/../..")
+
+from examples.pytorch.gpt.common.together_web3.rpc import AsyncJsonRpcClient, JsonRpcError
+
+
+class _JsonRpcStandIn:
+    """Local JSON-RPC server: `echo` returns its params, `fail` returns an error, `slow` holds the request."""
+
+    def __init__(self):
+        self.payloads = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.release = asyncio.Event()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.payloads.append(payload)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            calls = payload if isinstance(payload, list) else [payload]
+            if any(call["method"] == "slow" for call in calls):
+                await self.release.wait()
+            if any(call["method"] == "http_error" for call in calls):
+                return web.Response(status=500)
+            replies = [self._reply(call) for call in calls]
+        finally:
+            self.in_flight -= 1
+        return web.json_response(replies if isinstance(payload, list) else replies[0])
+
+    @staticmethod
+    def _reply(call):
+        if call["method"] == "fail":
+            return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32000, "message": "failed"}}
+        return {"jsonrpc": "2.0", "id": call["id"], "result": call["params"]}
+
+
+class TestAsyncJsonRpcClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = _JsonRpcStandIn()
+        app = web.Application()
+        app.add_routes([web.post("/", self.server.handle)])
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.client = AsyncJsonRpcClient(f"http://127.0.0.1:{port}/", max_in_flight=2, max_batch_size=4)
+
+    async def asyncTearDown(self):
+        self.server.release.set()
+        await self.client.close()
+        await self.runner.cleanup()
+
+    async def test_call_results(self):
+        results = await asyncio.gather(*[self.client.call("echo", [i]) for i in range(5)])
+        self.assertEqual(results, [[i] for i in range(5)])
+
+    async def test_errors(self):
+        with self.assertRaises(JsonRpcError) as context:
+            await self.client.call("fail", [])
+        self.assertEqual(context.exception.code, -32000)
+        with self.assertRaises(Exception):
+            await self.client.call("http_error", [])
+        # the client keeps working after failed calls
+        self.assertEqual(await self.client.call("echo", ["ok"]), ["ok"])
+
+    async def test_order_key_keeps_order_and_batches(self):
+        first = self.client.call("slow", ["first"], order_key="match-1")
+        await asyncio.sleep(0.1)
+        # queued behind the request in flight
+        rest = [self.client.call("echo", [i], order_key="match-1") for i in range(6)]
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.client.pending(), 6)
+        self.server.release.set()
+        self.assertEqual(await first, ["first"])
+        self.assertEqual(await asyncio.gather(*rest), [[i] for i in range(6)])
+
+        batches = [payload for payload in self.server.payloads if isinstance(payload, list)]
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+        sent = [call["params"][0] for batch in batches for call in batch]
+        self.assertEqual(sent, list(range(6)))
+        self.assertEqual(self.client.pending(), 0)
+
+    async def test_bounded_in_flight(self):
+        slow = [self.client.call("slow", [i]) for i in range(4)]
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.server.in_flight, 2)
+        self.server.release.set()
+        self.assertEqual(await asyncio.gather(*slow), [[i] for i in range(4)])
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    async def test_other_keys_do_not_wait(self):
+        blocked = self.client.call("slow", ["blocked"], order_key="match-1")
+        # another match, and calls without a key, are not held up by match-1
+        self.assertEqual(await asyncio.wait_for(self.client.call("echo", [1], order_key="match-2"), 5), [1])
+        self.assertEqual(await asyncio.wait_for(self.client.call("echo", [2]), 5), [2])
+        self.assertFalse(blocked.done())
+        self.server.release.set()
+        self.assertEqual(await blocked, ["blocked"])
+
+
+if __name__ == "__main__":
+    unittest.main()
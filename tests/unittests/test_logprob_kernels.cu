@@ -1,6 +1,8 @@
+#include <algorithm>
 #include <assert.h>
 #include <math.h>
 #include <float.h>
+#include <numeric>
 #include <stdexcept>
 #include <tuple>
 #include <vector>
@@ -136,6 +138,60 @@ void computeCumLogProbsBatchFirst(float* cum_log_probs,
     }
 }
 
+struct TopLogProbsTestCase {
+    std::string name;
+    size_t batch_size;
+    size_t vocab_size;
+    size_t top_n;
+    size_t max_steps;
+    size_t id_offset;
+    size_t gen_step;
+    bool   tied_logits;
+
+    std::string toString() {
+        char buf[200];
+        snprintf(buf, sizeof(buf),
+                 "TopLogProbsTestCase[name=%s, batch=%ld, vocab=%ld, top_n=%ld, max_steps=%ld, id_offset=%ld, "
+                 "gen_step=%ld, tied_logits=%d]",
+                 name.c_str(), batch_size, vocab_size, top_n, max_steps, id_offset, gen_step, tied_logits);
+        return buf;
+    }
+
+    void print() {
+        FT_LOG_INFO(toString());
+    }
+};
+
+void computeTopLogProbs(float* top_log_probs,
+                        int* top_ids,
+                        const float* logits,
+                        const size_t batch_size,
+                        const size_t vocab_size,
+                        const size_t vocab_size_padded,
+                        const size_t top_n,
+                        const size_t out_stride)
+{
+    // Reference of invokeTopLogProbs: ties are ordered by ascending token id.
+    std::vector<int> ids(vocab_size);
+    for (size_t i = 0; i < batch_size; ++i) {
+        const float* vec = logits + i * vocab_size_padded;
+        float max_logits = -FLT_MAX;
+        for (size_t v = 0; v < vocab_size; ++v) {
+            max_logits = std::max(max_logits, vec[v]);
+        }
+        float sum = 0.0f;
+        for (size_t v = 0; v < vocab_size; ++v) {
+            sum += expf(vec[v] - max_logits);
+        }
+        std::iota(ids.begin(), ids.end(), 0);
+        std::stable_sort(ids.begin(), ids.end(), [vec](int a, int b) { return vec[a] > vec[b]; });
+        for (size_t k = 0; k < top_n; ++k) {
+            top_ids[i * out_stride + k]       = ids[k];
+            top_log_probs[i * out_stride + k] = vec[ids[k]] - max_logits - logf(sum);
+        }
+    }
+}
+
 /////////////////////////////////// Unittests //////////////////////////////////////////
 
 template<typename T>
@@ -297,6 +353,106 @@ void testBatchFirstCumLogProbCorrectness(TestCase tc) {
     check_cuda_error(cudaStreamDestroy(stream));
 }
 
+void testTopLogProbsCorrectness(TopLogProbsTestCase tc) {
+    size_t batch_size = tc.batch_size;
+    size_t vocab_size = tc.vocab_size;
+    size_t top_n = tc.top_n;
+    // Make multiple of 8 as GPT does.
+    size_t vocab_size_padded = static_cast<size_t>(ceil(vocab_size / 8.f) * 8);
+    // [id_offset + batch_size, max_steps, top_n] outputs; the kernel writes one step of the last batch_size rows,
+    // as ParallelGpt does for a local batch during generation.
+    size_t out_stride = tc.max_steps * top_n;
+    size_t out_size = (tc.id_offset + batch_size) * out_stride;
+    size_t offset = tc.id_offset * out_stride + tc.gen_step * top_n;
+
+    cudaStream_t stream;
+    check_cuda_error(cudaStreamCreate(&stream));
+    Allocator<AllocatorType::CUDA> allocator(getDevice());
+
+    // input values
+    float* h_logits = new float[batch_size * vocab_size_padded];
+    if (tc.tied_logits) {
+        int* h_levels = new int[batch_size * vocab_size_padded];
+        initRandomInt(h_levels, batch_size * vocab_size_padded, 0, 4);
+        for (size_t i = 0; i < batch_size * vocab_size_padded; ++i) {
+            h_logits[i] = static_cast<float>(h_levels[i]);
+        }
+        delete[] h_levels;
+    }
+    else {
+        initRandom(h_logits, batch_size * vocab_size_padded, -10.0f, 10.0f);
+    }
+    // the padding must never be selected nor counted in the normalization
+    for (size_t i = 0; i < batch_size; ++i) {
+        for (size_t v = vocab_size; v < vocab_size_padded; ++v) {
+            h_logits[i * vocab_size_padded + v] = 100.0f;
+        }
+    }
+
+    // outupt buffers, filled with values the kernel never writes to check that it only writes its slots
+    float* h_top_log_probs = new float[out_size];
+    int* h_top_ids = new int[out_size];
+    float* expected_top_log_probs = new float[out_size];
+    int* expected_top_ids = new int[out_size];
+    std::fill(expected_top_log_probs, expected_top_log_probs + out_size, 1.0f);
+    std::fill(expected_top_ids, expected_top_ids + out_size, -1);
+
+    // device buffers
+    float* d_logits = reinterpret_cast<float*>(allocator.malloc(sizeof(float) * batch_size * vocab_size_padded));
+    float* d_top_log_probs = reinterpret_cast<float*>(allocator.malloc(sizeof(float) * out_size));
+    int* d_top_ids = reinterpret_cast<int*>(allocator.malloc(sizeof(int) * out_size));
+
+    // initialize device buffers
+    cudaH2Dcpy(d_logits, h_logits, batch_size * vocab_size_padded);
+    cudaH2Dcpy(d_top_log_probs, expected_top_log_probs, out_size);
+    cudaH2Dcpy(d_top_ids, expected_top_ids, out_size);
+
+    invokeTopLogProbs(d_top_log_probs + offset,
+                      d_top_ids + offset,
+                      d_logits,
+                      batch_size,
+                      vocab_size,
+                      vocab_size_padded,
+                      top_n,
+                      out_stride,
+                      stream);
+    check_cuda_error(cudaStreamSynchronize(stream));
+    computeTopLogProbs(expected_top_log_probs + offset,
+                       expected_top_ids + offset,
+                       h_logits,
+                       batch_size,
+                       vocab_size,
+                       vocab_size_padded,
+                       top_n,
+                       out_stride);
+
+    cudaD2Hcpy(h_top_log_probs, d_top_log_probs, out_size);
+    cudaD2Hcpy(h_top_ids, d_top_ids, out_size);
+    size_t id_failures = 0;
+    for (size_t i = 0; i < out_size; ++i) {
+        if (h_top_ids[i] != expected_top_ids[i] && id_failures++ < 4) {
+            FT_LOG_ERROR(">> invalid top id for i=%lu: found %d, expected %d", i, h_top_ids[i], expected_top_ids[i]);
+        }
+    }
+    EXPECT_TRUE(id_failures == 0);
+    std::string tag = tc.toString();
+    bool passed = checkResult(tag, h_top_log_probs, expected_top_log_probs, out_size, 1e-4f, 1e-4f);
+    EXPECT_TRUE(passed);
+
+    FT_LOG_DEBUG("free host buffers");
+    delete[] expected_top_ids;
+    delete[] expected_top_log_probs;
+    delete[] h_top_ids;
+    delete[] h_top_log_probs;
+    delete[] h_logits;
+
+    FT_LOG_DEBUG("free device buffers");
+    allocator.free((void**)(&d_top_ids));
+    allocator.free((void**)(&d_top_log_probs));
+    allocator.free((void**)(&d_logits));
+    check_cuda_error(cudaStreamDestroy(stream));
+}
+
 int main(int argc, char* argv[]) {
     std::vector<TestCase> test_cases {
         // TC: name / max_input_seq / batch / vocab / beam
@@ -320,5 +476,19 @@ int main(int argc, char* argv[]) {
     }
     FT_LOG_INFO("Test Done");
 
+    std::vector<TopLogProbsTestCase> top_test_cases {
+        // TC: name / batch / vocab / top_n / max_steps / id_offset / gen_step / tied_logits
+        TopLogProbsTestCase{"top_logprob test", 4,  16,    1, 1,  0, 0,  false},
+        TopLogProbsTestCase{"top_logprob test", 8,  50211, 5, 16, 0, 3,  false},
+        TopLogProbsTestCase{"top_logprob test", 3,  50211, 5, 16, 2, 15, false},
+        TopLogProbsTestCase{"top_logprob test", 8,  51200, 5, 8,  4, 0,  true},
+        TopLogProbsTestCase{"top_logprob test", 2,  13,    8, 4,  1, 2,  true},
+    };
+
+    for (auto &tc : top_test_cases) {
+        testTopLogProbsCorrectness(tc);
+    }
+    FT_LOG_INFO("Test Done");
+
     return 0;
 }